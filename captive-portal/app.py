@@ -2,40 +2,61 @@
 
 from __future__ import annotations
 
+import time
+
+_IMPORT_STARTED = time.perf_counter()
+
 import atexit
 import base64
 import binascii
 import csv
 import hashlib
 import json
+import multiprocessing
+import os
 import secrets
+import threading
 from datetime import datetime, timezone
-from functools import wraps
+from functools import partial, wraps
 from io import StringIO
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, Callable, Dict, List, Optional
 
-from flask import Flask, Response, g, jsonify, redirect, render_template, request
+from flask import Flask, Response, abort, g, jsonify, redirect, render_template, request, url_for
 from flask_compress import Compress
 from itsdangerous import BadSignature, BadTimeSignature, SignatureExpired, URLSafeTimedSerializer
-
-try:
-    import cv2  # type: ignore
-    import numpy as np  # type: ignore
-except Exception as exc:  # pragma: no cover - best effort import
-    cv2 = None
-    np = None
-    print(f"[Face Capture] OpenCV disabled: {exc}")
-
-from utils import captive_dns, firewall, firebase_client, local_db, session_manager
+from werkzeug.exceptions import InternalServerError
+
+from utils import (
+    dns_analytics,
+    face_engine,
+    firebase_client,
+    firebase_queue,
+    firewall,
+    grant_scheduler,
+    local_db,
+    memory,
+    metrics,
+    page_cache,
+    profiler,
+    replication,
+    session_manager,
+    sql_trace,
+    static_assets,
+    traffic_recorder,
+)
 
 _BASE_DIR = Path(__file__).resolve().parent
 _CONFIG_DIR = _BASE_DIR / "config"
 
-NETWORK_CONFIG = json.loads((_CONFIG_DIR / "network_settings.json").read_text(encoding="utf-8"))
+# serve.py --config and tools.load_test point PORTAL_CONFIG at another settings file.
+_CONFIG_PATH = Path(os.environ.get("PORTAL_CONFIG") or _CONFIG_DIR / "network_settings.json")
+NETWORK_CONFIG = json.loads(_CONFIG_PATH.read_text(encoding="utf-8"))
 _APP_SECRET = NETWORK_CONFIG.get("session", {}).get("flask_secret_key", "change-me-in-production")
 _DATA_SOURCE = NETWORK_CONFIG.get("data_source", "firebase").lower()
-_USING_SQLITE = _DATA_SOURCE == "sqlite"
+# "hybrid" serves everything from SQLite and replicates changes to Firebase in the background.
+_USING_HYBRID = _DATA_SOURCE == "hybrid"
+_USING_SQLITE = _DATA_SOURCE in ("sqlite", "hybrid")
 _SQLITE_CONFIG = NETWORK_CONFIG.get("sqlite", {})
 _SQLITE_DB_PATH_RAW = Path(_SQLITE_CONFIG.get("db_path", "data/portal.db"))
 _SQLITE_DB_PATH = (
@@ -43,6 +64,95 @@ _SQLITE_DB_PATH = (
     if _SQLITE_DB_PATH_RAW.is_absolute()
     else (_BASE_DIR / _SQLITE_DB_PATH_RAW).resolve()
 )
+_SQL_TRACE_CONFIG = _SQLITE_CONFIG.get("trace", {}) or {}
+if _SQL_TRACE_CONFIG.get("enabled", False):
+    _SLOW_QUERY_LOG = Path(_SQL_TRACE_CONFIG.get("log_path", "data/slow_queries.log"))
+    local_db.configure_tracing(
+        sql_trace.SqlTracer(
+            slow_threshold=float(_SQL_TRACE_CONFIG.get("slow_query_ms", 50)) / 1000.0,
+            log_path=_SLOW_QUERY_LOG if _SLOW_QUERY_LOG.is_absolute() else (_BASE_DIR / _SLOW_QUERY_LOG).resolve(),
+            max_bytes=int(_SQL_TRACE_CONFIG.get("max_bytes", 1_048_576)),
+            backup_count=int(_SQL_TRACE_CONFIG.get("backup_count", 3)),
+            explain=bool(_SQL_TRACE_CONFIG.get("explain", True)),
+        )
+    )
+_METRICS_CONFIG = NETWORK_CONFIG.get("metrics", {}) or {}
+_METRICS = metrics.Registry()
+_METRICS.describe("portal_http_request_duration_seconds", "histogram", "Request latency by URL rule, method and status class.")
+_METRICS.describe("portal_db_call_seconds", "histogram", "Latency of each local_db function.")
+_METRICS.describe("portal_db_errors_total", "counter", "local_db calls that failed; reason=locked means the SQLite busy timeout expired.")
+_METRICS.describe("portal_db_lock_wait_seconds", "histogram", "Time spent waiting for the SQLite write lock (BEGIN IMMEDIATE).")
+_METRICS.describe("portal_face_detect_seconds", "histogram", "Face detection and frame write time.")
+
+
+def _classify_db_error(exc: BaseException) -> Optional[str]:
+    # A refused attendance mark (already marked, device used, ...) is an answer, not a database error.
+    if isinstance(exc, local_db.AttendanceError):
+        return "locked" if exc.code == local_db.ATTENDANCE_BUSY else None
+    if isinstance(exc, local_db.LocalDatabaseError):
+        return "locked" if "locked" in str(exc) or "busy" in str(exc) else "error"
+    return None
+
+
+if _METRICS_CONFIG.get("instrument_db", True):
+    local_db.configure_lock_wait_observer(
+        lambda function, seconds: _METRICS.observe("portal_db_lock_wait_seconds", seconds, {"function": function})
+    )
+    metrics.instrument_module(
+        local_db,
+        _METRICS,
+        "portal_db_call_seconds",
+        error_counter="portal_db_errors_total",
+        classify=_classify_db_error,
+    )
+_STARTED_AT = time.time()
+_PROFILING_CONFIG = NETWORK_CONFIG.get("profiling", {}) or {}
+# Set at the end of the module when profiling.enabled; see utils/profiler.py.
+_PROFILER: Optional[profiler.SamplingProfiler] = None
+_MEMORY_CONFIG = NETWORK_CONFIG.get("memory", {}) or {}
+# Set at the end of the module when memory.enabled; see utils/memory.py.
+_MEMORY: Optional[memory.MemoryMonitor] = None
+_RECORDING_CONFIG = NETWORK_CONFIG.get("traffic_recording", {}) or {}
+# Set at the end of the module when traffic_recording.enabled; replay with tools.traffic_replay.
+_RECORDER: Optional[traffic_recorder.TrafficRecorder] = None
+_FIREBASE_CONFIG = NETWORK_CONFIG.get("firebase", {}) or {}
+firebase_client.configure_code_cache(
+    ttl_seconds=float(_FIREBASE_CONFIG.get("code_cache_ttl_seconds", 5.0)),
+    fallback_scan=bool(_FIREBASE_CONFIG.get("code_index_fallback_scan", True)),
+)
+_FIREBASE_QUEUE_CONFIG = _FIREBASE_CONFIG.get("write_behind", {}) or {}
+_FIREBASE_QUEUE: Optional[firebase_queue.FirebaseWriteQueue] = None
+if not _USING_SQLITE and _FIREBASE_QUEUE_CONFIG.get("enabled", True):
+    _FIREBASE_QUEUE = firebase_queue.FirebaseWriteQueue(
+        _SQLITE_DB_PATH,
+        firebase_client.apply_updates,
+        batch_size=int(_FIREBASE_QUEUE_CONFIG.get("batch_size", 200)),
+        flush_interval=float(_FIREBASE_QUEUE_CONFIG.get("flush_interval_ms", 500)) / 1000.0,
+        max_backoff=float(_FIREBASE_QUEUE_CONFIG.get("max_backoff_seconds", 60)),
+        reader=firebase_client.get_value,
+    )
+_REPLICATOR: Optional[replication.HybridReplicator] = None
+if _USING_HYBRID:
+    _REPLICATOR = replication.HybridReplicator(
+        _SQLITE_DB_PATH,
+        firebase_client.get_value,
+        firebase_client.apply_updates,
+        batch_size=int(_FIREBASE_QUEUE_CONFIG.get("batch_size", 200)),
+        flush_interval=float(_FIREBASE_QUEUE_CONFIG.get("flush_interval_ms", 500)) / 1000.0,
+        max_backoff=float(_FIREBASE_QUEUE_CONFIG.get("max_backoff_seconds", 60)),
+    )
+
+
+def _replicate(change: str, *args: Any) -> None:
+    """Append a local change to the hybrid-mode change log; a failure only delays replication."""
+    if _REPLICATOR is None:
+        return
+    try:
+        getattr(_REPLICATOR, change)(*args)
+    except local_db.LocalDatabaseError as exc:
+        print(f"[Replication] Unable to journal {change}: {exc} (run tools.hybrid_resync to catch up)")
+
+
 _ALLOWED_ORIGINS = NETWORK_CONFIG.get("allowed_origins", ["*"])
 if isinstance(_ALLOWED_ORIGINS, str):
     _ALLOWED_ORIGINS = [_ALLOWED_ORIGINS]
@@ -52,14 +162,81 @@ _AUTH_TOKEN_TTL_SECONDS = int(
 )
 _PORTAL_IP = NETWORK_CONFIG.get("portal_ip", "192.168.137.1")
 _CAPTIVE_DNS_CONFIG = NETWORK_CONFIG.get("captive_dns", {}) or {}
-_DNS_HANDLE: Optional[captive_dns.DNSServerHandle] = None
-if _CAPTIVE_DNS_CONFIG.get("enabled"):
+_DNS_HANDLE: Optional[Any] = None
+_FIREWALL_CONFIG = NETWORK_CONFIG.get("firewall", {}) or {}
+if not _FIREWALL_CONFIG.get("enabled", False):
+    # Never touch the host firewall unless asked to; "auto" would pick a backend nobody prepared.
+    _FIREWALL_BACKEND: firewall.FirewallBackend = firewall.RecordingBackend()
+else:
     try:
-        grant_url = None
-        if _CAPTIVE_DNS_CONFIG.get("auto_grant_on_connect"):
-            app_port = int(NETWORK_CONFIG.get("port", 8080))
-            grant_url = f"http://127.0.0.1:{app_port}/api/grant-access"
+        _FIREWALL_BACKEND = firewall.get_backend(_FIREWALL_CONFIG)
+    except firewall.FirewallError as exc:
+        print(f"[Firewall] {exc} Falling back to dry-run.")
+        _FIREWALL_BACKEND = firewall.RecordingBackend()
+_SESSION_LIFETIME_SECONDS = int(NETWORK_CONFIG.get("session", {}).get("lifetime_minutes", 180)) * 60
+_GRANT_EXPIRY_MODE = str(_FIREWALL_CONFIG.get("grant_expiry", "session")).lower()
+_GRANT_SCHEDULER: Any = grant_scheduler.GrantScheduler(
+    _FIREWALL_BACKEND,
+    flush_interval=float(_FIREWALL_CONFIG.get("flush_interval_ms", 250)) / 1000.0,
+    default_lifetime=_SESSION_LIFETIME_SECONDS if _GRANT_EXPIRY_MODE != "none" else None,
+    max_attempts=int(_FIREWALL_CONFIG.get("max_attempts", 5)),
+)
 
+
+def _grant_expiry(code_data: Optional[Dict[str, Any]] = None) -> Optional[float]:
+    """Unix timestamp at which a grant should lapse under ``firewall.grant_expiry``."""
+    if _GRANT_EXPIRY_MODE == "none":
+        return None
+    if _GRANT_EXPIRY_MODE == "code" and code_data and code_data.get("expiryTime"):
+        return int(code_data["expiryTime"]) / 1000.0
+    return time.time() + _SESSION_LIFETIME_SECONDS
+
+
+def _auto_grant_client(ip_address: str, scheduler: Any = None) -> bool:
+    """In-process equivalent of ``/api/grant-access`` used by the DNS auto-grant worker."""
+    student_id = _CAPTIVE_DNS_CONFIG.get("auto_grant_student_id") or "anonymous"
+    return (scheduler or _GRANT_SCHEDULER).request_grant(ip_address, student_id, _grant_expiry())
+
+
+_DNS_ANALYTICS_CONFIG = _CAPTIVE_DNS_CONFIG.get("analytics", {}) or {}
+
+
+def _persist_dns_events(events) -> None:
+    local_db.insert_dns_query_events(_SQLITE_DB_PATH, list(events))
+
+
+def _purge_dns_events(before_ms: int) -> None:
+    local_db.purge_dns_query_events(_SQLITE_DB_PATH, before_ms)
+
+
+_SERVICES_STARTED = False
+_DNS_STARTED = False
+# Shared per-worker resolver counters; created by create_app() before serve.py forks (see captive_dns.DNSStats).
+_DNS_STATS: Optional[Any] = None
+_SERVICE_CLOSERS: List[Callable[[], Any]] = []
+
+
+def _close_at_exit(close: Callable[..., Any], *args: Any) -> None:
+    _SERVICE_CLOSERS.append(partial(close, *args))
+    atexit.register(close, *args)
+
+
+def _start_captive_dns() -> None:
+    """Start the captive DNS server once; its worker pool forks, so this runs before other service threads."""
+    global _DNS_STARTED, _DNS_HANDLE
+    if _DNS_STARTED or not _CAPTIVE_DNS_CONFIG.get("enabled"):
+        return
+    _DNS_STARTED = True
+    from utils import captive_dns
+
+    dns_workers = int(_CAPTIVE_DNS_CONFIG.get("workers", 1))
+    grant_callback = _auto_grant_client
+    channel = None
+    if dns_workers > 1 and _CAPTIVE_DNS_CONFIG.get("auto_grant_on_connect") and captive_dns.worker_pool_supported():
+        # Pool workers are forked and have no scheduler thread; relay their grants to the one running here.
+        channel = multiprocessing.get_context("fork").Queue()
+        grant_callback = partial(_auto_grant_client, scheduler=grant_scheduler.GrantRelay(channel))
+    try:
         _DNS_HANDLE = captive_dns.start_dns_server(
             listen_address=_CAPTIVE_DNS_CONFIG.get("listen_address", "0.0.0.0"),
             listen_port=int(_CAPTIVE_DNS_CONFIG.get("listen_port", 53)),
@@ -69,34 +246,83 @@ if _CAPTIVE_DNS_CONFIG.get("enabled"):
             upstream_servers=_CAPTIVE_DNS_CONFIG.get("upstream_servers", []),
             log_queries=bool(_CAPTIVE_DNS_CONFIG.get("log_queries", False)),
             auto_grant=bool(_CAPTIVE_DNS_CONFIG.get("auto_grant_on_connect", False)),
-            grant_url=grant_url,
+            grant_callback=grant_callback,
+            server_mode=_CAPTIVE_DNS_CONFIG.get("server_mode", "threading"),
+            response_cache_size=int(_CAPTIVE_DNS_CONFIG.get("response_cache_size", 4096)),
+            upstream_timeout=float(_CAPTIVE_DNS_CONFIG.get("upstream_timeout_seconds", 1.0)),
+            upstream_cache_size=int(_CAPTIVE_DNS_CONFIG.get("upstream_cache_size", 2048)),
+            workers=dns_workers,
+            analytics_sink=_persist_dns_events if _DNS_ANALYTICS_CONFIG.get("enabled") else None,
+            analytics_ring_size=int(_DNS_ANALYTICS_CONFIG.get("ring_size", 8192)),
+            analytics_flush_interval=float(_DNS_ANALYTICS_CONFIG.get("flush_interval_seconds", 5.0)),
+            analytics_purge=_purge_dns_events,
+            analytics_retention=float(_DNS_ANALYTICS_CONFIG.get("retention_hours", 24)) * 3600,
+            stats=_DNS_STATS,
         )
-        atexit.register(captive_dns.stop_dns_server, _DNS_HANDLE)
+        _close_at_exit(captive_dns.stop_dns_server, _DNS_HANDLE)
     except captive_dns.CaptiveDNSError as exc:
         print(f"[Captive DNS] Disabled: {exc}")
+        return
+    if channel is not None:
+        grant_scheduler.relay_intents(channel, _GRANT_SCHEDULER)
+
+
+def start_services() -> None:
+    """Start the process-wide background services exactly once.
+
+    That is the captive DNS server, the firewall grant scheduler, the
+    Firebase attendance code listener, and the write-behind flusher or
+    hybrid replicator. The DNS server comes first because its worker pool
+    forks. ``serve.py`` calls this in a dedicated services process, so no
+    service thread is running when it forks workers; the workers just
+    journal writes and relay grants (see :func:`use_grant_relay`).
+    """
+    global _SERVICES_STARTED
+    if _SERVICES_STARTED:
+        return
+    _SERVICES_STARTED = True
+    if _FIREWALL_CONFIG.get("enabled", False):
+        try:
+            _FIREWALL_BACKEND.prepare()
+        except firewall.FirewallError as exc:
+            print(f"[Firewall] Unable to prepare {_FIREWALL_BACKEND.name} backend: {exc}")
+    _start_captive_dns()
+    _GRANT_SCHEDULER.start()
+    _close_at_exit(_GRANT_SCHEDULER.close)
+    if not _USING_SQLITE:
+        # The teacher clients write attendance_codes only; the listener keeps the code index in step.
+        firebase_client.start_code_listener()
+    for service in (_FIREBASE_QUEUE, _REPLICATOR):
+        if service is not None:
+            service.start()
+            _close_at_exit(service.close)
+
+
+def stop_services() -> None:
+    """Close what :func:`start_services` started, newest first, for a process that exits with ``os._exit``."""
+    while _SERVICE_CLOSERS:
+        _SERVICE_CLOSERS.pop()()
+
+
+def use_grant_relay(channel: Any) -> None:
+    """Send this process's firewall grants to the scheduler in the serving parent."""
+    global _GRANT_SCHEDULER
+    _GRANT_SCHEDULER = grant_scheduler.GrantRelay(channel)
+
+
 DEFAULT_STUDENT_PASSWORD = "sest@2024"
 
 _FACE_CAPTURE_SETTINGS = NETWORK_CONFIG.get("face_capture", {}) or {}
-_FACE_CAPTURE_DIR = (_BASE_DIR / "data" / "faces").resolve()
+_FACE_CAPTURE_DIR = (_BASE_DIR / _FACE_CAPTURE_SETTINGS.get("storage_dir", "data/faces")).resolve()
 _FACE_CAPTURE_MAX_AGE_SECONDS = int(_FACE_CAPTURE_SETTINGS.get("max_age_seconds", 300))
-_FACE_DETECTOR = None
-_FACE_CAPTURE_AVAILABLE = False
-if cv2 is not None and np is not None:
-    try:
-        cascade_root = getattr(getattr(cv2, "data", None), "haarcascades", None)
-        if cascade_root:
-            cascade_path = Path(cascade_root) / "haarcascade_frontalface_default.xml"
-            if cascade_path.exists():
-                detector = cv2.CascadeClassifier(str(cascade_path))
-                if not detector.empty():
-                    _FACE_DETECTOR = detector
-                    _FACE_CAPTURE_AVAILABLE = True
-    except Exception as exc:  # pragma: no cover - hardware dependent
-        print(f"[Face Capture] Detector unavailable: {exc}")
+# OpenCV is only imported when face capture is enabled, and then off the start-up path.
+_FACE_ENGINE = face_engine.FaceEngine(enabled=_USING_SQLITE and bool(_FACE_CAPTURE_SETTINGS.get("enabled", True)))
 
 app = Flask(__name__)
 app.secret_key = _APP_SECRET if _APP_SECRET != "change-me-in-production" else secrets.token_hex(32)
-app.config["SEND_FILE_MAX_AGE_DEFAULT"] = 86400  # cache static assets for a day
+# Unversioned /static/ files are revalidated (see add_performance_headers);
+# fingerprinted copies under /static/v/ are cached for a year.
+app.config["SEND_FILE_MAX_AGE_DEFAULT"] = None
 app.config["TEMPLATES_AUTO_RELOAD"] = False
 app.config["JSONIFY_PRETTYPRINT_REGULAR"] = False
 app.config["JSON_SORT_KEYS"] = False
@@ -111,18 +337,123 @@ app.config["COMPRESS_MIMETYPES"] = (
 )
 app.config["COMPRESS_LEVEL"] = int(NETWORK_CONFIG.get("performance", {}).get("compress_level", 6))
 Compress(app)
-session_manager.configure_session(
+_PAGE_CACHE = page_cache.PageCache(
     app,
-    lifetime_minutes=int(NETWORK_CONFIG.get("session", {}).get("lifetime_minutes", 180)),
-    secure_cookie=bool(NETWORK_CONFIG.get("session", {}).get("secure_cookie", False)),
+    enabled=bool(NETWORK_CONFIG.get("performance", {}).get("page_cache", True)),
+    check_interval=float(NETWORK_CONFIG.get("performance", {}).get("template_check_interval_seconds", 2.0)),
 )
 
-if _USING_SQLITE:
-    local_db.initialize_database(
-        _SQLITE_DB_PATH,
-        seed_sample=bool(_SQLITE_CONFIG.get("seed_demo_data", False)),
+
+def _configure_sessions(shared: bool) -> Optional[session_manager.SessionStore]:
+    return session_manager.configure_session(
+        app,
+        lifetime_minutes=int(NETWORK_CONFIG.get("session", {}).get("lifetime_minutes", 180)),
+        secure_cookie=bool(NETWORK_CONFIG.get("session", {}).get("secure_cookie", False)),
+        store=str(NETWORK_CONFIG.get("session", {}).get("store", "cookie")),
+        max_entries=int(NETWORK_CONFIG.get("session", {}).get("max_entries", 10000)),
+        db_path=_SQLITE_DB_PATH,
+        shared=shared,
     )
 
+
+_SESSION_STORE = _configure_sessions(shared=False)
+
+
+def _close_session_store() -> None:
+    if _SESSION_STORE is not None:
+        _SESSION_STORE.close()
+
+
+atexit.register(_close_session_store)
+
+
+def use_shared_sessions() -> None:
+    """Keep server-side sessions in the SQLite table that every worker process reads.
+
+    serve.py calls this before forking, whatever the initial worker count,
+    since SIGTTIN or a reload can add workers later.
+    """
+    global _SESSION_STORE
+    if _SESSION_STORE is None or _SESSION_STORE.shared:
+        return
+    previous = _SESSION_STORE
+    _SESSION_STORE = _configure_sessions(shared=True)
+    previous.close()
+
+
+_ASSETS = static_assets.AssetStore(_BASE_DIR / "static")
+
+
+def asset_url(filename: str) -> str:
+    """Fingerprinted URL of a static file; the plain static URL until assets are loaded."""
+    return _ASSETS.url(filename) or url_for("static", filename=filename)
+
+
+# Seconds spent in each start-up phase; reported by /api/health and serve.py --profile-startup.
+STARTUP_TIMINGS: Dict[str, Optional[float]] = {"import": None, "database": None, "assets": None, "services": None}
+_INITIALISED = False
+_INIT_LOCK = threading.Lock()
+
+
+def _timed_start_services() -> None:
+    started = time.perf_counter()
+    start_services()
+    STARTUP_TIMINGS["services"] = round(time.perf_counter() - started, 4)
+
+
+def create_app(services: bool = True, background: bool = True) -> Flask:
+    """Finish start-up and return the portal's WSGI application.
+
+    Creates the SQLite schema, then starts the background services (see
+    :func:`start_services`) and loads the face detector. With ``background``
+    those two run in threads so the portal answers requests straight away;
+    ``serve.py`` passes ``services=False, background=False`` because its
+    parent forks workers right after and runs the services in a child of
+    its own. Calling it again returns the same application.
+
+    Importing this module does none of this: ``python app.py`` and
+    ``serve.py`` call it, and other WSGI servers should load
+    ``app:create_app()`` rather than ``app:app``.
+    """
+    global _INITIALISED, _DNS_STATS
+    with _INIT_LOCK:
+        if not _INITIALISED:
+            _INITIALISED = True
+            if _USING_SQLITE:
+                started = time.perf_counter()
+                local_db.initialize_database(
+                    _SQLITE_DB_PATH,
+                    seed_sample=bool(_SQLITE_CONFIG.get("seed_demo_data", False)),
+                )
+                STARTUP_TIMINGS["database"] = round(time.perf_counter() - started, 4)
+            started = time.perf_counter()
+            try:
+                _ASSETS.load(rebuild=True)
+            except OSError as exc:
+                # A read-only install still works, with unversioned, compressed-per-request assets.
+                print(f"[Static] Fingerprinted assets unavailable: {exc}")
+            STARTUP_TIMINGS["assets"] = round(time.perf_counter() - started, 4)
+            if _CAPTIVE_DNS_CONFIG.get("enabled"):
+                from utils import captive_dns
+
+                _DNS_STATS = captive_dns.DNSStats(
+                    int(_CAPTIVE_DNS_CONFIG.get("workers", 1)), _CAPTIVE_DNS_CONFIG.get("upstream_servers", [])
+                )
+            if services and background:
+                # Before the face engine and services threads exist: the DNS worker pool forks.
+                _start_captive_dns()
+            if background:
+                _FACE_ENGINE.warm_up()
+            else:
+                _FACE_ENGINE.load()
+    if services and not _SERVICES_STARTED:
+        if background:
+            threading.Thread(target=_timed_start_services, name="PortalServices", daemon=True).start()
+        else:
+            _timed_start_services()
+    return app
+
+
 _token_serializer = URLSafeTimedSerializer(app.secret_key, salt="teacher-auth")
 
 
@@ -151,31 +482,29 @@ def _decode_image_payload(image_payload: str) -> bytes:
 
 
 def _save_face_capture(student_id: str, image_bytes: bytes) -> Dict[str, Any]:
-    if not _FACE_CAPTURE_AVAILABLE or not _FACE_DETECTOR or not cv2 or not np:
-        raise RuntimeError("Face detection engine is not available on this device.")
-
-    np_buffer = np.frombuffer(image_bytes, dtype=np.uint8)
-    image = cv2.imdecode(np_buffer, cv2.IMREAD_COLOR)
-    if image is None:
-        raise ValueError("Unable to read captured frame. Please retry.")
-
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    faces = _FACE_DETECTOR.detectMultiScale(gray, scaleFactor=1.15, minNeighbors=5, minSize=(90, 90))
-    if faces is None or len(faces) == 0:
-        raise ValueError("No face detected. Ensure good lighting and stay within frame.")
-
     timestamp_suffix = datetime.now(tz=timezone.utc).strftime("%Y%m%d%H%M%S")
-    filename = f"{student_id}_{timestamp_suffix}.jpg"
-    _FACE_CAPTURE_DIR.mkdir(parents=True, exist_ok=True)
-    file_path = _FACE_CAPTURE_DIR / filename
-    if not cv2.imwrite(str(file_path), image):
-        raise RuntimeError("Unable to persist face capture. Retry in a moment.")
+    file_path = _FACE_CAPTURE_DIR / f"{student_id}_{timestamp_suffix}.jpg"
+    started = time.perf_counter()
+    try:
+        with profiler.phase_of(_PROFILER, "face_detect"):
+            face_count = _FACE_ENGINE.detect_and_save(image_bytes, file_path)
+    finally:
+        _METRICS.observe("portal_face_detect_seconds", time.perf_counter() - started)
 
-    record = local_db.log_face_capture(_SQLITE_DB_PATH, student_id, str(file_path), len(faces))
+    record = local_db.log_face_capture(_SQLITE_DB_PATH, student_id, str(file_path), face_count)
     record.setdefault("image_path", str(file_path))
     return record
 
 
+_ATTENDANCE_ERROR_STATUS = {
+    local_db.ATTENDANCE_CAPTURE_NOT_FOUND: 400,
+    local_db.ATTENDANCE_CAPTURE_MISMATCH: 403,
+    local_db.ATTENDANCE_ALREADY_MARKED: 400,
+    local_db.ATTENDANCE_DEVICE_USED: 400,
+    local_db.ATTENDANCE_BUSY: 503,
+}
+
+
 def _face_capture_is_recent(face_data: Optional[dict[str, Any]]) -> bool:
     if not face_data:
         return False
@@ -266,8 +595,42 @@ def add_cors_headers(response):
 
 @app.after_request
 def add_performance_headers(response):
-    if request.path.startswith("/static/"):
-        response.headers.setdefault("Cache-Control", "public, max-age=86400, immutable")
+    if request.path.startswith("/static/") and not request.path.startswith(static_assets.URL_PREFIX):
+        # Not fingerprinted, so phones must revalidate (cheap 304s) or a deploy leaves them on stale JS.
+        response.headers.setdefault("Cache-Control", "no-cache")
+    return response
+
+
+@app.errorhandler(InternalServerError)
+def handle_internal_error(error: InternalServerError):
+    # A shared session store raises from save_session once its retries are spent;
+    # the session was not stored, so ask the client to try again.
+    if isinstance(error.original_exception, local_db.LocalDatabaseError):
+        response = jsonify({"success": False, "error": "The portal is busy, please try again.", "errorCode": "busy"})
+        response.headers["Retry-After"] = "1"
+        return response, 503
+    return error
+
+
+@app.route(static_assets.URL_PREFIX + "<path:name>")
+def versioned_static(name: str):
+    asset = _ASSETS.get(name)
+    if asset is None:
+        abort(404)
+    encoding, body = asset.choose(request.headers.get("Accept-Encoding", ""))
+    etag = f"{asset.etag}-{encoding}"
+    headers = {
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "Vary": "Accept-Encoding",
+        "ETag": f'"{etag}"',
+    }
+    if etag in request.if_none_match:
+        return Response(status=304, headers=headers)
+    if encoding != "identity":
+        # Flask-Compress leaves responses that already carry Content-Encoding alone.
+        headers["Content-Encoding"] = encoding
+    response = Response(body, content_type=asset.content_type, headers=headers)
+    response.direct_passthrough = True
     return response
 
 
@@ -335,7 +698,13 @@ def _require_sqlite_enabled():
 
 @app.context_processor
 def inject_globals() -> dict[str, Any]:
-    return {"current_year": datetime.now().year}
+    return {"current_year": datetime.now().year, "asset_url": asset_url}
+
+
+def _render_static_page(template: str):
+    """Render a page that depends only on the templates, the assets and the year."""
+    # Keyed on the asset URLs too, so a rebuilt asset yields a page that links to it.
+    return _PAGE_CACHE.render(template, key=(datetime.now().year, asset_url("css/style.css"), asset_url("js/main.js")))
 
 
 @app.route("/generate_204")
@@ -356,7 +725,7 @@ def captive_probe_redirect():
 
 @app.route("/")
 def index():
-    return render_template("index.html")
+    return _render_static_page("index.html")
 
 
 @app.route("/verify", methods=["GET", "POST"])
@@ -384,7 +753,7 @@ def verify_code():
         session_manager.store_code_data(code_data)
         return jsonify({"success": True, "data": code_data})
 
-    return render_template("verify.html")
+    return _render_static_page("verify.html")
 
 
 @app.route("/login", methods=["GET", "POST"])
@@ -500,7 +869,7 @@ def mark_attendance():
         return redirect("/verify")
 
     if request.method == "POST":
-        capture_record = None
+        capture_id = None
         if _USING_SQLITE:
             if not face_capture_data:
                 return jsonify({"success": False, "error": "Face verification is required before marking attendance."}), 403
@@ -512,34 +881,28 @@ def mark_attendance():
             capture_id = face_capture_data.get("captureId")
             if not capture_id:
                 return jsonify({"success": False, "error": "Face capture missing. Capture again."}), 400
+
+        today = datetime.now(tz=timezone.utc).date().isoformat()
+        if not _USING_SQLITE:
+            # The SQLite path checks capture, duplicate and device inside record_attendance's transaction.
             try:
-                capture_record = local_db.get_face_capture(_SQLITE_DB_PATH, capture_id)
+                if _FIREBASE_QUEUE is not None:
+                    # Marks through this portal are journaled; the flusher checks Firebase for the rest.
+                    existing = _FIREBASE_QUEUE.find_attendance(code_data["classId"], student["studentId"])
+                else:
+                    firebase_client.initialise()
+                    existing = firebase_client.load_existing_attendance(
+                        code_data["classId"], student["studentId"]
+                    )
             except local_db.LocalDatabaseError as exc:
                 return jsonify({"success": False, "error": str(exc)}), 500
-            if not capture_record:
-                session_manager.clear_face_capture()
-                return jsonify({"success": False, "error": "Face capture not found. Capture again."}), 400
-
-        today = datetime.now(tz=timezone.utc).date().isoformat()
-        try:
-            if _USING_SQLITE:
-                existing = local_db.load_existing_attendance(
-                    _SQLITE_DB_PATH, code_data["classId"], student["studentId"]
-                )
-            else:
-                firebase_client.initialise()
-                existing = firebase_client.load_existing_attendance(
-                    code_data["classId"], student["studentId"]
+            except firebase_client.FirebaseConfigurationError as exc:
+                return jsonify({"success": False, "error": str(exc)}), 500
+            if existing and existing.get("date") == today:
+                return (
+                    jsonify({"success": False, "error": "Attendance already recorded for today."}),
+                    400,
                 )
-        except local_db.LocalDatabaseError as exc:
-            return jsonify({"success": False, "error": str(exc)}), 500
-        except firebase_client.FirebaseConfigurationError as exc:
-            return jsonify({"success": False, "error": str(exc)}), 500
-        if existing and existing.get("date") == today:
-            return (
-                jsonify({"success": False, "error": "Attendance already recorded for today."}),
-                400,
-            )
 
         timestamp = datetime.now(tz=timezone.utc)
         forwarded_for = request.headers.get("X-Forwarded-For", "")
@@ -564,32 +927,44 @@ def mark_attendance():
             "deviceFingerprint": fingerprint,
         }
 
-        if capture_record:
-            attendance_payload["faceCaptureId"] = capture_record.get("id")
-            attendance_payload["faceCapturePath"] = capture_record.get("image_path")
-        elif face_capture_data:
+        if face_capture_data:
             attendance_payload["faceCaptureId"] = face_capture_data.get("captureId")
 
         try:
             if _USING_SQLITE:
-                local_db.mark_attendance(
-                    _SQLITE_DB_PATH, code_data["classId"], student["studentId"], attendance_payload
+                record = local_db.record_attendance(
+                    _SQLITE_DB_PATH,
+                    code_data["classId"],
+                    student["studentId"],
+                    attendance_payload,
+                    face_capture_id=capture_id,
                 )
+                # The ID, not the capture's path on this server, is what Firebase and the client see.
+                attendance_payload["faceCaptureId"] = record.get("face_capture_id")
+                _replicate("attendance_marked", code_data["classId"], student["studentId"], attendance_payload)
+            elif _FIREBASE_QUEUE is not None:
+                _FIREBASE_QUEUE.enqueue_attendance(code_data["classId"], student["studentId"], attendance_payload)
             else:
                 firebase_client.mark_attendance(
                     code_data["classId"], student["studentId"], attendance_payload
                 )
+        except local_db.AttendanceError as exc:
+            if exc.code == local_db.ATTENDANCE_CAPTURE_NOT_FOUND:
+                session_manager.clear_face_capture()
+            status = _ATTENDANCE_ERROR_STATUS.get(exc.code, 400)
+            return jsonify({"success": False, "error": str(exc), "errorCode": exc.code}), status
         except local_db.LocalDatabaseError as exc:
-            message = str(exc)
-            status = 400 if "already" in message.lower() or "device" in message.lower() else 500
-            return jsonify({"success": False, "error": message}), status
+            return jsonify({"success": False, "error": str(exc)}), 500
 
-        if NETWORK_CONFIG.get("firewall", {}).get("enabled", False):
-            rule_prefix = NETWORK_CONFIG["firewall"].get("rule_prefix", "Attendance")
-            firewall.grant_internet_access(request.remote_addr, student["studentId"], rule_prefix)
+        if _FIREWALL_CONFIG.get("enabled", False):
+            with profiler.phase_of(_PROFILER, "firewall"):
+                _GRANT_SCHEDULER.request_grant(request.remote_addr, student["studentId"], _grant_expiry(code_data))
 
         session_manager.store_attendance_data(attendance_payload)
         session_manager.clear_face_capture()
+        if not _USING_SQLITE and _FIREBASE_QUEUE is not None:
+            # Accepted, but not yet in Firebase; the flusher may still find an earlier mark from today.
+            return jsonify({"success": True, "pending": True, "data": attendance_payload})
         return jsonify({"success": True, "data": attendance_payload})
 
     return render_template(
@@ -617,7 +992,7 @@ def client_ip():
 def api_face_capture():
     if not _USING_SQLITE:
         return jsonify({"success": False, "error": "Face capture requires the SQLite data source."}), 400
-    if not _FACE_CAPTURE_AVAILABLE:
+    if not _FACE_ENGINE.available:
         return jsonify({"success": False, "error": "Face detection libraries are not installed on the server."}), 500
 
     payload = request.get_json(silent=True) or {}
@@ -662,14 +1037,290 @@ def grant_access_api():
     payload = request.get_json(silent=True) or {}
     student_id = payload.get("studentId") or "anonymous"
     ip_address = payload.get("ipAddress") or request.remote_addr
-    rule_prefix = NETWORK_CONFIG.get("firewall", {}).get("rule_prefix", "Attendance")
-    success = firewall.grant_internet_access(ip_address, student_id, rule_prefix)
-    return jsonify({"success": success})
+    with profiler.phase_of(_PROFILER, "firewall"):
+        queued = _GRANT_SCHEDULER.request_grant(ip_address, student_id, _grant_expiry())
+    if not queued:
+        return jsonify({"success": False, "error": "ipAddress must be an IPv4 address."}), 400
+    return jsonify({"success": True, "queued": True})
+
+
+def _firebase_queue_stats() -> Optional[Dict[str, Any]]:
+    source = _REPLICATOR or _FIREBASE_QUEUE
+    if source is None:
+        return None
+    try:
+        return source.stats()
+    except local_db.LocalDatabaseError as exc:
+        return {"error": str(exc)}
+
+
+def _grant_stats() -> Dict[str, Any]:
+    stats = getattr(_GRANT_SCHEDULER, "stats", None)
+    return stats() if stats else {}
+
+
+def _dns_stats() -> Optional[Dict[str, Any]]:
+    if _DNS_STATS is None:
+        return None
+    return {"workers": _DNS_STATS.snapshot()}
+
+
+def _collect_gauges():
+    yield "portal_uptime_seconds", {}, time.time() - _STARTED_AT
+    sessions = session_manager.session_store_stats() or {}
+    yield "portal_sessions", {}, sessions.get("size")
+    yield "portal_session_pending_writes", {}, sessions.get("pendingWrites")
+    grants = _grant_stats()
+    yield "portal_grant_queue_depth", {}, grants.get("pending")
+    yield "portal_grants_allowed", {}, grants.get("allowed")
+    queue = _firebase_queue_stats() or {}
+    yield "portal_firebase_outbox_depth", {}, queue.get("depth")
+    yield "portal_firebase_replication_lag_seconds", {}, queue.get("replicationLagSeconds")
+    yield "portal_face_engine_loaded", {}, 1 if _FACE_ENGINE.status()["available"] else 0
+    yield "portal_page_cache_entries", {}, _PAGE_CACHE.stats()["entries"]
+    yield "portal_captive_probe_redirects", {}, _PROBE_REDIRECT.hits
+    yield "portal_process_rss_bytes", {}, memory.rss_bytes()
+    for worker in (_dns_stats() or {}).get("workers", []):
+        labels = {"dns_worker": worker["worker"]}
+        yield "portal_dns_worker_queries", labels, worker["queries"]
+        yield "portal_dns_worker_qps", labels, worker["qps"]
+        yield "portal_dns_worker_restarts", labels, worker["restarts"]
+        auto_grant = worker["autoGrant"] or {}
+        yield "portal_dns_auto_grant_queue_depth", labels, auto_grant.get("depth")
+        yield "portal_dns_auto_grants", labels, auto_grant.get("granted")
+        yield "portal_dns_auto_grant_failures", labels, auto_grant.get("failed")
+        yield "portal_dns_auto_grants_dropped", labels, auto_grant.get("dropped")
+        for upstream in worker["upstreams"]:
+            upstream_labels = {**labels, "upstream": upstream["address"]}
+            yield "portal_dns_upstream_srtt_seconds", upstream_labels, upstream["srttMs"] / 1000
+            yield "portal_dns_upstream_failures", upstream_labels, upstream["failures"]
+            yield "portal_dns_upstream_healthy", upstream_labels, 1 if upstream["healthy"] else 0
+
+
+_METRICS.add_gauges(_collect_gauges)
+
+
+def _route_latency_summary() -> Dict[str, Any]:
+    summary = {}
+    for labels, histogram in _METRICS.histograms("portal_http_request_duration_seconds").items():
+        label = dict(labels)
+        summary[f"{label['method']} {label['route']} {label['status']}"] = histogram.summary()
+    return summary
+
+
+def _bearer_token() -> str:
+    return request.headers.get("Authorization", "").removeprefix("Bearer ").strip()
+
+
+def _metrics_token_matches(supplied: str) -> bool:
+    token = _METRICS_CONFIG.get("token")
+    return bool(token) and secrets.compare_digest(supplied.encode("utf-8"), str(token).encode("utf-8"))
+
+
+@app.route("/api/metrics", methods=["GET"])
+def api_metrics():
+    if _METRICS_CONFIG.get("token") and not _metrics_token_matches(_bearer_token()):
+        return jsonify({"success": False, "error": "Authentication required."}), 401
+    return Response(_METRICS.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
 
 
 @app.route("/api/health", methods=["GET"])
 def api_health():
-    return jsonify({"success": True, "status": "ok", "dataSource": _DATA_SOURCE})
+    """Status and database round trip for anyone; the details need ``metrics.token`` or a teacher token."""
+    database: Dict[str, Any] = {}
+    try:
+        database["roundTripMs"] = round(local_db.ping(_SQLITE_DB_PATH) * 1000, 3)
+    except local_db.LocalDatabaseError as exc:
+        database["error"] = str(exc)
+    healthy = "error" not in database
+    status = 200 if healthy else 503
+    summary = {"success": healthy, "status": "ok" if healthy else "degraded"}
+    supplied = _bearer_token()
+    if not supplied or not (_metrics_token_matches(supplied) or "teacher_id" in (_decode_teacher_token(supplied) or {})):
+        return jsonify({**summary, "database": {"roundTripMs": database.get("roundTripMs")}}), status
+    grants = _grant_stats()
+    sessions = session_manager.session_store_stats()
+    firebase_queue_stats = _firebase_queue_stats()
+    return (
+        jsonify(
+            {
+                **summary,
+                "pid": os.getpid(),
+                "uptimeSeconds": round(time.time() - _STARTED_AT, 1),
+                "dataSource": _DATA_SOURCE,
+                "database": {"path": str(_SQLITE_DB_PATH), **database},
+                "queues": {
+                    "grants": grants.get("pending"),
+                    "firebaseOutbox": (firebase_queue_stats or {}).get("depth"),
+                    "sessionWrites": (sessions or {}).get("pendingWrites"),
+                },
+                "grants": grants,
+                "sessions": sessions,
+                "firebaseQueue": firebase_queue_stats,
+                "faceCapture": _FACE_ENGINE.status(),
+                "captiveDns": _dns_stats(),
+                "pageCache": {**_PAGE_CACHE.stats(), "probeRedirects": _PROBE_REDIRECT.hits},
+                "latency": _route_latency_summary(),
+                "profiling": _PROFILER.stats() if _PROFILER is not None else None,
+                "recording": _RECORDER.stats() if _RECORDER is not None else None,
+                "memory": {
+                    "rssBytes": memory.rss_bytes(),
+                    "peakRssBytes": memory.peak_rss_bytes(),
+                    "monitor": _MEMORY is not None,
+                },
+                "startup": STARTUP_TIMINGS,
+            }
+        ),
+        status,
+    )
+
+
+def _require_profiler():
+    if _PROFILER is None:
+        return jsonify({"success": False, "error": "Profiling is disabled (profiling.enabled)."}), 404
+    return None
+
+
+@app.route("/api/admin/profile", methods=["GET"])
+@require_teacher_auth
+def api_admin_profile():
+    disabled = _require_profiler()
+    if disabled:
+        return disabled
+    body = _PROFILER.collapsed()
+    if request.args.get("reset") in ("1", "true"):
+        _PROFILER.reset()
+    return Response(body, content_type="text/plain; charset=utf-8")
+
+
+@app.route("/api/admin/slow-requests", methods=["GET"])
+@require_teacher_auth
+def api_admin_slow_requests():
+    disabled = _require_profiler()
+    if disabled:
+        return disabled
+    return jsonify({"success": True, "profiler": _PROFILER.stats(), "requests": _PROFILER.slow_requests()})
+
+
+@app.route("/api/admin/slow-requests/<entry_id>", methods=["GET"])
+@require_teacher_auth
+def api_admin_slow_request(entry_id: str):
+    disabled = _require_profiler()
+    if disabled:
+        return disabled
+    record = _PROFILER.slow_request(entry_id)
+    if record is None:
+        return jsonify({"success": False, "error": "Slow request not found."}), 404
+    if request.args.get("format") == "collapsed":
+        return Response(_PROFILER.collapsed(record.get("stacks", {})), content_type="text/plain; charset=utf-8")
+    return jsonify({"success": True, "request": record})
+
+
+def _require_memory_monitor():
+    if _MEMORY is None:
+        return jsonify({"success": False, "error": "Memory accounting is disabled (memory.enabled)."}), 404
+    return None
+
+
+def _limit_arg(default: int):
+    try:
+        return max(1, min(int(request.args.get("limit", default)), 500))
+    except ValueError:
+        return None
+
+
+@app.route("/api/admin/memory", methods=["GET"])
+@require_teacher_auth
+def api_admin_memory():
+    disabled = _require_memory_monitor()
+    if disabled:
+        return disabled
+    taken = _MEMORY.snapshot() if request.args.get("snapshot") in ("1", "true") else None
+    stats = _MEMORY.stats()
+    if request.args.get("reset") in ("1", "true"):
+        _MEMORY.reset()
+    return jsonify({"success": True, **stats, "snapshotTaken": taken, "snapshotList": _MEMORY.snapshots()})
+
+
+@app.route("/api/admin/memory/snapshots/<int:snapshot_id>", methods=["GET"])
+@require_teacher_auth
+def api_admin_memory_snapshot(snapshot_id: int):
+    disabled = _require_memory_monitor()
+    if disabled:
+        return disabled
+    limit = _limit_arg(_MEMORY.top_limit)
+    if limit is None:
+        return jsonify({"success": False, "error": "limit must be an integer."}), 400
+    top = _MEMORY.top(snapshot_id, limit)
+    if top is None:
+        return jsonify({"success": False, "error": "Snapshot not found."}), 404
+    return jsonify({"success": True, "id": snapshot_id, "top": top})
+
+
+@app.route("/api/admin/memory/diff", methods=["GET"])
+@require_teacher_auth
+def api_admin_memory_diff():
+    disabled = _require_memory_monitor()
+    if disabled:
+        return disabled
+    limit = _limit_arg(_MEMORY.top_limit)
+    snapshots = _MEMORY.snapshots()
+    try:
+        first = int(request.args.get("from") or (snapshots[0]["id"] if snapshots else 0))
+        second = int(request.args.get("to") or (snapshots[-1]["id"] if snapshots else 0))
+    except ValueError:
+        return jsonify({"success": False, "error": "from and to must be snapshot ids."}), 400
+    if limit is None:
+        return jsonify({"success": False, "error": "limit must be an integer."}), 400
+    diff = _MEMORY.diff(first, second, limit)
+    if diff is None:
+        return jsonify({"success": False, "error": "Snapshot not found; take two with /api/admin/memory?snapshot=1."}), 404
+    return jsonify({"success": True, **diff})
+
+
+@app.route("/api/admin/sql-stats", methods=["GET"])
+@require_teacher_auth
+def api_admin_sql_stats():
+    try:
+        limit = max(1, min(int(request.args.get("limit", 50)), 500))
+    except ValueError:
+        return jsonify({"success": False, "error": "limit must be an integer."}), 400
+    stats = local_db.tracing_stats(
+        request.args.get("sort", "totalMs"), limit, reset=request.args.get("reset") in ("1", "true")
+    )
+    if stats is None:
+        return jsonify({"success": False, "error": "SQL tracing is disabled (sqlite.trace.enabled)."}), 404
+    return jsonify({"success": True, **stats})
+
+
+@app.route("/api/dns/stats", methods=["GET"])
+@require_teacher_auth
+def api_dns_stats():
+    try:
+        minutes = max(1, min(int(request.args.get("minutes", 60)), 7 * 24 * 60))
+    except ValueError:
+        return jsonify({"success": False, "error": "minutes must be an integer."}), 400
+
+    since_ms = int(datetime.now(tz=timezone.utc).timestamp() * 1000) - minutes * 60 * 1000
+    try:
+        stats = local_db.get_dns_query_stats(_SQLITE_DB_PATH, since_ms)
+    except local_db.LocalDatabaseError as exc:
+        return jsonify({"success": False, "error": str(exc)}), 500
+
+    from dnslib import QTYPE  # only needed here, so kept off the start-up path
+
+    for row in stats["decisions"]:
+        row["decisionName"] = dns_analytics.DECISION_NAMES.get(row["decision"], "unknown")
+    for row in stats["qtypes"]:
+        row["qtypeName"] = str(QTYPE.get(row["qtype"], row["qtype"]))
+    return jsonify(
+        {
+            "success": True,
+            "minutes": minutes,
+            "enabled": bool(_CAPTIVE_DNS_CONFIG.get("enabled") and _DNS_ANALYTICS_CONFIG.get("enabled")),
+            **stats,
+        }
+    )
 
 
 @app.route("/api/teachers/signup", methods=["POST"])
@@ -763,6 +1414,7 @@ def api_create_code():
     code_value = f"{secrets.randbelow(900000) + 100000:06d}"
 
     try:
+        previous = local_db.get_attendance_code(_SQLITE_DB_PATH, class_id) if _USING_HYBRID else None
         saved = local_db.save_attendance_code(
             _SQLITE_DB_PATH,
             class_id=class_id,
@@ -777,6 +1429,7 @@ def api_create_code():
     except local_db.LocalDatabaseError as exc:
         return jsonify({"success": False, "error": str(exc)}), 500
 
+    _replicate("code_saved", saved, (previous or {}).get("code"))
     return jsonify({"success": True, "code": _serialise_attendance_code(saved)})
 
 
@@ -790,9 +1443,11 @@ def api_delete_code():
     data = request.get_json(silent=True) or {}
     class_id = data.get("classId") or g.teacher.get("classId") or g.teacher.get("class_id")
     try:
+        previous = local_db.get_attendance_code(_SQLITE_DB_PATH, class_id) if _USING_HYBRID else None
         local_db.clear_attendance_code(_SQLITE_DB_PATH, class_id)
     except local_db.LocalDatabaseError as exc:
         return jsonify({"success": False, "error": str(exc)}), 500
+    _replicate("code_cleared", class_id, (previous or {}).get("code"))
     return jsonify({"success": True})
 
 
@@ -912,6 +1567,7 @@ def api_manual_attendance():
                     "password": DEFAULT_STUDENT_PASSWORD,
                 },
             )
+            _replicate("student_saved", student)
         timestamp = datetime.now(tz=timezone.utc)
         attendance_payload = {
             "name": student_name,
@@ -928,12 +1584,15 @@ def api_manual_attendance():
             "department": department,
             "markedVia": "Teacher Dashboard",
         }
-        local_db.mark_attendance(_SQLITE_DB_PATH, class_id, student_id, attendance_payload)
-        record = local_db.load_existing_attendance(_SQLITE_DB_PATH, class_id, student_id)
+        record = local_db.record_attendance(_SQLITE_DB_PATH, class_id, student_id, attendance_payload)
+        _replicate("attendance_marked", class_id, student_id, attendance_payload)
+    except local_db.AttendanceError as exc:
+        status = _ATTENDANCE_ERROR_STATUS.get(exc.code, 400)
+        return jsonify({"success": False, "error": str(exc), "errorCode": exc.code}), status
     except local_db.LocalDatabaseError as exc:
         return jsonify({"success": False, "error": str(exc)}), 400
 
-    return jsonify({"success": True, "record": _serialise_attendance_record(record) if record else None})
+    return jsonify({"success": True, "record": _serialise_attendance_record(record)})
 
 
 @app.route("/api/students", methods=["GET"])
@@ -978,6 +1637,7 @@ def api_create_student():
     except local_db.LocalDatabaseError as exc:
         return jsonify({"success": False, "error": str(exc)}), 400
 
+    _replicate("student_saved", student)
     return jsonify({"success": True, "student": _serialise_student(student), "defaultPassword": DEFAULT_STUDENT_PASSWORD})
 
 
@@ -1051,7 +1711,61 @@ def api_delete_timetable_entry(entry_id: int):
     return jsonify({"success": True})
 
 
+# Captive probes are answered before Flask: no session lookup, hooks or compression.
+_PROBE_REDIRECT = page_cache.ProbeRedirect(app.wsgi_app, page_cache.rule_paths(app, "captive_probe_redirect"), "/verify")
+app.wsgi_app = _PROBE_REDIRECT
+if _PROFILING_CONFIG.get("enabled", False):
+    _RING_DIR = Path(_PROFILING_CONFIG.get("ring_dir", "data/slow_requests"))
+    _PROFILER = profiler.SamplingProfiler(
+        app.wsgi_app,
+        interval=float(_PROFILING_CONFIG.get("interval_ms", 10)) / 1000.0,
+        slow_threshold=float(_PROFILING_CONFIG.get("slow_request_ms", 500)) / 1000.0,
+        ring_dir=_RING_DIR if _RING_DIR.is_absolute() else (_BASE_DIR / _RING_DIR).resolve(),
+        ring_size=int(_PROFILING_CONFIG.get("ring_size", 50)),
+        max_stacks=int(_PROFILING_CONFIG.get("max_stacks", 5000)),
+    )
+    # After metrics.instrument_module, which skips functions that are already wrapped.
+    _PROFILER.trace_module(local_db, "sqlite")
+    _PROFILER.trace_module(firebase_client, "firebase")
+    app.wsgi_app = _PROFILER
+if _MEMORY_CONFIG.get("enabled", False):
+    _MEMORY = memory.MemoryMonitor(
+        app.wsgi_app,
+        trace_frames=int(_MEMORY_CONFIG.get("tracemalloc_frames", 1)),
+        snapshot_interval=float(_MEMORY_CONFIG.get("snapshot_interval_seconds", 300)),
+        keep=int(_MEMORY_CONFIG.get("keep_snapshots", 12)),
+        top=int(_MEMORY_CONFIG.get("top", 25)),
+    )
+    app.wsgi_app = _MEMORY
+if _METRICS_CONFIG.get("enabled", True):
+    app.wsgi_app = metrics.RequestMetrics(app.wsgi_app, _METRICS, "portal_http_request_duration_seconds")
+if _RECORDING_CONFIG.get("enabled", False):
+    _RECORDING_DIR = Path(_RECORDING_CONFIG.get("dir", "data/traffic"))
+    # Outermost, so the recorded duration includes every other middleware.
+    _RECORDER = traffic_recorder.TrafficRecorder(
+        app.wsgi_app,
+        _RECORDING_DIR if _RECORDING_DIR.is_absolute() else (_BASE_DIR / _RECORDING_DIR).resolve(),
+        salt=_RECORDING_CONFIG.get("salt"),
+        max_bytes=int(_RECORDING_CONFIG.get("max_bytes", 64 * 1024 * 1024)),
+        max_files=int(_RECORDING_CONFIG.get("max_files", 20)),
+        max_body_bytes=int(_RECORDING_CONFIG.get("max_body_bytes", 8 * 1024 * 1024)),
+    )
+    app.wsgi_app = _RECORDER
+
+
+def _tag_route() -> None:
+    if request.url_rule is not None:
+        request.environ[metrics.ROUTE_ENVIRON_KEY] = request.url_rule.rule
+
+
+# First, so the route is known even when another hook (CORS preflight) answers the request.
+app.before_request_funcs.setdefault(None, []).insert(0, _tag_route)
+
+STARTUP_TIMINGS["import"] = round(time.perf_counter() - _IMPORT_STARTED, 4)
+
+
 if __name__ == "__main__":
+    create_app()
     host = NETWORK_CONFIG.get("host", "192.168.137.1")
     port = int(NETWORK_CONFIG.get("port", 8080))
     debug = bool(NETWORK_CONFIG.get("debug", False))
@@ -0,0 +1,396 @@
+"""Production entry point for the captive portal.
+
+Run from ``captive-portal/``::
+
+    python serve.py                 # settings from config/network_settings.json
+    python serve.py --workers 4 --threads 32
+    python serve.py --profile-startup   # import/start-up time report
+
+The parent process imports the app once and binds the listening socket.
+It forks one services process, which runs the process-wide services
+(captive DNS, firewall grant scheduler, Firebase flusher/replicator), and
+pre-forks ``server.workers`` worker processes that share the socket. The
+parent itself runs no service threads, so a fork never copies a lock held
+by one. Each worker serves requests from a pool of ``server.threads``
+threads. Grants made in a worker are relayed to the scheduler in the
+services process. The session store always uses the shared SQLite table,
+since the number of workers can grow after start-up. A services process
+or worker that dies is restarted.
+
+Signals (POSIX):
+
+* ``SIGHUP`` — graceful reload: re-read the ``server`` settings and start a
+  new generation of workers. The old workers stop accepting connections
+  and exit once their in-flight requests finish.
+* ``SIGTERM``/``SIGINT`` — graceful shutdown, bounded by
+  ``server.graceful_timeout_seconds``.
+* ``SIGTTIN``/``SIGTTOU`` — add or remove one worker.
+
+Worker processes need ``os.fork``. Elsewhere (Windows) the portal runs as
+one process with the thread pool.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+_BASE_DIR = Path(__file__).resolve().parent
+_CONFIG_PATH = _BASE_DIR / "config" / "network_settings.json"
+
+_RESPAWN_DELAY_SECONDS = 1.0
+
+
+def load_server_settings(config_path: Path = _CONFIG_PATH) -> Dict[str, Any]:
+    config = json.loads(config_path.read_text(encoding="utf-8"))
+    server = config.get("server", {}) or {}
+    return {
+        "host": server.get("host") or config.get("host", "0.0.0.0"),
+        "port": int(server.get("port") or config.get("port", 8080)),
+        "workers": max(1, int(server.get("workers", 1))),
+        "threads": max(1, int(server.get("threads", 16))),
+        "backlog": int(server.get("backlog", 1024)),
+        "keepalive_timeout": float(server.get("keepalive_timeout_seconds", 2.0)),
+        "graceful_timeout": float(server.get("graceful_timeout_seconds", 30.0)),
+    }
+
+
+def forking_supported() -> bool:
+    return hasattr(os, "fork")
+
+
+class _PortalRequestHandler(WSGIRequestHandler):
+    # Keep-alive lets a phone fetch CSS/JS over one connection, but an idle
+    # connection holds a pool thread, so it is closed after ``timeout``.
+    protocol_version = "HTTP/1.1"
+    timeout = 2.0
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """Werkzeug WSGI server that handles connections on a fixed-size thread pool."""
+
+    multithread = True
+
+    def __init__(self, host: str, port: int, app: Any, threads: int, fd: Optional[int] = None, keepalive_timeout: float = 2.0) -> None:
+        handler = type("PortalRequestHandler", (_PortalRequestHandler,), {"timeout": keepalive_timeout})
+        super().__init__(host, port, app, handler=handler, fd=fd)
+        self._pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="portal-http")
+
+    def process_request(self, request, client_address) -> None:
+        self._pool.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address) -> None:
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def drain(self, timeout: float) -> None:
+        """Wait up to ``timeout`` seconds for in-flight requests to finish."""
+        waiter = threading.Thread(target=self._pool.shutdown, kwargs={"wait": True}, daemon=True)
+        waiter.start()
+        waiter.join(timeout)
+
+
+def _bind(host: str, port: int, backlog: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _import_portal(forking: bool, config_path: Path = _CONFIG_PATH):
+    # Importing the app starts nothing; create_app() runs below, once, in this process only.
+    os.environ["PORTAL_CONFIG"] = str(Path(config_path).resolve())
+    import app as portal
+
+    if forking:
+        # Not decided by the initial worker count: SIGTTIN and SIGHUP can add
+        # workers to an arbiter that started with one.
+        portal.use_shared_sessions()
+    return portal
+
+
+def _serve_worker(portal, sock: socket.socket, settings: Dict[str, Any], channel: Any) -> None:
+    """Body of a forked worker process; never returns."""
+    exit_code = 0
+    try:
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        portal.use_grant_relay(channel)
+        server = PooledWSGIServer(
+            settings["host"],
+            settings["port"],
+            portal.app,
+            settings["threads"],
+            fd=sock.fileno(),
+            keepalive_timeout=settings["keepalive_timeout"],
+        )
+        # shutdown() blocks until serve_forever() returns, so it cannot run in the handler itself.
+        signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown, daemon=True).start())
+        server.serve_forever()
+        server.drain(settings["graceful_timeout"])
+    except Exception as exc:
+        print(f"[serve] Worker {os.getpid()} failed: {exc}", file=sys.stderr)
+        exit_code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(exit_code)
+
+
+def _run_services(portal, channel: Any) -> None:
+    """Body of the forked services process; never returns."""
+    exit_code = 0
+    stop = threading.Event()
+    try:
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+        portal.start_services()
+        from utils import grant_scheduler
+
+        grant_scheduler.relay_intents(channel, portal._GRANT_SCHEDULER)
+        while not stop.wait(1.0):
+            pass
+        portal.stop_services()
+    except Exception as exc:
+        print(f"[serve] Services process {os.getpid()} failed: {exc}", file=sys.stderr)
+        exit_code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(exit_code)
+
+
+class Arbiter:
+    """Parent process: owns the socket, keeps the services process and the workers running."""
+
+    def __init__(self, portal, sock: socket.socket, settings: Dict[str, Any], config_path: Path, overrides: Dict[str, Any]) -> None:
+        self.portal = portal
+        self.sock = sock
+        self.settings = settings
+        self.config_path = config_path
+        self.overrides = overrides
+        self.channel = multiprocessing.Queue()
+        self.workers: Dict[int, int] = {}  # pid -> generation
+        self.services_pid: Optional[int] = None
+        self.generation = 0
+        self._signals: List[int] = []
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_w, False)
+
+    def _on_signal(self, signum, _frame) -> None:
+        self._signals.append(signum)
+        try:
+            os.write(self._wake_w, b"!")
+        except OSError:
+            pass
+
+    @staticmethod
+    def _fork() -> int:
+        pid = os.fork()
+        if pid == 0:
+            for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGCHLD, signal.SIGTTIN, signal.SIGTTOU):
+                signal.signal(signum, signal.SIG_DFL)
+        return pid
+
+    def _spawn(self) -> None:
+        pid = self._fork()
+        if pid == 0:
+            _serve_worker(self.portal, self.sock, self.settings, self.channel)
+        self.workers[pid] = self.generation
+
+    def _spawn_services(self) -> None:
+        pid = self._fork()
+        if pid == 0:
+            self.sock.close()
+            _run_services(self.portal, self.channel)
+        self.services_pid = pid
+
+    def _spawn_missing(self) -> None:
+        current = [pid for pid, generation in self.workers.items() if generation == self.generation]
+        for _ in range(self.settings["workers"] - len(current)):
+            self._spawn()
+        for pid in current[self.settings["workers"]:]:
+            self._kill(pid, signal.SIGTERM)
+
+    def _kill(self, pid: int, signum: int) -> None:
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            self.workers.pop(pid, None)
+
+    def _reap(self) -> bool:
+        """Collect exited children; returns True if the services process or a current-generation worker died."""
+        died = False
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return died
+            if pid == 0:
+                return died
+            if pid == self.services_pid:
+                self.services_pid = None
+                died = True
+                print(f"[serve] Services process {pid} exited with status {os.waitstatus_to_exitcode(status)}", file=sys.stderr)
+                continue
+            generation = self.workers.pop(pid, None)
+            if generation == self.generation:
+                died = True
+                print(f"[serve] Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}", file=sys.stderr)
+
+    def reload(self) -> None:
+        try:
+            fresh = load_server_settings(self.config_path)
+        except (OSError, ValueError) as exc:
+            print(f"[serve] Reload skipped, unable to read settings: {exc}", file=sys.stderr)
+            return
+        # The socket stays bound, so host, port and backlog cannot change here.
+        for key in ("workers", "threads", "keepalive_timeout", "graceful_timeout"):
+            self.settings[key] = self.overrides.get(key, fresh[key])
+        old = [pid for pid, generation in self.workers.items() if generation == self.generation]
+        self.generation += 1
+        self._spawn_missing()
+        for pid in old:
+            self._kill(pid, signal.SIGTERM)
+        print(f"[serve] Reloaded: {self.settings['workers']} worker(s) x {self.settings['threads']} thread(s)")
+
+    def stop(self) -> None:
+        for pid in list(self.workers):
+            self._kill(pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.settings["graceful_timeout"]
+        while self.workers and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.05)
+        for pid in list(self.workers):
+            self._kill(pid, signal.SIGKILL)
+        self._reap()
+        # Workers are gone, so no grant can follow; then let the services close cleanly.
+        self.channel.put(None)
+        if self.services_pid is not None:
+            pid = self.services_pid
+            self._kill_services(signal.SIGTERM)
+            deadline = time.monotonic() + self.settings["graceful_timeout"]
+            while self.services_pid == pid and time.monotonic() < deadline:
+                self._reap()
+                time.sleep(0.05)
+            if self.services_pid == pid:
+                self._kill_services(signal.SIGKILL)
+                self._reap()
+
+    def _kill_services(self, signum: int) -> None:
+        try:
+            os.kill(self.services_pid, signum)
+        except ProcessLookupError:
+            self.services_pid = None
+
+    def run(self) -> int:
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT, signal.SIGCHLD, signal.SIGTTIN, signal.SIGTTOU):
+            signal.signal(signum, self._on_signal)
+        # Load everything before forking so workers start warm and share the pages;
+        # the services start in their own process, never here.
+        self.portal.create_app(services=False, background=False)
+        self._spawn_services()
+        self._spawn_missing()
+        print(
+            f"[serve] Listening on http://{self.settings['host']}:{self.settings['port']} with "
+            f"{self.settings['workers']} worker(s) x {self.settings['threads']} thread(s) (pid {os.getpid()})"
+        )
+        last_respawn = 0.0
+        while True:
+            try:
+                os.read(self._wake_r, 64)
+            except InterruptedError:
+                pass
+            signals, self._signals = self._signals, []
+            for signum in signals:
+                if signum in (signal.SIGTERM, signal.SIGINT):
+                    print("[serve] Shutting down")
+                    self.stop()
+                    return 0
+                if signum == signal.SIGHUP:
+                    self.reload()
+                elif signum == signal.SIGTTIN:
+                    self.settings["workers"] += 1
+                elif signum == signal.SIGTTOU:
+                    self.settings["workers"] = max(1, self.settings["workers"] - 1)
+            if self._reap():
+                # Avoid a fork loop if workers die straight away.
+                time.sleep(max(0.0, last_respawn + _RESPAWN_DELAY_SECONDS - time.monotonic()))
+                last_respawn = time.monotonic()
+            if self.services_pid is None:
+                self._spawn_services()
+            self._spawn_missing()
+
+
+def _serve_single_process(portal, sock: socket.socket, settings: Dict[str, Any]) -> int:
+    portal.create_app()
+    server = PooledWSGIServer(
+        settings["host"],
+        settings["port"],
+        portal.app,
+        settings["threads"],
+        fd=sock.fileno(),
+        keepalive_timeout=settings["keepalive_timeout"],
+    )
+    print(f"[serve] Listening on http://{settings['host']}:{settings['port']} with {settings['threads']} thread(s)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.drain(settings["graceful_timeout"])
+    return 0
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--config", type=Path, default=_CONFIG_PATH)
+    parser.add_argument("--host")
+    parser.add_argument("--port", type=int)
+    parser.add_argument("--workers", type=int, help="override server.workers")
+    parser.add_argument("--threads", type=int, help="override server.threads")
+    parser.add_argument("--profile-startup", action="store_true", help="report start-up and import times, then exit")
+    parser.add_argument("--startup-budget-ms", type=float, help="with --profile-startup, fail above this")
+    args = parser.parse_args(argv)
+
+    if args.profile_startup:
+        from tools import startup_profile
+
+        budget = [] if args.startup_budget_ms is None else ["--budget-ms", str(args.startup_budget_ms)]
+        return startup_profile.main(budget)
+
+    settings = load_server_settings(args.config)
+    overrides = {key: getattr(args, key) for key in ("host", "port", "workers", "threads") if getattr(args, key) is not None}
+    settings.update(overrides)
+    if settings["workers"] > 1 and not forking_supported():
+        print("[serve] Worker processes need os.fork; running one process instead.", file=sys.stderr)
+        settings["workers"] = 1
+
+    sock = _bind(settings["host"], settings["port"], settings["backlog"])
+    portal = _import_portal(forking_supported(), args.config)
+    if not forking_supported():
+        return _serve_single_process(portal, sock, settings)
+    return Arbiter(portal, sock, settings, args.config, overrides).run()
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,216 @@
+"""``FirebaseWriteQueue`` on a temporary SQLite journal with a local Firebase stand-in."""
+
+from __future__ import annotations
+
+import time
+from typing import Any, Dict, List
+
+import pytest
+
+from utils import firebase_local, firebase_queue
+
+
+class FakeFirebase:
+    """Applies updates to a :class:`LocalDatabase`, failing the first ``failures`` calls."""
+
+    def __init__(self, failures: int = 0, error: Exception = ConnectionError("uplink down")) -> None:
+        self.database = firebase_local.LocalDatabase()
+        self.failures = failures
+        self.error = error
+        self.calls: List[Dict[str, Any]] = []
+
+    def update(self, updates: Dict[str, Any]) -> None:
+        self.calls.append(dict(updates))
+        if self.failures:
+            self.failures -= 1
+            raise self.error
+        self.database.reference("/").update(updates)
+
+    def get(self, path: str) -> Any:
+        return self.database.reference(path).get()
+
+
+def record(student_id: str, date: str = "2024-05-01", timestamp: int = 1) -> Dict[str, Any]:
+    return {"studentId": student_id, "date": date, "timestamp": timestamp, "status": "present"}
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return tmp_path / "portal.db"
+
+
+@pytest.fixture
+def queues():
+    created: List[firebase_queue.FirebaseWriteQueue] = []
+
+    def make(db_path, firebase: FakeFirebase, **options) -> firebase_queue.FirebaseWriteQueue:
+        options.setdefault("flush_interval", 0.05)
+        queue = firebase_queue.FirebaseWriteQueue(db_path, firebase.update, **options)
+        created.append(queue)
+        return queue
+
+    yield make
+    for queue in created:
+        queue.close(drain_timeout=1)
+
+
+def test_enqueue_journals_without_writing(db_path, queues):
+    firebase = FakeFirebase()
+    queue = queues(db_path, firebase)
+
+    queue.enqueue_attendance("class-1", "s1", record("s1"))
+
+    assert firebase.calls == []
+    assert queue.stats()["depth"] == 1
+    assert queue.stats()["enqueued"] == 1
+    assert queue.find_attendance("class-1", "s1") == record("s1")
+
+
+def test_flush_sends_one_multi_path_update(db_path, queues):
+    firebase = FakeFirebase()
+    queue = queues(db_path, firebase)
+    for student_id in ("s1", "s2", "s3"):
+        queue.enqueue_attendance("class-1", student_id, record(student_id))
+
+    assert queue.flush_once() == 3
+
+    assert len(firebase.calls) == 1
+    assert sorted(firebase.calls[0]) == [f"attendance/class-1/{sid}" for sid in ("s1", "s2", "s3")]
+    assert firebase.get("attendance/class-1/s2") == record("s2")
+    stats = queue.stats()
+    assert stats["depth"] == 0
+    assert stats["flushed"] == 3
+    assert stats["batches"] == 1
+    assert queue.flush_once() == 0
+
+
+def test_batches_are_capped_at_batch_size(db_path, queues):
+    firebase = FakeFirebase()
+    queue = queues(db_path, firebase, batch_size=2)
+    for index in range(5):
+        queue.enqueue_attendance("class-1", f"s{index}", record(f"s{index}"))
+
+    assert [queue.flush_once() for _ in range(4)] == [2, 2, 1, 0]
+    assert len(firebase.calls) == 3
+
+
+def test_failed_batch_is_kept_and_backs_off(db_path, queues):
+    firebase = FakeFirebase(failures=2)
+    queue = queues(db_path, firebase, flush_interval=0.1, max_backoff=10)
+    queue.enqueue_attendance("class-1", "s1", record("s1"))
+
+    assert queue.flush_once() == 0
+    first = queue.stats()
+    assert first["depth"] == 1
+    assert first["failures"] == 1
+    assert first["consecutiveFailures"] == 1
+    assert "uplink down" in first["lastError"]
+    # flush_interval * 2 ** failures, with up to half of it taken off as jitter.
+    assert 0.1 <= first["retryInSeconds"] <= 0.2
+
+    assert queue.flush_once() == 0
+    assert 0.2 <= queue.stats()["retryInSeconds"] <= 0.4
+
+    assert queue.flush_once() == 1
+    recovered = queue.stats()
+    assert recovered["depth"] == 0
+    assert recovered["consecutiveFailures"] == 0
+    assert recovered["retryInSeconds"] == 0
+    assert firebase.get("attendance/class-1/s1") == record("s1")
+
+
+def test_backoff_is_capped(db_path, queues):
+    firebase = FakeFirebase(failures=10)
+    queue = queues(db_path, firebase, flush_interval=0.1, max_backoff=0.5)
+    queue.enqueue_attendance("class-1", "s1", record("s1"))
+
+    for _ in range(6):
+        queue.flush_once()
+
+    assert queue.stats()["retryInSeconds"] <= 0.5
+
+
+def test_invalid_row_is_parked_without_blocking_the_rest(db_path, queues):
+    class RejectsBadRows(FakeFirebase):
+        def update(self, updates):
+            self.calls.append(dict(updates))
+            if any(value.get("status") == "bad" for value in updates.values()):
+                raise ValueError("invalid payload")
+            self.database.reference("/").update(updates)
+
+    firebase = RejectsBadRows()
+    queue = queues(db_path, firebase)
+    queue.enqueue_attendance("class-1", "s1", record("s1"))
+    queue.enqueue_attendance("class-1", "s2", {**record("s2"), "status": "bad"})
+    queue.enqueue_attendance("class-1", "s3", record("s3"))
+
+    for _ in range(10):
+        if not queue.stats()["depth"]:
+            break
+        queue.flush_once()
+
+    stats = queue.stats()
+    assert stats["parked"] == 1
+    assert stats["parkedRows"] == 1
+    assert firebase.get("attendance/class-1/s1") == record("s1")
+    assert firebase.get("attendance/class-1/s2") is None
+    assert firebase.get("attendance/class-1/s3") == record("s3")
+
+
+def test_outbox_survives_a_restart(db_path, queues):
+    offline = FakeFirebase(failures=100)
+    first = queues(db_path, offline)
+    first.enqueue_attendance("class-1", "s1", record("s1"))
+    first.enqueue_attendance("class-1", "s2", record("s2"))
+    first.flush_once()
+    first.close(drain_timeout=1)
+
+    online = FakeFirebase()
+    second = queues(db_path, online)
+
+    assert second.stats()["depth"] == 2
+    assert second.flush_once() == 2
+    assert online.get("attendance/class-1/s1") == record("s1")
+    assert online.get("attendance/class-1/s2") == record("s2")
+
+
+def test_background_thread_drains_the_outbox(db_path, queues):
+    firebase = FakeFirebase(failures=1)
+    queue = queues(db_path, firebase, flush_interval=0.02, max_backoff=0.05)
+    queue.start()
+    queue.enqueue_attendance("class-1", "s1", record("s1"))
+
+    deadline = time.monotonic() + 5
+    while queue.stats()["depth"] and time.monotonic() < deadline:
+        time.sleep(0.02)
+
+    assert queue.stats()["depth"] == 0
+    assert queue.stats()["failures"] == 1
+    assert firebase.get("attendance/class-1/s1") == record("s1")
+
+
+def test_same_day_record_already_in_firebase_is_not_overwritten(db_path, queues):
+    firebase = FakeFirebase()
+    firebase.database.reference("attendance/class-1/s1").set(record("s1", timestamp=99))
+    queue = queues(db_path, firebase, reader=firebase.get)
+    queue.enqueue_attendance("class-1", "s1", record("s1", timestamp=1))
+    queue.enqueue_attendance("class-1", "s2", record("s2"))
+
+    assert queue.flush_once() == 2
+
+    assert firebase.get("attendance/class-1/s1")["timestamp"] == 99
+    assert firebase.get("attendance/class-1/s2") == record("s2")
+    stats = queue.stats()
+    assert stats["duplicates"] == 1
+    assert stats["flushed"] == 1
+    assert stats["depth"] == 0
+
+
+def test_replayed_write_is_not_treated_as_duplicate(db_path, queues):
+    firebase = FakeFirebase()
+    firebase.database.reference("attendance/class-1/s1").set(record("s1", timestamp=1))
+    queue = queues(db_path, firebase, reader=firebase.get)
+    queue.enqueue_attendance("class-1", "s1", record("s1", timestamp=1))
+
+    assert queue.flush_once() == 1
+    assert queue.stats()["duplicates"] == 0
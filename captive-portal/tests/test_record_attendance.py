@@ -0,0 +1,49 @@
+"""How ``local_db.record_attendance`` reports refused and failed marks."""
+
+from __future__ import annotations
+
+import sqlite3
+
+import pytest
+
+from utils import local_db
+
+
+def mark(db_path, student_id="s1", **payload):
+    payload.setdefault("date", "2024-05-01")
+    return local_db.record_attendance(db_path, "class-1", student_id, payload)
+
+
+def test_second_mark_is_already_marked(tmp_path):
+    db_path = tmp_path / "portal.db"
+    mark(db_path)
+
+    with pytest.raises(local_db.AttendanceError) as refused:
+        mark(db_path)
+
+    assert refused.value.code == local_db.ATTENDANCE_ALREADY_MARKED
+
+
+def test_attendance_key_violation_matches_sqlite_message(tmp_path):
+    db_path = tmp_path / "portal.db"
+    mark(db_path)
+    row = ("class-1", "s1", 0, "", "2024-05-01")
+
+    with sqlite3.connect(db_path) as conn, pytest.raises(sqlite3.IntegrityError) as violation:
+        conn.execute("INSERT INTO attendance (class_id, student_id, timestamp, marked_at, date) VALUES (?, ?, ?, ?, ?)", row)
+
+    assert str(violation.value) == local_db._ATTENDANCE_KEY_VIOLATION
+
+
+def test_other_constraint_failures_are_not_reported_as_duplicates(tmp_path):
+    db_path = tmp_path / "portal.db"
+
+    with pytest.raises(local_db.LocalDatabaseError) as missing_date:
+        mark(db_path, date=None)
+    with pytest.raises(local_db.LocalDatabaseError) as unknown_capture:
+        mark(db_path, "s2", faceCaptureId=999)
+
+    for failure in (missing_date.value, unknown_capture.value):
+        assert not isinstance(failure, local_db.AttendanceError)
+    assert "NOT NULL" in str(missing_date.value)
+    assert "FOREIGN KEY" in str(unknown_capture.value)
@@ -0,0 +1,227 @@
+"""``UpstreamForwarder`` against a stub DNS server on the loopback interface."""
+
+from __future__ import annotations
+
+import socket
+import threading
+import time
+from typing import Callable, List, Optional
+
+import pytest
+from dnslib import A, DNSRecord, QTYPE, RR
+
+from utils import captive_dns
+
+Responder = Callable[[DNSRecord], List[DNSRecord]]
+
+
+class StubUpstream:
+    """UDP server that sends whatever ``respond`` returns for each query.
+
+    Replies go out from the server socket, or from ``spoof_sock`` (another
+    port on the same host) when ``spoof`` is set on the reply record.
+    """
+
+    def __init__(self, respond: Responder) -> None:
+        self.respond = respond
+        self.queries: List[DNSRecord] = []
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.settimeout(0.1)
+        self.spoof_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.spoof_sock.bind(("127.0.0.1", 0))
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    @property
+    def address(self) -> str:
+        host, port = self.sock.getsockname()
+        return f"{host}:{port}"
+
+    def _serve(self) -> None:
+        while not self._closed.is_set():
+            try:
+                data, client = self.sock.recvfrom(4096)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            request = DNSRecord.parse(data)
+            self.queries.append(request)
+            for reply in self.respond(request):
+                sender = self.spoof_sock if getattr(reply, "spoof", False) else self.sock
+                sender.sendto(reply.pack(), client)
+
+    def close(self) -> None:
+        self._closed.set()
+        self.sock.close()
+        self.spoof_sock.close()
+        self._thread.join(timeout=1)
+
+
+def answer(request: DNSRecord, ip: str = "10.0.0.1", ttl: int = 60, query_id: Optional[int] = None) -> DNSRecord:
+    reply = request.reply()
+    reply.add_answer(RR(request.q.qname, QTYPE.A, ttl=ttl, rdata=A(ip)))
+    if query_id is not None:
+        reply.header.id = query_id
+    return reply
+
+
+def query(name: str = "example.com", query_id: int = 0x1234) -> bytes:
+    record = DNSRecord.question(name, "A")
+    record.header.id = query_id
+    return record.pack()
+
+
+@pytest.fixture
+def stub():
+    servers: List[StubUpstream] = []
+
+    def start(respond: Responder) -> StubUpstream:
+        server = StubUpstream(respond)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.close()
+
+
+@pytest.fixture
+def forwarder():
+    forwarders: List[captive_dns.UpstreamForwarder] = []
+
+    def start(*servers: StubUpstream, **options) -> captive_dns.UpstreamForwarder:
+        options.setdefault("timeout", 0.5)
+        instance = captive_dns.UpstreamForwarder([server.address for server in servers], **options)
+        forwarders.append(instance)
+        return instance
+
+    yield start
+    for instance in forwarders:
+        instance.close()
+
+
+def test_forwards_query_and_restores_client_id(stub, forwarder):
+    upstream = stub(lambda request: [answer(request, "10.0.0.7")])
+
+    response = forwarder(upstream).forward(query(query_id=0x4242))
+
+    record = DNSRecord.parse(response)
+    assert record.header.id == 0x4242
+    assert [str(rr.rdata) for rr in record.rr] == ["10.0.0.7"]
+    assert len(upstream.queries) == 1
+
+
+def test_rejects_reply_with_wrong_id(stub, forwarder):
+    upstream = stub(lambda request: [answer(request, query_id=request.header.id ^ 0xFFFF)])
+
+    assert forwarder(upstream, cache_size=0).forward(query()) is None
+
+
+def test_rejects_reply_from_another_port(stub, forwarder):
+    def respond(request):
+        spoofed = answer(request, "10.6.6.6")
+        spoofed.spoof = True
+        return [spoofed]
+
+    upstream = stub(respond)
+
+    assert forwarder(upstream, cache_size=0).forward(query()) is None
+
+
+def test_rejects_reply_for_another_question(stub, forwarder):
+    def respond(request):
+        other = DNSRecord.question("attacker.example", "A")
+        other.header.id = request.header.id
+        return [answer(other, "10.6.6.6")]
+
+    upstream = stub(respond)
+
+    assert forwarder(upstream, cache_size=0).forward(query()) is None
+
+
+def test_spoofed_replies_do_not_preempt_the_real_one(stub, forwarder):
+    def respond(request):
+        wrong_id = answer(request, "10.6.6.6", query_id=request.header.id ^ 0xFFFF)
+        wrong_port = answer(request, "10.6.6.7")
+        wrong_port.spoof = True
+        return [wrong_id, wrong_port, answer(request, "10.0.0.1")]
+
+    upstream = stub(respond)
+
+    response = forwarder(upstream, cache_size=0).forward(query())
+
+    assert [str(rr.rdata) for rr in DNSRecord.parse(response).rr] == ["10.0.0.1"]
+
+
+def test_timeout_returns_none_and_parks_upstream(stub, forwarder):
+    upstream = stub(lambda request: [])
+    instance = forwarder(upstream, timeout=0.2, failure_threshold=2, cache_size=0)
+
+    started = time.monotonic()
+    assert instance.forward(query()) is None
+    assert time.monotonic() - started < 1.0
+    assert instance.health()[0]["failures"] == 1
+    assert instance.health()[0]["healthy"] is True
+
+    assert instance.forward(query()) is None
+    assert instance.health()[0]["healthy"] is False
+
+
+def test_falls_back_to_second_upstream(stub, forwarder):
+    dead = stub(lambda request: [])
+    live = stub(lambda request: [answer(request, "10.0.0.2")])
+    instance = forwarder(dead, live, race_delay=0.05)
+
+    response = instance.forward(query())
+
+    assert [str(rr.rdata) for rr in DNSRecord.parse(response).rr] == ["10.0.0.2"]
+
+
+def test_caches_answer_until_ttl_expires(stub, forwarder):
+    upstream = stub(lambda request: [answer(request, ttl=1)])
+    instance = forwarder(upstream)
+
+    first = instance.forward(query(query_id=1))
+    cached = instance.lookup(query(query_id=2))
+
+    assert first is not None and cached is not None
+    assert DNSRecord.parse(cached).header.id == 2
+    assert DNSRecord.parse(cached).rr[0].ttl <= 1
+    assert len(upstream.queries) == 1
+
+    time.sleep(1.1)
+    assert instance.lookup(query()) is None
+    assert instance.forward(query()) is not None
+    assert len(upstream.queries) == 2
+
+
+def test_cache_is_per_question(stub, forwarder):
+    upstream = stub(lambda request: [answer(request)])
+    instance = forwarder(upstream)
+
+    instance.forward(query("one.example"))
+    instance.forward(query("two.example"))
+
+    assert len(upstream.queries) == 2
+    assert instance.lookup(query("one.example")) is not None
+    assert instance.lookup(query("three.example")) is None
+
+
+@pytest.mark.skipif(not captive_dns.worker_pool_supported(), reason="DNSStats shares memory with forked processes")
+def test_dns_stats_publishes_forwarder_health(stub, forwarder):
+    upstream = stub(lambda request: [answer(request)])
+    instance = forwarder(upstream)
+    instance.forward(query())
+    stats = captive_dns.DNSStats(workers=2, upstreams=[upstream.address, "not a server"])
+
+    stats.set_upstreams(1, instance.health())
+
+    idle, busy = stats.snapshot()
+    assert idle["upstreams"] == []
+    assert [row["address"] for row in busy["upstreams"]] == [upstream.address]
+    assert busy["upstreams"][0]["healthy"] is True
+    assert busy["upstreams"][0]["failures"] == 0
+    assert busy["upstreams"][0]["srttMs"] > 0
@@ -0,0 +1,40 @@
+"""Build fingerprinted, precompressed copies of the portal's static assets.
+
+Run from ``captive-portal/``::
+
+    python -m tools.build_assets
+
+Writes ``static/dist/`` (see :mod:`utils.static_assets`). The portal also
+does this at start-up, so running it by hand is only needed for a
+read-only deployment or to inspect the output.
+"""
+
+from __future__ import annotations
+
+import argparse
+from pathlib import Path
+from typing import Optional, Sequence
+
+from utils import static_assets
+
+_BASE_DIR = Path(__file__).resolve().parent.parent
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--static-dir", type=Path, default=_BASE_DIR / "static")
+    args = parser.parse_args(argv)
+
+    manifest = static_assets.build(args.static_dir)
+    dist = args.static_dir / static_assets.DIST_DIRNAME
+    for relative, entry in sorted(manifest.items()):
+        sizes = [f"identity {entry['size']} B"]
+        for encoding in entry["encodings"]:
+            suffix = ".br" if encoding == "br" else ".gz"
+            sizes.append(f"{encoding} {(dist / (str(entry['path']) + suffix)).stat().st_size} B")
+        print(f"{relative:28} -> {entry['path']:36} {', '.join(sizes)}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,142 @@
+"""Exercise ``UpstreamForwarder`` against local stub DNS servers.
+
+Run from ``captive-portal/``::
+
+    python -m tools.dns_forwarder_bench
+
+Starts a stub upstream that answers every A query with a fixed TTL (after an
+optional artificial delay) plus a "dead" upstream that swallows queries,
+then compares the per-socket sequential forwarding the redirector used to
+do with the racing, caching forwarder: cold lookups, cached lookups, TTL
+expiry and a dead primary upstream.
+"""
+
+from __future__ import annotations
+
+import argparse
+import socket
+import threading
+import time
+from typing import List, Optional, Sequence
+
+from dnslib import A, DNSRecord, QTYPE, RR
+
+from utils import captive_dns
+
+
+class StubUpstream:
+    """Tiny UDP DNS server answering A queries with ``answer_ip``."""
+
+    def __init__(self, *, answer_ip: str = "10.0.0.1", ttl: int = 60, delay: float = 0.0, silent: bool = False) -> None:
+        self.answer_ip = answer_ip
+        self.ttl = ttl
+        self.delay = delay
+        self.silent = silent
+        self.queries = 0
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind(("127.0.0.1", 0))
+        self._sock.settimeout(0.2)
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    @property
+    def address(self) -> str:
+        host, port = self._sock.getsockname()
+        return f"{host}:{port}"
+
+    def _serve(self) -> None:
+        while not self._closed.is_set():
+            try:
+                data, client = self._sock.recvfrom(4096)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            self.queries += 1
+            if self.silent:
+                continue
+            request = DNSRecord.parse(data)
+            reply = request.reply()
+            reply.add_answer(RR(request.q.qname, QTYPE.A, ttl=self.ttl, rdata=A(self.answer_ip)))
+            if self.delay:
+                time.sleep(self.delay)
+            self._sock.sendto(reply.pack(), client)
+
+    def close(self) -> None:
+        self._closed.set()
+        self._sock.close()
+        self._thread.join(timeout=1)
+
+
+def _legacy_forward(raw_query: bytes, upstreams: Sequence[str]) -> Optional[bytes]:
+    for upstream in upstreams:
+        host, _, port = upstream.rpartition(":")
+        try:
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as forwarder:
+                forwarder.settimeout(1.0)
+                forwarder.sendto(raw_query, (host, int(port)))
+                response, _ = forwarder.recvfrom(4096)
+                return response
+        except OSError:
+            continue
+    return None
+
+
+def _query(name: str) -> bytes:
+    return DNSRecord.question(name, "A").pack()
+
+
+def _timed_ms(func, *args) -> tuple[float, object]:
+    started = time.perf_counter()
+    result = func(*args)
+    return (time.perf_counter() - started) * 1000, result
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lookups", type=int, default=200)
+    args = parser.parse_args(argv)
+
+    live = StubUpstream(ttl=2, delay=0.002)
+    dead = StubUpstream(silent=True)
+    upstreams = [dead.address, live.address]
+    forwarder = captive_dns.UpstreamForwarder(upstreams, timeout=1.0, race_delay=0.05)
+    try:
+        names = [f"host{index}.firebaseio.com" for index in range(args.lookups)]
+
+        legacy_ms: List[float] = []
+        for name in names[:5]:
+            elapsed, response = _timed_ms(_legacy_forward, _query(name), upstreams)
+            assert response, "legacy forwarder got no answer"
+            legacy_ms.append(elapsed)
+        print(f"legacy, dead primary     : {sum(legacy_ms) / len(legacy_ms):8.2f} ms/lookup")
+
+        cold_ms: List[float] = []
+        for name in names:
+            elapsed, response = _timed_ms(forwarder.forward, _query(name))
+            assert response and DNSRecord.parse(response).rr, "forwarder got no answer"
+            cold_ms.append(elapsed)
+        print(f"forwarder, cold (racing) : {cold_ms[0]:8.2f} ms first, {sum(cold_ms[1:]) / max(1, len(cold_ms) - 1):.2f} ms after")
+
+        before = live.queries
+        warm_ms = [_timed_ms(forwarder.forward, _query(name))[0] for name in names]
+        print(
+            f"forwarder, cached        : {sum(warm_ms) / len(warm_ms):8.3f} ms/lookup "
+            f"({live.queries - before} upstream queries)"
+        )
+
+        time.sleep(2.1)
+        elapsed, response = _timed_ms(forwarder.forward, _query(names[0]))
+        print(f"forwarder, after TTL     : {elapsed:8.2f} ms (re-fetched: {live.queries > before})")
+        for upstream in forwarder.health():
+            print(f"  upstream {upstream}")
+    finally:
+        forwarder.close()
+        live.close()
+        dead.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,221 @@
+"""Load generator for the captive DNS redirector.
+
+Run from ``captive-portal/``::
+
+    python -m tools.dns_loadgen --clients 64 --duration 10
+    python -m tools.dns_loadgen --modes asyncio --target 192.168.137.1:53
+    python -m tools.dns_loadgen --modes asyncio --workers 1 2 4 8 --client-procs 4
+
+Without ``--target`` a server is started on an ephemeral loopback port for
+every requested ``server_mode`` and worker count so the implementations can
+be compared side by side. Each client thread keeps one socket open and sends
+queries back to back; ``--client-procs`` spreads the client threads over
+several processes so the generator itself is not capped by one GIL. The
+report lists queries per second, loss, latency percentiles and, for
+multi-worker runs, how many queries each worker answered.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing
+import random
+import socket
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+from dnslib import DNSRecord
+
+from utils import captive_dns
+
+_SAMPLE_NAMES = (
+    "connectivitycheck.gstatic.com",
+    "captive.apple.com",
+    "www.msftconnecttest.com",
+    "clients3.google.com",
+    "graph.facebook.com",
+    "api.whatsapp.net",
+    "i.instagram.com",
+    "youtube.com",
+    "mtalk.google.com",
+    "time.android.com",
+)
+
+
+def build_queries(count: int, seed: int = 7) -> List[bytes]:
+    rng = random.Random(seed)
+    packets: List[bytes] = []
+    for index in range(count):
+        name = rng.choice(_SAMPLE_NAMES)
+        qtype = "AAAA" if index % 4 == 0 else "A"
+        record = DNSRecord.question(name, qtype)
+        record.header.id = rng.randrange(0, 0xFFFF)
+        packets.append(record.pack())
+    return packets
+
+
+def percentile(samples: Sequence[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def _client_worker(
+    target: tuple[str, int],
+    queries: Sequence[bytes],
+    deadline: float,
+    timeout: float,
+    latencies: List[float],
+    counters: Dict[str, int],
+    lock: threading.Lock,
+) -> None:
+    local_latencies: List[float] = []
+    lost = 0
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(timeout)
+        index = 0
+        while time.perf_counter() < deadline:
+            packet = queries[index % len(queries)]
+            index += 1
+            started = time.perf_counter()
+            sock.sendto(packet, target)
+            try:
+                while True:
+                    reply, _ = sock.recvfrom(4096)
+                    if reply[:2] == packet[:2]:
+                        break
+            except socket.timeout:
+                lost += 1
+                continue
+            local_latencies.append(time.perf_counter() - started)
+    with lock:
+        latencies.extend(local_latencies)
+        counters["lost"] += lost
+
+
+def _collect(
+    target: tuple[str, int], clients: int, duration: float, timeout: float, packets: Sequence[bytes]
+) -> tuple[List[float], int]:
+    latencies: List[float] = []
+    counters = {"lost": 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+    workers = [
+        threading.Thread(
+            target=_client_worker,
+            args=(target, packets, deadline, timeout, latencies, counters, lock),
+            daemon=True,
+        )
+        for _ in range(clients)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return latencies, counters["lost"]
+
+
+def run_load(
+    target: tuple[str, int],
+    *,
+    clients: int,
+    duration: float,
+    timeout: float = 1.0,
+    queries: Optional[Sequence[bytes]] = None,
+    client_procs: int = 1,
+) -> Dict[str, Any]:
+    packets = list(queries or build_queries(1024))
+    started = time.perf_counter()
+    if client_procs > 1:
+        per_proc = max(1, clients // client_procs)
+        with multiprocessing.get_context("spawn").Pool(client_procs) as pool:
+            parts = pool.starmap(
+                _collect, [(target, per_proc, duration, timeout, packets)] * client_procs
+            )
+        latencies = [sample for part, _ in parts for sample in part]
+        lost = sum(part_lost for _, part_lost in parts)
+    else:
+        latencies, lost = _collect(target, clients, duration, timeout, packets)
+    elapsed = time.perf_counter() - started
+    return {
+        "clients": clients,
+        "durationSeconds": round(elapsed, 3),
+        "answered": len(latencies),
+        "lost": lost,
+        "qps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50Ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95Ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99Ms": round(percentile(latencies, 99) * 1000, 3),
+        "maxMs": round(max(latencies) * 1000, 3) if latencies else 0.0,
+    }
+
+
+def _run_local(mode: str, workers: int, args: argparse.Namespace) -> Dict[str, Any]:
+    handle = captive_dns.start_dns_server(
+        listen_address="127.0.0.1",
+        listen_port=0,
+        portal_ip=args.portal_ip,
+        force_portal_domains=["captive.apple.com", "connectivitycheck.gstatic.com"],
+        server_mode=mode,
+        workers=workers,
+    )
+    try:
+        address = handle.server.server_address
+        time.sleep(0.5 if workers > 1 else 0.1)
+        stats = run_load(
+            (address[0], address[1]),
+            clients=args.clients,
+            duration=args.duration,
+            client_procs=args.client_procs,
+        )
+        if isinstance(handle.server, captive_dns.DNSWorkerPool):
+            time.sleep(0.6)  # let workers publish their final counters
+            stats["perWorkerQueries"] = [entry["queries"] for entry in handle.server.worker_stats()]
+        return stats
+    finally:
+        captive_dns.stop_dns_server(handle)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--modes", nargs="+", default=list(captive_dns.SERVER_MODES))
+    parser.add_argument("--workers", type=int, nargs="+", default=[1], help="resolver process counts to compare")
+    parser.add_argument("--client-procs", type=int, default=1)
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--portal-ip", default="192.168.137.1")
+    parser.add_argument("--target", help="host:port of an already running redirector")
+    parser.add_argument("--json", dest="json_path", help="write the results to this file")
+    args = parser.parse_args(argv)
+
+    results: Dict[str, Any] = {}
+    if args.target:
+        host, _, port = args.target.rpartition(":")
+        results["external"] = run_load(
+            (host, int(port)), clients=args.clients, duration=args.duration, client_procs=args.client_procs
+        )
+    else:
+        for mode in args.modes:
+            for workers in args.workers:
+                label = mode if args.workers == [1] else f"{mode}x{workers}"
+                results[label] = _run_local(mode, workers, args)
+
+    for label, stats in results.items():
+        print(
+            f"{label:>12}: {stats['qps']:>9.1f} qps  p50 {stats['p50Ms']:.3f} ms  "
+            f"p95 {stats['p95Ms']:.3f} ms  p99 {stats['p99Ms']:.3f} ms  lost {stats['lost']}"
+        )
+        if "perWorkerQueries" in stats:
+            print(f"{'':>12}per worker: {stats['perWorkerQueries']}")
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as handle:
+            json.dump(results, handle, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
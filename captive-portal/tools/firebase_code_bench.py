@@ -0,0 +1,91 @@
+"""Compare attendance code lookups against the local Realtime Database stand-in.
+
+Run from ``captive-portal/``::
+
+    python -m tools.firebase_code_bench --classes 300 --latency-ms 40
+
+Fills a :class:`~utils.firebase_local.LocalDatabase` with ``--classes``
+codes, written straight to ``attendance_codes`` as the teacher clients do,
+simulating ``--latency-ms`` per round trip and ``--bandwidth-kbps`` of
+downlink. The code listener builds the index, then the old full-node scan
+is timed against the indexed lookup (cold and cached) for ``--lookups``
+students typing a code, and against a mistyped code.
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import time
+from typing import Optional, Sequence
+
+from utils import firebase_client, firebase_local
+
+
+def _legacy_verify(database: firebase_local.LocalDatabase, code: str) -> Optional[dict]:
+    snapshot = database.reference("attendance_codes").get() or {}
+    for class_id, data in snapshot.items():
+        if str(data.get("code")) == code:
+            return {"classId": class_id, **data}
+    return None
+
+
+def _timed(label: str, database: firebase_local.LocalDatabase, codes: Sequence[str], lookup, found: bool = True) -> None:
+    database.counters.update(reads=0, bytesRead=0)
+    started = time.perf_counter()
+    for code in codes:
+        assert (lookup(code) is not None) == found
+    elapsed = time.perf_counter() - started
+    print(
+        f"{label:>16}: {elapsed / len(codes) * 1000:7.2f} ms/lookup, "
+        f"{database.counters['reads'] / len(codes):.2f} reads and "
+        f"{database.counters['bytesRead'] / len(codes) / 1024:.1f} KiB per lookup"
+    )
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--classes", type=int, default=300)
+    parser.add_argument("--lookups", type=int, default=60)
+    parser.add_argument("--latency-ms", type=float, default=40.0)
+    parser.add_argument("--bandwidth-kbps", type=float, default=2000.0, help="simulated downlink, 0 for unlimited")
+    args = parser.parse_args(argv)
+
+    expiry = int(time.time() * 1000) + 3_600_000
+    database = firebase_local.LocalDatabase(latency=args.latency_ms / 1000.0, bandwidth=args.bandwidth_kbps * 125.0)
+    firebase_client.use_local_database(database)
+    database.reference("attendance_codes").set(
+        {
+            f"class-{index:04d}": {
+                "code": str(100000 + index),
+                "subject": f"Subject {index}",
+                "teacherName": "Dr. Example",
+                "expiryTime": expiry,
+                "department": "CSE",
+            }
+            for index in range(args.classes)
+        }
+    )
+    firebase_client.start_code_listener()
+    # A teacher opening a new session after the portal started.
+    database.reference(f"attendance_codes/class-{args.classes:04d}").set(
+        {"code": str(100000 + args.classes), "teacherName": "Dr. Example", "expiryTime": expiry}
+    )
+    rng = random.Random(7)
+    active = [str(100000 + rng.randrange(args.classes)) for _ in range(3)]
+    active.append(str(100000 + args.classes))
+    codes = [rng.choice(active) for _ in range(args.lookups)]
+
+    _timed("full scan", database, codes, lambda code: _legacy_verify(database, code))
+    firebase_client.configure_code_cache(ttl_seconds=0)
+    _timed("index", database, codes, firebase_client.verify_attendance_code)
+    firebase_client.configure_code_cache(ttl_seconds=5)
+    _timed("index + cache", database, codes, firebase_client.verify_attendance_code)
+    firebase_client.configure_code_cache(ttl_seconds=0)
+    _timed("index, mistyped", database, ["999999"] * len(codes), firebase_client.verify_attendance_code, found=False)
+    firebase_client.use_local_database(None)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
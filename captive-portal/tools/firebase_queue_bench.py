@@ -0,0 +1,139 @@
+"""Drive the Firebase write-behind queue against the local stand-in.
+
+Run from ``captive-portal/``::
+
+    python -m tools.firebase_queue_bench --students 300 --latency-ms 120 --outage-seconds 2
+
+Students mark attendance from ``--threads`` request threads against a
+temporary SQLite journal while the :class:`~utils.firebase_local.LocalDatabase`
+simulates ``--latency-ms`` per round trip and rejects every write during the
+first ``--outage-seconds``. One malformed payload is mixed in to show it is
+parked without blocking the rest. Reports request-side latency for direct
+writes and for the queue, then waits for replication and checks that
+every record arrived.
+"""
+
+from __future__ import annotations
+
+import argparse
+import statistics
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+from utils import firebase_local, firebase_queue
+
+
+class _FlakyWriter:
+    """Applies updates to the stand-in, failing like a dead uplink until ``outage_until``."""
+
+    def __init__(self, database: firebase_local.LocalDatabase, outage_until: float) -> None:
+        self.database = database
+        self.outage_until = outage_until
+        self.calls = 0
+
+    def __call__(self, updates: Dict[str, Any]) -> None:
+        self.calls += 1
+        if time.monotonic() < self.outage_until:
+            time.sleep(self.database.latency)
+            raise ConnectionError("simulated uplink outage")
+        for path, value in updates.items():
+            if not isinstance(value, dict):
+                raise ValueError(f"Invalid value at {path}")
+        self.database.reference("/").update(updates)
+
+
+def _payload(index: int) -> Dict[str, Any]:
+    return {"studentId": f"s{index:04d}", "date": time.strftime("%Y-%m-%d"), "timestamp": int(time.time() * 1000)}
+
+
+def _percentile(samples: List[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def _run_threads(count: int, threads: int, work) -> List[float]:
+    latencies: List[float] = []
+    lock = threading.Lock()
+    indices = iter(range(count))
+
+    def worker() -> None:
+        while True:
+            with lock:
+                index = next(indices, None)
+            if index is None:
+                return
+            started = time.perf_counter()
+            work(index)
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return latencies
+
+
+def _report(label: str, latencies: List[float]) -> None:
+    print(
+        f"{label:>12}: p50 {statistics.median(latencies) * 1000:7.2f} ms, "
+        f"p99 {_percentile(latencies, 0.99) * 1000:7.2f} ms per request"
+    )
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--students", type=int, default=300)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--latency-ms", type=float, default=120.0)
+    parser.add_argument("--outage-seconds", type=float, default=2.0)
+    args = parser.parse_args(argv)
+    latency = args.latency_ms / 1000.0
+
+    direct_db = firebase_local.LocalDatabase(latency=latency)
+    direct = _run_threads(
+        args.students,
+        args.threads,
+        lambda index: direct_db.reference(firebase_queue.attendance_path("bench", f"s{index:04d}")).set(_payload(index)),
+    )
+    _report("direct", direct)
+
+    database = firebase_local.LocalDatabase(latency=latency)
+    writer = _FlakyWriter(database, time.monotonic() + args.outage_seconds)
+    with tempfile.TemporaryDirectory() as tmp:
+        queue = firebase_queue.FirebaseWriteQueue(
+            Path(tmp) / "journal.db", writer, flush_interval=0.05, max_backoff=1.0
+        )
+        queue.start()
+        queue.enqueue("attendance/bench/broken", "not-an-object")
+        queued = _run_threads(
+            args.students,
+            args.threads,
+            lambda index: queue.enqueue_attendance("bench", f"s{index:04d}", _payload(index)),
+        )
+        _report("write-behind", queued)
+        print(f"queue depth after the burst: {queue.stats()['depth']}")
+
+        started = time.monotonic()
+        while queue.stats()["depth"] and time.monotonic() - started < 60:
+            time.sleep(0.05)
+        stats = queue.stats()
+        queue.close()
+
+    replicated = database.reference("attendance/bench").get() or {}
+    missing = args.students - len(replicated)
+    print(
+        f"replicated {len(replicated)}/{args.students} in {time.monotonic() - started:.2f} s after the burst "
+        f"({stats['batches']} batches, {writer.calls} writer calls, {stats['failures']} failures, "
+        f"{stats['parked']} parked, last lag {stats['lastReplicationLagSeconds']} s)"
+    )
+    return 1 if missing else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
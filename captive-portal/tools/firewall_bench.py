@@ -0,0 +1,139 @@
+"""Grant-throughput benchmark for the firewall backends.
+
+Run from ``captive-portal/`` (no root needed)::
+
+    python -m tools.firewall_bench --clients 600 --batch-latency-ms 250
+
+The dry-run backend simulates a fixed per-call cost (``--batch-latency-ms``,
+roughly what spawning PowerShell or nft costs) so per-grant and batched
+application can be compared. The real backends are driven with a recording
+command runner to count how many processes and how much script input each
+strategy would produce. Finally a burst of repeated grant requests is pushed
+through the coalescing :class:`~utils.grant_scheduler.GrantScheduler`.
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+from typing import List, Optional, Sequence, Tuple
+
+from utils import firewall, grant_scheduler
+
+
+def _entries(count: int) -> List[firewall.GrantEntry]:
+    return [(f"192.168.{137 + index // 250}.{index % 250 + 2}", f"student{index:04d}") for index in range(count)]
+
+
+class _RecordingRunner:
+    def __init__(self) -> None:
+        self.calls: List[Tuple[Tuple[str, ...], int]] = []
+
+    def __call__(self, args: Sequence[str], input_text: Optional[str] = None) -> str:
+        command_bytes = len(input_text or "") + sum(len(arg) for arg in args)
+        self.calls.append((tuple(args[:2]), command_bytes))
+        return ""
+
+
+def _chunks(entries: Sequence[firewall.GrantEntry], size: int):
+    for start in range(0, len(entries), size):
+        yield entries[start:start + size]
+
+
+def bench_dry_run(entries: Sequence[firewall.GrantEntry], batch_size: int, latency: float) -> dict:
+    per_grant = firewall.RecordingBackend(batch_latency=latency)
+    started = time.perf_counter()
+    for ip_address, student_id in entries:
+        per_grant.grant(ip_address, student_id)
+    per_grant_seconds = time.perf_counter() - started
+
+    batched = firewall.RecordingBackend(batch_latency=latency)
+    started = time.perf_counter()
+    for chunk in _chunks(entries, batch_size):
+        batched.grant_many(chunk)
+    batched_seconds = time.perf_counter() - started
+    assert batched.allowed.keys() == per_grant.allowed.keys()
+    return {
+        "perGrantSeconds": per_grant_seconds,
+        "perGrantRate": len(entries) / per_grant_seconds,
+        "batchedSeconds": batched_seconds,
+        "batchedRate": len(entries) / batched_seconds,
+        "batches": len(batched.operations),
+    }
+
+
+def bench_command_volume(entries: Sequence[firewall.GrantEntry], batch_size: int) -> dict:
+    results = {}
+    for name in ("nftables", "ipset"):
+        per_grant_runner, batched_runner = _RecordingRunner(), _RecordingRunner()
+        per_grant = firewall.get_backend({"backend": name}, runner=per_grant_runner)
+        batched = firewall.get_backend({"backend": name}, runner=batched_runner)
+        for ip_address, student_id in entries:
+            per_grant.grant(ip_address, student_id)
+        for chunk in _chunks(entries, batch_size):
+            batched.grant_many(chunk)
+        results[name] = {
+            "perGrantProcesses": len(per_grant_runner.calls),
+            "batchedProcesses": len(batched_runner.calls),
+            "batchedInputBytes": sum(size for _, size in batched_runner.calls),
+        }
+    return results
+
+
+def bench_scheduler(
+    entries: Sequence[firewall.GrantEntry], repeats: int, latency: float, flush_interval: float
+) -> dict:
+    backend = firewall.RecordingBackend(batch_latency=latency)
+    scheduler = grant_scheduler.GrantScheduler(backend, flush_interval=flush_interval)
+    scheduler.start()
+    started = time.perf_counter()
+    for _ in range(repeats):
+        for ip_address, student_id in entries:
+            scheduler.request_grant(ip_address, student_id)
+    enqueue_seconds = time.perf_counter() - started
+    while len(backend.allowed) < len(entries):
+        time.sleep(flush_interval / 10)
+    applied_seconds = time.perf_counter() - started
+    scheduler.close()
+    return {
+        "requests": len(entries) * repeats,
+        "enqueueMicros": enqueue_seconds / (len(entries) * repeats) * 1e6,
+        "appliedSeconds": applied_seconds,
+        "backendCalls": len(backend.operations),
+        **scheduler.stats(),
+    }
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=600)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--batch-latency-ms", type=float, default=20.0)
+    parser.add_argument("--repeats", type=int, default=3, help="grant requests per client in the scheduler burst")
+    parser.add_argument("--flush-interval-ms", type=float, default=250.0)
+    args = parser.parse_args(argv)
+
+    entries = _entries(args.clients)
+    stats = bench_dry_run(entries, args.batch_size, args.batch_latency_ms / 1000.0)
+    print(
+        f"dry-run, {args.clients} grants at {args.batch_latency_ms:.0f} ms/call: "
+        f"per-grant {stats['perGrantSeconds']:.2f} s ({stats['perGrantRate']:.0f}/s), "
+        f"batched {stats['batchedSeconds']:.2f} s ({stats['batchedRate']:.0f}/s, {stats['batches']} calls)"
+    )
+    for name, volume in bench_command_volume(entries, args.batch_size).items():
+        print(
+            f"{name:>9}: {volume['perGrantProcesses']} processes per-grant vs "
+            f"{volume['batchedProcesses']} batched ({volume['batchedInputBytes']} bytes of input)"
+        )
+    burst = bench_scheduler(
+        entries, args.repeats, args.batch_latency_ms / 1000.0, args.flush_interval_ms / 1000.0
+    )
+    print(
+        f"scheduler: {burst['requests']} requests enqueued at {burst['enqueueMicros']:.1f} us each, "
+        f"all applied after {burst['appliedSeconds']:.2f} s in {burst['backendCalls']} backend call(s)"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
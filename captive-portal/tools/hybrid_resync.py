@@ -0,0 +1,78 @@
+"""Catch-up resync between the local SQLite database and Firebase (hybrid mode).
+
+Run from ``captive-portal/``::
+
+    python -m tools.hybrid_resync            # reconcile and push
+    python -m tools.hybrid_resync --dry-run  # only report what would change
+
+Compares every class's attendance on both sides with the hybrid conflict
+rule (later date wins; on the same date the earlier mark wins), imports
+Firebase-side winners into SQLite, queues local winners plus all codes and
+students for pushing, then waits for the change log to drain.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import time
+from pathlib import Path
+from typing import Optional, Sequence
+
+from utils import firebase_client, replication
+
+_BASE_DIR = Path(__file__).resolve().parent.parent
+
+
+def _db_path(config: dict) -> Path:
+    raw = Path((config.get("sqlite") or {}).get("db_path", "data/portal.db"))
+    return raw if raw.is_absolute() else (_BASE_DIR / raw).resolve()
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--config", type=Path, default=_BASE_DIR / "config" / "network_settings.json")
+    parser.add_argument("--db", type=Path, help="SQLite database (defaults to sqlite.db_path from the config)")
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--timeout", type=float, default=120.0, help="seconds to wait for the push to finish")
+    args = parser.parse_args(argv)
+
+    config = json.loads(args.config.read_text(encoding="utf-8"))
+    try:
+        firebase_client.initialise()
+    except firebase_client.FirebaseConfigurationError as exc:
+        print(f"Firebase unavailable: {exc}")
+        return 2
+
+    replicator = replication.HybridReplicator(
+        args.db or _db_path(config),
+        firebase_client.get_value,
+        firebase_client.apply_updates,
+        flush_interval=0.1,
+        max_backoff=5.0,
+    )
+    summary = replicator.resync(dry_run=args.dry_run)
+    print(
+        f"{summary['classes']} classes: {summary['pushed']} attendance record(s) to push, "
+        f"{summary['imported']} imported from Firebase, {summary['unchanged']} unchanged; "
+        f"{summary['codes']} code(s) and {summary['students']} student(s) refreshed"
+    )
+    if args.dry_run:
+        return 0
+
+    replicator.start()
+    deadline = time.monotonic() + args.timeout
+    stats = replicator.stats()
+    while stats["depth"] and time.monotonic() < deadline:
+        time.sleep(0.2)
+        stats = replicator.stats()
+    replicator.close()
+    if stats["depth"]:
+        print(f"{stats['depth']} change(s) still queued ({stats['lastError']}); they are sent when the portal runs.")
+        return 1
+    print(f"Change log drained; {stats['conflicts']} conflict(s) resolved in favour of Firebase during the push.")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
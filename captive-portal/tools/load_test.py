@@ -0,0 +1,502 @@
+"""Class-start burst test: N students mark attendance at once.
+
+Run from ``captive-portal/``::
+
+    python -m tools.load_test --students 600
+    python -m tools.load_test --students 600 --workers 4 --threads 32 --json runs/600-w4.json
+    python -m tools.load_test --students 600 --images samples/faces --compare runs/600-w4.json
+    python -m tools.load_test --students 600 --compare runs/baseline.json --max-memory-regression 10
+
+Creates a temporary SQLite database with ``--students`` synthetic students
+and one open attendance code. It then starts ``serve.py`` on a loopback
+port with a copy of ``config/network_settings.json`` that points at that
+database, with captive DNS off and the ``dry-run`` firewall backend. Each
+student is a thread with its own keep-alive connection, cookie jar and
+User-Agent. It walks the real flow:
+``POST /verify`` -> ``POST /api/face-capture`` -> ``POST /login`` ->
+``POST /mark-attendance``. All threads start together, or spread over
+``--ramp-seconds``. A student whose step fails stops there.
+
+Face detection: with ``--images`` (a folder of face JPEGs, used round
+robin), the portal runs OpenCV as configured. Without it, the portal's
+detector is swapped for one that accepts every frame after
+``--face-cost-ms``, so the rest of the flow can be measured on machines
+without OpenCV or sample photos. The report states which mode was used.
+
+Prints throughput, per-step p50/p95/p99 and error classes. It also
+prints the server's peak RSS: ``VmHWM`` summed over ``serve.py`` and its
+workers on Linux, otherwise the peak reported by ``/api/health``.
+``--json`` saves the report, and ``--compare`` prints the change from an
+earlier one. With ``--max-memory-regression`` as well, the run exits
+with status 3 when the peak grew by more than that percentage. That
+makes it usable as a CI check against a committed baseline report.
+"""
+
+from __future__ import annotations
+
+import argparse
+import base64
+import gzip
+import http.client
+import json
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from http.cookies import SimpleCookie
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from utils import face_engine, local_db
+
+_BASE_DIR = Path(__file__).resolve().parent.parent
+_CONFIG_PATH = _BASE_DIR / "config" / "network_settings.json"
+
+STEPS = ("verify", "face_capture", "login", "mark_attendance")
+CLASS_ID = "loadtest-class"
+CODE = "424242"
+PASSWORD = "loadtest-pass"
+HEALTH_TOKEN = "loadtest-health"
+
+# Only read by the simulated detector, which never decodes it.
+_PLACEHOLDER_JPEG = b"\xff\xd8\xff\xe0\x00\x10JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00\xff\xd9"
+
+_BOOTSTRAP = """
+import os, sys
+sys.path.insert(0, os.getcwd())
+import app
+if os.environ.get("LOADTEST_FACE_COST_MS") is not None:
+    from tools.load_test import SimulatedFaceEngine
+    app._FACE_ENGINE = SimulatedFaceEngine(float(os.environ["LOADTEST_FACE_COST_MS"]))
+import serve
+sys.exit(serve.main(sys.argv[1:]))
+"""
+
+
+class SimulatedFaceEngine(face_engine.FaceEngine):
+    """Accepts every frame as one face after ``cost_ms``; the frame is not written."""
+
+    def __init__(self, cost_ms: float = 0.0) -> None:
+        super().__init__(enabled=True)
+        self.cost = max(0.0, cost_ms) / 1000.0
+        self.error = None
+
+    def load(self) -> bool:
+        return True
+
+    def warm_up(self) -> None:
+        return None
+
+    def status(self) -> dict:
+        return {**super().status(), "loaded": True, "available": True, "simulated": True}
+
+    def detect_and_save(self, image_bytes: bytes, file_path: Path) -> int:
+        if not image_bytes:
+            raise ValueError("Unable to read captured frame. Please retry.")
+        if self.cost:
+            time.sleep(self.cost)
+        return 1
+
+
+def student_id(index: int) -> str:
+    return f"lt{index:05d}"
+
+
+def seed_database(db_path: Path, students: int) -> None:
+    local_db.initialize_database(db_path)
+    now_ms = int(time.time() * 1000)
+    local_db.save_attendance_code(
+        db_path,
+        class_id=CLASS_ID,
+        code=CODE,
+        subject="Load Test",
+        teacher_name="Load Test",
+        expiry_time=now_ms + 3 * 3600 * 1000,
+        department="CSE",
+        duration_minutes=180,
+    )
+    for index in range(students):
+        local_db.add_or_update_student(
+            db_path,
+            {
+                "studentId": student_id(index),
+                "name": f"Student {index}",
+                "email": f"{student_id(index)}@example.edu",
+                "department": "CSE",
+                "batch": "2024",
+                "password": PASSWORD,
+                "classId": CLASS_ID,
+            },
+        )
+
+
+def write_config(tmp: Path, port: int, base_config: Path = _CONFIG_PATH) -> Path:
+    config = json.loads(base_config.read_text(encoding="utf-8"))
+    config.update(host="127.0.0.1", port=port, data_source="sqlite", debug=False, use_reloader=False)
+    config.setdefault("server", {}).update(host="127.0.0.1", port=port)
+    config.setdefault("sqlite", {}).update(db_path=str(tmp / "portal.db"), seed_demo_data=False)
+    config.setdefault("captive_dns", {})["enabled"] = False
+    config.setdefault("firewall", {}).update(enabled=True, backend="dry-run")
+    config.setdefault("face_capture", {}).update(enabled=True, storage_dir=str(tmp / "faces"))
+    config.setdefault("traffic_recording", {})["enabled"] = False
+    # /api/health only reports its details to a caller with the metrics token.
+    config.setdefault("metrics", {})["token"] = HEALTH_TOKEN
+    path = tmp / "network_settings.json"
+    path.write_text(json.dumps(config, indent=2), encoding="utf-8")
+    return path
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _process_tree(root: int) -> List[int]:
+    """``root`` and its descendants, from ``/proc``; empty where there is no ``/proc``."""
+    children: Dict[int, List[int]] = {}
+    proc = Path("/proc")
+    if not proc.is_dir():
+        return []
+    for entry in proc.iterdir():
+        if not entry.name.isdigit():
+            continue
+        try:
+            # The command name may contain spaces; the parent PID follows its closing parenthesis.
+            parent = int((entry / "stat").read_text(encoding="ascii", errors="replace").rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(parent, []).append(int(entry.name))
+    tree, pending = [], [root]
+    while pending:
+        pid = pending.pop()
+        tree.append(pid)
+        pending.extend(children.get(pid, []))
+    return tree
+
+
+class Portal:
+    """``serve.py`` in a child process, stopped with SIGTERM; its output goes to ``log_path``."""
+
+    def __init__(
+        self, config: Path, port: int, workers: int, threads: int, face_cost_ms: Optional[float], log_path: Path
+    ) -> None:
+        env = dict(os.environ, PORTAL_CONFIG=str(config))
+        if face_cost_ms is not None:
+            env["LOADTEST_FACE_COST_MS"] = str(face_cost_ms)
+        args = ["--config", str(config), "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers)]
+        args += ["--threads", str(threads)]
+        self.port = port
+        self.log_path = log_path
+        self._log = log_path.open("wb")
+        self.process = subprocess.Popen(
+            [sys.executable, "-c", _BOOTSTRAP, *args], cwd=_BASE_DIR, env=env, stdout=self._log, stderr=subprocess.STDOUT
+        )
+
+    def wait_ready(self, timeout: float = 60.0) -> Dict[str, Any]:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                tail = "\n".join(self.log_path.read_text(encoding="utf-8", errors="replace").splitlines()[-15:])
+                raise RuntimeError(f"Portal exited with code {self.process.returncode}:\n{tail}")
+            try:
+                return self.health()
+            except (OSError, http.client.HTTPException, ValueError):
+                time.sleep(0.2)
+        raise RuntimeError("Portal did not answer /api/health in time")
+
+    def health(self) -> Dict[str, Any]:
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=5)
+        try:
+            conn.request("GET", "/api/health", headers={"Authorization": f"Bearer {HEALTH_TOKEN}"})
+            return json.loads(conn.getresponse().read())
+        finally:
+            conn.close()
+
+    def memory(self) -> Optional[Dict[str, Any]]:
+        """Peak and current RSS summed over ``serve.py`` and its workers (Linux only)."""
+        pids = _process_tree(self.process.pid)
+        if not pids:
+            return None
+        peak = current = largest = 0
+        for pid in pids:
+            try:
+                status = Path(f"/proc/{pid}/status").read_text(encoding="ascii", errors="replace")
+            except OSError:
+                continue
+            fields = dict(line.split(":", 1) for line in status.splitlines() if ":" in line)
+            hwm = int(fields.get("VmHWM", "0 kB").split()[0]) * 1024
+            peak += hwm
+            largest = max(largest, hwm)
+            current += int(fields.get("VmRSS", "0 kB").split()[0]) * 1024
+        return {"peakRssBytes": peak, "rssBytes": current, "largestPeakRssBytes": largest, "processes": len(pids)}
+
+    def stop(self) -> None:
+        if self.process.poll() is None:
+            self.process.send_signal(signal.SIGTERM if hasattr(signal, "SIGTERM") else signal.SIGINT)
+            try:
+                self.process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        self._log.close()
+
+
+class Student:
+    def __init__(self, index: int, port: int, image: bytes, timeout: float) -> None:
+        self.index = index
+        self.conn = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+        self.cookies: Dict[str, str] = {}
+        self.image = image
+        # The portal fingerprints devices by IP and User-Agent; every student is a different phone.
+        self.user_agent = f"Mozilla/5.0 (Linux; Android 14; LoadTest-{index:05d}) Mobile Safari/537.36"
+
+    def post(self, path: str, payload: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        headers = {"Content-Type": "application/json", "User-Agent": self.user_agent, "Accept-Encoding": "gzip"}
+        if self.cookies:
+            headers["Cookie"] = "; ".join(f"{name}={value}" for name, value in self.cookies.items())
+        self.conn.request("POST", path, body=json.dumps(payload).encode("utf-8"), headers=headers)
+        response = self.conn.getresponse()
+        body = response.read()
+        for header in response.headers.get_all("Set-Cookie") or []:
+            for name, morsel in SimpleCookie(header).items():
+                self.cookies[name] = morsel.value
+        if response.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        try:
+            data = json.loads(body)
+        except ValueError:
+            data = {}
+        return response.status, data
+
+    def run(self, record, think: float) -> bool:
+        sid = student_id(self.index)
+        image = "data:image/jpeg;base64," + base64.b64encode(self.image).decode("ascii")
+        flow = (
+            ("verify", "/verify", lambda: {"code": CODE}),
+            ("face_capture", "/api/face-capture", lambda: {"studentId": sid, "imageData": image}),
+            ("login", "/login", lambda: {"rollNumber": sid, "password": PASSWORD, "faceCaptureId": self.capture_id}),
+            ("mark_attendance", "/mark-attendance", lambda: {}),
+        )
+        self.capture_id = None
+        try:
+            for step, path, payload in flow:
+                started = time.perf_counter()
+                try:
+                    status, data = self.post(path, payload())
+                except (OSError, http.client.HTTPException) as exc:
+                    record(step, time.perf_counter() - started, f"{type(exc).__name__}")
+                    return False
+                elapsed = time.perf_counter() - started
+                if status != 200 or not data.get("success"):
+                    record(step, elapsed, f"HTTP {status}: {str(data.get('error', ''))[:80]}")
+                    return False
+                record(step, elapsed, None)
+                if step == "face_capture":
+                    self.capture_id = data.get("captureId")
+                if think:
+                    time.sleep(random.uniform(0.5, 1.5) * think)
+            return True
+        finally:
+            self.conn.close()
+
+
+def _percentile(ordered: List[float], fraction: float) -> float:
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+
+def summarise(latencies: List[float], errors: Counter, seconds: float) -> Dict[str, Any]:
+    ordered = sorted(latencies)
+    return {
+        "ok": len(ordered),
+        "errors": sum(errors.values()),
+        "perSecond": round(len(ordered) / seconds, 1) if seconds else 0.0,
+        "meanMs": round(sum(ordered) / len(ordered) * 1000, 2) if ordered else 0.0,
+        "p50Ms": round(_percentile(ordered, 0.50) * 1000, 2),
+        "p95Ms": round(_percentile(ordered, 0.95) * 1000, 2),
+        "p99Ms": round(_percentile(ordered, 0.99) * 1000, 2),
+        "maxMs": round(ordered[-1] * 1000, 2) if ordered else 0.0,
+        "errorClasses": dict(errors.most_common()),
+    }
+
+
+def run_burst(port: int, students: int, images: List[bytes], ramp: float, think: float, timeout: float) -> Dict[str, Any]:
+    latencies: Dict[str, List[float]] = {step: [] for step in STEPS}
+    errors: Dict[str, Counter] = {step: Counter() for step in STEPS}
+    lock = threading.Lock()
+    completed = [0]
+
+    def record(step: str, seconds: float, error: Optional[str]) -> None:
+        with lock:
+            if error is None:
+                latencies[step].append(seconds)
+            else:
+                errors[step][error] += 1
+
+    start_gate = threading.Barrier(students + 1)
+
+    def student(index: int) -> None:
+        start_gate.wait()
+        if ramp:
+            time.sleep(ramp * index / students)
+        if Student(index, port, images[index % len(images)], timeout).run(record, think):
+            with lock:
+                completed[0] += 1
+
+    threads = [threading.Thread(target=student, args=(index,), daemon=True) for index in range(students)]
+    for thread in threads:
+        thread.start()
+    start_gate.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - started
+    requests = sum(len(values) + sum(errors[step].values()) for step, values in latencies.items())
+    return {
+        "seconds": round(seconds, 3),
+        "completed": completed[0],
+        "studentsPerSecond": round(completed[0] / seconds, 1) if seconds else 0.0,
+        "requestsPerSecond": round(requests / seconds, 1) if seconds else 0.0,
+        "steps": {step: summarise(latencies[step], errors[step], seconds) for step in STEPS},
+    }
+
+
+def load_images(folder: Optional[Path]) -> List[bytes]:
+    if folder is None:
+        return [_PLACEHOLDER_JPEG]
+    images = [path.read_bytes() for path in sorted(folder.iterdir()) if path.suffix.lower() in (".jpg", ".jpeg")]
+    if not images:
+        raise SystemExit(f"No .jpg files in {folder}")
+    return images
+
+
+def memory_regression(report: Dict[str, Any], previous: Optional[Dict[str, Any]]) -> Optional[float]:
+    """Percentage change in server peak RSS from ``previous``, when both runs measured it."""
+    peak = (report.get("memory") or {}).get("peakRssBytes")
+    before = ((previous or {}).get("memory") or {}).get("peakRssBytes")
+    if not peak or not before:
+        return None
+    return (peak / before - 1) * 100
+
+
+def format_report(report: Dict[str, Any], previous: Optional[Dict[str, Any]] = None) -> str:
+    result = report["result"]
+    settings = report["settings"]
+    lines = [
+        f"{settings['students']} students, {settings['workers']} worker(s) x {settings['threads']} thread(s), "
+        f"face detection {settings['faceDetection']}",
+        f"{result['completed']}/{settings['students']} marked attendance in {result['seconds']:.2f} s: "
+        f"{result['studentsPerSecond']} students/s, {result['requestsPerSecond']} requests/s",
+        "",
+        f"{'step':<16}{'ok':>6}{'err':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}",
+    ]
+    for step in STEPS:
+        row = result["steps"][step]
+        line = f"{step:<16}{row['ok']:>6}{row['errors']:>6}{row['p50Ms']:>10.1f}{row['p95Ms']:>10.1f}{row['p99Ms']:>10.1f}{row['maxMs']:>10.1f}"
+        if previous:
+            before = previous["result"]["steps"].get(step, {}).get("p95Ms")
+            if before:
+                line += f"   p95 {row['p95Ms'] - before:+.1f} ms ({(row['p95Ms'] / before - 1) * 100:+.0f}%)"
+        lines.append(line)
+    if previous:
+        before = previous["result"]["studentsPerSecond"]
+        lines.append(f"\nthroughput {result['studentsPerSecond']} vs {before} students/s in {previous.get('startedAt', 'previous run')}")
+    peak = (report.get("memory") or {}).get("peakRssBytes")
+    if peak:
+        line = f"server peak RSS {peak / 1048576:.1f} MB over {report['memory']['processes']} process(es)"
+        regression = memory_regression(report, previous)
+        if regression is not None:
+            line += f" ({regression:+.1f}% vs previous)"
+        lines.append(line)
+    for step in STEPS:
+        for error, count in result["steps"][step]["errorClasses"].items():
+            lines.append(f"  {step}: {count} x {error}")
+    return "\n".join(lines)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--students", type=int, default=600)
+    parser.add_argument("--workers", type=int, default=1, help="serve.py worker processes")
+    parser.add_argument("--threads", type=int, default=32, help="serve.py threads per worker")
+    parser.add_argument("--ramp-seconds", type=float, default=0.0, help="spread student start times over this")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="mean pause between a student's steps")
+    parser.add_argument("--images", type=Path, help="folder of face JPEGs; enables real OpenCV detection")
+    parser.add_argument("--face-cost-ms", type=float, default=0.0, help="simulated detection time without --images")
+    parser.add_argument("--timeout", type=float, default=30.0, help="per-request socket timeout")
+    parser.add_argument("--json", type=Path, help="write the report here")
+    parser.add_argument("--compare", type=Path, help="earlier --json report to compare against")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary database and config")
+    parser.add_argument(
+        "--max-memory-regression", type=float, help="with --compare: exit 3 if server peak RSS grew more than this %%"
+    )
+    args = parser.parse_args(argv)
+
+    images = load_images(args.images)
+    previous = json.loads(args.compare.read_text(encoding="utf-8")) if args.compare else None
+    tmp = Path(tempfile.mkdtemp(prefix="portal-loadtest-"))
+    port = _free_port()
+    config = write_config(tmp, port)
+    seeded = time.perf_counter()
+    seed_database(tmp / "portal.db", args.students)
+    seed_seconds = time.perf_counter() - seeded
+
+    simulated = args.images is None
+    portal = Portal(
+        config, port, args.workers, args.threads, args.face_cost_ms if simulated else None, tmp / "server.log"
+    )
+    try:
+        portal.wait_ready()
+        result = run_burst(
+            port, args.students, images, args.ramp_seconds, args.think_ms / 1000.0, args.timeout
+        )
+        server = portal.health()
+        memory = portal.memory() or {**(server.get("memory") or {}), "processes": 1}
+    except RuntimeError as exc:
+        print(exc, file=sys.stderr)
+        return 2
+    finally:
+        portal.stop()
+        if not args.keep:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    report = {
+        "startedAt": datetime.now(tz=timezone.utc).isoformat(timespec="seconds"),
+        "settings": {
+            "students": args.students,
+            "workers": args.workers,
+            "threads": args.threads,
+            "rampSeconds": args.ramp_seconds,
+            "thinkMs": args.think_ms,
+            "faceDetection": f"simulated ({args.face_cost_ms:g} ms)" if simulated else f"opencv ({len(images)} images)",
+            "seedSeconds": round(seed_seconds, 3),
+            "python": sys.version.split()[0],
+            "cpus": os.cpu_count(),
+        },
+        "result": result,
+        "server": {key: server.get(key) for key in ("latency", "database", "queues", "sessions", "grants")},
+        "memory": memory,
+    }
+    print(format_report(report, previous))
+    if args.keep:
+        print(f"\nDatabase, config and server log kept in {tmp}")
+    if args.json:
+        args.json.parent.mkdir(parents=True, exist_ok=True)
+        args.json.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    regression = memory_regression(report, previous)
+    if args.max_memory_regression is not None and regression is not None and regression > args.max_memory_regression:
+        print(f"FAIL: server peak RSS grew {regression:.1f}%, more than {args.max_memory_regression:g}%", file=sys.stderr)
+        return 3
+    return 0 if result["completed"] == args.students else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,673 @@
+"""Benchmark every public ``utils.local_db`` function at several data sizes.
+
+Run from ``captive-portal/``::
+
+    python -m tools.local_db_bench --sizes s,m
+    python -m tools.local_db_bench --sizes s,m,l --json runs/db-bench.json
+    python -m tools.local_db_bench --sizes 1000:20:20000,50000:500:10000000 --only fetch_student,list_students
+    python -m tools.local_db_bench --sizes s,m --compare runs/db-bench.json
+
+A size is a preset or ``students:classes:attendance_rows``:
+
+    s  1,000 students,  20 classes,    20,000 attendance rows
+    m  10,000 students, 100 classes,   500,000 attendance rows
+    l  50,000 students, 500 classes, 10,000,000 attendance rows (a full term)
+
+Each size's database is built once with :mod:`tools.synthetic_db` and
+cached as ``data/bench-<students>-<classes>-<rows>.db``. Building ``l``
+takes a few minutes. Every run works on a fresh copy, because the writers
+change the data. Functions run in the order of :data:`CASES`, readers
+first, against the same copy. ``enable_wal`` runs first, so the rest run
+in WAL mode as they do when the Firebase queue is on. Each function gets
+one untimed warm-up call and then up to ``--repeat`` timed calls, stopping
+early after ``--max-seconds``. Arguments are drawn from the generated
+data, for example a student on the class roster, and any set-up a call
+needs (an entry to delete) is done before the timer starts. A call that
+raises is counted as an error; the run carries on.
+
+The report has the p50 of each function at each size. It also shows the
+growth from the smallest size to the largest, and flags functions whose
+p50 grew more than ``--flag-ratio`` times. Those are the queries that stop
+scaling. ``--json`` saves p50/p95/max per function per size, and
+``--compare`` prints the p50 change from an earlier report.
+"""
+
+from __future__ import annotations
+
+import argparse
+import inspect
+import json
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from tools import synthetic_db
+from utils import local_db
+
+_BASE_DIR = Path(__file__).resolve().parent.parent
+_CACHE_DIR = _BASE_DIR / "data"
+
+PRESETS = {
+    "s": (1_000, 20, 20_000),
+    "m": (10_000, 100, 500_000),
+    "l": (50_000, 500, 10_000_000),
+}
+# Not database operations.
+SKIPPED = {"configure_tracing", "tracing_stats", "configure_lock_wait_observer"}
+
+Thunk = Callable[[], Any]
+CASES: Dict[str, Callable[["Context", int], List[Thunk]]] = {}
+
+
+def case(name: str) -> Callable:
+    def register(make: Callable[["Context", int], List[Thunk]]) -> Callable:
+        CASES[name] = make
+        return make
+
+    return register
+
+
+def parse_size(spec: str) -> Tuple[str, Tuple[int, int, int]]:
+    spec = spec.strip()
+    if spec in PRESETS:
+        return spec, PRESETS[spec]
+    try:
+        students, classes, rows = (int(part.replace("_", "")) for part in spec.split(":"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"size {spec!r} is not one of {', '.join(PRESETS)} or students:classes:rows")
+    return spec, (students, classes, rows)
+
+
+def cached_database(students: int, classes: int, rows: int, rebuild: bool = False) -> Path:
+    path = _CACHE_DIR / f"bench-{students}-{classes}-{rows}.db"
+    if rebuild or not path.exists():
+        print(f"generating {path.name} ...", file=sys.stderr, flush=True)
+        partial = path.with_name(path.name + ".partial")
+        summary = synthetic_db.generate(partial, students=students, classes=classes, rows=rows, progress=True)
+        partial.replace(path)
+        print(f"  {sum(summary['rows'].values()):,} rows in {summary['seconds']} s", file=sys.stderr, flush=True)
+    return path
+
+
+class Context:
+    """The working database and what is known about its contents."""
+
+    def __init__(self, db: Path, students: int, classes: int, rows: int, seed: int = 1) -> None:
+        self.db = db
+        self.term = synthetic_db.Term(
+            students, classes, rows, days=120, attendance_rate=0.85, start=synthetic_db.TERM_START, seed=1
+        )
+        self.rng = random.Random(seed)
+        self.now = time.time()
+        self.today = datetime.now(tz=timezone.utc).date().isoformat()
+
+    def student(self) -> str:
+        return synthetic_db.student_id(self.rng.randrange(self.term.students))
+
+    def class_index(self) -> int:
+        return self.rng.randrange(self.term.classes)
+
+    def class_id(self) -> str:
+        return synthetic_db.class_id(self.class_index())
+
+    def enrolment(self) -> Tuple[str, str]:
+        """A class and a student on its roster."""
+        index = self.class_index()
+        position = self.rng.choice(self.term.roster(index))
+        return synthetic_db.class_id(index), synthetic_db.student_id(position % self.term.students)
+
+    def enrolments(self, count: int) -> List[Tuple[str, str]]:
+        """``count`` distinct class/student pairs from the rosters."""
+        pairs = []
+        for number in range(count):
+            index = number % self.term.classes
+            roster = self.term.roster(index)
+            position = roster[(number // self.term.classes) % len(roster)]
+            pairs.append((synthetic_db.class_id(index), synthetic_db.student_id(position % self.term.students)))
+        return pairs
+
+    def teacher(self) -> int:
+        return self.rng.randrange(self.term.classes) + 1
+
+    def attendance_payload(self, student: str, number: int, date: str) -> Dict[str, Any]:
+        return {
+            "date": date,
+            "subject": "Bench",
+            "code": "123456",
+            "teacherName": "Bench Teacher",
+            "department": "CSE",
+            "markedVia": "Captive Portal",
+            "email": f"{student}@example.edu",
+            "name": student,
+            "deviceFingerprint": f"bench-device-{number}",
+        }
+
+
+# Readers.
+
+
+@case("enable_wal")
+def _enable_wal(ctx: Context, count: int) -> List[Thunk]:
+    return [lambda: local_db.enable_wal(ctx.db)] * count
+
+
+@case("ping")
+def _ping(ctx: Context, count: int) -> List[Thunk]:
+    return [lambda: local_db.ping(ctx.db)] * count
+
+
+@case("initialize_database")
+def _initialize_database(ctx: Context, count: int) -> List[Thunk]:
+    return [lambda: local_db.initialize_database(ctx.db)] * count
+
+
+@case("verify_attendance_code")
+def _verify_attendance_code(ctx: Context, count: int) -> List[Thunk]:
+    # Every tenth generated code is still open; an expired one would be deleted.
+    open_codes = [row["code"] for row in local_db.list_attendance_codes(ctx.db) if (row["expiry_time"] or 0) > ctx.now * 1000]
+    if not open_codes:
+        raise RuntimeError("no open attendance codes in the generated database")
+    return [lambda code=ctx.rng.choice(open_codes): local_db.verify_attendance_code(ctx.db, code) for _ in range(count)]
+
+
+@case("get_attendance_code")
+def _get_attendance_code(ctx: Context, count: int) -> List[Thunk]:
+    return [lambda cid=ctx.class_id(): local_db.get_attendance_code(ctx.db, cid) for _ in range(count)]
+
+
+@case("list_attendance_codes")
+def _list_attendance_codes(ctx: Context, count: int) -> List[Thunk]:
+    return [lambda: local_db.list_attendance_codes(ctx.db)] * count
+
+
+@case("fetch_student")
+def _fetch_student(ctx: Context, count: int) -> List[Thunk]:
+    return [lambda sid=ctx.student(): local_db.fetch_student(ctx.db, sid) for _ in range(count)]
+
+
+@case("list_students")
+def _list_students(ctx: Context, count: int) -> List[Thunk]:
+    return [lambda cid=ctx.class_id(): local_db.list_students(ctx.db, cid) for _ in range(count)]
+
+
+@case("load_existing_attendance")
+def _load_existing_attendance(ctx: Context, count: int) -> List[Thunk]:
+    return [lambda pair=ctx.enrolment(): local_db.load_existing_attendance(ctx.db, *pair) for _ in range(count)]
+
+
+@case("list_attendance_class_ids")
+def _list_attendance_class_ids(ctx: Context, count: int) -> List[Thunk]:
+    return [lambda: local_db.list_attendance_class_ids(ctx.db)] * count
+
+
+@case("list_attendance_records")
+def _list_attendance_records(ctx: Context, count: int) -> List[Thunk]:
+    return [lambda cid=ctx.class_id(): local_db.list_attendance_records(ctx.db, cid) for _ in range(count)]
+
+
+@case("get_face_capture")
+def _get_face_capture(ctx: Context, count: int) -> List[Thunk]:
+    return [
+        lambda capture=ctx.rng.randrange(1, ctx.term.students + 1): local_db.get_face_capture(ctx.db, capture)
+        for _ in range(count)
+    ]
+
+
+@case("get_teacher_by_email")
+def _get_teacher_by_email(ctx: Context, count: int) -> List[Thunk]:
+    return [
+        lambda email=synthetic_db.teacher_email(ctx.teacher() - 1): local_db.get_teacher_by_email(ctx.db, email)
+        for _ in range(count)
+    ]
+
+
+@case("get_teacher_with_secret")
+def _get_teacher_with_secret(ctx: Context, count: int) -> List[Thunk]:
+    return [lambda teacher=ctx.teacher(): local_db.get_teacher_with_secret(ctx.db, teacher) for _ in range(count)]
+
+
+@case("get_teacher_by_id")
+def _get_teacher_by_id(ctx: Context, count: int) -> List[Thunk]:
+    return [lambda teacher=ctx.teacher(): local_db.get_teacher_by_id(ctx.db, teacher) for _ in range(count)]
+
+
+@case("verify_teacher_credentials")
+def _verify_teacher_credentials(ctx: Context, count: int) -> List[Thunk]:
+    # Dominated by the password hash, whatever the data size.
+    return [
+        lambda email=synthetic_db.teacher_email(ctx.teacher() - 1): local_db.verify_teacher_credentials(
+            ctx.db, email, synthetic_db.TEACHER_PASSWORD
+        )
+        for _ in range(count)
+    ]
+
+
+@case("list_timetable_entries")
+def _list_timetable_entries(ctx: Context, count: int) -> List[Thunk]:
+    return [lambda teacher=ctx.teacher(): local_db.list_timetable_entries(ctx.db, teacher) for _ in range(count)]
+
+
+@case("get_dns_query_stats")
+def _get_dns_query_stats(ctx: Context, count: int) -> List[Thunk]:
+    since = int((ctx.now - 3600) * 1000)
+    return [lambda: local_db.get_dns_query_stats(ctx.db, since)] * count
+
+
+@case("load_portal_session")
+def _load_portal_session(ctx: Context, count: int) -> List[Thunk]:
+    sessions = min(ctx.term.students, 5_000)
+    return [
+        lambda sid=f"session-{ctx.rng.randrange(sessions):07d}": local_db.load_portal_session(ctx.db, sid, ctx.now)
+        for _ in range(count)
+    ]
+
+
+@case("fetch_pending_firebase_writes")
+def _fetch_pending_firebase_writes(ctx: Context, count: int) -> List[Thunk]:
+    return [lambda: local_db.fetch_pending_firebase_writes(ctx.db, 50)] * count
+
+
+@case("get_firebase_outbox_stats")
+def _get_firebase_outbox_stats(ctx: Context, count: int) -> List[Thunk]:
+    return [lambda: local_db.get_firebase_outbox_stats(ctx.db)] * count
+
+
+@case("find_journaled_attendance")
+def _find_journaled_attendance(ctx: Context, count: int) -> List[Thunk]:
+    return [lambda pair=ctx.enrolment(): local_db.find_journaled_attendance(ctx.db, *pair) for _ in range(count)]
+
+
+# Writers.
+
+
+@case("save_attendance_code")
+def _save_attendance_code(ctx: Context, count: int) -> List[Thunk]:
+    expiry = int((ctx.now + 3600) * 1000)
+    return [
+        lambda cid=ctx.class_id(), number=number: local_db.save_attendance_code(
+            ctx.db,
+            class_id=cid,
+            code=f"{900000 + number:06d}",
+            subject="Bench",
+            teacher_name="Bench Teacher",
+            expiry_time=expiry,
+            department="CSE",
+            duration_minutes=60,
+        )
+        for number in range(count)
+    ]
+
+
+@case("clear_attendance_code")
+def _clear_attendance_code(ctx: Context, count: int) -> List[Thunk]:
+    expiry = int((ctx.now + 3600) * 1000)
+    for number in range(count):
+        local_db.save_attendance_code(
+            ctx.db,
+            class_id=f"bench-clear-{number}",
+            code=f"{800000 + number:06d}",
+            subject="Bench",
+            teacher_name="Bench Teacher",
+            expiry_time=expiry,
+            department="CSE",
+            duration_minutes=60,
+        )
+    return [lambda cid=f"bench-clear-{number}": local_db.clear_attendance_code(ctx.db, cid) for number in range(count)]
+
+
+@case("add_or_update_student")
+def _add_or_update_student(ctx: Context, count: int) -> List[Thunk]:
+    def update(sid: str) -> Thunk:
+        data = {
+            "studentId": sid,
+            "name": f"Renamed {sid}",
+            "email": f"{sid}@example.edu",
+            "department": "CSE",
+            "batch": "2024",
+            "password": synthetic_db.STUDENT_PASSWORD,
+            "classId": ctx.class_id(),
+        }
+        return lambda: local_db.add_or_update_student(ctx.db, data)
+
+    return [update(ctx.student()) for _ in range(count)]
+
+
+@case("log_face_capture")
+def _log_face_capture(ctx: Context, count: int) -> List[Thunk]:
+    return [
+        lambda sid=ctx.student(): local_db.log_face_capture(ctx.db, sid, f"data/faces/{sid}-bench.jpg", 1)
+        for _ in range(count)
+    ]
+
+
+@case("mark_attendance")
+def _mark_attendance(ctx: Context, count: int) -> List[Thunk]:
+    # Today is outside the generated term, so every pair is a first mark.
+    return [
+        lambda cid=cid, sid=sid, payload=ctx.attendance_payload(sid, number, ctx.today): local_db.mark_attendance(
+            ctx.db, cid, sid, payload
+        )
+        for number, (cid, sid) in enumerate(ctx.enrolments(count))
+    ]
+
+
+@case("record_attendance")
+def _record_attendance(ctx: Context, count: int) -> List[Thunk]:
+    # Tomorrow, so the pairs do not collide with the mark_attendance case; generated capture N + 1 is student N's.
+    tomorrow = (datetime.now(tz=timezone.utc).date() + timedelta(days=1)).isoformat()
+    return [
+        lambda cid=cid, sid=sid, payload=ctx.attendance_payload(sid, number, tomorrow): local_db.record_attendance(
+            ctx.db, cid, sid, payload, face_capture_id=int(sid[1:]) + 1
+        )
+        for number, (cid, sid) in enumerate(ctx.enrolments(count))
+    ]
+
+
+@case("upsert_replicated_attendance")
+def _upsert_replicated_attendance(ctx: Context, count: int) -> List[Thunk]:
+    # Replaces rows of the generated term, as replication of an edited record would.
+    def upsert(number: int) -> Thunk:
+        cid, sid = ctx.enrolment()
+        index = int(cid.rsplit("-", 1)[1])
+        payload = ctx.attendance_payload(sid, number, ctx.rng.choice(ctx.term.dates(index)).isoformat())
+        return lambda: local_db.upsert_replicated_attendance(ctx.db, cid, sid, payload)
+
+    return [upsert(number) for number in range(count)]
+
+
+@case("create_teacher")
+def _create_teacher(ctx: Context, count: int) -> List[Thunk]:
+    # Dominated by the password hash, whatever the data size.
+    return [
+        lambda number=number: local_db.create_teacher(
+            ctx.db,
+            {"email": f"bench{number}@example.edu", "password": "bench-pass", "name": "Bench", "classId": ctx.class_id()},
+        )
+        for number in range(count)
+    ]
+
+
+def _timetable_data(day: str) -> Dict[str, Any]:
+    return {"subject": "Bench", "day": day, "start_time": "17:00", "end_time": "18:00", "credits": 2}
+
+
+@case("create_timetable_entry")
+def _create_timetable_entry(ctx: Context, count: int) -> List[Thunk]:
+    return [
+        lambda teacher=ctx.teacher(): local_db.create_timetable_entry(ctx.db, teacher, _timetable_data("Saturday"))
+        for _ in range(count)
+    ]
+
+
+def _timetable_entries(ctx: Context, count: int) -> List[Tuple[int, int]]:
+    entries = []
+    for _ in range(count):
+        teacher = ctx.teacher()
+        entries.append((teacher, local_db.create_timetable_entry(ctx.db, teacher, _timetable_data("Sunday"))["id"]))
+    return entries
+
+
+@case("update_timetable_entry")
+def _update_timetable_entry(ctx: Context, count: int) -> List[Thunk]:
+    return [
+        lambda teacher=teacher, entry=entry: local_db.update_timetable_entry(
+            ctx.db, teacher, entry, _timetable_data("Friday")
+        )
+        for teacher, entry in _timetable_entries(ctx, count)
+    ]
+
+
+@case("delete_timetable_entry")
+def _delete_timetable_entry(ctx: Context, count: int) -> List[Thunk]:
+    return [
+        lambda teacher=teacher, entry=entry: local_db.delete_timetable_entry(ctx.db, teacher, entry)
+        for teacher, entry in _timetable_entries(ctx, count)
+    ]
+
+
+@case("insert_dns_query_events")
+def _insert_dns_query_events(ctx: Context, count: int) -> List[Thunk]:
+    # One flush of the DNS analytics buffer.
+    def batch() -> List[tuple]:
+        now_ms = int(ctx.now * 1000)
+        return [
+            (now_ms + offset, f"192.168.137.{ctx.rng.randrange(2, 255)}", ctx.rng.randrange(1, 5000), 1, 0, 1.5)
+            for offset in range(100)
+        ]
+
+    return [lambda events=batch(): local_db.insert_dns_query_events(ctx.db, events) for _ in range(count)]
+
+
+@case("save_portal_sessions")
+def _save_portal_sessions(ctx: Context, count: int) -> List[Thunk]:
+    return [
+        lambda rows=[(f"bench-session-{number}", "{}", ctx.now + 3600)]: local_db.save_portal_sessions(ctx.db, rows, [])
+        for number in range(count)
+    ]
+
+
+@case("enqueue_firebase_write")
+def _enqueue_firebase_write(ctx: Context, count: int) -> List[Thunk]:
+    def enqueue() -> Thunk:
+        cid, sid = ctx.enrolment()
+        payload = json.dumps({"studentId": sid, "date": ctx.today})
+        return lambda: local_db.enqueue_firebase_write(ctx.db, f"attendance/{cid}/{sid}", payload, cid, sid)
+
+    return [enqueue() for _ in range(count)]
+
+
+def _pending_writes(ctx: Context, count: int) -> List[int]:
+    return [
+        local_db.enqueue_firebase_write(ctx.db, f"bench/{number}", "{}", ctx.class_id(), ctx.student())
+        for number in range(count)
+    ]
+
+
+@case("mark_firebase_writes_flushed")
+def _mark_firebase_writes_flushed(ctx: Context, count: int) -> List[Thunk]:
+    return [
+        lambda ids=[write]: local_db.mark_firebase_writes_flushed(ctx.db, ids, ctx.now)
+        for write in _pending_writes(ctx, count)
+    ]
+
+
+@case("record_firebase_write_failure")
+def _record_firebase_write_failure(ctx: Context, count: int) -> List[Thunk]:
+    return [
+        lambda ids=[write]: local_db.record_firebase_write_failure(ctx.db, ids, "bench")
+        for write in _pending_writes(ctx, count)
+    ]
+
+
+# Purges last: after the first call there is little left to delete.
+
+
+@case("purge_expired_portal_sessions")
+def _purge_expired_portal_sessions(ctx: Context, count: int) -> List[Thunk]:
+    return [lambda: local_db.purge_expired_portal_sessions(ctx.db, ctx.now)] * count
+
+
+@case("purge_flushed_firebase_writes")
+def _purge_flushed_firebase_writes(ctx: Context, count: int) -> List[Thunk]:
+    return [lambda: local_db.purge_flushed_firebase_writes(ctx.db, ctx.now)] * count
+
+
+@case("purge_dns_query_events")
+def _purge_dns_query_events(ctx: Context, count: int) -> List[Thunk]:
+    # The analytics retention sweep; after the first call there is nothing old left to delete.
+    before = int((ctx.now - 24 * 3600) * 1000)
+    return [lambda: local_db.purge_dns_query_events(ctx.db, before)] * count
+
+
+def unbenched() -> List[str]:
+    """Public functions of ``local_db`` with no case, so new ones are not missed."""
+    return sorted(
+        name
+        for name, value in vars(local_db).items()
+        if inspect.isfunction(value)
+        and value.__module__ == local_db.__name__
+        and not name.startswith("_")
+        and name not in CASES
+        and name not in SKIPPED
+    )
+
+
+def _percentile(ordered: List[float], fraction: float) -> float:
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+
+def run_case(ctx: Context, name: str, repeat: int, max_seconds: float) -> Dict[str, Any]:
+    errors: Counter = Counter()
+    timings: List[float] = []
+    try:
+        thunks = CASES[name](ctx, repeat + 1)
+    except Exception as exc:
+        return {"calls": 0, "errors": 1, "errorClasses": {f"setup: {exc}": 1}}
+    deadline = time.perf_counter() + max_seconds
+    for number, thunk in enumerate(thunks):
+        started = time.perf_counter()
+        try:
+            thunk()
+        except Exception as exc:
+            errors[f"{type(exc).__name__}: {exc}"] += 1
+        else:
+            if number:
+                timings.append(time.perf_counter() - started)
+        if time.perf_counter() > deadline and (timings or errors):
+            break
+    ordered = sorted(timings)
+    result: Dict[str, Any] = {"calls": len(ordered), "errors": sum(errors.values())}
+    if ordered:
+        result.update(
+            {
+                "p50Ms": round(_percentile(ordered, 0.50) * 1000, 3),
+                "p95Ms": round(_percentile(ordered, 0.95) * 1000, 3),
+                "maxMs": round(ordered[-1] * 1000, 3),
+            }
+        )
+    if errors:
+        result["errorClasses"] = dict(errors.most_common(3))
+    return result
+
+
+def run_size(
+    label: str, size: Tuple[int, int, int], names: List[str], repeat: int, max_seconds: float, rebuild: bool
+) -> Dict[str, Any]:
+    students, classes, rows = size
+    source = cached_database(students, classes, rows, rebuild)
+    tmp = Path(tempfile.mkdtemp(prefix="portal-dbbench-"))
+    try:
+        db = tmp / "portal.db"
+        shutil.copyfile(source, db)
+        ctx = Context(db, students, classes, rows)
+        results = {}
+        for name in names:
+            print(f"  [{label}] {name}", file=sys.stderr, flush=True)
+            results[name] = run_case(ctx, name, repeat, max_seconds)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return {
+        "students": students,
+        "classes": classes,
+        "attendanceRows": rows,
+        "bytes": source.stat().st_size,
+        "functions": results,
+    }
+
+
+def format_report(report: Dict[str, Any], flag_ratio: float, previous: Optional[Dict[str, Any]] = None) -> str:
+    labels = list(report["sizes"])
+    functions = report["functions"]
+    width = max([len(name) for name in functions] + [8]) + 2
+    column = max([len(label) for label in labels] + [10]) + 2
+    lines = [
+        "p50 ms per call; growth is the p50 at the largest size over the smallest",
+        "".join([f"{'function':<{width}}"] + [f"{label:>{column}}" for label in labels] + [f"{'growth':>10}"]),
+    ]
+    flagged = []
+    for name, by_size in functions.items():
+        cells = []
+        for label in labels:
+            row = by_size.get(label, {})
+            cells.append(f"{row['p50Ms']:>{column}.3f}" if "p50Ms" in row else f"{'error' if row.get('errors') else '-':>{column}}")
+        line = f"{name:<{width}}" + "".join(cells)
+        first, last = by_size.get(labels[0], {}).get("p50Ms"), by_size.get(labels[-1], {}).get("p50Ms")
+        if len(labels) > 1 and first and last:
+            growth = last / first
+            line += f"{growth:>9.1f}x"
+            if growth > flag_ratio:
+                line += "  !"
+                flagged.append(name)
+        if previous:
+            before = previous.get("functions", {}).get(name, {}).get(labels[-1], {}).get("p50Ms")
+            if before and last:
+                line += f"   p50 {(last / before - 1) * 100:+.0f}% vs previous"
+        lines.append(line)
+    if flagged:
+        lines.append(f"\nnot scaling (p50 grew more than {flag_ratio:g}x): {', '.join(flagged)}")
+    for name, by_size in functions.items():
+        for label, row in by_size.items():
+            for error, count in row.get("errorClasses", {}).items():
+                lines.append(f"  {name} [{label}]: {count} x {error}")
+    for name in report.get("unbenched", []):
+        lines.append(f"  {name}: no benchmark case")
+    return "\n".join(lines)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="s,m", help="comma-separated presets (s, m, l) or students:classes:rows")
+    parser.add_argument("--only", help="comma-separated function names")
+    parser.add_argument("--repeat", type=int, default=100, help="timed calls per function and size")
+    parser.add_argument("--max-seconds", type=float, default=3.0, help="stop timing a function after this")
+    parser.add_argument("--flag-ratio", type=float, default=5.0, help="flag functions whose p50 grew more than this")
+    parser.add_argument("--rebuild", action="store_true", help="regenerate cached databases")
+    parser.add_argument("--json", type=Path, help="write the report here")
+    parser.add_argument("--compare", type=Path, help="earlier --json report to compare against")
+    args = parser.parse_args(argv)
+
+    try:
+        sizes = dict(parse_size(spec) for spec in args.sizes.split(",") if spec.strip())
+    except argparse.ArgumentTypeError as exc:
+        parser.error(str(exc))
+    sizes = dict(sorted(sizes.items(), key=lambda item: item[1][2]))
+    names = list(CASES)
+    if args.only:
+        wanted = [name.strip() for name in args.only.split(",") if name.strip()]
+        unknown = [name for name in wanted if name not in CASES]
+        if unknown:
+            parser.error(f"no benchmark case for {', '.join(unknown)}")
+        names = [name for name in names if name in wanted]
+    previous = json.loads(args.compare.read_text(encoding="utf-8")) if args.compare else None
+
+    results = {label: run_size(label, size, names, max(1, args.repeat), args.max_seconds, args.rebuild) for label, size in sizes.items()}
+    report = {
+        "startedAt": datetime.now(tz=timezone.utc).isoformat(timespec="seconds"),
+        "settings": {
+            "repeat": args.repeat,
+            "maxSeconds": args.max_seconds,
+            "python": sys.version.split()[0],
+            "sqlite": sqlite3.sqlite_version,
+            "cpus": os.cpu_count(),
+        },
+        "sizes": {label: {key: value for key, value in result.items() if key != "functions"} for label, result in results.items()},
+        "functions": {name: {label: results[label]["functions"][name] for label in results} for name in names},
+        "unbenched": unbenched(),
+    }
+    print(format_report(report, args.flag_ratio, previous))
+    if args.json:
+        args.json.parent.mkdir(parents=True, exist_ok=True)
+        args.json.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,139 @@
+"""Start-up time report for the captive portal.
+
+Run from ``captive-portal/``::
+
+    python serve.py --profile-startup
+    python -m tools.startup_profile --top 15 --budget-ms 1500
+
+Imports ``app`` and runs ``create_app(services=False, background=False)``
+in a fresh interpreter under ``python -X importtime``. Prints the
+portal's own phase timings and the slowest imports, by cumulative and by
+self time. With ``--budget-ms``, exits non-zero when import plus
+initialisation takes longer, so start-up regressions fail CI.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+_BASE_DIR = Path(__file__).resolve().parent.parent
+
+_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.create_app(services=False, background=False)
+finished = time.perf_counter()
+print(json.dumps({
+    "importSeconds": imported - started,
+    "initSeconds": finished - imported,
+    "phases": app.STARTUP_TIMINGS,
+    "faceCapture": app._FACE_ENGINE.status(),
+    "modules": sorted(name for name in ("cv2", "numpy", "firebase_admin", "dnslib", "asyncio") if name in sys.modules),
+}))
+"""
+
+
+def parse_importtime(stderr: str) -> List[Dict[str, Any]]:
+    """Parse ``-X importtime`` lines into ``{"module", "self_us", "cumulative_us", "depth"}``."""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+            entries.append(
+                {
+                    "module": name.strip(),
+                    "self_us": int(self_us),
+                    "cumulative_us": int(cumulative_us),
+                    # importtime indents nested imports by two spaces per level.
+                    "depth": (len(name) - len(name.lstrip(" ")) - 1) // 2,
+                }
+            )
+        except ValueError:
+            continue
+    return entries
+
+
+def app_imports(entries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Direct imports of ``app``; importtime lists children before their parent."""
+    children: List[Dict[str, Any]] = []
+    for entry in entries:
+        if entry["depth"] == 0:
+            if entry["module"] == "app":
+                return children
+            children = []
+        elif entry["depth"] == 1:
+            children.append(entry)
+    return []
+
+
+def profile_startup(python: str = sys.executable) -> Dict[str, Any]:
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    completed = subprocess.run(
+        [python, "-X", "importtime", "-c", _PROBE],
+        cwd=_BASE_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    if completed.returncode != 0:
+        tail = "\n".join(completed.stderr.splitlines()[-15:])
+        raise RuntimeError(f"Portal failed to start:\n{tail}")
+    report = json.loads(completed.stdout.strip().splitlines()[-1])
+    report["imports"] = parse_importtime(completed.stderr)
+    report["totalSeconds"] = report["importSeconds"] + report["initSeconds"]
+    return report
+
+
+def format_report(report: Dict[str, Any], top: int = 15) -> str:
+    lines = [
+        f"Start-up: {report['totalSeconds'] * 1000:.1f} ms "
+        f"(import {report['importSeconds'] * 1000:.1f} ms, create_app {report['initSeconds'] * 1000:.1f} ms)",
+        "Phases (s): " + ", ".join(f"{name}={value}" for name, value in report["phases"].items()),
+        f"Face engine: {report['faceCapture']}",
+        "Heavy modules loaded: " + (", ".join(report["modules"]) or "none"),
+        "",
+        f"Top {top} imports made by app.py, by cumulative time:",
+    ]
+    for entry in sorted(app_imports(report["imports"]), key=lambda item: item["cumulative_us"], reverse=True)[:top]:
+        lines.append(f"  {entry['cumulative_us'] / 1000:9.1f} ms  {entry['module']}")
+    lines.append("")
+    lines.append(f"Top {top} modules by self time:")
+    for entry in sorted(report["imports"], key=lambda item: item["self_us"], reverse=True)[:top]:
+        lines.append(f"  {entry['self_us'] / 1000:9.1f} ms  {entry['module']}")
+    return "\n".join(lines)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--top", type=int, default=15, help="rows per table")
+    parser.add_argument("--budget-ms", type=float, help="fail when import + create_app exceeds this")
+    parser.add_argument("--json", type=Path, help="also write the full report here")
+    args = parser.parse_args(argv)
+
+    try:
+        report = profile_startup()
+    except RuntimeError as exc:
+        print(exc, file=sys.stderr)
+        return 2
+    print(format_report(report, args.top))
+    if args.json:
+        args.json.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    if args.budget_ms is not None and report["totalSeconds"] * 1000 > args.budget_ms:
+        print(f"\nStart-up budget exceeded: {report['totalSeconds'] * 1000:.1f} ms > {args.budget_ms:.0f} ms", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
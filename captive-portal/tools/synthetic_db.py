@@ -0,0 +1,361 @@
+"""Generate a realistic portal database of any size.
+
+Run from ``captive-portal/``::
+
+    python -m tools.synthetic_db data/term.db --students 50000 --classes 500 --rows 10000000
+
+A term of ``--days`` days is simulated. Each class has a teacher, an
+attendance code (every tenth one still open), three timetable slots a
+week and a roster of students, and meets on its three weekdays. At each
+meeting about ``--attendance-rate`` of the roster marks attendance.
+Roster sizes are chosen so the term adds up to about ``--rows``
+attendance rows. Students also get a face capture each, and the DNS
+analytics, session and Firebase outbox tables get rows in proportion.
+
+Rows are bulk-inserted with ``executemany`` in batches, inside one
+transaction with journaling off, in primary key order. The secondary
+indexes are dropped first and rebuilt by
+:func:`utils.local_db.initialize_database` at the end. A 10M-row term
+takes a few minutes; the output is the same for the same arguments and
+``--seed``.
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import random
+import sqlite3
+import time
+from datetime import date, datetime, time as dtime, timedelta, timezone
+from itertools import islice
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence
+
+from werkzeug.security import generate_password_hash
+
+from utils import local_db
+
+STUDENT_PASSWORD = "student-pass"
+TEACHER_PASSWORD = "teacher-pass"
+DEPARTMENTS = ("CSE", "ECE", "MECH", "CIVIL", "MATH", "PHYS", "CHEM", "BIO")
+_WEEKDAYS = ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")
+_SLOTS = ("09:00", "10:00", "11:15", "12:15", "14:00", "15:00", "16:15")
+_BATCH = 50_000
+TERM_START = date(2025, 1, 6)
+
+
+def student_id(index: int) -> str:
+    return f"s{index:07d}"
+
+
+def class_id(index: int) -> str:
+    return f"class-{index:05d}"
+
+
+def teacher_email(index: int) -> str:
+    return f"teacher{index:05d}@example.edu"
+
+
+def _batched(rows: Iterable[tuple], size: int = _BATCH) -> Iterator[List[tuple]]:
+    iterator = iter(rows)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class Term:
+    """The shape of the generated term, derived from the arguments."""
+
+    def __init__(
+        self, students: int, classes: int, rows: int, days: int, attendance_rate: float, start: date, seed: int
+    ) -> None:
+        self.students = max(1, students)
+        self.classes = max(1, classes)
+        self.days = max(1, days)
+        self.attendance_rate = min(1.0, max(0.01, attendance_rate))
+        self.start = start
+        self.seed = seed
+        rng = random.Random(seed)
+        # Each class meets on three weekdays.
+        self.meeting_days = [sorted(rng.sample(range(5), 3)) for _ in range(self.classes)]
+        meetings = sum(self.meetings(index) for index in range(self.classes))
+        per_meeting = rows / max(1, meetings)
+        self.roster_size = max(1, min(self.students, round(per_meeting / self.attendance_rate)))
+
+    def meetings(self, index: int) -> int:
+        weekdays = self.meeting_days[index]
+        return sum(1 for offset in range(self.days) if (self.start + timedelta(days=offset)).weekday() in weekdays)
+
+    def roster(self, index: int) -> range:
+        """Student indexes of a class: a window that wraps around, so rosters overlap."""
+        first = (index * self.students // self.classes) % self.students
+        return range(first, first + self.roster_size)
+
+    def dates(self, index: int) -> List[date]:
+        weekdays = self.meeting_days[index]
+        return [
+            day
+            for day in (self.start + timedelta(days=offset) for offset in range(self.days))
+            if day.weekday() in weekdays
+        ]
+
+
+def _attendance_rows(term: Term) -> Iterator[tuple]:
+    rng = random.Random(term.seed + 1)
+    for index in range(term.classes):
+        cid = class_id(index)
+        subject = f"Course {index}"
+        teacher = f"Teacher {index}"
+        department = DEPARTMENTS[index % len(DEPARTMENTS)]
+        code = f"{(index * 7919) % 900000 + 100000}"
+        meetings = []
+        for day in term.dates(index):
+            hour, minute = map(int, _SLOTS[index % len(_SLOTS)].split(":"))
+            started = datetime.combine(day, dtime(hour, minute), tzinfo=timezone.utc)
+            meetings.append((day.isoformat(), int(started.timestamp() * 1000)))
+        rate = term.attendance_rate
+        for position in term.roster(index):
+            student_index = position % term.students
+            sid = student_id(student_index)
+            fingerprint = hashlib.sha256(sid.encode("ascii")).hexdigest()
+            email = f"{sid}@example.edu"
+            name = f"Student {student_index}"
+            for day, started_ms in meetings:
+                if rng.random() >= rate:
+                    continue
+                marked_ms = started_ms + rng.randrange(0, 600_000)
+                marked_at = datetime.fromtimestamp(marked_ms / 1000, tz=timezone.utc).isoformat()
+                yield (
+                    cid, sid, marked_ms, marked_at, day, subject, code, 0, teacher, department,
+                    "Captive Portal", email, name, fingerprint, None,
+                )
+
+
+def _insert(conn: sqlite3.Connection, sql: str, rows: Iterable[tuple], label: str, progress: bool) -> int:
+    total = 0
+    started = time.perf_counter()
+    for batch in _batched(rows):
+        conn.executemany(sql, batch)
+        total += len(batch)
+        if progress and total % (_BATCH * 20) == 0:
+            print(f"  {label}: {total:,} rows ({total / (time.perf_counter() - started):,.0f}/s)", flush=True)
+    return total
+
+
+def generate(
+    db_path: Path,
+    students: int = 50_000,
+    classes: int = 500,
+    rows: int = 10_000_000,
+    days: int = 120,
+    attendance_rate: float = 0.85,
+    dns_rows: Optional[int] = None,
+    seed: int = 1,
+    progress: bool = False,
+) -> Dict[str, Any]:
+    """Create ``db_path`` (replacing it) and return the row counts and timings."""
+    db_path = Path(db_path)
+    for suffix in ("", "-journal", "-wal", "-shm"):
+        Path(f"{db_path}{suffix}").unlink(missing_ok=True)
+    started = time.perf_counter()
+    local_db.initialize_database(db_path)
+    term = Term(students, classes, rows, days, attendance_rate, TERM_START, seed)
+    rng = random.Random(seed)
+    now = time.time()
+    now_ms = int(now * 1000)
+    counts: Dict[str, int] = {}
+
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute("PRAGMA cache_size = -262144")
+        index_sql = [
+            row[0]
+            for row in conn.execute("SELECT sql FROM sqlite_master WHERE type = 'index' AND name LIKE 'idx_%'")
+        ]
+        for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'idx_%'").fetchall():
+            conn.execute(f"DROP INDEX {name}")
+        conn.execute("BEGIN")
+
+        teacher_hash = generate_password_hash(TEACHER_PASSWORD)
+        created_iso = datetime.fromtimestamp(now, tz=timezone.utc).isoformat()
+        counts["teachers"] = _insert(
+            conn,
+            "INSERT INTO teachers (email, name, password_hash, class_id, department, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                (teacher_email(index), f"Teacher {index}", teacher_hash, class_id(index), DEPARTMENTS[index % len(DEPARTMENTS)], created_iso)
+                for index in range(term.classes)
+            ),
+            "teachers",
+            progress,
+        )
+        counts["timetable"] = _insert(
+            conn,
+            "INSERT INTO timetable (teacher_id, subject, day, start_time, end_time, credits, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                (index + 1, f"Course {index}", _WEEKDAYS[weekday], _SLOTS[index % len(_SLOTS)], "", 3, created_iso, created_iso)
+                for index in range(term.classes)
+                for weekday in term.meeting_days[index]
+            ),
+            "timetable",
+            progress,
+        )
+        counts["attendance_codes"] = _insert(
+            conn,
+            "INSERT INTO attendance_codes (id, code, subject, teacher_name, expiry_time, department, duration, generated_by, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                (
+                    class_id(index),
+                    f"{(index * 7919) % 900000 + 100000}",
+                    f"Course {index}",
+                    f"Teacher {index}",
+                    # Every tenth code is still open.
+                    now_ms + 3_600_000 if index % 10 == 0 else now_ms - 86_400_000,
+                    DEPARTMENTS[index % len(DEPARTMENTS)],
+                    60,
+                    index + 1,
+                    now_ms - 3_600_000,
+                )
+                for index in range(term.classes)
+            ),
+            "attendance codes",
+            progress,
+        )
+        counts["students"] = _insert(
+            conn,
+            "INSERT INTO students (id, name, email, department, batch, password, class_id) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                (
+                    student_id(index),
+                    f"Student {index}",
+                    f"{student_id(index)}@example.edu",
+                    DEPARTMENTS[index % len(DEPARTMENTS)],
+                    str(2021 + index % 4),
+                    STUDENT_PASSWORD,
+                    class_id(index * term.classes // term.students),
+                )
+                for index in range(term.students)
+            ),
+            "students",
+            progress,
+        )
+        counts["face_captures"] = _insert(
+            conn,
+            "INSERT INTO face_captures (student_id, image_path, detected_faces, created_at) VALUES (?, ?, ?, ?)",
+            ((student_id(index), f"data/faces/{student_id(index)}.jpg", 1, created_iso) for index in range(term.students)),
+            "face captures",
+            progress,
+        )
+        counts["attendance"] = _insert(
+            conn,
+            "INSERT INTO attendance (class_id, student_id, timestamp, marked_at, date, subject, code, manual_entry, "
+            "teacher_name, department, marked_via, email, name, device_fingerprint, face_capture_id) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            _attendance_rows(term),
+            "attendance",
+            progress,
+        )
+        dns_total = max(0, dns_rows if dns_rows is not None else min(term.students * 20, 2_000_000))
+        counts["dns_queries"] = _insert(
+            conn,
+            "INSERT INTO dns_queries (timestamp, client_ip, qname_hash, qtype, decision, latency_ms) VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                (
+                    now_ms - 86_400_000 + index * 86_400_000 // max(1, dns_total),
+                    f"192.168.{137 + rng.randrange(2)}.{rng.randrange(2, 255)}",
+                    rng.randrange(1, 5000),
+                    rng.choice((1, 1, 1, 28, 65)),
+                    rng.randrange(3),
+                    round(rng.uniform(0.05, 40.0), 3),
+                )
+                for index in range(dns_total)
+            ),
+            "dns queries",
+            progress,
+        )
+        sessions = min(term.students, 5_000)
+        counts["portal_sessions"] = _insert(
+            conn,
+            "INSERT INTO portal_sessions (id, data, expires_at) VALUES (?, ?, ?)",
+            ((f"session-{index:07d}", "{}", now + (3600 if index % 2 else -3600)) for index in range(sessions)),
+            "sessions",
+            progress,
+        )
+        outbox = min(term.students, 20_000)
+        counts["firebase_outbox"] = _insert(
+            conn,
+            "INSERT INTO firebase_outbox (path, payload, class_id, student_id, created_at, flushed_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                (
+                    f"attendance/{class_id(index % term.classes)}/{student_id(index % term.students)}",
+                    json.dumps({"studentId": student_id(index % term.students)}),
+                    class_id(index % term.classes),
+                    student_id(index % term.students),
+                    now - outbox + index,
+                    # All but the newest 100 were already sent.
+                    now - outbox + index + 1 if index < outbox - 100 else None,
+                )
+                for index in range(outbox)
+            ),
+            "outbox",
+            progress,
+        )
+        conn.execute("COMMIT")
+        index_started = time.perf_counter()
+        for sql in index_sql:
+            conn.execute(sql)
+        conn.execute("ANALYZE")
+        conn.execute("PRAGMA journal_mode = DELETE")
+        index_seconds = time.perf_counter() - index_started
+    finally:
+        conn.close()
+    local_db.initialize_database(db_path)
+    return {
+        "path": str(db_path),
+        "students": term.students,
+        "classes": term.classes,
+        "days": term.days,
+        "rosterSize": term.roster_size,
+        "rows": counts,
+        "indexSeconds": round(index_seconds, 2),
+        "seconds": round(time.perf_counter() - started, 2),
+        "bytes": db_path.stat().st_size,
+    }
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("db", type=Path, help="database to create (replaced if it exists)")
+    parser.add_argument("--students", type=int, default=50_000)
+    parser.add_argument("--classes", type=int, default=500)
+    parser.add_argument("--rows", type=int, default=10_000_000, help="approximate attendance rows over the term")
+    parser.add_argument("--days", type=int, default=120, help="term length in days")
+    parser.add_argument("--attendance-rate", type=float, default=0.85)
+    parser.add_argument("--dns-rows", type=int, help="DNS analytics rows (default: 20 per student, at most 2M)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    summary = generate(
+        args.db,
+        students=args.students,
+        classes=args.classes,
+        rows=args.rows,
+        days=args.days,
+        attendance_rate=args.attendance_rate,
+        dns_rows=args.dns_rows,
+        seed=args.seed,
+        progress=True,
+    )
+    print(json.dumps(summary, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
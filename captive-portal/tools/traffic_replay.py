@@ -0,0 +1,419 @@
+"""Replay a recorded lecture against a test portal.
+
+Run from ``captive-portal/``::
+
+    python -m tools.traffic_replay data/traffic
+    python -m tools.traffic_replay data/traffic --speed 4 --skip 600 --duration 900 --json runs/lecture.json
+    python -m tools.traffic_replay lecture.jsonl --workers 4 --compare runs/lecture.json
+    python -m tools.traffic_replay lecture.jsonl --url http://127.0.0.1:8080 --seed-db /tmp/test/portal.db
+
+Reads the ``traffic-*.jsonl`` files written by
+:class:`utils.traffic_recorder.TrafficRecorder` (files or directories), in
+time order. ``--skip`` and ``--duration`` select a window, in seconds from
+the first request. Each request is sent at its recorded offset divided by
+``--speed``. Clients are kept apart: each recorded client has its own
+cookies, User-Agent and keep-alive connections. A request waits for that
+client's earlier requests only if they had finished before it started in
+the recording. Requests that overlapped in the recording overlap again.
+
+By default a portal is started as in :mod:`tools.load_test`: ``serve.py``
+on a loopback port, with a temporary database, the dry-run firewall and
+simulated face detection unless ``--images`` is given. The database is
+seeded with what the trace needs. Every pseudonymised code is an open
+attendance code, every student and teacher exists, and all passwords
+are :data:`PASSWORD`. ``--url`` targets a running test instance instead,
+and ``--seed-db`` seeds its database first.
+
+Recorded secrets become :data:`PASSWORD`. Recorded images become the
+``--images`` files (or a placeholder JPEG), chosen by digest, so a
+repeated image is repeated in the replay. A ``faceCaptureId`` or teacher
+token is taken from the replayed response that returned it.
+
+Prints, per route, the recorded and replayed p50/p95 and how many
+statuses differ from the recording. It also prints the send lag: how late
+requests went out, which grows when the client side cannot keep up.
+``--json`` saves the report, and ``--compare`` prints the change from an
+earlier one.
+"""
+
+from __future__ import annotations
+
+import argparse
+import base64
+import gzip
+import http.client
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from http.cookies import SimpleCookie
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import urlencode, urlsplit
+
+from tools import load_test
+from utils import local_db
+
+PASSWORD = "replay-pass"
+STUDENT_FIELDS = ("studentId", "rollNumber", "rollNo", "roll_no")
+_RESPONSE_VALUES = {"captureId": "faceCaptureId", "token": "token"}
+
+
+def load_trace(paths: Sequence[Path], skip: float = 0.0, duration: Optional[float] = None) -> List[Dict[str, Any]]:
+    """Records from ``paths`` in time order, with ``offset`` seconds from the first kept one."""
+    files: List[Path] = []
+    for path in paths:
+        files.extend(sorted(path.glob("traffic-*.jsonl")) if path.is_dir() else [path])
+    records = []
+    for path in files:
+        with path.open(encoding="utf-8") as handle:
+            for line in handle:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+    records.sort(key=lambda record: record["ts"])
+    if not records:
+        return []
+    first = records[0]["ts"] + skip * 1000
+    last = first + duration * 1000 if duration is not None else float("inf")
+    kept = [record for record in records if first <= record["ts"] < last]
+    for record in kept:
+        record["offset"] = (record["ts"] - kept[0]["ts"]) / 1000
+    return kept
+
+
+def seed_database(db_path: Path, records: List[Dict[str, Any]]) -> Dict[str, int]:
+    """Create the codes, students and teachers named in ``records``."""
+    codes, students, teachers = set(), set(), set()
+    for record in records:
+        body = record.get("body")
+        if not isinstance(body, dict):
+            continue
+        if record["route"] == "/verify" and body.get("code"):
+            codes.add(str(body["code"]))
+        for field in STUDENT_FIELDS:
+            if isinstance(body.get(field), str):
+                students.add(body[field].lower())
+        if record["route"].startswith("/api/teachers/") and isinstance(body.get("email"), str):
+            teachers.add(body["email"].lower())
+    local_db.initialize_database(db_path)
+    expiry = int((time.time() + 24 * 3600) * 1000)
+    class_ids = [f"replay-{code}" for code in sorted(codes)] or ["replay-class"]
+    for code, class_id in zip(sorted(codes), class_ids):
+        local_db.save_attendance_code(
+            db_path,
+            class_id=class_id,
+            code=code,
+            subject="Replay",
+            teacher_name="Replay",
+            expiry_time=expiry,
+            department="CSE",
+            duration_minutes=24 * 60,
+        )
+    for number, student in enumerate(sorted(students)):
+        local_db.add_or_update_student(
+            db_path,
+            {
+                "studentId": student,
+                "name": student,
+                "email": f"{student}@anon.invalid",
+                "department": "CSE",
+                "batch": "2024",
+                "password": PASSWORD,
+                "classId": class_ids[number % len(class_ids)],
+            },
+        )
+    for number, email in enumerate(sorted(teachers)):
+        try:
+            local_db.create_teacher(
+                db_path,
+                {"email": email, "password": PASSWORD, "name": email, "classId": class_ids[number % len(class_ids)]},
+            )
+        except local_db.LocalDatabaseError:
+            continue
+    return {"codes": len(codes), "students": len(students), "teachers": len(teachers)}
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _percentile(ordered: List[float], fraction: float) -> float:
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+
+class Client:
+    """One recorded device: its cookies, User-Agent, connections and values from earlier responses."""
+
+    def __init__(self, name: str, host: str, port: int, timeout: float, images: List[bytes]) -> None:
+        self.name = name
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.images = images
+        self.user_agent = f"Mozilla/5.0 (Linux; Android 14; Replay-{name}) Mobile Safari/537.36"
+        self.cookies: Dict[str, str] = {}
+        self.values: Dict[str, Any] = {}
+        self._idle: List[http.client.HTTPConnection] = []
+        self._lock = threading.Lock()
+        # (recorded end, done event) of every request sent so far.
+        self.history: List[Tuple[float, threading.Event]] = []
+
+    def _materialise(self, key: str, value: Any) -> Any:
+        if isinstance(value, dict):
+            if "$image" in value:
+                image = self.images[int(value.get("digest") or "0", 16) % len(self.images)]
+                return "data:image/jpeg;base64," + base64.b64encode(image).decode("ascii")
+            return {name: self._materialise(name, item) for name, item in value.items()}
+        if isinstance(value, list):
+            return [self._materialise(key, item) for item in value]
+        if value == "$secret":
+            return PASSWORD
+        if key in self.values:
+            return self.values[key]
+        return value
+
+    def request(self, record: Dict[str, Any]) -> Tuple[int, float]:
+        path = record["path"]
+        if record.get("query"):
+            path += "?" + urlencode(record["query"])
+        headers = {"User-Agent": self.user_agent, "Accept-Encoding": "gzip"}
+        body: Optional[bytes] = None
+        if "body" in record:
+            body = json.dumps(self._materialise("", record["body"])).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        elif record.get("in"):
+            body = bytes(record["in"])
+            headers["Content-Type"] = "application/octet-stream"
+        with self._lock:
+            if self.cookies:
+                headers["Cookie"] = "; ".join(f"{name}={value}" for name, value in self.cookies.items())
+            if record.get("auth") and "token" in self.values:
+                headers["Authorization"] = f"Bearer {self.values['token']}"
+            conn = self._idle.pop() if self._idle else http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        started = time.perf_counter()
+        try:
+            conn.request(record["method"], path, body=body, headers=headers)
+            response = conn.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            raise
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._idle.append(conn)
+            for header in response.headers.get_all("Set-Cookie") or []:
+                for name, morsel in SimpleCookie(header).items():
+                    self.cookies[name] = morsel.value
+            if "json" in (response.headers.get("Content-Type") or ""):
+                if response.headers.get("Content-Encoding") == "gzip":
+                    data = gzip.decompress(data)
+                try:
+                    payload = json.loads(data)
+                except ValueError:
+                    payload = None
+                if isinstance(payload, dict):
+                    for source, target in _RESPONSE_VALUES.items():
+                        if payload.get(source) is not None:
+                            self.values[target] = payload[source]
+        return response.status, elapsed
+
+    def close(self) -> None:
+        with self._lock:
+            for conn in self._idle:
+                conn.close()
+            self._idle.clear()
+
+
+def replay(
+    records: List[Dict[str, Any]], host: str, port: int, speed: float, images: List[bytes], timeout: float, max_in_flight: int
+) -> Dict[str, Any]:
+    clients: Dict[str, Client] = {}
+    lock = threading.Lock()
+    recorded: Dict[str, List[float]] = defaultdict(list)
+    replayed: Dict[str, List[float]] = defaultdict(list)
+    mismatches: Dict[str, Counter] = defaultdict(Counter)
+    lags: List[float] = []
+
+    def send(record: Dict[str, Any], client: Client, waits: List[threading.Event], done: threading.Event, due: float) -> None:
+        try:
+            for event in waits:
+                event.wait()
+            lag = time.perf_counter() - due
+            key = f"{record['method']} {record['route']}"
+            try:
+                status, elapsed = client.request(record)
+            except (OSError, http.client.HTTPException) as exc:
+                status, elapsed = type(exc).__name__, None
+            with lock:
+                lags.append(max(0.0, lag))
+                recorded[key].append(record["ms"] / 1000)
+                if elapsed is not None:
+                    replayed[key].append(elapsed)
+                if status != record["status"]:
+                    mismatches[key][f"{record['status']} -> {status}"] += 1
+        finally:
+            done.set()
+
+    with ThreadPoolExecutor(max_workers=max(1, max_in_flight)) as pool:
+        started = time.perf_counter()
+        for record in records:
+            client = clients.get(record["client"])
+            if client is None:
+                client = clients[record["client"]] = Client(record["client"], host, port, timeout, images)
+            begin = record["offset"]
+            waits = [event for end, event in client.history if end <= begin]
+            done = threading.Event()
+            client.history.append((begin + record["ms"] / 1000, done))
+            due = started + begin / speed
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(send, record, client, waits, done, due)
+    seconds = time.perf_counter() - started
+    for client in clients.values():
+        client.close()
+
+    routes = {}
+    for key in sorted(recorded, key=lambda item: -len(recorded[item])):
+        routes[key] = {
+            "requests": len(recorded[key]),
+            "recorded": load_test.summarise(recorded[key], Counter(), 0),
+            "replayed": load_test.summarise(replayed[key], Counter(), seconds),
+            "statusMismatches": dict(mismatches[key].most_common(5)),
+        }
+    ordered_lags = sorted(lags)
+    return {
+        "seconds": round(seconds, 3),
+        "requests": len(records),
+        "clients": len(clients),
+        "requestsPerSecond": round(len(records) / seconds, 1) if seconds else 0.0,
+        "lag": {
+            "p50Ms": round(_percentile(ordered_lags, 0.50) * 1000, 2),
+            "p95Ms": round(_percentile(ordered_lags, 0.95) * 1000, 2),
+            "maxMs": round(ordered_lags[-1] * 1000, 2) if ordered_lags else 0.0,
+        },
+        "routes": routes,
+    }
+
+
+def format_report(report: Dict[str, Any], previous: Optional[Dict[str, Any]] = None) -> str:
+    result = report["result"]
+    settings = report["settings"]
+    lines = [
+        f"{result['requests']} requests from {result['clients']} clients over {settings['recordedSeconds']:.1f} s "
+        f"recorded, replayed at {settings['speed']:g}x in {result['seconds']:.1f} s ({result['requestsPerSecond']} requests/s)",
+        f"send lag p50 {result['lag']['p50Ms']} ms, p95 {result['lag']['p95Ms']} ms, max {result['lag']['maxMs']} ms",
+        "",
+        f"{'route':<40}{'n':>6}{'rec p50':>10}{'rec p95':>10}{'p50 ms':>10}{'p95 ms':>10}{'status':>8}",
+    ]
+    for key, row in result["routes"].items():
+        line = (
+            f"{key[:39]:<40}{row['requests']:>6}{row['recorded']['p50Ms']:>10.1f}{row['recorded']['p95Ms']:>10.1f}"
+            f"{row['replayed']['p50Ms']:>10.1f}{row['replayed']['p95Ms']:>10.1f}{sum(row['statusMismatches'].values()):>8}"
+        )
+        if previous:
+            before = previous["result"]["routes"].get(key, {}).get("replayed", {}).get("p95Ms")
+            if before:
+                line += f"   p95 {row['replayed']['p95Ms'] - before:+.1f} ms ({(row['replayed']['p95Ms'] / before - 1) * 100:+.0f}%)"
+        lines.append(line)
+    for key, row in result["routes"].items():
+        for change, count in row["statusMismatches"].items():
+            lines.append(f"  {key}: {count} x {change}")
+    return "\n".join(lines)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("trace", type=Path, nargs="+", help="traffic-*.jsonl files or directories holding them")
+    parser.add_argument("--speed", type=float, default=1.0, help="2 replays twice as fast as recorded")
+    parser.add_argument("--skip", type=float, default=0.0, help="seconds of the recording to skip")
+    parser.add_argument("--duration", type=float, help="seconds of the recording to replay")
+    parser.add_argument("--url", help="running test portal (http://host:port); default starts one")
+    parser.add_argument("--seed-db", type=Path, help="with --url: seed this database first")
+    parser.add_argument("--workers", type=int, default=1, help="serve.py worker processes")
+    parser.add_argument("--threads", type=int, default=32, help="serve.py threads per worker")
+    parser.add_argument("--images", type=Path, help="folder of face JPEGs; enables real OpenCV detection")
+    parser.add_argument("--face-cost-ms", type=float, default=0.0, help="simulated detection time without --images")
+    parser.add_argument("--max-in-flight", type=int, default=1024, help="client threads")
+    parser.add_argument("--timeout", type=float, default=30.0, help="per-request socket timeout")
+    parser.add_argument("--json", type=Path, help="write the report here")
+    parser.add_argument("--compare", type=Path, help="earlier --json report to compare against")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary database, config and server log")
+    args = parser.parse_args(argv)
+    if args.speed <= 0:
+        parser.error("--speed must be positive")
+
+    records = load_trace(args.trace, args.skip, args.duration)
+    if not records:
+        print("No recorded requests in the selected window.", file=sys.stderr)
+        return 2
+    images = load_test.load_images(args.images)
+    previous = json.loads(args.compare.read_text(encoding="utf-8")) if args.compare else None
+
+    tmp: Optional[Path] = None
+    portal: Optional[load_test.Portal] = None
+    try:
+        if args.url:
+            target = urlsplit(args.url)
+            host, port = target.hostname or "127.0.0.1", target.port or 80
+            seeded = seed_database(args.seed_db, records) if args.seed_db else None
+        else:
+            tmp = Path(tempfile.mkdtemp(prefix="portal-replay-"))
+            host, port = "127.0.0.1", _free_port()
+            config = load_test.write_config(tmp, port)
+            seeded = seed_database(tmp / "portal.db", records)
+            simulated = args.images is None
+            portal = load_test.Portal(
+                config, port, args.workers, args.threads, args.face_cost_ms if simulated else None, tmp / "server.log"
+            )
+            portal.wait_ready()
+        result = replay(records, host, port, args.speed, images, args.timeout, args.max_in_flight)
+    except RuntimeError as exc:
+        print(exc, file=sys.stderr)
+        return 2
+    finally:
+        if portal is not None:
+            portal.stop()
+        if tmp is not None and not args.keep:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    report = {
+        "startedAt": datetime.now(tz=timezone.utc).isoformat(timespec="seconds"),
+        "settings": {
+            "trace": [str(path) for path in args.trace],
+            "recordedSeconds": round(records[-1]["offset"], 3),
+            "speed": args.speed,
+            "skip": args.skip,
+            "duration": args.duration,
+            "target": args.url or f"serve.py, {args.workers} worker(s) x {args.threads} thread(s)",
+            "faceDetection": f"simulated ({args.face_cost_ms:g} ms)"
+            if args.images is None
+            else f"opencv ({len(images)} images)",
+            "seeded": seeded,
+            "python": sys.version.split()[0],
+            "cpus": os.cpu_count(),
+        },
+        "result": result,
+    }
+    print(format_report(report, previous))
+    if tmp is not None and args.keep:
+        print(f"\nDatabase, config and server log kept in {tmp}")
+    if args.json:
+        args.json.parent.mkdir(parents=True, exist_ok=True)
+        args.json.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
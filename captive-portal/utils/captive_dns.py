@@ -2,19 +2,32 @@
 
 from __future__ import annotations
 
+import asyncio
 import ipaddress
 import logging
+import multiprocessing
+import os
+import queue
+import secrets
 import socket
 import socketserver
+import struct
 import threading
+import time
+from collections import OrderedDict, deque
 from dataclasses import dataclass
-from typing import Optional, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, Sequence, Union
 
 from dnslib import AAAA, A, DNSRecord, DNSError, QTYPE, RCODE, RR
 
+from . import dns_analytics
+
 LOGGER = logging.getLogger("captive_dns")
 LOGGER.addHandler(logging.NullHandler())
 
+SERVER_MODES = ("threading", "asyncio")
+
 
 class CaptiveDNSError(RuntimeError):
     """Raised when the redirector cannot be started."""
@@ -31,8 +44,543 @@ def _normalise_domains(domains: Sequence[str] | None) -> set[str]:
     return cleaned
 
 
-def _domain_matches(domain: str, patterns: set[str]) -> bool:
-    return any(domain == pattern or domain.endswith(f".{pattern}") for pattern in patterns)
+def _domain_suffixes(domain: str):
+    """Yield ``domain`` and each parent domain, longest first."""
+    while domain:
+        yield domain
+        dot = domain.find(".")
+        if dot < 0:
+            return
+        domain = domain[dot + 1:]
+
+
+_RULE_BYPASS = 1
+_RULE_FORCE_PORTAL = 2
+
+
+def _compile_domain_rules(bypass: set[str], force_portal: set[str]) -> dict[str, int]:
+    """Map every configured suffix to its rule; force-portal wins ties."""
+    rules = {domain: _RULE_BYPASS for domain in bypass}
+    rules.update((domain, _RULE_FORCE_PORTAL) for domain in force_portal)
+    return rules
+
+
+_HEADER = struct.Struct("!HHHHHH")
+_QTAIL = struct.Struct("!HH")
+_FLAG_QR = 0x8000
+_FLAG_OPCODE = 0x7800
+_FLAG_RD = 0x0100
+_QCLASS_IN = 1
+
+
+def _parse_simple_query(raw_query: bytes) -> Optional[tuple[str, int, int]]:
+    """Return ``(qname, qtype, question_end)`` for a plain single-question query.
+
+    Anything unusual (responses, other opcodes, multiple questions, compressed
+    or non-ASCII names) returns ``None`` so the caller falls back to dnslib.
+    """
+    if len(raw_query) < _HEADER.size + 5:
+        return None
+    _, flags, qdcount, ancount, nscount, _ = _HEADER.unpack_from(raw_query)
+    if flags & (_FLAG_QR | _FLAG_OPCODE) or qdcount != 1 or ancount or nscount:
+        return None
+
+    labels: list[str] = []
+    offset = _HEADER.size
+    end = len(raw_query)
+    while True:
+        if offset >= end:
+            return None
+        length = raw_query[offset]
+        offset += 1
+        if length == 0:
+            break
+        if length > 63 or offset + length > end:
+            return None
+        label = raw_query[offset:offset + length]
+        if b"." in label:
+            return None
+        try:
+            labels.append(label.decode("ascii").lower())
+        except UnicodeDecodeError:
+            return None
+        offset += length
+
+    if offset + _QTAIL.size > end:
+        return None
+    qtype, qclass = _QTAIL.unpack_from(raw_query, offset)
+    if qclass != _QCLASS_IN:
+        return None
+    return ".".join(labels), qtype, offset + _QTAIL.size
+
+
+_RR_FIXED = struct.Struct("!HHIH")
+_TTL = struct.Struct("!I")
+_RCODE_MASK = 0x000F
+_FLAG_TC = 0x0200
+_CACHEABLE_RCODES = (RCODE.NOERROR, RCODE.NXDOMAIN)
+
+
+def _skip_name(packet: bytes, offset: int) -> int:
+    end = len(packet)
+    while True:
+        if offset >= end:
+            raise ValueError("truncated name")
+        length = packet[offset]
+        if length & 0xC0 == 0xC0:
+            return offset + 2
+        if length & 0xC0:
+            raise ValueError("unsupported label type")
+        offset += 1 + length
+        if length == 0:
+            return offset
+
+
+def _ttl_offsets(response: bytes, question_end: int) -> list[int]:
+    """Return the byte offsets of every TTL field after the question."""
+    _, _, _, ancount, nscount, arcount = _HEADER.unpack_from(response)
+    offsets: list[int] = []
+    offset = question_end
+    for _ in range(ancount + nscount + arcount):
+        offset = _skip_name(response, offset)
+        if offset + _RR_FIXED.size > len(response):
+            raise ValueError("truncated record")
+        rtype, _, _, rdlength = _RR_FIXED.unpack_from(response, offset)
+        if rtype != QTYPE.OPT:  # the OPT "TTL" carries EDNS flags
+            offsets.append(offset + 4)
+        offset += _RR_FIXED.size + rdlength
+    if offset > len(response):
+        raise ValueError("truncated rdata")
+    return offsets
+
+
+def _parse_upstream(server: str) -> Optional[tuple[str, int]]:
+    """``(ip, port)`` for an ``upstream_servers`` entry, or ``None`` (logged) if it cannot be used."""
+    host, _, port = str(server).strip().rpartition(":")
+    if not host or not port.isdigit():
+        host, port = str(server).strip(), "53"
+    if not 0 < int(port) < 65536:
+        LOGGER.warning("Skipping upstream DNS server %r: invalid port", server)
+        return None
+    try:
+        return socket.gethostbyname(host), int(port)
+    except (OSError, UnicodeError) as exc:
+        LOGGER.warning("Skipping upstream DNS server %r: %s", server, exc)
+        return None
+
+
+class _Upstream:
+    __slots__ = ("address", "srtt", "failures", "down_until")
+
+    def __init__(self, address: tuple[str, int]) -> None:
+        self.address = address
+        self.srtt = 0.05
+        self.failures = 0
+        self.down_until = 0.0
+
+
+class _UpstreamSocket:
+    __slots__ = ("sock", "sent", "closed", "retire_at", "thread")
+
+    def __init__(self, sock: socket.socket) -> None:
+        self.sock = sock
+        self.sent = 0
+        self.closed = False
+        self.retire_at = 0.0
+        self.thread: Optional[threading.Thread] = None
+
+
+class _PendingQuery:
+    __slots__ = ("question", "source", "sent", "answered", "event", "response")
+
+    def __init__(self, question: Optional[bytes], source: _UpstreamSocket) -> None:
+        self.question = question
+        self.source = source
+        self.sent: dict[tuple[str, int], float] = {}
+        self.answered: set[tuple[str, int]] = set()
+        self.event = threading.Event()
+        self.response: Optional[bytes] = None
+
+
+class _CachedAnswer:
+    __slots__ = ("stored_at", "expires_at", "template", "ttl_offsets")
+
+    def __init__(self, stored_at: float, expires_at: float, template: bytes, ttl_offsets: list[int]) -> None:
+        self.stored_at = stored_at
+        self.expires_at = expires_at
+        self.template = template
+        self.ttl_offsets = ttl_offsets
+
+
+class UpstreamForwarder:
+    """Forwards bypassed queries over a small pool of UDP sockets.
+
+    Each query goes out on a randomly chosen socket of the pool with a
+    transaction ID from :mod:`secrets`. The socket's receiver thread hands
+    the reply back to the waiting caller, and only accepts it from the
+    queried upstream, on that socket, for the same question. A socket is
+    replaced by one on a new kernel-chosen port after ``rotate_after``
+    queries, so a spoofed reply has to guess the port as well as the ID.
+
+    The upstream with the lowest smoothed RTT is tried first; if it has not
+    answered within ``race_delay`` the next one is queried as well and the
+    first reply wins. Upstreams that keep timing out are parked for
+    ``down_seconds``. Answers are cached per ``(qname, qtype)`` until their
+    smallest TTL runs out.
+    """
+
+    def __init__(
+        self,
+        servers: Sequence[str],
+        *,
+        timeout: float = 1.0,
+        race_delay: float = 0.15,
+        cache_size: int = 2048,
+        max_ttl: int = 300,
+        failure_threshold: int = 3,
+        down_seconds: float = 30.0,
+        sockets: int = 4,
+        rotate_after: int = 256,
+    ) -> None:
+        addresses = [_parse_upstream(server) for server in servers if server]
+        self._upstreams = [_Upstream(address) for address in addresses if address is not None]
+        if not self._upstreams:
+            raise CaptiveDNSError("At least one usable upstream DNS server is required")
+        self.timeout = float(timeout)
+        self.race_delay = float(race_delay)
+        self.cache_size = max(0, int(cache_size))
+        self.max_ttl = int(max_ttl)
+        self.failure_threshold = int(failure_threshold)
+        self.down_seconds = float(down_seconds)
+        self._pending: dict[int, _PendingQuery] = {}
+        self._pending_lock = threading.Lock()
+        self._cache: OrderedDict[tuple[str, int, bool], _CachedAnswer] = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._closed = threading.Event()
+        self.rotate_after = max(1, int(rotate_after))
+        self._sockets_lock = threading.Lock()
+        self._sockets: list[_UpstreamSocket] = []
+        self._retiring: list[_UpstreamSocket] = []
+        try:
+            for _ in range(max(1, int(sockets))):
+                self._sockets.append(self._open_socket())
+        except OSError:
+            self.close()
+            raise
+
+    def close(self) -> None:
+        self._closed.set()
+        with self._sockets_lock:
+            entries = self._sockets + self._retiring
+            self._sockets, self._retiring = [], []
+        for entry in entries:
+            self._close_socket(entry)
+        for entry in entries:
+            if entry.thread is not None:
+                entry.thread.join(timeout=1)
+
+    def _open_socket(self) -> _UpstreamSocket:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.bind(("0.0.0.0", 0))
+            sock.settimeout(0.5)
+        except OSError:
+            sock.close()
+            raise
+        entry = _UpstreamSocket(sock)
+        entry.thread = threading.Thread(target=self._receive_loop, args=(entry,), name="CaptiveDNSUpstream", daemon=True)
+        entry.thread.start()
+        return entry
+
+    @staticmethod
+    def _close_socket(entry: _UpstreamSocket) -> None:
+        entry.closed = True
+        entry.sock.close()
+
+    def _checkout_socket(self) -> _UpstreamSocket:
+        """A random pool socket for one query, rotating it out once it has carried ``rotate_after``."""
+        now = time.monotonic()
+        with self._sockets_lock:
+            while self._retiring and self._retiring[0].retire_at <= now:
+                self._close_socket(self._retiring.pop(0))
+            index = secrets.randbelow(len(self._sockets))
+            entry = self._sockets[index]
+            entry.sent += 1
+            if entry.sent >= self.rotate_after:
+                try:
+                    self._sockets[index] = self._open_socket()
+                except OSError as exc:
+                    LOGGER.warning("Unable to rotate upstream DNS socket: %s", exc)
+                    entry.sent = 0
+                else:
+                    # Still open until queries in flight on it have had their chance to be answered.
+                    entry.retire_at = now + self.timeout + 1.0
+                    self._retiring.append(entry)
+            return entry
+
+    def health(self) -> list[dict[str, object]]:
+        now = time.monotonic()
+        return [
+            {
+                "address": f"{upstream.address[0]}:{upstream.address[1]}",
+                "srttMs": round(upstream.srtt * 1000, 2),
+                "failures": upstream.failures,
+                "healthy": upstream.down_until <= now,
+            }
+            for upstream in self._upstreams
+        ]
+
+    def lookup(self, raw_query: bytes) -> Optional[bytes]:
+        """Return a cached answer for ``raw_query`` without touching the network."""
+        simple = _parse_simple_query(raw_query)
+        if simple is None or not self.cache_size:
+            return None
+        return self._cached_answer(raw_query, simple)
+
+    def forward(self, raw_query: bytes) -> Optional[bytes]:
+        simple = _parse_simple_query(raw_query)
+        if simple is not None and self.cache_size:
+            cached = self._cached_answer(raw_query, simple)
+            if cached is not None:
+                return cached
+
+        question = raw_query[_HEADER.size:simple[2]].lower() if simple else None
+        source = self._checkout_socket()
+        pending = _PendingQuery(question, source)
+        with self._pending_lock:
+            query_id = secrets.randbits(16)
+            while query_id in self._pending:
+                query_id = secrets.randbits(16)
+            self._pending[query_id] = pending
+        outgoing = query_id.to_bytes(2, "big") + raw_query[2:]
+
+        started = time.monotonic()
+        deadline = started + self.timeout
+        try:
+            ordered = self._ordered_upstreams(started)
+            for index, upstream in enumerate(ordered):
+                now = time.monotonic()
+                if now >= deadline:
+                    break
+                pending.sent[upstream.address] = now
+                try:
+                    source.sock.sendto(outgoing, upstream.address)
+                except OSError:
+                    self._record_failure(upstream)
+                    continue
+                last = index == len(ordered) - 1
+                wait = deadline - now if last else min(self.race_delay, deadline - now)
+                if pending.event.wait(wait):
+                    break
+            else:
+                pending.event.wait(max(0.0, deadline - time.monotonic()))
+        finally:
+            with self._pending_lock:
+                self._pending.pop(query_id, None)
+
+        by_address = {upstream.address: upstream for upstream in self._upstreams}
+        if pending.response is None:
+            for address in pending.sent:
+                self._record_failure(by_address[address])
+            return None
+        finished = time.monotonic()
+        for address, sent_at in pending.sent.items():
+            if address not in pending.answered:
+                # Lost the race: count the time waited so far as an RTT sample.
+                upstream = by_address[address]
+                upstream.srtt = 0.7 * upstream.srtt + 0.3 * (finished - sent_at)
+
+        response = raw_query[:2] + pending.response[2:]
+        if simple is not None and self.cache_size:
+            self._store_answer(simple, response, bool(_HEADER.unpack_from(raw_query)[5]))
+        return response
+
+    def _ordered_upstreams(self, now: float) -> list[_Upstream]:
+        healthy = sorted((u for u in self._upstreams if u.down_until <= now), key=lambda u: u.srtt)
+        parked = sorted((u for u in self._upstreams if u.down_until > now), key=lambda u: u.down_until)
+        return healthy + parked
+
+    def _record_failure(self, upstream: _Upstream) -> None:
+        upstream.failures += 1
+        if upstream.failures >= self.failure_threshold:
+            upstream.down_until = time.monotonic() + self.down_seconds
+            LOGGER.warning("Upstream DNS %s:%s marked down", *upstream.address)
+
+    def _receive_loop(self, source: _UpstreamSocket) -> None:
+        by_address = {upstream.address: upstream for upstream in self._upstreams}
+        while not source.closed:
+            try:
+                data, address = source.sock.recvfrom(4096)
+            except socket.timeout:
+                continue
+            except OSError:
+                if source.closed:
+                    return
+                continue
+            if len(data) < _HEADER.size:
+                continue
+            with self._pending_lock:
+                pending = self._pending.get(int.from_bytes(data[:2], "big"))
+            if pending is None or pending.source is not source or address not in pending.sent:
+                continue
+            if pending.question is not None:
+                if data[_HEADER.size:_HEADER.size + len(pending.question)].lower() != pending.question:
+                    continue
+            upstream = by_address[address]
+            pending.answered.add(address)
+            sample = time.monotonic() - pending.sent[address]
+            upstream.srtt = 0.7 * upstream.srtt + 0.3 * sample
+            upstream.failures = 0
+            upstream.down_until = 0.0
+            if pending.response is None:
+                pending.response = data
+                pending.event.set()
+
+    def _cached_answer(self, raw_query: bytes, simple: tuple[str, int, int]) -> Optional[bytes]:
+        qname, qtype_id, question_end = simple
+        key = (qname, qtype_id, bool(_HEADER.unpack_from(raw_query)[5]))
+        now = time.monotonic()
+        with self._cache_lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            if entry.expires_at <= now:
+                del self._cache[key]
+                return None
+            self._cache.move_to_end(key)
+        elapsed = int(now - entry.stored_at)
+        packet = bytearray(entry.template)
+        packet[0:2] = raw_query[0:2]
+        flags = (_HEADER.unpack_from(packet)[1] & ~_FLAG_RD) | (_HEADER.unpack_from(raw_query)[1] & _FLAG_RD)
+        packet[2:4] = flags.to_bytes(2, "big")
+        packet[_HEADER.size:question_end] = raw_query[_HEADER.size:question_end]
+        for offset in entry.ttl_offsets:
+            (ttl,) = _TTL.unpack_from(packet, offset)
+            _TTL.pack_into(packet, offset, max(0, ttl - elapsed))
+        return bytes(packet)
+
+    def _store_answer(self, simple: tuple[str, int, int], response: bytes, has_additional: bool) -> None:
+        qname, qtype_id, question_end = simple
+        flags = _HEADER.unpack_from(response)[1]
+        if flags & _FLAG_TC or (flags & _RCODE_MASK) not in _CACHEABLE_RCODES:
+            return
+        try:
+            offsets = _ttl_offsets(response, question_end)
+        except (ValueError, struct.error):
+            return
+        if not offsets:
+            return
+        ttl = min(min(_TTL.unpack_from(response, offset)[0] for offset in offsets), self.max_ttl)
+        if ttl <= 0:
+            return
+        now = time.monotonic()
+        key = (qname, qtype_id, has_additional)
+        with self._cache_lock:
+            self._cache[key] = _CachedAnswer(now, now + ttl, response, offsets)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+
+def _http_grant(grant_url: str) -> Callable[[str], object]:
+    def grant(client_ip: str) -> object:
+        import requests
+
+        response = requests.post(grant_url, json={"ipAddress": client_ip, "studentId": None}, timeout=5.0)
+        response.raise_for_status()
+        return response.json().get("success", True)
+
+    return grant
+
+
+class AutoGrantQueue:
+    """Runs auto-grants on a background thread, once per client per ``seen_ttl``.
+
+    ``submit`` is O(1) and never blocks: a client IP is recorded in a bounded,
+    time-expiring seen table before it is queued, so repeat queries from the
+    same device are dropped instead of queued again. A failed grant is
+    retried by the first query after ``retry_after`` seconds.
+    """
+
+    def __init__(
+        self,
+        grant: Callable[[str], object],
+        *,
+        seen_ttl: float = 3600.0,
+        max_seen: int = 10000,
+        max_pending: int = 1024,
+        retry_after: float = 30.0,
+    ) -> None:
+        self._grant = grant
+        self.seen_ttl = float(seen_ttl)
+        self.retry_after = float(retry_after)
+        self.max_seen = max(1, int(max_seen))
+        self._seen: OrderedDict[str, float] = OrderedDict()
+        self._lock = threading.Lock()
+        self._pending: queue.Queue[Optional[str]] = queue.Queue(maxsize=max(1, int(max_pending)))
+        self.granted = 0
+        self.failed = 0
+        self.dropped = 0
+        self._worker = threading.Thread(target=self._run, name="CaptiveDNSAutoGrant", daemon=True)
+        self._worker.start()
+
+    def submit(self, client_ip: str) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            expires_at = self._seen.get(client_ip)
+            if expires_at is not None and expires_at > now:
+                return False
+            self._seen[client_ip] = now + self.seen_ttl
+            self._seen.move_to_end(client_ip)
+            # Entries share one TTL, so the oldest insertions expire first.
+            while self._seen:
+                _, oldest_expiry = next(iter(self._seen.items()))
+                if len(self._seen) <= self.max_seen and oldest_expiry > now:
+                    break
+                self._seen.popitem(last=False)
+        try:
+            self._pending.put_nowait(client_ip)
+        except queue.Full:
+            self._forget(client_ip)
+            self.dropped += 1
+            return False
+        return True
+
+    def depth(self) -> int:
+        return self._pending.qsize()
+
+    def close(self) -> None:
+        try:
+            self._pending.put_nowait(None)
+        except queue.Full:
+            pass
+        self._worker.join(timeout=2)
+
+    def _forget(self, client_ip: str) -> None:
+        with self._lock:
+            self._seen.pop(client_ip, None)
+
+    def _retry_later(self, client_ip: str) -> None:
+        with self._lock:
+            if client_ip in self._seen:
+                self._seen[client_ip] = time.monotonic() + self.retry_after
+
+    def _run(self) -> None:
+        while True:
+            client_ip = self._pending.get()
+            if client_ip is None:
+                return
+            try:
+                result = self._grant(client_ip)
+            except Exception:
+                LOGGER.exception("Auto-grant failed for %s", client_ip)
+                result = False
+            if result is False:
+                self.failed += 1
+                self._retry_later(client_ip)
+            else:
+                self.granted += 1
+                LOGGER.info("Auto-grant applied for %s", client_ip)
 
 
 class DNSRedirectResolver:
@@ -49,72 +597,216 @@ class DNSRedirectResolver:
         ttl: int = 5,
         auto_grant: bool = False,
         grant_url: Optional[str] = None,
+        grant_callback: Optional[Callable[[str], object]] = None,
+        response_cache_size: int = 4096,
+        upstream_timeout: float = 1.0,
+        upstream_cache_size: int = 2048,
+        analytics_sink: Optional[Callable[[Sequence[dns_analytics.QueryEvent]], None]] = None,
+        analytics_ring_size: int = 8192,
+        analytics_flush_interval: float = 5.0,
+        analytics_purge: Optional[Callable[[int], object]] = None,
+        analytics_retention: float = 24 * 3600,
     ) -> None:
         ip_obj = ipaddress.ip_address(portal_ip)
         if ip_obj.version != 4:
             raise CaptiveDNSError("portal_ip must be an IPv4 address")
 
         self.portal_ip = str(ip_obj)
-        self.portal_ipv6 = f"::ffff:{ip_obj}"
+        # dnslib cannot parse the dotted-quad form of a v4-mapped address.
+        self.portal_ipv6 = tuple(ipaddress.IPv6Address(f"::ffff:{ip_obj}").packed)
         self.ttl = ttl
         self.log_queries = log_queries
-        self.bypass_domains = _normalise_domains(bypass_domains)
-        self.force_portal_domains = _normalise_domains(force_portal_domains)
+        self.bypass_domains = frozenset(_normalise_domains(bypass_domains))
+        self.force_portal_domains = frozenset(_normalise_domains(force_portal_domains))
+        self._domain_rules = _compile_domain_rules(self.bypass_domains, self.force_portal_domains)
         self.upstream_servers = tuple(server for server in (upstream_servers or []) if server)
+        self.forwarder: Optional[UpstreamForwarder] = None
+        if self.upstream_servers and self.bypass_domains:
+            try:
+                self.forwarder = UpstreamForwarder(
+                    self.upstream_servers, timeout=upstream_timeout, cache_size=upstream_cache_size
+                )
+            except OSError as exc:
+                raise CaptiveDNSError(f"Unable to open upstream DNS socket: {exc}") from exc
+            except CaptiveDNSError as exc:
+                # Bypassed domains are then redirected like the rest.
+                LOGGER.warning("Upstream forwarding disabled: %s", exc)
         self.auto_grant = bool(auto_grant)
         self.grant_url = str(grant_url) if grant_url else None
-        self._seen_clients: set[str] = set()
+        self.auto_grant_queue: Optional[AutoGrantQueue] = None
+        if self.auto_grant and (grant_callback or self.grant_url):
+            self.auto_grant_queue = AutoGrantQueue(grant_callback or _http_grant(self.grant_url))
+        self.queries = 0
+        self.response_cache_size = max(0, int(response_cache_size))
+        self._response_cache: OrderedDict[tuple[str, int], bytes] = OrderedDict()
+        self._response_cache_lock = threading.Lock()
+        self.analytics: Optional[dns_analytics.QueryAnalytics] = None
+        if analytics_sink is not None:
+            self.analytics = dns_analytics.QueryAnalytics(
+                analytics_sink,
+                ring_size=analytics_ring_size,
+                flush_interval=analytics_flush_interval,
+                purge=analytics_purge,
+                retention_seconds=analytics_retention,
+            )
 
-    def handle_packet(self, raw_query: bytes, client_address: tuple[str, int]) -> Optional[bytes]:
-        try:
-            request = DNSRecord.parse(raw_query)
-        except DNSError as exc:
-            if self.log_queries:
-                LOGGER.warning("Invalid DNS frame from %s: %s", client_address[0], exc)
-            return None
+    def close(self) -> None:
+        if self.forwarder is not None:
+            self.forwarder.close()
+        if self.auto_grant_queue is not None:
+            self.auto_grant_queue.close()
+        if self.analytics is not None:
+            self.analytics.close()
+
+    def handle_packet(
+        self,
+        raw_query: bytes,
+        client_address: tuple[str, int],
+        defer_upstream: Optional[Callable[[Callable[[], Optional[bytes]]], None]] = None,
+    ) -> Optional[bytes]:
+        """Answer ``raw_query``.
+
+        When ``defer_upstream`` is given, bypassed queries that miss the
+        forwarder cache are handed to it as a job instead of blocking the
+        caller; the job returns the answer and ``None`` is returned here.
+        """
+        self.queries += 1
+        started = time.perf_counter()
+        request: Optional[DNSRecord] = None
+        simple = _parse_simple_query(raw_query)
+        if simple is not None:
+            qname, qtype_id, question_end = simple
+        else:
+            try:
+                request = DNSRecord.parse(raw_query)
+            except DNSError as exc:
+                if self.log_queries:
+                    LOGGER.warning("Invalid DNS frame from %s: %s", client_address[0], exc)
+                return None
+            qname = str(request.q.qname).rstrip(".").lower()
+            qtype_id = request.q.qtype
+            question_end = 0
 
-        qname = str(request.q.qname).rstrip(".").lower()
-        qtype_id = request.q.qtype
         if self.log_queries:
             LOGGER.debug("DNS query %s (%s) from %s", qname, QTYPE.get(qtype_id, qtype_id), client_address[0])
 
-        # attempt an auto-grant for new clients if configured
+        # queue an auto-grant for new clients; the answer never waits on it
+        if self.auto_grant_queue is not None:
+            self.auto_grant_queue.submit(client_address[0])
+
         client_ip = client_address[0]
-        if self.auto_grant and self.grant_url and client_ip not in self._seen_clients:
-            # mark seen immediately to avoid duplicate posts
-            self._seen_clients.add(client_ip)
-            try:
-                import requests
+        if self.forwarder is not None and self._should_bypass(qname):
+            cached = self.forwarder.lookup(raw_query)
+            if cached is not None:
+                response, decision = cached, dns_analytics.DECISION_FORWARD_CACHED
+            elif defer_upstream is None:
+                response, decision = self._forward_or_redirect(raw_query, request, qname, qtype_id, question_end)
+            else:
+                def job() -> Optional[bytes]:
+                    answer, outcome = self._forward_or_redirect(raw_query, request, qname, qtype_id, question_end)
+                    self._record(client_ip, qname, qtype_id, outcome, started)
+                    return answer
 
-                requests.post(self.grant_url, json={"ipAddress": client_ip, "studentId": None}, timeout=1.0)
-                LOGGER.info("Auto-grant requested for %s", client_ip)
-            except Exception:
-                LOGGER.exception("Auto-grant request failed for %s", client_ip)
+                defer_upstream(job)
+                return None
+        else:
+            response, decision = self._redirect(raw_query, request, qname, qtype_id, question_end)
 
-        if self._should_bypass(qname) and self.upstream_servers:
-            forwarded = self._forward_upstream(raw_query)
-            if forwarded:
-                return forwarded
+        self._record(client_ip, qname, qtype_id, decision, started)
+        return response
 
-        response = self._redirect_response(request, qtype_id)
-        return response.pack()
+    def _record(self, client_ip: str, qname: str, qtype_id: int, decision: int, started: float) -> None:
+        if self.analytics is not None:
+            self.analytics.record(client_ip, qname, qtype_id, decision, started)
 
-    def _should_bypass(self, qname: str) -> bool:
-        if _domain_matches(qname, self.force_portal_domains):
-            return False
-        return bool(self.bypass_domains) and _domain_matches(qname, self.bypass_domains)
+    def _forward_or_redirect(
+        self,
+        raw_query: bytes,
+        request: Optional[DNSRecord],
+        qname: str,
+        qtype_id: int,
+        question_end: int,
+    ) -> tuple[Optional[bytes], int]:
+        assert self.forwarder is not None
+        forwarded = self.forwarder.forward(raw_query)
+        if forwarded:
+            return forwarded, dns_analytics.DECISION_FORWARD
+        response, _ = self._redirect(raw_query, request, qname, qtype_id, question_end)
+        return response, dns_analytics.DECISION_FORWARD_FAILED
 
-    def _forward_upstream(self, raw_query: bytes) -> Optional[bytes]:
-        for upstream in self.upstream_servers:
+    def _redirect(
+        self,
+        raw_query: bytes,
+        request: Optional[DNSRecord],
+        qname: str,
+        qtype_id: int,
+        question_end: int,
+    ) -> tuple[Optional[bytes], int]:
+        if question_end:
+            cached = self._cached_response(raw_query, qname, qtype_id, question_end)
+            if cached is not None:
+                return cached, dns_analytics.DECISION_REDIRECT_CACHED
+
+        if request is None:
             try:
-                with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as forwarder:
-                    forwarder.settimeout(1.0)
-                    forwarder.sendto(raw_query, (upstream, 53))
-                    response, _ = forwarder.recvfrom(4096)
-                    return response
-            except OSError:
-                continue
-        return None
+                request = DNSRecord.parse(raw_query)
+            except DNSError:
+                return None, dns_analytics.DECISION_REDIRECT
+        packed = self._redirect_response(request, qtype_id).pack()
+        if question_end:
+            self._store_response((qname, qtype_id), packed)
+        return packed, dns_analytics.DECISION_REDIRECT
+
+    def _cached_response(
+        self, raw_query: bytes, qname: str, qtype_id: int, question_end: int
+    ) -> Optional[bytes]:
+        if not self.response_cache_size:
+            return None
+        key = (qname, qtype_id)
+        with self._response_cache_lock:
+            template = self._response_cache.get(key)
+            if template is None:
+                return None
+            self._response_cache.move_to_end(key)
+        # Patch the transaction ID, the echoed RD bit and the question (whose
+        # letter case may differ from the cached one); answers use a
+        # compression pointer to the question so they are reused verbatim.
+        flags = (_HEADER.unpack_from(template)[1] & ~_FLAG_RD) | (
+            _HEADER.unpack_from(raw_query)[1] & _FLAG_RD
+        )
+        return b"".join(
+            (
+                raw_query[:2],
+                flags.to_bytes(2, "big"),
+                template[4:_HEADER.size],
+                raw_query[_HEADER.size:question_end],
+                template[question_end:],
+            )
+        )
+
+    def _store_response(self, key: tuple[str, int], packed: bytes) -> None:
+        if not self.response_cache_size:
+            return
+        with self._response_cache_lock:
+            self._response_cache[key] = packed
+            self._response_cache.move_to_end(key)
+            while len(self._response_cache) > self.response_cache_size:
+                self._response_cache.popitem(last=False)
+
+    def _should_bypass(self, qname: str) -> bool:
+        # One hashed lookup per label: a force-portal suffix anywhere in the
+        # name overrides a bypass suffix, matching the old two-pass semantics.
+        rules = self._domain_rules
+        if not rules:
+            return False
+        bypass = False
+        for suffix in _domain_suffixes(qname):
+            rule = rules.get(suffix)
+            if rule == _RULE_FORCE_PORTAL:
+                return False
+            if rule == _RULE_BYPASS:
+                bypass = True
+        return bypass
 
     def _redirect_response(self, request: DNSRecord, qtype_id: int) -> DNSRecord:
         response = request.reply()
@@ -143,8 +835,11 @@ class DNSRedirectResolver:
 class DNSRedirectServer(socketserver.ThreadingUDPServer):
     allow_reuse_address = True
 
-    def __init__(self, server_address: tuple[str, int], resolver: DNSRedirectResolver) -> None:
+    def __init__(
+        self, server_address: tuple[str, int], resolver: DNSRedirectResolver, reuse_port: bool = False
+    ) -> None:
         self.resolver = resolver
+        self.allow_reuse_port = reuse_port
         super().__init__(server_address, _DNSRequestHandler)
 
 
@@ -157,14 +852,432 @@ class _DNSRequestHandler(socketserver.BaseRequestHandler):
             socket_obj.sendto(response, self.client_address)
 
 
+class _DNSDatagramProtocol(asyncio.DatagramProtocol):
+    def __init__(self, resolver: DNSRedirectResolver, upstream_pool: ThreadPoolExecutor) -> None:
+        self.resolver = resolver
+        self.upstream_pool = upstream_pool
+        self.transport: Optional[asyncio.DatagramTransport] = None
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        self.transport = transport  # type: ignore[assignment]
+
+    def datagram_received(self, data: bytes, addr: tuple[str, int]) -> None:
+        def defer(job: Callable[[], Optional[bytes]]) -> None:
+            future = asyncio.get_running_loop().run_in_executor(self.upstream_pool, job)
+            future.add_done_callback(lambda done: self._send_result(done, addr))
+
+        try:
+            response = self.resolver.handle_packet(data, addr, defer_upstream=defer)
+        except Exception:
+            LOGGER.exception("DNS handler failed for %s", addr[0])
+            return
+        if response and self.transport is not None:
+            self.transport.sendto(response, addr)
+
+    def _send_result(self, future: asyncio.Future, addr: tuple[str, int]) -> None:
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            LOGGER.error("Upstream forward failed for %s: %s", addr[0], future.exception())
+            return
+        response = future.result()
+        if response and self.transport is not None:
+            self.transport.sendto(response, addr)
+
+    def error_received(self, exc: Exception) -> None:
+        LOGGER.debug("DNS socket error: %s", exc)
+
+
+class AsyncDNSRedirectServer:
+    """Single-threaded asyncio variant of :class:`DNSRedirectServer`.
+
+    Every datagram is answered on the event loop thread, so no OS thread is
+    created per packet; only upstream lookups for bypassed domains that miss
+    the forwarder cache run on a small fixed thread pool. The public surface
+    mirrors the ``socketserver`` methods used by :func:`start_dns_server` and
+    :func:`stop_dns_server`.
+    """
+
+    def __init__(
+        self, server_address: tuple[str, int], resolver: DNSRedirectResolver, reuse_port: bool = False
+    ) -> None:
+        self.resolver = resolver
+        self._loop = asyncio.new_event_loop()
+        self._transport: Optional[asyncio.DatagramTransport] = None
+        self._stopping = threading.Event()
+        self._upstream_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="CaptiveDNSForward")
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if reuse_port:
+                self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            self._sock.bind(server_address)
+        except OSError:
+            self._sock.close()
+            self._loop.close()
+            self._upstream_pool.shutdown(wait=False)
+            raise
+        self.server_address = self._sock.getsockname()
+
+    def serve_forever(self) -> None:
+        asyncio.set_event_loop(self._loop)
+        transport, _ = self._loop.run_until_complete(
+            self._loop.create_datagram_endpoint(
+                lambda: _DNSDatagramProtocol(self.resolver, self._upstream_pool), sock=self._sock
+            )
+        )
+        self._transport = transport
+        try:
+            if not self._stopping.is_set():
+                self._loop.run_forever()
+        finally:
+            transport.close()
+            self._loop.run_until_complete(asyncio.sleep(0))
+            self._loop.close()
+
+    def shutdown(self) -> None:
+        self._stopping.set()
+        try:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        except RuntimeError:  # loop already closed
+            pass
+
+    def server_close(self) -> None:
+        self._upstream_pool.shutdown(wait=False, cancel_futures=True)
+        if self._transport is None:
+            self._sock.close()
+            if not self._loop.is_closed():
+                self._loop.close()
+
+
+class DNSStats:
+    """Per-worker resolver counters kept in shared memory.
+
+    Create it before forking anything that should read it: ``serve.py``'s
+    HTTP workers report it on ``/api/health`` and ``/api/metrics`` while the
+    resolvers run in the services process or in a :class:`DNSWorkerPool`.
+    A single-process server uses slot 0. Each worker's
+    :meth:`UpstreamForwarder.health` is kept alongside, one row per entry
+    of ``upstreams``, as are its :class:`AutoGrantQueue` counters.
+    """
+
+    FIELDS = ("pid", "queries", "qps", "restarts", "auto_grant", "grant_depth", "granted", "grant_failed", "grant_dropped")
+    _AUTO_GRANT_KEYS = {"grant_depth": "depth", "granted": "granted", "grant_failed": "failed", "grant_dropped": "dropped"}
+    UPSTREAM_FIELDS = ("srtt_us", "failures", "state")
+    _QPS_WINDOW_SECONDS = 5.0
+    # Upstream ``state``: not reported yet (no forwarder in that worker), healthy, parked.
+    _UNREPORTED, _HEALTHY, _DOWN = 0, 1, 2
+
+    def __init__(self, workers: int = 1, upstreams: Sequence[str] = ()) -> None:
+        self.workers = max(1, int(workers))
+        parsed = (_parse_upstream(server) for server in upstreams if server)
+        self.upstreams = [f"{address[0]}:{address[1]}" for address in parsed if address is not None]
+        context = multiprocessing.get_context("fork")
+        # QPS is stored in tenths to keep the array integral.
+        self._values = context.Array("q", self.workers * len(self.FIELDS), lock=False)
+        self._upstream_values = context.Array(
+            "q", self.workers * len(self.upstreams) * len(self.UPSTREAM_FIELDS), lock=False
+        )
+
+    def _slot(self, index: int, field: str) -> int:
+        return index * len(self.FIELDS) + self.FIELDS.index(field)
+
+    def set(self, index: int, field: str, value: float) -> None:
+        self._values[self._slot(index, field)] = int(value * 10 if field == "qps" else value)
+
+    def add(self, index: int, field: str, amount: int = 1) -> None:
+        self._values[self._slot(index, field)] += amount
+
+    def set_auto_grant(self, index: int, auto_grant: AutoGrantQueue) -> None:
+        self.set(index, "auto_grant", 1)
+        self.set(index, "grant_depth", auto_grant.depth())
+        self.set(index, "granted", auto_grant.granted)
+        self.set(index, "grant_failed", auto_grant.failed)
+        self.set(index, "grant_dropped", auto_grant.dropped)
+
+    def set_upstreams(self, index: int, health: list[dict[str, object]]) -> None:
+        width = len(self.UPSTREAM_FIELDS)
+        for entry in health:
+            if entry["address"] not in self.upstreams:
+                continue
+            base = (index * len(self.upstreams) + self.upstreams.index(entry["address"])) * width
+            self._upstream_values[base] = int(float(entry["srttMs"]) * 1000)
+            self._upstream_values[base + 1] = int(entry["failures"])
+            self._upstream_values[base + 2] = self._HEALTHY if entry["healthy"] else self._DOWN
+
+    def _upstream_rows(self, index: int, values: list[int]) -> list[dict[str, object]]:
+        width = len(self.UPSTREAM_FIELDS)
+        rows = []
+        for position, address in enumerate(self.upstreams):
+            base = (index * len(self.upstreams) + position) * width
+            srtt_us, failures, state = values[base:base + width]
+            if state != self._UNREPORTED:
+                rows.append(
+                    {"address": address, "srttMs": srtt_us / 1000, "failures": failures, "healthy": state == self._HEALTHY}
+                )
+        return rows
+
+    def snapshot(self) -> list[dict[str, object]]:
+        values = list(self._values)
+        upstream_values = list(self._upstream_values)
+        width = len(self.FIELDS)
+        rows = []
+        for index in range(self.workers):
+            row = dict(zip(self.FIELDS, values[index * width:(index + 1) * width]))
+            auto_grant = {key: row.pop(field) for field, key in self._AUTO_GRANT_KEYS.items()}
+            has_auto_grant = row.pop("auto_grant")
+            rows.append(
+                {
+                    "worker": index,
+                    **row,
+                    "pid": row["pid"] or None,
+                    "qps": row["qps"] / 10,
+                    "upstreams": self._upstream_rows(index, upstream_values),
+                    "autoGrant": auto_grant if has_auto_grant else None,
+                }
+            )
+        return rows
+
+
+def _publish_stats(index: int, resolver: DNSRedirectResolver, stats: DNSStats, running: Callable[[], bool]) -> None:
+    """Copy ``resolver``'s counters into ``stats`` twice a second while ``running()``."""
+    stats.set(index, "pid", os.getpid())
+    samples: deque[tuple[float, int]] = deque([(time.monotonic(), resolver.queries)])
+    try:
+        while running():
+            time.sleep(0.5)
+            now, queries = time.monotonic(), resolver.queries
+            samples.append((now, queries))
+            while now - samples[0][0] > DNSStats._QPS_WINDOW_SECONDS:
+                samples.popleft()
+            elapsed = now - samples[0][0]
+            stats.set(index, "queries", queries)
+            stats.set(index, "qps", (queries - samples[0][1]) / elapsed if elapsed else 0.0)
+            if resolver.forwarder is not None:
+                stats.set_upstreams(index, resolver.forwarder.health())
+            if resolver.auto_grant_queue is not None:
+                stats.set_auto_grant(index, resolver.auto_grant_queue)
+    finally:
+        stats.set(index, "queries", resolver.queries)
+        stats.set(index, "qps", 0)
+        if resolver.auto_grant_queue is not None:
+            stats.set_auto_grant(index, resolver.auto_grant_queue)
+
+
+def _run_pool_worker(
+    index: int,
+    server_address: tuple[str, int],
+    resolver_options: dict,
+    server_mode: str,
+    stop_flag,
+    stats: DNSStats,
+    supervisor_pid: int,
+) -> None:
+    # Built after the fork: forwarder and auto-grant threads do not survive it.
+    resolver = DNSRedirectResolver(**resolver_options)
+    server = create_dns_server(server_address, resolver, server_mode, reuse_port=True)
+    thread = threading.Thread(target=server.serve_forever, name=f"CaptiveDNS-{index}", daemon=True)
+    thread.start()
+    try:
+        _publish_stats(index, resolver, stats, lambda: not stop_flag.value and os.getppid() == supervisor_pid)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        thread.join(timeout=2)
+        server.server_close()
+        resolver.close()
+
+
+def _supervise_pool(
+    workers: int,
+    server_address: tuple[str, int],
+    resolver_options: dict,
+    server_mode: str,
+    stop_flag,
+    stats: DNSStats,
+    owner_pid: int,
+) -> None:
+    """Body of the pool supervisor: forks the workers and replaces any that exit.
+
+    It runs no other threads, so forking from it never copies a lock held
+    by some other thread of the portal.
+    """
+    context = multiprocessing.get_context("fork")
+    supervisor_pid = os.getpid()
+
+    def spawn(index: int):
+        process = context.Process(
+            target=_run_pool_worker,
+            args=(index, server_address, resolver_options, server_mode, stop_flag, stats, supervisor_pid),
+            name=f"CaptiveDNSWorker-{index}",
+            daemon=True,
+        )
+        process.start()
+        return process
+
+    processes = [spawn(index) for index in range(workers)]
+    try:
+        while not stop_flag.value:
+            time.sleep(0.5)
+            if os.getppid() != owner_pid:
+                # The process that owns the pool is gone; take the workers down with us.
+                stop_flag.value = 1
+                break
+            for index, process in enumerate(processes):
+                if process.is_alive():
+                    continue
+                LOGGER.warning("Captive DNS worker %s (pid %s) exited with %s; restarting", index, process.pid, process.exitcode)
+                stats.add(index, "restarts")
+                processes[index] = spawn(index)
+    except KeyboardInterrupt:
+        stop_flag.value = 1
+    for process in processes:
+        process.join(timeout=2)
+        if process.is_alive():
+            process.terminate()
+
+
+def worker_pool_supported() -> bool:
+    return hasattr(socket, "SO_REUSEPORT") and "fork" in multiprocessing.get_all_start_methods()
+
+
+class DNSWorkerPool:
+    """Runs ``workers`` resolver processes that share the listen port.
+
+    Each process binds its own socket with ``SO_REUSEPORT`` so the kernel
+    spreads packets across them, and keeps its own caches and seen-clients
+    table. The workers are forked by a supervisor process, itself forked by
+    :meth:`start` before the caller starts any other service thread; the
+    supervisor restarts workers that exit. Per-worker counters go to
+    ``stats`` (a :class:`DNSStats`). Only available where ``fork`` and
+    ``SO_REUSEPORT`` exist (Linux, macOS); exposes the same
+    ``serve_forever``/``shutdown``/``server_close`` surface as the
+    single-process servers.
+    """
+
+    resolver: Optional[DNSRedirectResolver] = None
+
+    def __init__(
+        self,
+        server_address: tuple[str, int],
+        resolver_options: dict,
+        server_mode: str,
+        workers: int,
+        stats: Optional[DNSStats] = None,
+    ) -> None:
+        if not hasattr(socket, "SO_REUSEPORT"):
+            raise CaptiveDNSError("SO_REUSEPORT is not supported on this platform")
+        try:
+            self._context = multiprocessing.get_context("fork")
+        except ValueError as exc:
+            raise CaptiveDNSError("Multi-worker DNS requires the fork start method") from exc
+        if server_mode.lower() not in SERVER_MODES:
+            raise CaptiveDNSError(f"Unknown captive DNS server_mode '{server_mode}'")
+        self.workers = int(workers)
+        if stats is not None and stats.workers < self.workers:
+            raise CaptiveDNSError(f"DNSStats has room for {stats.workers} worker(s), not {self.workers}")
+        self.server_address = self._resolve_port(server_address)
+        self._resolver_options = resolver_options
+        self._server_mode = server_mode
+        # A plain shared byte rather than a multiprocessing.Event: a worker killed
+        # while waiting on the Event's lock would leave it held for everyone else.
+        self._stop_flag = self._context.RawValue("b", 0)
+        self._stopping = threading.Event()
+        self.stats = stats or DNSStats(self.workers)
+        self._supervisor = None
+
+    @staticmethod
+    def _resolve_port(server_address: tuple[str, int]) -> tuple[str, int]:
+        # Port 0 must become one concrete port that every worker binds.
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+            probe.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            try:
+                probe.bind(server_address)
+            except OSError as exc:
+                raise CaptiveDNSError(str(exc)) from exc
+            return probe.getsockname()
+
+    def start(self, ready_timeout: float = 5.0) -> None:
+        """Fork the supervisor; call this before starting other threads in this process.
+
+        Returns once every worker has bound the port (or ``ready_timeout``
+        has passed), so a query sent right after start-up is not dropped.
+        """
+        if self._supervisor is not None:
+            return
+        for index in range(self.workers):
+            self.stats.set(index, "pid", 0)
+        self._supervisor = self._context.Process(
+            target=_supervise_pool,
+            args=(
+                self.workers,
+                self.server_address,
+                self._resolver_options,
+                self._server_mode,
+                self._stop_flag,
+                self.stats,
+                os.getpid(),
+            ),
+            name="CaptiveDNSPool",
+        )
+        self._supervisor.start()
+        # A worker publishes its pid only after its socket is bound.
+        deadline = time.monotonic() + ready_timeout
+        while self._supervisor.is_alive() and time.monotonic() < deadline:
+            if all(row["pid"] for row in self.worker_stats()):
+                return
+            time.sleep(0.02)
+        LOGGER.warning("Captive DNS workers not all listening after %.1f s", ready_timeout)
+
+    def serve_forever(self) -> None:
+        self.start()
+        self._stopping.wait()
+
+    def shutdown(self) -> None:
+        self._stop_flag.value = 1
+        self._stopping.set()
+
+    def server_close(self) -> None:
+        if self._supervisor is None:
+            return
+        self._supervisor.join(timeout=5)
+        if self._supervisor.is_alive():
+            self._supervisor.terminate()
+
+    def worker_stats(self) -> list[dict[str, object]]:
+        """Per-worker pid, query total, QPS over the last few seconds and restart count."""
+        return self.stats.snapshot()[: self.workers]
+
+
+DNSServer = Union[DNSRedirectServer, AsyncDNSRedirectServer, DNSWorkerPool]
+
+
 @dataclass(frozen=True)
 class DNSServerHandle:
-    server: DNSRedirectServer
+    server: DNSServer
     thread: threading.Thread
     listen_address: str
     listen_port: int
 
 
+def create_dns_server(
+    server_address: tuple[str, int],
+    resolver: DNSRedirectResolver,
+    server_mode: str = "threading",
+    reuse_port: bool = False,
+) -> DNSServer:
+    mode = (server_mode or "threading").lower()
+    if mode not in SERVER_MODES:
+        raise CaptiveDNSError(f"Unknown captive DNS server_mode '{server_mode}'")
+    try:
+        if mode == "asyncio":
+            return AsyncDNSRedirectServer(server_address, resolver, reuse_port=reuse_port)
+        return DNSRedirectServer(server_address, resolver, reuse_port=reuse_port)
+    except OSError as exc:
+        raise CaptiveDNSError(str(exc)) from exc
+
+
 def start_dns_server(
     *,
     listen_address: str,
@@ -176,8 +1289,20 @@ def start_dns_server(
     log_queries: bool = False,
     auto_grant: bool = False,
     grant_url: Optional[str] = None,
+    grant_callback: Optional[Callable[[str], object]] = None,
+    server_mode: str = "threading",
+    response_cache_size: int = 4096,
+    upstream_timeout: float = 1.0,
+    upstream_cache_size: int = 2048,
+    workers: int = 1,
+    analytics_sink: Optional[Callable[[Sequence[dns_analytics.QueryEvent]], None]] = None,
+    analytics_ring_size: int = 8192,
+    analytics_flush_interval: float = 5.0,
+    analytics_purge: Optional[Callable[[int], object]] = None,
+    analytics_retention: float = 24 * 3600,
+    stats: Optional[DNSStats] = None,
 ) -> DNSServerHandle:
-    resolver = DNSRedirectResolver(
+    resolver_options = dict(
         portal_ip=portal_ip,
         bypass_domains=bypass_domains,
         force_portal_domains=force_portal_domains,
@@ -185,16 +1310,51 @@ def start_dns_server(
         log_queries=log_queries,
         auto_grant=auto_grant,
         grant_url=grant_url,
+        grant_callback=grant_callback,
+        response_cache_size=response_cache_size,
+        upstream_timeout=upstream_timeout,
+        upstream_cache_size=upstream_cache_size,
+        analytics_sink=analytics_sink,
+        analytics_ring_size=analytics_ring_size,
+        analytics_flush_interval=analytics_flush_interval,
+        analytics_purge=analytics_purge,
+        analytics_retention=analytics_retention,
     )
 
-    try:
-        server = DNSRedirectServer((listen_address, listen_port), resolver)
-    except OSError as exc:
-        raise CaptiveDNSError(str(exc)) from exc
+    workers = max(1, int(workers))
+    if workers > 1 and not worker_pool_supported():
+        LOGGER.warning("Multi-worker captive DNS needs fork and SO_REUSEPORT; using one worker")
+        workers = 1
+
+    server: DNSServer
+    if workers > 1:
+        server = DNSWorkerPool((listen_address, listen_port), resolver_options, server_mode, workers, stats)
+        # Fork now, from the caller's thread, not from the serving thread started below.
+        server.start()
+    else:
+        resolver = DNSRedirectResolver(**resolver_options)
+        try:
+            server = create_dns_server((listen_address, listen_port), resolver, server_mode)
+        except CaptiveDNSError:
+            resolver.close()
+            raise
 
     thread = threading.Thread(target=server.serve_forever, name="CaptiveDNS", daemon=True)
     thread.start()
-    LOGGER.info("Captive DNS redirector listening on %s:%s", listen_address, listen_port)
+    if stats is not None and workers == 1:
+        threading.Thread(
+            target=_publish_stats,
+            args=(0, resolver, stats, thread.is_alive),
+            name="CaptiveDNSStats",
+            daemon=True,
+        ).start()
+    LOGGER.info(
+        "Captive DNS redirector (%s, %s worker(s)) listening on %s:%s",
+        server_mode,
+        workers,
+        listen_address,
+        listen_port,
+    )
     return DNSServerHandle(server=server, thread=thread, listen_address=listen_address, listen_port=listen_port)
 
 
@@ -202,6 +1362,8 @@ def stop_dns_server(handle: Optional[DNSServerHandle]) -> None:
     if not handle:
         return
     handle.server.shutdown()
-    handle.server.server_close()
     handle.thread.join(timeout=2)
+    handle.server.server_close()
+    if handle.server.resolver is not None:
+        handle.server.resolver.close()
     LOGGER.info("Captive DNS redirector stopped")
@@ -0,0 +1,161 @@
+"""Fixed-size query event ring for the captive DNS redirector.
+
+The resolver appends one event per answered packet into preallocated
+arrays; a background thread drains new events in batches and hands them to
+a sink (normally :func:`utils.local_db.insert_dns_query_events`). Nothing on
+the append path formats strings or builds per-event objects. With a
+``purge`` callback the same thread also drops stored events older than
+``retention_seconds``, every :data:`_PURGE_INTERVAL_SECONDS`.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+import zlib
+from array import array
+from typing import Callable, Optional, Sequence
+
+LOGGER = logging.getLogger("captive_dns.analytics")
+LOGGER.addHandler(logging.NullHandler())
+
+DECISION_REDIRECT = 0
+DECISION_REDIRECT_CACHED = 1
+DECISION_FORWARD = 2
+DECISION_FORWARD_CACHED = 3
+DECISION_FORWARD_FAILED = 4
+
+DECISION_NAMES = {
+    DECISION_REDIRECT: "redirect",
+    DECISION_REDIRECT_CACHED: "redirect_cached",
+    DECISION_FORWARD: "forward",
+    DECISION_FORWARD_CACHED: "forward_cached",
+    DECISION_FORWARD_FAILED: "forward_failed",
+}
+
+_PURGE_INTERVAL_SECONDS = 600.0
+
+# (timestamp_ms, client_ip, qname_hash, qtype, decision, latency_ms)
+QueryEvent = tuple[int, str, int, int, int, float]
+
+
+def qname_hash(qname: str) -> int:
+    return zlib.crc32(qname.encode("ascii", "replace"))
+
+
+class QueryRing:
+    """Array-backed ring of the most recent ``size`` query events."""
+
+    def __init__(self, size: int = 8192) -> None:
+        self.size = max(16, int(size))
+        self._timestamps = array("d", bytes(8 * self.size))
+        self._hashes = array("L", bytes(array("L").itemsize * self.size))
+        self._qtypes = array("H", bytes(2 * self.size))
+        self._decisions = array("B", bytes(self.size))
+        self._latencies = array("f", bytes(4 * self.size))
+        self._clients: list[Optional[str]] = [None] * self.size
+        self._written = 0
+        self._lock = threading.Lock()
+
+    @property
+    def written(self) -> int:
+        return self._written
+
+    def append(self, client_ip: str, qname_hash_value: int, qtype: int, decision: int, latency: float) -> None:
+        with self._lock:
+            slot = self._written % self.size
+            self._written += 1
+            self._timestamps[slot] = time.time()
+            self._clients[slot] = client_ip
+            self._hashes[slot] = qname_hash_value
+            self._qtypes[slot] = qtype
+            self._decisions[slot] = decision
+            self._latencies[slot] = latency
+
+    def read_since(self, cursor: int) -> tuple[list[QueryEvent], int, int]:
+        """Return ``(events, new_cursor, overwritten)`` for events after ``cursor``."""
+        with self._lock:
+            end = self._written
+            start = max(cursor, end - self.size)
+            events = [
+                (
+                    int(self._timestamps[index % self.size] * 1000),
+                    self._clients[index % self.size] or "",
+                    self._hashes[index % self.size],
+                    self._qtypes[index % self.size],
+                    self._decisions[index % self.size],
+                    round(self._latencies[index % self.size] * 1000, 3),
+                )
+                for index in range(start, end)
+            ]
+        return events, end, start - cursor
+
+
+class QueryAnalytics:
+    """Owns a :class:`QueryRing` and the thread that flushes it to ``sink``."""
+
+    def __init__(
+        self,
+        sink: Callable[[Sequence[QueryEvent]], None],
+        *,
+        ring_size: int = 8192,
+        flush_interval: float = 5.0,
+        purge: Optional[Callable[[int], object]] = None,
+        retention_seconds: float = 24 * 3600,
+    ) -> None:
+        self.ring = QueryRing(ring_size)
+        self._sink = sink
+        self._purge = purge
+        self.flush_interval = max(0.1, float(flush_interval))
+        self.retention_seconds = max(60.0, float(retention_seconds))
+        self._last_purge = 0.0
+        self._cursor = 0
+        self.flushed = 0
+        self.overwritten = 0
+        self._closed = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="CaptiveDNSAnalytics", daemon=True)
+        self._thread.start()
+
+    def record(self, client_ip: str, qname: str, qtype: int, decision: int, started: float) -> None:
+        self.ring.append(client_ip, qname_hash(qname), qtype, decision, time.perf_counter() - started)
+
+    def pending(self) -> int:
+        return self.ring.written - self._cursor
+
+    def flush(self) -> int:
+        with self._flush_lock:
+            events, cursor, overwritten = self.ring.read_since(self._cursor)
+            self.overwritten += overwritten
+            if not events:
+                self._cursor = cursor
+                return 0
+            try:
+                self._sink(events)
+            except Exception:
+                LOGGER.exception("Unable to persist %s DNS query events", len(events))
+                return 0
+            self._cursor = cursor
+            self.flushed += len(events)
+            return len(events)
+
+    def close(self) -> None:
+        self._closed.set()
+        self._thread.join(timeout=2)
+        self.flush()
+
+    def purge(self) -> None:
+        """Drop stored events older than ``retention_seconds``; ``purge(before_ms)`` does the deleting."""
+        if self._purge is None or time.monotonic() - self._last_purge < _PURGE_INTERVAL_SECONDS:
+            return
+        self._last_purge = time.monotonic()
+        try:
+            self._purge(int((time.time() - self.retention_seconds) * 1000))
+        except Exception:
+            LOGGER.exception("Unable to purge old DNS query events")
+
+    def _run(self) -> None:
+        while not self._closed.wait(self.flush_interval):
+            self.flush()
+            self.purge()
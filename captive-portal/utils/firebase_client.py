@@ -1,28 +1,78 @@
-"""Firebase helper functions used by the captive portal."""
+"""Firebase helper functions used by the captive portal.
+
+Attendance codes are looked up through the ``attendance_code_index`` node
+(``code -> classId``). Codes are written by the teacher clients, which do
+not know about the index, so a listener on ``attendance_codes`` keeps it up
+to date: the first event rebuilds it from the full snapshot and every later
+change rewrites the entries of the classes it touches.
+:func:`save_attendance_code` also writes the entry itself, in the same
+multi-path update as the code. Lookups are cached for ``code_cache_ttl``
+seconds and the cache is dropped on every listener event.
+"""
 
 from __future__ import annotations
 
 import json
+import logging
+import threading
+import time
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any, Dict, Optional, Tuple
 
-import firebase_admin
-from firebase_admin import credentials, db
+# firebase_admin pulls in google-cloud and grpc, so it is imported on first
+# use by _load_sdk() rather than whenever the portal starts.
+firebase_admin: Optional[Any] = None
+credentials: Optional[Any] = None
+db: Optional[Any] = None
 
 _CONFIG_DIR = Path(__file__).resolve().parent.parent / "config"
-_APP: Optional[firebase_admin.App] = None
+_APP: Optional[Any] = None
+# In-process stand-in (utils.firebase_local.LocalDatabase) used instead of Firebase when set.
+_LOCAL_DB: Optional[Any] = None
+
+LOGGER = logging.getLogger("firebase_client")
+LOGGER.addHandler(logging.NullHandler())
+
+CODE_INDEX_PATH = "attendance_code_index"
+
+_CODE_CACHE: Dict[str, Tuple[float, Optional[dict[str, Any]]]] = {}
+_CODE_CACHE_LOCK = threading.Lock()
+_CODE_CACHE_TTL = 5.0
+_CODE_CACHE_MAX = 1024
+_CODE_LISTENER: Optional[Any] = None
+_INDEX_FALLBACK_SCAN = True
+# classId -> code as last written to the index by the listener; guarded by _INDEX_LOCK.
+_INDEXED_CODES: Dict[str, str] = {}
+_INDEX_LOCK = threading.Lock()
+# Set once the listener has written the index from a full snapshot; misses after that are real.
+_INDEX_SYNCED = False
 
 
 class FirebaseConfigurationError(RuntimeError):
     """Raised when Firebase cannot be initialised."""
 
 
-def initialise() -> firebase_admin.App:
+def _load_sdk() -> None:
+    global firebase_admin, credentials, db
+    if firebase_admin is not None:
+        return
+    try:
+        import firebase_admin as sdk
+        from firebase_admin import credentials as sdk_credentials, db as sdk_db
+    except ImportError as exc:  # pragma: no cover - only the local stand-in is usable
+        raise FirebaseConfigurationError("firebase-admin is not installed. Run `pip install -r requirements.txt`.") from exc
+    firebase_admin, credentials, db = sdk, sdk_credentials, sdk_db
+
+
+def initialise() -> Any:
     """Initialise Firebase Admin SDK exactly once."""
     global _APP
+    if _LOCAL_DB is not None:
+        return _LOCAL_DB
     if _APP:
         return _APP
+    _load_sdk()
 
     config_path = _CONFIG_DIR / "firebase_config.json"
     if not config_path.exists():
@@ -40,46 +90,254 @@ def initialise() -> firebase_admin.App:
     return _APP
 
 
-def _attendance_codes_ref():
+def use_local_database(database: Optional[Any]) -> None:
+    """Route every call to ``database`` (a ``LocalDatabase``) instead of Firebase; ``None`` undoes it."""
+    global _LOCAL_DB
+    _LOCAL_DB = database
+    _stop_code_listener()
+    _reset_code_index_state()
+    invalidate_code_cache()
+
+
+def configure_code_cache(ttl_seconds: float = 5.0, fallback_scan: bool = True) -> None:
+    """Set the code lookup cache TTL (``0`` disables it) and whether index misses scan all codes.
+
+    The scan only runs until the ``attendance_codes`` listener has rebuilt
+    the index; after that a miss means the code does not exist.
+    """
+    global _CODE_CACHE_TTL, _INDEX_FALLBACK_SCAN
+    _CODE_CACHE_TTL = max(0.0, float(ttl_seconds))
+    _INDEX_FALLBACK_SCAN = bool(fallback_scan)
+    invalidate_code_cache()
+
+
+def _reference(path: str):
+    if _LOCAL_DB is not None:
+        return _LOCAL_DB.reference(path)
     initialise()
-    return db.reference("attendance_codes")
+    return db.reference(path)
+
+
+def _attendance_codes_ref():
+    return _reference("attendance_codes")
+
+
+def invalidate_code_cache(code: Optional[str] = None) -> None:
+    with _CODE_CACHE_LOCK:
+        if code is None:
+            _CODE_CACHE.clear()
+        else:
+            _CODE_CACHE.pop(str(code).strip(), None)
+
+
+def _code_of(value: Any) -> Optional[str]:
+    if isinstance(value, dict) and value.get("code") is not None:
+        return str(value["code"])
+    return None
+
+
+def _collect_code_changes(parts: list[str], data: Any, changes: Dict[str, Optional[str]]) -> None:
+    """Record the ``classId -> code`` effect of ``data`` being put at ``parts`` under ``attendance_codes``."""
+    if len(parts) == 1:
+        changes[parts[0]] = _code_of(data)
+    elif len(parts) == 2 and parts[1] == "code":
+        changes[parts[0]] = None if data is None else str(data)
+
+
+def _write_full_index(snapshot: Any) -> int:
+    global _INDEX_SYNCED
+    codes = {str(class_id): _code_of(data) for class_id, data in (snapshot or {}).items()}
+    index = {code: class_id for class_id, code in codes.items() if code is not None}
+    with _INDEX_LOCK:
+        if index:
+            _reference(CODE_INDEX_PATH).set(index)
+        else:
+            _reference(CODE_INDEX_PATH).delete()
+        _INDEXED_CODES.clear()
+        _INDEXED_CODES.update({class_id: code for class_id, code in codes.items() if code is not None})
+        _INDEX_SYNCED = True
+    return len(index)
+
+
+def _sync_code_index(event) -> None:
+    parts = [part for part in str(event.path).split("/") if part]
+    if not parts and event.event_type == "put":
+        # Initial snapshot (or the whole node replaced): rewrite the index from it.
+        _write_full_index(event.data)
+        return
+    if not _INDEX_SYNCED:
+        # An earlier index write failed, so the entries are not trustworthy; start over.
+        _write_full_index(_attendance_codes_ref().get())
+        return
+
+    changes: Dict[str, Optional[str]] = {}
+    if event.event_type == "patch" and isinstance(event.data, dict):
+        for key, value in event.data.items():
+            _collect_code_changes(parts + [part for part in str(key).split("/") if part], value, changes)
+    else:
+        _collect_code_changes(parts, event.data, changes)
+    with _INDEX_LOCK:
+        removed: Dict[str, Any] = {}
+        added: Dict[str, Any] = {}
+        for class_id, code in changes.items():
+            previous = _INDEXED_CODES.get(class_id)
+            if previous == code:
+                continue
+            if previous is not None:
+                removed[f"{CODE_INDEX_PATH}/{previous}"] = None
+            if code is not None:
+                added[f"{CODE_INDEX_PATH}/{code}"] = class_id
+        if not removed and not added:
+            return
+        _reference("/").update({**removed, **added})
+        for class_id, code in changes.items():
+            if code is None:
+                _INDEXED_CODES.pop(class_id, None)
+            else:
+                _INDEXED_CODES[class_id] = code
+
+
+def _on_codes_event(event) -> None:
+    global _INDEX_SYNCED
+    try:
+        _sync_code_index(event)
+    except Exception as exc:  # pragma: no cover - network dependent
+        # Misses go back to the fallback scan until the next event rebuilds the index.
+        LOGGER.warning("Unable to update %s: %s", CODE_INDEX_PATH, exc)
+        with _INDEX_LOCK:
+            _INDEX_SYNCED = False
+    # After the index write, so a miss cached while it was in flight does not outlive it.
+    invalidate_code_cache()
+
+
+def _ensure_code_listener() -> None:
+    global _CODE_LISTENER
+    if _CODE_LISTENER is not None:
+        return
+    try:
+        _CODE_LISTENER = _attendance_codes_ref().listen(_on_codes_event)
+    except Exception as exc:  # pragma: no cover - network dependent
+        # Fall back to TTL-only expiry and the fallback scan; try again on a later lookup.
+        LOGGER.warning("Unable to listen for attendance code changes: %s", exc)
+
+
+def start_code_listener() -> None:
+    """Start maintaining ``attendance_code_index`` now rather than on the first lookup."""
+    _ensure_code_listener()
+
+
+def _stop_code_listener() -> None:
+    global _CODE_LISTENER
+    listener, _CODE_LISTENER = _CODE_LISTENER, None
+    if listener is not None:
+        try:
+            listener.close()
+        except Exception:  # pragma: no cover - best effort
+            pass
+
+
+def _reset_code_index_state() -> None:
+    global _INDEX_SYNCED
+    with _INDEX_LOCK:
+        _INDEXED_CODES.clear()
+        _INDEX_SYNCED = False
+
+
+def _lookup_code(code: str) -> Optional[dict[str, Any]]:
+    class_id = _reference(f"{CODE_INDEX_PATH}/{code}").get()
+    if class_id:
+        data = _reference(f"attendance_codes/{class_id}").get()
+        # Guard against an index entry left behind by a code that was replaced.
+        if data and str(data.get("code")) == code:
+            return {"classId": class_id, **data}
+    if not _INDEX_FALLBACK_SCAN or _INDEX_SYNCED:
+        return None
+    snapshot = _attendance_codes_ref().get()
+    for class_id, data in (snapshot or {}).items():
+        if str(data.get("code")) == code:
+            return {"classId": class_id, **data}
+    return None
 
 
 def verify_attendance_code(code: str) -> Optional[dict[str, Any]]:
     """Return attendance metadata if the code is valid and not expired."""
-    snapshot = _attendance_codes_ref().get()
-    if not snapshot:
+    code = str(code).strip()
+    now = time.monotonic()
+    cached = None
+    _ensure_code_listener()
+    if _CODE_CACHE_TTL:
+        with _CODE_CACHE_LOCK:
+            cached = _CODE_CACHE.get(code)
+    if cached is not None and cached[0] > now:
+        code_data = cached[1]
+    else:
+        code_data = _lookup_code(code)
+        if _CODE_CACHE_TTL:
+            with _CODE_CACHE_LOCK:
+                if len(_CODE_CACHE) >= _CODE_CACHE_MAX:
+                    _CODE_CACHE.clear()
+                _CODE_CACHE[code] = (now + _CODE_CACHE_TTL, code_data)
+    if not code_data:
+        return None
+
+    expiry_time = code_data.get("expiryTime")
+    if expiry_time and int(expiry_time) < int(datetime.now(tz=timezone.utc).timestamp() * 1000):
         return None
+    return dict(code_data)
 
-    for class_id, data in snapshot.items():
-        if str(data.get("code")) != str(code).strip():
-            continue
 
-        expiry_time = data.get("expiryTime")
-        if expiry_time and int(expiry_time) < int(datetime.now(tz=timezone.utc).timestamp() * 1000):
-            return None
+def save_attendance_code(class_id: str, data: dict[str, Any]) -> None:
+    """Write a class's code and its index entry in one multi-path update."""
+    previous = _reference(f"attendance_codes/{class_id}").get()
+    updates: Dict[str, Any] = {
+        f"attendance_codes/{class_id}": data,
+        f"{CODE_INDEX_PATH}/{data['code']}": class_id,
+    }
+    if previous and str(previous.get("code")) != str(data["code"]):
+        updates[f"{CODE_INDEX_PATH}/{previous.get('code')}"] = None
+    _reference("/").update(updates)
+    invalidate_code_cache()
 
-        enriched = {"classId": class_id, **data}
-        return enriched
 
-    return None
+def clear_attendance_code(class_id: str) -> None:
+    previous = _reference(f"attendance_codes/{class_id}").get()
+    updates: Dict[str, Any] = {f"attendance_codes/{class_id}": None}
+    if previous and previous.get("code") is not None:
+        updates[f"{CODE_INDEX_PATH}/{previous['code']}"] = None
+    _reference("/").update(updates)
+    invalidate_code_cache()
+
+
+def rebuild_code_index() -> int:
+    """Recreate ``attendance_code_index`` from ``attendance_codes``; returns the entry count."""
+    count = _write_full_index(_attendance_codes_ref().get())
+    invalidate_code_cache()
+    return count
+
+
+def get_value(path: str, shallow: bool = False) -> Any:
+    """Read ``path``; with ``shallow`` only the child keys (mapped to ``True``) are returned."""
+    reference = _reference(path)
+    return reference.get(shallow=True) if shallow else reference.get()
+
+
+def apply_updates(updates: Dict[str, Any]) -> None:
+    """Apply a multi-path update (``{"a/b": value, ...}``) atomically at the database root."""
+    _reference("/").update(updates)
 
 
 def fetch_student(student_id: str) -> Optional[dict[str, Any]]:
-    initialise()
-    student_ref = db.reference(f"students/{student_id}")
+    student_ref = _reference(f"students/{student_id}")
     snapshot = student_ref.get()
     return snapshot if snapshot else None
 
 
 def load_existing_attendance(class_id: str, student_id: str) -> Optional[dict[str, Any]]:
-    initialise()
-    attendance_ref = db.reference(f"attendance/{class_id}/{student_id}")
+    attendance_ref = _reference(f"attendance/{class_id}/{student_id}")
     snapshot = attendance_ref.get()
     return snapshot if snapshot else None
 
 
 def mark_attendance(class_id: str, student_id: str, payload: dict[str, Any]) -> None:
-    initialise()
-    attendance_ref = db.reference(f"attendance/{class_id}/{student_id}")
+    attendance_ref = _reference(f"attendance/{class_id}/{student_id}")
     attendance_ref.set(payload)
@@ -0,0 +1,187 @@
+"""In-process stand-in for the Firebase Realtime Database.
+
+Implements the subset of ``firebase_admin.db.Reference`` the portal uses —
+``get``, ``set``, ``update`` (including multi-path updates), ``delete``,
+``child`` and ``listen`` — over a JSON tree held in memory, so the
+Firebase code paths can be exercised and benchmarked without network
+access or credentials. Install it with
+``firebase_client.use_local_database(LocalDatabase())``.
+
+``latency`` adds a fixed delay per call and ``bandwidth`` (bytes/second)
+a delay proportional to the payload, to approximate a remote database.
+"""
+
+from __future__ import annotations
+
+import copy
+import json
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+def _split(path: str) -> List[str]:
+    return [part for part in str(path).split("/") if part]
+
+
+def _join(parts: List[str]) -> str:
+    return "/" + "/".join(parts)
+
+
+def _prune(value: Any) -> Any:
+    """Drop ``None`` leaves and empty objects, as the Realtime Database does."""
+    if isinstance(value, dict):
+        pruned = {str(key): _prune(child) for key, child in value.items()}
+        pruned = {key: child for key, child in pruned.items() if child is not None}
+        return pruned or None
+    return value
+
+
+class Event:
+    """Mirrors ``firebase_admin.db.Event``."""
+
+    def __init__(self, event_type: str, path: str, data: Any) -> None:
+        self.event_type = event_type
+        self.path = path
+        self.data = data
+
+
+class ListenerRegistration:
+    def __init__(self, database: "LocalDatabase", listener_id: int) -> None:
+        self._database = database
+        self._listener_id = listener_id
+
+    def close(self) -> None:
+        self._database._remove_listener(self._listener_id)
+
+
+class LocalDatabase:
+    def __init__(self, initial: Optional[Dict[str, Any]] = None, latency: float = 0.0, bandwidth: float = 0.0) -> None:
+        self._root: Any = _prune(copy.deepcopy(initial)) if initial else None
+        self._lock = threading.RLock()
+        self._listeners: Dict[int, Tuple[List[str], Callable[[Event], None]]] = {}
+        self._next_listener = 0
+        self.latency = float(latency)
+        self.bandwidth = float(bandwidth)
+        self.counters = {"reads": 0, "writes": 0, "bytesRead": 0, "bytesWritten": 0}
+
+    def reference(self, path: str = "/") -> "LocalReference":
+        return LocalReference(self, _split(path))
+
+    def _delay(self, payload: Any) -> int:
+        size = len(json.dumps(payload, separators=(",", ":"))) if payload is not None else 0
+        delay = self.latency + (size / self.bandwidth if self.bandwidth else 0.0)
+        if delay:
+            time.sleep(delay)
+        return size
+
+    def _read(self, parts: List[str]) -> Any:
+        with self._lock:
+            node = self._root
+            for part in parts:
+                if not isinstance(node, dict) or part not in node:
+                    node = None
+                    break
+                node = node[part]
+            value = copy.deepcopy(node)
+            self.counters["reads"] += 1
+        size = self._delay(value)
+        with self._lock:
+            self.counters["bytesRead"] += size
+        return value
+
+    def _write(self, changes: List[Tuple[List[str], Any]]) -> None:
+        """Apply ``(path_parts, value)`` writes atomically; ``None`` deletes."""
+        size = self._delay([value for _, value in changes])
+        with self._lock:
+            for parts, value in changes:
+                self._root = self._assign(self._root, parts, _prune(copy.deepcopy(value)))
+            self.counters["writes"] += 1
+            self.counters["bytesWritten"] += size
+            notifications = self._collect_events(changes)
+        for callback, event in notifications:
+            callback(event)
+
+    def _assign(self, node: Any, parts: List[str], value: Any) -> Any:
+        if not parts:
+            return value
+        children = dict(node) if isinstance(node, dict) else {}
+        child = self._assign(children.get(parts[0]), parts[1:], value)
+        if child is None:
+            children.pop(parts[0], None)
+        else:
+            children[parts[0]] = child
+        return children or None
+
+    def _collect_events(self, changes: List[Tuple[List[str], Any]]) -> List[Tuple[Callable[[Event], None], Event]]:
+        events = []
+        for listener_parts, callback in list(self._listeners.values()):
+            for parts, value in changes:
+                if parts[: len(listener_parts)] == listener_parts:
+                    relative = parts[len(listener_parts):]
+                    events.append((callback, Event("put", _join(relative), copy.deepcopy(_prune(value)))))
+                elif listener_parts[: len(parts)] == parts:
+                    current = self._root
+                    for part in listener_parts:
+                        current = current.get(part) if isinstance(current, dict) else None
+                    events.append((callback, Event("put", "/", copy.deepcopy(current))))
+        return events
+
+    def _add_listener(self, parts: List[str], callback: Callable[[Event], None]) -> ListenerRegistration:
+        with self._lock:
+            listener_id = self._next_listener
+            self._next_listener += 1
+            self._listeners[listener_id] = (parts, callback)
+            initial = Event("put", "/", copy.deepcopy(self._read_unlocked(parts)))
+        callback(initial)
+        return ListenerRegistration(self, listener_id)
+
+    def _read_unlocked(self, parts: List[str]) -> Any:
+        node = self._root
+        for part in parts:
+            node = node.get(part) if isinstance(node, dict) else None
+        return node
+
+    def _remove_listener(self, listener_id: int) -> None:
+        with self._lock:
+            self._listeners.pop(listener_id, None)
+
+
+class LocalReference:
+    """Mirrors the parts of ``firebase_admin.db.Reference`` used by the portal."""
+
+    def __init__(self, database: LocalDatabase, parts: List[str]) -> None:
+        self._database = database
+        self._parts = parts
+
+    @property
+    def key(self) -> Optional[str]:
+        return self._parts[-1] if self._parts else None
+
+    @property
+    def path(self) -> str:
+        return _join(self._parts)
+
+    def child(self, path: str) -> "LocalReference":
+        return LocalReference(self._database, self._parts + _split(path))
+
+    def get(self, shallow: bool = False) -> Any:
+        value = self._database._read(self._parts)
+        if shallow and isinstance(value, dict):
+            return {key: True for key in value}
+        return value
+
+    def set(self, value: Any) -> None:
+        self._database._write([(self._parts, value)])
+
+    def update(self, value: Dict[str, Any]) -> None:
+        """Multi-path update: each key is a path relative to this reference."""
+        if not value:
+            raise ValueError("Update value must be a non-empty dictionary.")
+        self._database._write([(self._parts + _split(key), child) for key, child in value.items()])
+
+    def delete(self) -> None:
+        self._database._write([(self._parts, None)])
+
+    def listen(self, callback: Callable[[Event], None]) -> ListenerRegistration:
+        return self._database._add_listener(self._parts, callback)
@@ -0,0 +1,226 @@
+"""Durable write-behind queue for Firebase writes.
+
+Writes are journaled in the ``firebase_outbox`` SQLite table and the caller
+returns immediately. A background thread reads pending rows in order and
+pushes them as one multi-path ``update()`` per batch, so a slow or offline
+uplink delays replication instead of the request. Failed batches are
+retried with exponential back-off and jitter; a batch rejected as invalid
+(``ValueError``/``TypeError`` from the SDK) is retried one row at a time so
+the offending row can be parked without holding up the rest.
+
+With a ``reader``, the flusher also does the same-day duplicate check the
+request no longer waits for: before an attendance row is written, the
+record at its path is read, and if one from the same day is already there
+(marked through the web-app or another portal) the row is dropped instead
+of overwriting it.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import random
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from . import local_db
+
+LOGGER = logging.getLogger("firebase_queue")
+LOGGER.addHandler(logging.NullHandler())
+
+Writer = Callable[[Dict[str, Any]], None]
+Reader = Callable[[str], Any]
+
+_PERMANENT_ERRORS = (ValueError, TypeError)
+_PURGE_INTERVAL_SECONDS = 600.0
+
+
+def attendance_path(class_id: str, student_id: str) -> str:
+    return f"attendance/{class_id}/{student_id}"
+
+
+class FirebaseWriteQueue:
+    def __init__(
+        self,
+        db_path: Path,
+        writer: Writer,
+        *,
+        batch_size: int = 200,
+        flush_interval: float = 0.5,
+        max_backoff: float = 60.0,
+        retention_seconds: float = 2 * 24 * 3600,
+        reader: Optional[Reader] = None,
+    ) -> None:
+        self.db_path = Path(db_path)
+        self.writer = writer
+        self.reader = reader
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = max(0.01, float(flush_interval))
+        self.max_backoff = float(max_backoff)
+        self.retention_seconds = float(retention_seconds)
+        self._wake = threading.Event()
+        self._closed = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._consecutive_failures = 0
+        self._isolate = False
+        self._retry_at = 0.0
+        self._last_purge = 0.0
+        self.counters: Dict[str, Any] = {
+            "enqueued": 0,
+            "flushed": 0,
+            "batches": 0,
+            "failures": 0,
+            "parked": 0,
+            "duplicates": 0,
+            "lastError": None,
+            "lastFlushAt": None,
+            "lastReplicationLagSeconds": None,
+        }
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        # Here rather than in __init__, so that constructing the queue touches no files.
+        local_db.enable_wal(self.db_path)
+        self._thread = threading.Thread(target=self._run, name="FirebaseWriteQueue", daemon=True)
+        self._thread.start()
+
+    def close(self, drain_timeout: float = 5.0) -> None:
+        """Stop the flusher after one last attempt; anything left stays journaled."""
+        self._closed.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=drain_timeout)
+            self._thread = None
+
+    def enqueue(
+        self,
+        path: str,
+        payload: Any,
+        class_id: Optional[str] = None,
+        student_id: Optional[str] = None,
+    ) -> int:
+        """Journal ``payload`` for ``path``; raises ``LocalDatabaseError`` if it cannot be stored."""
+        sequence = local_db.enqueue_firebase_write(
+            self.db_path, path, json.dumps(payload, separators=(",", ":")), class_id, student_id, time.time()
+        )
+        with self._lock:
+            self.counters["enqueued"] += 1
+        self._wake.set()
+        return sequence
+
+    def enqueue_attendance(self, class_id: str, student_id: str, payload: Dict[str, Any]) -> int:
+        return self.enqueue(attendance_path(class_id, student_id), payload, class_id, student_id)
+
+    def find_attendance(self, class_id: str, student_id: str) -> Optional[Dict[str, Any]]:
+        """Newest attendance journaled for the student, whether or not it has replicated yet."""
+        payload = local_db.find_journaled_attendance(self.db_path, class_id, student_id)
+        return json.loads(payload) if payload else None
+
+    def stats(self) -> Dict[str, Any]:
+        outbox = local_db.get_firebase_outbox_stats(self.db_path)
+        oldest = outbox["oldestCreatedAt"]
+        with self._lock:
+            return {
+                **self.counters,
+                "depth": outbox["depth"],
+                "parkedRows": outbox["failed"],
+                # Age of the oldest write not yet in Firebase, i.e. current replication lag.
+                "replicationLagSeconds": round(time.time() - oldest, 3) if oldest else 0.0,
+                "consecutiveFailures": self._consecutive_failures,
+                "retryInSeconds": round(max(0.0, self._retry_at - time.monotonic()), 3),
+            }
+
+    def flush_once(self) -> int:
+        """Push one batch; returns the number of rows replicated."""
+        limit = 1 if self._isolate else self.batch_size
+        rows = local_db.fetch_pending_firebase_writes(self.db_path, limit)
+        if not rows:
+            return 0
+        updates: Dict[str, Any] = {}
+        ids: List[int] = [row["id"] for row in rows]
+        duplicates = 0
+        try:
+            for row in rows:
+                payload = json.loads(row["payload"])
+                if row["student_id"] and self._already_recorded(row["path"], payload):
+                    duplicates += 1
+                    LOGGER.info("Dropped %s: already marked for %s in Firebase", row["path"], payload.get("date"))
+                    continue
+                updates[row["path"]] = payload
+            if updates:
+                self.writer(updates)
+        except Exception as exc:
+            self._on_failure(ids, exc)
+            return 0
+        now = time.time()
+        local_db.mark_firebase_writes_flushed(self.db_path, ids, now)
+        with self._lock:
+            self._consecutive_failures = 0
+            self._isolate = False
+            self._retry_at = 0.0
+            self.counters["flushed"] += len(ids) - duplicates
+            self.counters["duplicates"] += duplicates
+            self.counters["batches"] += 1
+            self.counters["lastFlushAt"] = now
+            self.counters["lastReplicationLagSeconds"] = round(now - rows[0]["created_at"], 3)
+        return len(ids)
+
+    def _already_recorded(self, path: str, payload: Dict[str, Any]) -> bool:
+        """Whether Firebase already holds a different same-day record at ``path``."""
+        if self.reader is None:
+            return False
+        existing = self.reader(path)
+        if not isinstance(existing, dict) or existing.get("date") != payload.get("date"):
+            return False
+        # Our own write, replayed after a batch whose acknowledgement was lost.
+        return existing.get("timestamp") != payload.get("timestamp")
+
+    def _on_failure(self, ids: List[int], exc: Exception) -> None:
+        message = f"{type(exc).__name__}: {exc}"
+        permanent = isinstance(exc, _PERMANENT_ERRORS)
+        park = permanent and len(ids) == 1
+        local_db.record_firebase_write_failure(self.db_path, ids, message, permanent=park)
+        with self._lock:
+            self.counters["failures"] += 1
+            self.counters["lastError"] = message
+            if park:
+                self.counters["parked"] += 1
+                LOGGER.error("Parked Firebase write %s: %s", ids[0], message)
+                return
+            if permanent:
+                # Find the bad row by sending rows one at a time.
+                self._isolate = True
+                return
+            self._consecutive_failures += 1
+            backoff = min(self.max_backoff, self.flush_interval * 2 ** self._consecutive_failures)
+            self._retry_at = time.monotonic() + backoff * random.uniform(0.5, 1.0)
+        LOGGER.warning("Firebase batch of %s write(s) failed: %s", len(ids), message)
+
+    def _purge(self) -> None:
+        if time.monotonic() - self._last_purge < _PURGE_INTERVAL_SECONDS:
+            return
+        self._last_purge = time.monotonic()
+        local_db.purge_flushed_firebase_writes(self.db_path, time.time() - self.retention_seconds)
+
+    def _run(self) -> None:
+        while True:
+            delay = max(self.flush_interval, self._retry_at - time.monotonic())
+            self._wake.wait(delay)
+            self._wake.clear()
+            if time.monotonic() < self._retry_at and not self._closed.is_set():
+                continue
+            try:
+                # Drain while full batches keep coming back.
+                while self.flush_once() >= self.batch_size:
+                    pass
+                self._purge()
+            except local_db.LocalDatabaseError as exc:
+                LOGGER.warning("Firebase queue journal error: %s", exc)
+            except Exception:
+                LOGGER.exception("Firebase queue flush failed")
+            if self._closed.is_set():
+                return
@@ -1,71 +1,378 @@
-"""Windows firewall helpers for captive portal access control."""
+"""Firewall helpers for captive portal access control.
+
+Access is granted through a :class:`FirewallBackend`:
+
+* ``windows`` — one outbound allow rule per student via PowerShell (the
+  original behaviour), batched into a single PowerShell process per call.
+* ``nftables`` — allowed clients live in one nftables set, so rule
+  evaluation is a single set lookup and a batch is one ``nft -f`` run.
+* ``ipset`` — the same idea for iptables hosts, one ``ipset restore`` per batch.
+* ``dry-run`` — records operations in memory; needs no privileges and is used
+  for tests and grant-throughput benchmarks.
+"""
 
 from __future__ import annotations
 
+import ipaddress
+import json
 import platform
+import shutil
 import subprocess
-from typing import Optional
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
 
 
 class FirewallError(RuntimeError):
     """Raised when a firewall command fails."""
 
 
+# (ip_address, student_id)
+GrantEntry = Tuple[str, str]
+CommandRunner = Callable[[Sequence[str], Optional[str]], str]
+
+BACKENDS = ("windows", "nftables", "ipset", "dry-run")
+
+
 def _windows_only() -> None:
     if platform.system() != "Windows":
         raise FirewallError("Firewall automation is only supported on Windows hosts.")
 
 
-def _run_powershell(command: str) -> None:
-    completed = subprocess.run(
-        ["powershell", "-NoProfile", "-ExecutionPolicy", "Bypass", "-Command", command],
-        check=False,
-        capture_output=True,
-        text=True,
-    )
+def run_command(args: Sequence[str], input_text: Optional[str] = None) -> str:
+    try:
+        completed = subprocess.run(
+            list(args),
+            input=input_text,
+            check=False,
+            capture_output=True,
+            text=True,
+        )
+    except OSError as exc:
+        raise FirewallError(str(exc)) from exc
     if completed.returncode != 0:
         raise FirewallError(completed.stderr.strip() or "Firewall command failed.")
+    return completed.stdout
+
+
+def _run_powershell(command: str, runner: CommandRunner = run_command) -> str:
+    return runner(["powershell", "-NoProfile", "-ExecutionPolicy", "Bypass", "-Command", command], None)
 
 
 def _rule_name(rule_prefix: str, student_id: str, ip_address: str) -> str:
     safe_ip = ip_address.replace(".", "_")
-    safe_student = student_id.replace(" ", "_")
+    safe_student = student_id.replace(" ", "_").replace("'", "")
     return f"{rule_prefix}_{safe_student}_{safe_ip}"
 
 
-def grant_internet_access(ip_address: str, student_id: str, rule_prefix: str) -> bool:
-    """Create (or refresh) a firewall rule allowing outbound traffic for the IP."""
-    try:
-        _windows_only()
-    except FirewallError:
-        return False
+def _valid_entries(entries: Iterable[GrantEntry]) -> List[GrantEntry]:
+    """Drop entries whose address is not a literal IPv4 address.
 
-    rule = _rule_name(rule_prefix, student_id, ip_address)
-    try:
-        _run_powershell(
-            f"Remove-NetFirewallRule -DisplayName '{rule}' -ErrorAction SilentlyContinue"
+    Addresses end up inside shell scripts and nft/ipset input, so anything
+    else is rejected rather than quoted.
+    """
+    valid: List[GrantEntry] = []
+    for ip_address, student_id in entries:
+        try:
+            parsed = ipaddress.ip_address(str(ip_address).strip())
+        except ValueError:
+            continue
+        if parsed.version == 4:
+            valid.append((str(parsed), str(student_id) if student_id else ""))
+    return valid
+
+
+class FirewallBackend:
+    """Grants and revokes outbound access for client IP addresses."""
+
+    name = "base"
+
+    def prepare(self) -> None:
+        """Create whatever tables, sets or rules the backend relies on."""
+
+    def grant_many(self, entries: Sequence[GrantEntry]) -> bool:
+        raise NotImplementedError
+
+    def revoke_many(self, entries: Sequence[GrantEntry]) -> bool:
+        raise NotImplementedError
+
+    def list_allowed(self) -> Optional[Set[str]]:
+        """Return the currently allowed IPs, or ``None`` if the backend cannot tell."""
+        return None
+
+    def grant(self, ip_address: str, student_id: str) -> bool:
+        return self.grant_many([(ip_address, student_id)])
+
+    def revoke(self, ip_address: str, student_id: str) -> bool:
+        return self.revoke_many([(ip_address, student_id)])
+
+
+class WindowsFirewallBackend(FirewallBackend):
+    name = "windows"
+
+    def __init__(self, rule_prefix: str = "Attendance", runner: CommandRunner = run_command) -> None:
+        self.rule_prefix = rule_prefix
+        self._runner = runner
+
+    def grant_many(self, entries: Sequence[GrantEntry]) -> bool:
+        try:
+            _windows_only()
+        except FirewallError:
+            return False
+        valid = _valid_entries(entries)
+        if not valid:
+            return not entries
+        commands: List[str] = []
+        for ip_address, student_id in valid:
+            rule = _rule_name(self.rule_prefix, student_id or "anonymous", ip_address)
+            commands.append(f"Remove-NetFirewallRule -DisplayName '{rule}' -ErrorAction SilentlyContinue")
+            commands.append(
+                "New-NetFirewallRule "
+                f"-DisplayName '{rule}' "
+                "-Direction Outbound "
+                f"-RemoteAddress {ip_address} "
+                "-Action Allow | Out-Null"
+            )
+        try:
+            _run_powershell("; ".join(commands), self._runner)
+            return True
+        except FirewallError:
+            return False
+
+    def revoke_many(self, entries: Sequence[GrantEntry]) -> bool:
+        try:
+            _windows_only()
+        except FirewallError:
+            return False
+        valid = _valid_entries(entries)
+        if not valid:
+            return not entries
+        # Without a student ID (e.g. state reconciled from existing rules),
+        # remove every rule for the address.
+        commands = [
+            f"Remove-NetFirewallRule -DisplayName '{_rule_name(self.rule_prefix, student_id or '*', ip_address)}' "
+            "-ErrorAction SilentlyContinue"
+            for ip_address, student_id in valid
+        ]
+        try:
+            _run_powershell("; ".join(commands), self._runner)
+            return True
+        except FirewallError:
+            return False
+
+    def list_allowed(self) -> Optional[Set[str]]:
+        try:
+            _windows_only()
+            output = _run_powershell(
+                f"Get-NetFirewallRule -DisplayName '{self.rule_prefix}_*' -ErrorAction SilentlyContinue "
+                "| Get-NetFirewallAddressFilter | Select-Object -ExpandProperty RemoteAddress",
+                self._runner,
+            )
+        except FirewallError:
+            return None
+        return {ip for ip, _ in _valid_entries((line.strip(), "") for line in output.splitlines())}
+
+
+class NftablesBackend(FirewallBackend):
+    """Keeps allowed clients in a single ``ipv4_addr`` nftables set.
+
+    :meth:`prepare` creates the table and set and, when ``lan_interface`` is
+    given, a forward-chain rule dropping traffic from that interface unless
+    the source address is in the set.
+    """
+
+    name = "nftables"
+
+    def __init__(
+        self,
+        table: str = "uninet_attendance",
+        set_name: str = "allowed_clients",
+        lan_interface: Optional[str] = None,
+        runner: CommandRunner = run_command,
+    ) -> None:
+        self.table = table
+        self.set_name = set_name
+        self.lan_interface = lan_interface
+        self._runner = runner
+
+    def _apply(self, script: str) -> bool:
+        try:
+            self._runner(["nft", "-f", "-"], script)
+            return True
+        except FirewallError:
+            return False
+
+    def prepare(self) -> None:
+        script = [
+            f"add table inet {self.table}",
+            f"add set inet {self.table} {self.set_name} {{ type ipv4_addr; }}",
+        ]
+        if self.lan_interface:
+            script += [
+                f"add chain inet {self.table} forward {{ type filter hook forward priority 0; policy accept; }}",
+                f"flush chain inet {self.table} forward",
+                f'add rule inet {self.table} forward iifname "{self.lan_interface}" '
+                f"ip saddr != @{self.set_name} drop",
+            ]
+        self._runner(["nft", "-f", "-"], "\n".join(script) + "\n")
+
+    def _elements(self, entries: Sequence[GrantEntry]) -> str:
+        return ", ".join(sorted({ip for ip, _ in _valid_entries(entries)}))
+
+    def grant_many(self, entries: Sequence[GrantEntry]) -> bool:
+        elements = self._elements(entries)
+        if not elements:
+            return not entries
+        return self._apply(f"add element inet {self.table} {self.set_name} {{ {elements} }}\n")
+
+    def revoke_many(self, entries: Sequence[GrantEntry]) -> bool:
+        elements = self._elements(entries)
+        if not elements:
+            return not entries
+        # "delete" fails for absent elements and would abort the whole
+        # transaction; adding first makes the batch idempotent.
+        return self._apply(
+            f"add element inet {self.table} {self.set_name} {{ {elements} }}\n"
+            f"delete element inet {self.table} {self.set_name} {{ {elements} }}\n"
         )
-        _run_powershell(
-            "New-NetFirewallRule "
-            f"-DisplayName '{rule}' "
-            "-Direction Outbound "
-            f"-RemoteAddress {ip_address} "
-            "-Action Allow"
+
+    def list_allowed(self) -> Optional[Set[str]]:
+        try:
+            output = self._runner(["nft", "-j", "list", "set", "inet", self.table, self.set_name], None)
+            payload = json.loads(output)
+        except (FirewallError, ValueError):
+            return None
+        allowed: Set[str] = set()
+        for item in payload.get("nftables", []):
+            for element in (item.get("set") or {}).get("elem", []) or []:
+                if isinstance(element, str):
+                    allowed.add(element)
+                elif isinstance(element, dict) and isinstance(element.get("elem"), dict):
+                    allowed.add(str(element["elem"].get("val")))
+        return allowed
+
+
+class IpsetBackend(FirewallBackend):
+    """Keeps allowed clients in a ``hash:ip`` ipset referenced by iptables rules."""
+
+    name = "ipset"
+
+    def __init__(self, set_name: str = "uninet_allowed", runner: CommandRunner = run_command) -> None:
+        self.set_name = set_name
+        self._runner = runner
+
+    def _restore(self, lines: List[str]) -> bool:
+        try:
+            self._runner(["ipset", "restore"], "\n".join(lines) + "\n")
+            return True
+        except FirewallError:
+            return False
+
+    def prepare(self) -> None:
+        self._runner(["ipset", "restore"], f"-exist create {self.set_name} hash:ip\n")
+
+    def grant_many(self, entries: Sequence[GrantEntry]) -> bool:
+        valid = _valid_entries(entries)
+        if not valid:
+            return not entries
+        return self._restore([f"-exist add {self.set_name} {ip}" for ip, _ in valid])
+
+    def revoke_many(self, entries: Sequence[GrantEntry]) -> bool:
+        valid = _valid_entries(entries)
+        if not valid:
+            return not entries
+        return self._restore([f"-exist del {self.set_name} {ip}" for ip, _ in valid])
+
+    def list_allowed(self) -> Optional[Set[str]]:
+        try:
+            output = self._runner(["ipset", "save", self.set_name], None)
+        except FirewallError:
+            return None
+        prefix = f"add {self.set_name} "
+        return {line[len(prefix):].strip() for line in output.splitlines() if line.startswith(prefix)}
+
+
+class RecordingBackend(FirewallBackend):
+    """Dry-run backend that only records what would have been applied.
+
+    ``batch_latency`` simulates the fixed cost of one real firewall call so
+    benchmarks can compare per-grant and batched application.
+    """
+
+    name = "dry-run"
+
+    def __init__(self, batch_latency: float = 0.0) -> None:
+        self.batch_latency = float(batch_latency)
+        self.allowed: Dict[str, str] = {}
+        self.operations: List[Tuple[str, int]] = []
+        self._lock = threading.Lock()
+
+    def _record(self, operation: str, count: int) -> None:
+        if self.batch_latency:
+            time.sleep(self.batch_latency)
+        self.operations.append((operation, count))
+
+    def grant_many(self, entries: Sequence[GrantEntry]) -> bool:
+        valid = _valid_entries(entries)
+        with self._lock:
+            self._record("grant", len(valid))
+            for ip_address, student_id in valid:
+                self.allowed[ip_address] = student_id
+        return bool(valid) or not entries
+
+    def revoke_many(self, entries: Sequence[GrantEntry]) -> bool:
+        valid = _valid_entries(entries)
+        with self._lock:
+            self._record("revoke", len(valid))
+            for ip_address, _ in valid:
+                self.allowed.pop(ip_address, None)
+        return bool(valid) or not entries
+
+    def list_allowed(self) -> Optional[Set[str]]:
+        with self._lock:
+            return set(self.allowed)
+
+
+def get_backend(config: Optional[Dict[str, Any]] = None, runner: CommandRunner = run_command) -> FirewallBackend:
+    """Build the backend selected by the ``firewall`` section of the network settings.
+
+    ``backend`` defaults to ``auto``: Windows hosts use the PowerShell rules,
+    Linux hosts nftables when ``nft`` is installed (else ipset), anything
+    else the dry-run recorder.
+    """
+    config = config or {}
+    choice = str(config.get("backend", "auto")).lower()
+    if choice == "auto":
+        system = platform.system()
+        if system == "Windows":
+            choice = "windows"
+        elif system == "Linux" and shutil.which("nft"):
+            choice = "nftables"
+        elif system == "Linux" and shutil.which("ipset"):
+            choice = "ipset"
+        else:
+            choice = "dry-run"
+
+    if choice == "windows":
+        return WindowsFirewallBackend(config.get("rule_prefix", "Attendance"), runner=runner)
+    if choice == "nftables":
+        return NftablesBackend(
+            table=config.get("nft_table", "uninet_attendance"),
+            set_name=config.get("nft_set", "allowed_clients"),
+            lan_interface=config.get("lan_interface"),
+            runner=runner,
         )
-        return True
-    except FirewallError:
-        return False
+    if choice == "ipset":
+        return IpsetBackend(config.get("ipset_name", "uninet_allowed"), runner=runner)
+    if choice == "dry-run":
+        return RecordingBackend()
+    raise FirewallError(f"Unknown firewall backend '{choice}'. Expected one of: {', '.join(BACKENDS)}")
 
 
-def revoke_internet_access(ip_address: str, student_id: str, rule_prefix: str) -> bool:
-    try:
-        _windows_only()
-    except FirewallError:
-        return False
+def grant_internet_access(ip_address: str, student_id: str, rule_prefix: str) -> bool:
+    """Create (or refresh) a firewall rule allowing outbound traffic for the IP."""
+    return WindowsFirewallBackend(rule_prefix).grant(ip_address, student_id)
 
-    rule = _rule_name(rule_prefix, student_id, ip_address)
-    try:
-        _run_powershell(f"Remove-NetFirewallRule -DisplayName '{rule}' -ErrorAction SilentlyContinue")
-        return True
-    except FirewallError:
-        return False
+
+def revoke_internet_access(ip_address: str, student_id: str, rule_prefix: str) -> bool:
+    return WindowsFirewallBackend(rule_prefix).revoke(ip_address, student_id)
@@ -0,0 +1,355 @@
+"""Coalescing scheduler that applies firewall grants and revokes in batches.
+
+HTTP handlers only record an intent; a background thread wakes every
+``flush_interval`` seconds, collapses the intents gathered since the last
+batch (the newest intent per IP wins), drops re-grants for addresses that
+are already allowed and hands the rest to the firewall backend in one
+``grant_many``/``revoke_many`` call each. Granted addresses can carry an
+expiry; a hashed timer wheel turns expiries into revoke intents.
+
+Only literal IPv4 addresses are queued, since the backends reject anything
+else. A failed batch is retried after a back-off, and an address whose
+batch has failed ``max_attempts`` times in a row is dropped.
+"""
+
+from __future__ import annotations
+
+import ipaddress
+import logging
+import math
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from .firewall import FirewallBackend
+
+LOGGER = logging.getLogger("grant_scheduler")
+LOGGER.addHandler(logging.NullHandler())
+
+_GRANT = "grant"
+_REVOKE = "revoke"
+
+
+def _parse_ip(ip_address: Any) -> Optional[str]:
+    """Return ``ip_address`` in canonical form if it is a literal IPv4 address, else ``None``."""
+    try:
+        parsed = ipaddress.ip_address(str(ip_address).strip())
+    except ValueError:
+        return None
+    return str(parsed) if parsed.version == 4 else None
+
+
+class TimerWheel:
+    """Hashed timer wheel with ``tick``-second slots.
+
+    Scheduling and cancelling are O(1); :meth:`advance` only visits the slots
+    whose time has passed. A key that is rescheduled keeps just its newest
+    deadline; stale slot entries are ignored when they fire.
+    """
+
+    def __init__(self, tick: float = 1.0, slots: int = 512) -> None:
+        self.tick = float(tick)
+        self._slots: List[Set[str]] = [set() for _ in range(int(slots))]
+        self._deadlines: Dict[str, float] = {}
+        self._cursor = int(time.time() // self.tick)
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def _slot_for(self, deadline: float) -> int:
+        # Round up so a slot only fires once all of its deadlines have passed.
+        return math.ceil(deadline / self.tick)
+
+    def schedule(self, key: str, deadline: float) -> None:
+        self._deadlines[key] = deadline
+        slot_index = max(self._slot_for(deadline), self._cursor)
+        self._slots[slot_index % len(self._slots)].add(key)
+
+    def cancel(self, key: str) -> None:
+        self._deadlines.pop(key, None)
+
+    def deadline(self, key: str) -> Optional[float]:
+        return self._deadlines.get(key)
+
+    def advance(self, now: float) -> List[str]:
+        expired: List[str] = []
+        target = int(now // self.tick)
+        # Never walk more than one full turn; every slot is covered by then.
+        start = max(self._cursor, target - len(self._slots) + 1)
+        for tick_index in range(start, target + 1):
+            slot = self._slots[tick_index % len(self._slots)]
+            if not slot:
+                continue
+            keep: Set[str] = set()
+            for key in slot:
+                deadline = self._deadlines.get(key)
+                if deadline is None:
+                    continue
+                if deadline <= now:
+                    expired.append(key)
+                    del self._deadlines[key]
+                elif self._slot_for(deadline) % len(self._slots) == tick_index % len(self._slots):
+                    keep.add(key)  # belongs to a later turn of the wheel
+            slot.clear()
+            slot.update(keep)
+        self._cursor = target + 1
+        return expired
+
+
+class GrantScheduler:
+    """Queues grant/revoke intents and applies them to ``backend`` in batches."""
+
+    def __init__(
+        self,
+        backend: FirewallBackend,
+        *,
+        flush_interval: float = 0.25,
+        default_lifetime: Optional[float] = None,
+        max_attempts: int = 5,
+    ) -> None:
+        self.backend = backend
+        self.flush_interval = max(0.01, float(flush_interval))
+        self.default_lifetime = default_lifetime
+        self.max_attempts = max(1, int(max_attempts))
+        self._intents: Dict[str, Tuple[str, str, Optional[float]]] = {}
+        # Failed batches each address has been part of since its last new intent.
+        self._attempts: Dict[str, int] = {}
+        self._allowed: Dict[str, str] = {}
+        self._wheel = TimerWheel()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._consecutive_failures = 0
+        self._retry_at = 0.0
+        self.counters = {
+            "granted": 0,
+            "revoked": 0,
+            "expired": 0,
+            "skipped": 0,
+            "batches": 0,
+            "failures": 0,
+            "rejected": 0,
+            "dropped": 0,
+        }
+
+    def reconcile(self) -> int:
+        """Seed the state table from the addresses the backend already allows."""
+        allowed = self.backend.list_allowed()
+        if allowed is None:
+            return 0
+        now = time.time()
+        with self._lock:
+            self._allowed = {ip_address: "" for ip_address in allowed}
+            if self.default_lifetime:
+                for ip_address in allowed:
+                    self._wheel.schedule(ip_address, now + self.default_lifetime)
+        return len(allowed)
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        try:
+            reconciled = self.reconcile()
+            if reconciled:
+                LOGGER.info("Reconciled %s allowed client(s) from the %s backend", reconciled, self.backend.name)
+        except Exception:
+            LOGGER.exception("Unable to reconcile firewall state")
+        self._thread = threading.Thread(target=self._run, name="GrantScheduler", daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        self._closed.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush(force=True)
+
+    def _reject(self, ip_address: Any) -> bool:
+        LOGGER.warning("Ignoring firewall intent for %r: not an IPv4 address", ip_address)
+        with self._lock:
+            self.counters["rejected"] += 1
+        return False
+
+    def request_grant(self, ip_address: str, student_id: str, expires_at: Optional[float] = None) -> bool:
+        """Queue a grant; ``expires_at`` is a Unix timestamp after which access is revoked.
+
+        Returns ``False`` (and queues nothing) when ``ip_address`` is not an IPv4 address.
+        """
+        address = _parse_ip(ip_address)
+        if address is None:
+            return self._reject(ip_address)
+        if expires_at is None and self.default_lifetime:
+            expires_at = time.time() + self.default_lifetime
+        with self._lock:
+            self._intents[address] = (_GRANT, student_id or "anonymous", expires_at)
+            self._attempts.pop(address, None)
+        return True
+
+    def request_revoke(self, ip_address: str, student_id: str = "") -> bool:
+        address = _parse_ip(ip_address)
+        if address is None:
+            return self._reject(ip_address)
+        with self._lock:
+            self._intents[address] = (_REVOKE, student_id, None)
+            self._attempts.pop(address, None)
+        self._wake.set()
+        return True
+
+    def is_allowed(self, ip_address: str) -> bool:
+        with self._lock:
+            return _parse_ip(ip_address) in self._allowed
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                **self.counters,
+                "pending": len(self._intents),
+                "allowed": len(self._allowed),
+                "scheduledExpiries": len(self._wheel),
+            }
+
+    def flush(self, force: bool = False) -> None:
+        now = time.time()
+        with self._lock:
+            if now < self._retry_at and not force:
+                return
+            for ip_address in self._wheel.advance(now):
+                if ip_address not in self._intents:
+                    self._intents[ip_address] = (_REVOKE, self._allowed.get(ip_address, ""), None)
+                    self.counters["expired"] += 1
+            intents, self._intents = self._intents, {}
+
+            grants: List[Tuple[str, str]] = []
+            revokes: List[Tuple[str, str]] = []
+            for ip_address, (action, student_id, expires_at) in intents.items():
+                if action == _GRANT:
+                    if expires_at is not None:
+                        self._wheel.schedule(ip_address, expires_at)
+                    else:
+                        self._wheel.cancel(ip_address)
+                    if ip_address in self._allowed:
+                        self.counters["skipped"] += 1
+                        continue
+                    grants.append((ip_address, student_id))
+                else:
+                    self._wheel.cancel(ip_address)
+                    if ip_address not in self._allowed:
+                        self.counters["skipped"] += 1
+                        continue
+                    revokes.append((ip_address, student_id or self._allowed.get(ip_address, "")))
+
+        if grants:
+            self._apply(_GRANT, grants, intents)
+        if revokes:
+            self._apply(_REVOKE, revokes, intents)
+
+    def _apply(
+        self,
+        action: str,
+        entries: List[Tuple[str, str]],
+        intents: Dict[str, Tuple[str, str, Optional[float]]],
+    ) -> None:
+        try:
+            if action == _GRANT:
+                applied = self.backend.grant_many(entries)
+            else:
+                applied = self.backend.revoke_many(entries)
+        except Exception:
+            LOGGER.exception("Firewall %s batch failed", action)
+            applied = False
+
+        with self._lock:
+            self.counters["batches"] += 1
+            if not applied:
+                self.counters["failures"] += 1
+                self._consecutive_failures += 1
+                backoff = min(30.0, self.flush_interval * 2 ** self._consecutive_failures)
+                self._retry_at = time.time() + backoff
+                # Retry after the back-off unless a newer intent arrived meanwhile,
+                # giving up on addresses that have failed too often to hold back the rest.
+                for ip_address, _ in entries:
+                    if ip_address in self._intents:
+                        continue
+                    attempts = self._attempts.get(ip_address, 0) + 1
+                    if attempts >= self.max_attempts:
+                        self._attempts.pop(ip_address, None)
+                        self.counters["dropped"] += 1
+                        LOGGER.error("Dropping firewall %s for %s after %s failed attempts", action, ip_address, attempts)
+                        continue
+                    self._attempts[ip_address] = attempts
+                    self._intents[ip_address] = intents[ip_address]
+                return
+            self._consecutive_failures = 0
+            for ip_address, student_id in entries:
+                self._attempts.pop(ip_address, None)
+                if action == _GRANT:
+                    self._allowed[ip_address] = student_id
+                else:
+                    self._allowed.pop(ip_address, None)
+            self.counters["granted" if action == _GRANT else "revoked"] += len(entries)
+
+    def _run(self) -> None:
+        while not self._closed.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                LOGGER.exception("Grant scheduler flush failed")
+
+
+class GrantRelay:
+    """Stand-in for :class:`GrantScheduler` in a worker process.
+
+    Intents are put on ``channel`` (a ``multiprocessing`` queue) and applied
+    by :func:`relay_intents` running next to the real scheduler.
+    """
+
+    def __init__(self, channel: Any) -> None:
+        self._channel = channel
+        self.relayed = 0
+
+    def request_grant(self, ip_address: str, student_id: str, expires_at: Optional[float] = None) -> bool:
+        address = _parse_ip(ip_address)
+        if address is None:
+            LOGGER.warning("Ignoring firewall intent for %r: not an IPv4 address", ip_address)
+            return False
+        self._channel.put((_GRANT, address, student_id, expires_at))
+        self.relayed += 1
+        return True
+
+    def request_revoke(self, ip_address: str, student_id: str = "") -> bool:
+        address = _parse_ip(ip_address)
+        if address is None:
+            LOGGER.warning("Ignoring firewall intent for %r: not an IPv4 address", ip_address)
+            return False
+        self._channel.put((_REVOKE, address, student_id, None))
+        self.relayed += 1
+        return True
+
+    def stats(self) -> Dict[str, int]:
+        return {"relayed": self.relayed}
+
+
+def relay_intents(channel: Any, scheduler: GrantScheduler) -> threading.Thread:
+    """Apply intents from worker processes to ``scheduler`` until ``None`` is received."""
+
+    def run() -> None:
+        while True:
+            try:
+                item = channel.get()
+            except (EOFError, OSError):
+                return
+            if item is None:
+                return
+            action, ip_address, student_id, expires_at = item
+            if action == _GRANT:
+                scheduler.request_grant(ip_address, student_id, expires_at)
+            else:
+                scheduler.request_revoke(ip_address, student_id)
+
+    thread = threading.Thread(target=run, name="GrantRelay", daemon=True)
+    thread.start()
+    return thread
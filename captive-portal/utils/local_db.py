@@ -3,12 +3,15 @@
 from __future__ import annotations
 
 import sqlite3
+import time
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional
 
 from werkzeug.security import check_password_hash, generate_password_hash
 
+from .sql_trace import SqlTracer, TracedConnection
+
 SCHEMA_SQL = """
 CREATE TABLE IF NOT EXISTS attendance_codes (
 	id TEXT PRIMARY KEY,
@@ -84,6 +87,35 @@ CREATE TABLE IF NOT EXISTS face_captures (
 	created_at TEXT NOT NULL,
 	FOREIGN KEY (student_id) REFERENCES students(id) ON DELETE CASCADE
 );
+
+CREATE TABLE IF NOT EXISTS dns_queries (
+	id INTEGER PRIMARY KEY AUTOINCREMENT,
+	timestamp INTEGER NOT NULL,
+	client_ip TEXT NOT NULL,
+	qname_hash INTEGER NOT NULL,
+	qtype INTEGER NOT NULL,
+	decision INTEGER NOT NULL,
+	latency_ms REAL
+);
+
+CREATE TABLE IF NOT EXISTS firebase_outbox (
+	id INTEGER PRIMARY KEY AUTOINCREMENT,
+	path TEXT NOT NULL,
+	payload TEXT NOT NULL,
+	class_id TEXT,
+	student_id TEXT,
+	created_at REAL NOT NULL,
+	attempts INTEGER NOT NULL DEFAULT 0,
+	last_error TEXT,
+	failed INTEGER NOT NULL DEFAULT 0,
+	flushed_at REAL
+);
+
+CREATE TABLE IF NOT EXISTS portal_sessions (
+	id TEXT PRIMARY KEY,
+	data TEXT NOT NULL,
+	expires_at REAL NOT NULL
+);
 """
 
 _OPTIONAL_COLUMNS: Dict[str, Dict[str, str]] = {
@@ -142,9 +174,53 @@ class LocalDatabaseError(RuntimeError):
 	"""Raised when an SQLite operation fails."""
 
 
+_TRACER: Optional[SqlTracer] = None
+
+
+def configure_tracing(tracer: Optional[SqlTracer]) -> None:
+	"""Report every statement run by this module to ``tracer``; ``None`` turns tracing off."""
+	global _TRACER
+	_TRACER = tracer
+
+
+_LOCK_WAIT_OBSERVER: Optional[Callable[[str, float], None]] = None
+
+
+def configure_lock_wait_observer(observer: Optional[Callable[[str, float], None]]) -> None:
+	"""Call ``observer(function, seconds)`` with the time each ``BEGIN IMMEDIATE`` waited for the write lock."""
+	global _LOCK_WAIT_OBSERVER
+	_LOCK_WAIT_OBSERVER = observer
+
+
+def _begin_immediate(conn: sqlite3.Connection, function: str) -> None:
+	started = time.perf_counter()
+	try:
+		conn.execute("BEGIN IMMEDIATE")
+	finally:
+		observer = _LOCK_WAIT_OBSERVER
+		if observer is not None:
+			observer(function, time.perf_counter() - started)
+
+
+def tracing_stats(sort: str = "totalMs", limit: int = 50, reset: bool = False) -> Optional[Dict[str, Any]]:
+	"""Per-statement aggregates from the active tracer, or ``None`` when tracing is off."""
+	tracer = _TRACER
+	if tracer is None:
+		return None
+	stats = tracer.stats(sort, limit)
+	if reset:
+		tracer.reset()
+	return stats
+
+
 def _connect(db_path: Path) -> sqlite3.Connection:
 	db_path.parent.mkdir(parents=True, exist_ok=True)
-	conn = sqlite3.connect(db_path)
+	tracer = _TRACER
+	if tracer is not None:
+		conn = sqlite3.connect(db_path, factory=TracedConnection)
+		conn.tracer = tracer
+	else:
+		conn = sqlite3.connect(db_path)
 	conn.row_factory = sqlite3.Row
 	conn.execute("PRAGMA foreign_keys = ON;")
 	return conn
@@ -165,12 +241,31 @@ def _ensure_indexes(conn: sqlite3.Connection) -> None:
 	conn.execute(
 		"CREATE INDEX IF NOT EXISTS idx_attendance_student ON attendance(student_id)"
 	)
+	conn.execute(
+		"CREATE INDEX IF NOT EXISTS idx_attendance_date_device ON attendance(date, device_fingerprint)"
+	)
 	conn.execute(
 		"CREATE INDEX IF NOT EXISTS idx_timetable_teacher_day ON timetable(teacher_id, day)"
 	)
 	conn.execute(
 		"CREATE INDEX IF NOT EXISTS idx_face_captures_student ON face_captures(student_id, created_at)"
 	)
+	conn.execute(
+		"CREATE INDEX IF NOT EXISTS idx_dns_queries_timestamp ON dns_queries(timestamp)"
+	)
+	conn.execute(
+		"CREATE INDEX IF NOT EXISTS idx_dns_queries_client ON dns_queries(client_ip, timestamp)"
+	)
+	conn.execute(
+		"CREATE INDEX IF NOT EXISTS idx_portal_sessions_expiry ON portal_sessions(expires_at)"
+	)
+	conn.execute(
+		"CREATE INDEX IF NOT EXISTS idx_firebase_outbox_pending ON firebase_outbox(id) "
+		"WHERE flushed_at IS NULL AND failed = 0"
+	)
+	conn.execute(
+		"CREATE INDEX IF NOT EXISTS idx_firebase_outbox_student ON firebase_outbox(class_id, student_id, id)"
+	)
 
 
 def _ensure_schema(conn: sqlite3.Connection) -> None:
@@ -179,6 +274,27 @@ def _ensure_schema(conn: sqlite3.Connection) -> None:
 	_ensure_indexes(conn)
 
 
+def ping(db_path: Path) -> float:
+	"""Seconds taken to open a connection and run a trivial query."""
+	started = time.perf_counter()
+	try:
+		with _connect(Path(db_path)) as conn:
+			conn.execute("SELECT 1").fetchone()
+	except sqlite3.Error as err:
+		raise LocalDatabaseError(str(err)) from err
+	return time.perf_counter() - started
+
+
+def enable_wal(db_path: Path) -> None:
+	"""Switch the database to WAL so journal appends do not block on concurrent readers."""
+	db_path = Path(db_path)
+	try:
+		with _connect(db_path) as conn:
+			conn.execute("PRAGMA journal_mode=WAL").fetchone()
+	except sqlite3.Error as err:
+		raise LocalDatabaseError(str(err)) from err
+
+
 def _now_ts_ms() -> int:
 	return int(datetime.now(tz=timezone.utc).timestamp() * 1000)
 
@@ -475,31 +591,157 @@ def get_face_capture(db_path: Path, capture_id: int) -> Optional[Dict[str, Any]]
 		raise LocalDatabaseError(str(err)) from err
 
 
-def mark_attendance(db_path: Path, class_id: str, student_id: str, payload: Dict[str, Any]) -> None:
+ATTENDANCE_CAPTURE_NOT_FOUND = "capture_not_found"
+ATTENDANCE_CAPTURE_MISMATCH = "capture_mismatch"
+ATTENDANCE_ALREADY_MARKED = "already_marked"
+ATTENDANCE_DEVICE_USED = "device_used"
+ATTENDANCE_BUSY = "busy"
+# SQLite's message for a second mark slipping past the check (the UNIQUE key of ``attendance``).
+_ATTENDANCE_KEY_VIOLATION = "UNIQUE constraint failed: attendance.class_id, attendance.student_id, attendance.date"
+
+
+class AttendanceError(LocalDatabaseError):
+	"""``record_attendance`` refused the mark; ``code`` is one of the ``ATTENDANCE_*`` constants."""
+
+	def __init__(self, code: str, message: str) -> None:
+		super().__init__(message)
+		self.code = code
+
+
+def record_attendance(
+	db_path: Path,
+	class_id: str,
+	student_id: str,
+	payload: Dict[str, Any],
+	face_capture_id: Optional[int] = None,
+) -> Dict[str, Any]:
+	"""Check and store one attendance mark in a single ``BEGIN IMMEDIATE`` transaction.
+
+	In order: the face capture (when ``face_capture_id`` is given) must exist
+	and belong to ``student_id``; the student must not be marked in this
+	class on ``payload["date"]``; the device fingerprint must not have been
+	used that day. Each failure raises :class:`AttendanceError` with its own
+	code, as does a write lock that is not released within the busy timeout.
+	Returns the stored row, with ``face_capture_path`` from the capture.
+	"""
 	db_path = Path(db_path)
+	fingerprint = (payload.get("deviceFingerprint") or "").strip()
+	date = payload.get("date")
 	try:
 		with _connect(db_path) as conn:
 			_ensure_schema(conn)
-			fingerprint = (payload.get("deviceFingerprint") or "").strip()
-			if fingerprint and payload.get("date"):
-				existing_device = conn.execute(
-					"SELECT 1 FROM attendance WHERE device_fingerprint = ? AND date = ?",
-					(fingerprint, payload.get("date")),
+			_begin_immediate(conn, "record_attendance")
+			try:
+				if face_capture_id is not None:
+					capture = conn.execute(
+						"SELECT student_id FROM face_captures WHERE id = ?",
+						(int(face_capture_id),),
+					).fetchone()
+					if not capture:
+						raise AttendanceError(ATTENDANCE_CAPTURE_NOT_FOUND, "Face capture not found. Capture again.")
+					if capture["student_id"] != str(student_id).strip().lower():
+						raise AttendanceError(ATTENDANCE_CAPTURE_MISMATCH, "Face capture belongs to a different roll number.")
+				if conn.execute(
+					"SELECT 1 FROM attendance WHERE class_id = ? AND student_id = ? AND date = ?",
+					(class_id, student_id, date),
+				).fetchone():
+					raise AttendanceError(ATTENDANCE_ALREADY_MARKED, "Attendance already recorded for today.")
+				if fingerprint and date and conn.execute(
+					"SELECT 1 FROM attendance WHERE date = ? AND device_fingerprint = ?",
+					(date, fingerprint),
+				).fetchone():
+					raise AttendanceError(
+						ATTENDANCE_DEVICE_USED, "This device has already been used to mark attendance today."
+					)
+				cursor = conn.execute(
+					"""
+					INSERT INTO attendance (
+						class_id, student_id, timestamp, marked_at, date, subject, code,
+						manual_entry, teacher_name, department, marked_via, email, name, device_fingerprint, face_capture_id
+					) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+					""",
+					(
+						class_id,
+						student_id,
+						int(payload.get("timestamp", _now_ts_ms())),
+						payload.get("markedAt", datetime.now(tz=timezone.utc).isoformat()),
+						date,
+						payload.get("subject"),
+						payload.get("code"),
+						1 if payload.get("manualEntry") else 0,
+						payload.get("teacherName"),
+						payload.get("department"),
+						payload.get("markedVia"),
+						payload.get("email"),
+						payload.get("name"),
+						fingerprint or None,
+						face_capture_id if face_capture_id is not None else payload.get("faceCaptureId"),
+					),
+				)
+				row = conn.execute(
+					"""
+					SELECT attendance.*, face_captures.image_path AS face_capture_path
+					FROM attendance LEFT JOIN face_captures ON face_captures.id = attendance.face_capture_id
+					WHERE attendance.id = ?
+					""",
+					(cursor.lastrowid,),
 				).fetchone()
-				if existing_device:
-					raise LocalDatabaseError("This device has already been used to mark attendance today.")
+				conn.commit()
+			except BaseException:
+				conn.rollback()
+				raise
+			return dict(row)
+	except sqlite3.IntegrityError as err:
+		if str(err) == _ATTENDANCE_KEY_VIOLATION:
+			raise AttendanceError(ATTENDANCE_ALREADY_MARKED, "Attendance already recorded for today.") from err
+		# NOT NULL, foreign key, ...: a bad record, not a duplicate mark.
+		raise LocalDatabaseError(str(err)) from err
+	except sqlite3.OperationalError as err:
+		if "locked" in str(err) or "busy" in str(err):
+			raise AttendanceError(ATTENDANCE_BUSY, "The attendance database is busy. Please retry.") from err
+		raise LocalDatabaseError(str(err)) from err
+	except sqlite3.Error as err:
+		raise LocalDatabaseError(str(err)) from err
+
+
+def mark_attendance(db_path: Path, class_id: str, student_id: str, payload: Dict[str, Any]) -> None:
+	record_attendance(db_path, class_id, student_id, payload)
+
+
+def upsert_replicated_attendance(db_path: Path, class_id: str, student_id: str, payload: Dict[str, Any]) -> None:
+	"""Store an attendance record that originated in Firebase, replacing that day's local row.
+
+	The local face capture link is kept and the device check is skipped, since
+	the record was already accepted elsewhere.
+	"""
+	db_path = Path(db_path)
+	try:
+		with _connect(db_path) as conn:
+			_ensure_schema(conn)
 			conn.execute(
 				"""
 				INSERT INTO attendance (
 					class_id, student_id, timestamp, marked_at, date, subject, code,
-					manual_entry, teacher_name, department, marked_via, email, name, device_fingerprint, face_capture_id
+					manual_entry, teacher_name, department, marked_via, email, name, device_fingerprint
 				) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+				ON CONFLICT(class_id, student_id, date) DO UPDATE SET
+					timestamp=excluded.timestamp,
+					marked_at=excluded.marked_at,
+					subject=excluded.subject,
+					code=excluded.code,
+					manual_entry=excluded.manual_entry,
+					teacher_name=excluded.teacher_name,
+					department=excluded.department,
+					marked_via=excluded.marked_via,
+					email=COALESCE(excluded.email, attendance.email),
+					name=COALESCE(excluded.name, attendance.name),
+					device_fingerprint=excluded.device_fingerprint
 				""",
 				(
 					class_id,
 					student_id,
-					int(payload.get("timestamp", _now_ts_ms())),
-					payload.get("markedAt", datetime.now(tz=timezone.utc).isoformat()),
+					int(payload.get("timestamp") or _now_ts_ms()),
+					payload.get("markedAt") or datetime.now(tz=timezone.utc).isoformat(),
 					payload.get("date"),
 					payload.get("subject"),
 					payload.get("code"),
@@ -509,13 +751,34 @@ def mark_attendance(db_path: Path, class_id: str, student_id: str, payload: Dict
 					payload.get("markedVia"),
 					payload.get("email"),
 					payload.get("name"),
-					fingerprint or None,
-					payload.get("faceCaptureId"),
+					payload.get("deviceFingerprint"),
 				),
 			)
 			conn.commit()
-	except sqlite3.IntegrityError as err:
-		raise LocalDatabaseError("Attendance already recorded for today.") from err
+	except sqlite3.Error as err:
+		raise LocalDatabaseError(str(err)) from err
+
+
+def list_attendance_codes(db_path: Path) -> List[Dict[str, Any]]:
+	db_path = Path(db_path)
+	try:
+		with _connect(db_path) as conn:
+			_ensure_schema(conn)
+			return [dict(row) for row in conn.execute("SELECT * FROM attendance_codes ORDER BY id")]
+	except sqlite3.Error as err:
+		raise LocalDatabaseError(str(err)) from err
+
+
+def list_attendance_class_ids(db_path: Path) -> List[str]:
+	"""Class IDs that have a code or any attendance locally."""
+	db_path = Path(db_path)
+	try:
+		with _connect(db_path) as conn:
+			_ensure_schema(conn)
+			rows = conn.execute(
+				"SELECT id AS class_id FROM attendance_codes UNION SELECT DISTINCT class_id FROM attendance"
+			).fetchall()
+			return sorted(row["class_id"] for row in rows if row["class_id"])
 	except sqlite3.Error as err:
 		raise LocalDatabaseError(str(err)) from err
 
@@ -742,3 +1005,290 @@ def delete_timetable_entry(db_path: Path, teacher_id: int, entry_id: int) -> Non
 			conn.commit()
 	except sqlite3.Error as err:
 		raise LocalDatabaseError(str(err)) from err
+
+
+def insert_dns_query_events(db_path: Path, events: List[tuple]) -> None:
+	"""Batch-insert ``(timestamp_ms, client_ip, qname_hash, qtype, decision, latency_ms)`` rows."""
+	db_path = Path(db_path)
+	if not events:
+		return
+	try:
+		with _connect(db_path) as conn:
+			_ensure_schema(conn)
+			conn.executemany(
+				"""
+				INSERT INTO dns_queries (timestamp, client_ip, qname_hash, qtype, decision, latency_ms)
+				VALUES (?, ?, ?, ?, ?, ?)
+				""",
+				events,
+			)
+			conn.commit()
+	except sqlite3.Error as err:
+		raise LocalDatabaseError(str(err)) from err
+
+
+def purge_dns_query_events(db_path: Path, before_ms: int, batch_size: int = 10_000) -> int:
+	"""Delete ``dns_queries`` rows older than ``before_ms``, ``batch_size`` rows per transaction.
+
+	Small batches keep each write lock short, so attendance marks are not held
+	up behind the first purge of a large backlog.
+	"""
+	db_path = Path(db_path)
+	deleted = 0
+	try:
+		with _connect(db_path) as conn:
+			_ensure_schema(conn)
+			while True:
+				cursor = conn.execute(
+					"""
+					DELETE FROM dns_queries WHERE id IN (
+						SELECT id FROM dns_queries WHERE timestamp < ? LIMIT ?
+					)
+					""",
+					(before_ms, batch_size),
+				)
+				conn.commit()
+				deleted += cursor.rowcount
+				if cursor.rowcount < batch_size:
+					return deleted
+	except sqlite3.Error as err:
+		raise LocalDatabaseError(str(err)) from err
+
+
+def get_dns_query_stats(db_path: Path, since_ms: int, client_limit: int = 100) -> Dict[str, Any]:
+	db_path = Path(db_path)
+	try:
+		with _connect(db_path) as conn:
+			_ensure_schema(conn)
+			totals = conn.execute(
+				"""
+				SELECT COUNT(*) AS queries,
+					COUNT(DISTINCT client_ip) AS clients,
+					AVG(latency_ms) AS avg_latency_ms,
+					MAX(latency_ms) AS max_latency_ms
+				FROM dns_queries WHERE timestamp >= ?
+				""",
+				(since_ms,),
+			).fetchone()
+			decisions = conn.execute(
+				"""
+				SELECT decision, COUNT(*) AS queries, AVG(latency_ms) AS avg_latency_ms
+				FROM dns_queries WHERE timestamp >= ?
+				GROUP BY decision
+				""",
+				(since_ms,),
+			).fetchall()
+			qtypes = conn.execute(
+				"""
+				SELECT qtype, COUNT(*) AS queries
+				FROM dns_queries WHERE timestamp >= ?
+				GROUP BY qtype ORDER BY queries DESC
+				""",
+				(since_ms,),
+			).fetchall()
+			clients = conn.execute(
+				"""
+				SELECT client_ip, MIN(timestamp) AS first_seen, MAX(timestamp) AS last_seen, COUNT(*) AS queries
+				FROM dns_queries WHERE timestamp >= ?
+				GROUP BY client_ip ORDER BY first_seen DESC
+				LIMIT ?
+				""",
+				(since_ms, client_limit),
+			).fetchall()
+			timeline = conn.execute(
+				"""
+				SELECT (timestamp / 60000) * 60000 AS minute, COUNT(*) AS queries,
+					COUNT(DISTINCT client_ip) AS clients
+				FROM dns_queries WHERE timestamp >= ?
+				GROUP BY minute ORDER BY minute
+				""",
+				(since_ms,),
+			).fetchall()
+			return {
+				"totals": dict(totals) if totals else {},
+				"decisions": [dict(row) for row in decisions],
+				"qtypes": [dict(row) for row in qtypes],
+				"clients": [dict(row) for row in clients],
+				"timeline": [dict(row) for row in timeline],
+			}
+	except sqlite3.Error as err:
+		raise LocalDatabaseError(str(err)) from err
+
+
+def save_portal_sessions(db_path: Path, rows: List[tuple], deleted: List[str]) -> None:
+	"""Upsert ``(session_id, serialised_data, expires_at)`` rows and drop ``deleted`` IDs."""
+	db_path = Path(db_path)
+	if not rows and not deleted:
+		return
+	try:
+		with _connect(db_path) as conn:
+			_ensure_schema(conn)
+			if rows:
+				conn.executemany(
+					"""
+					INSERT INTO portal_sessions (id, data, expires_at) VALUES (?, ?, ?)
+					ON CONFLICT(id) DO UPDATE SET data = excluded.data, expires_at = excluded.expires_at
+					""",
+					rows,
+				)
+			if deleted:
+				conn.executemany("DELETE FROM portal_sessions WHERE id = ?", [(sid,) for sid in deleted])
+			conn.commit()
+	except sqlite3.Error as err:
+		raise LocalDatabaseError(str(err)) from err
+
+
+def load_portal_session(db_path: Path, session_id: str, now: float) -> Optional[tuple]:
+	"""Return ``(serialised_data, expires_at)`` for an unexpired session, else ``None``."""
+	db_path = Path(db_path)
+	try:
+		with _connect(db_path) as conn:
+			_ensure_schema(conn)
+			row = conn.execute(
+				"SELECT data, expires_at FROM portal_sessions WHERE id = ? AND expires_at > ?",
+				(session_id, now),
+			).fetchone()
+	except sqlite3.Error as err:
+		raise LocalDatabaseError(str(err)) from err
+	return (row["data"], row["expires_at"]) if row else None
+
+
+def purge_expired_portal_sessions(db_path: Path, now: float) -> int:
+	db_path = Path(db_path)
+	try:
+		with _connect(db_path) as conn:
+			_ensure_schema(conn)
+			cursor = conn.execute("DELETE FROM portal_sessions WHERE expires_at <= ?", (now,))
+			conn.commit()
+			return cursor.rowcount
+	except sqlite3.Error as err:
+		raise LocalDatabaseError(str(err)) from err
+
+
+def enqueue_firebase_write(
+	db_path: Path,
+	path: str,
+	payload_json: str,
+	class_id: Optional[str] = None,
+	student_id: Optional[str] = None,
+	created_at: Optional[float] = None,
+) -> int:
+	"""Journal a pending Firebase write and return its sequence number."""
+	db_path = Path(db_path)
+	try:
+		with _connect(db_path) as conn:
+			_ensure_schema(conn)
+			cursor = conn.execute(
+				"""
+				INSERT INTO firebase_outbox (path, payload, class_id, student_id, created_at)
+				VALUES (?, ?, ?, ?, ?)
+				""",
+				(path, payload_json, class_id, student_id, created_at if created_at is not None else _now_ts_ms() / 1000.0),
+			)
+			conn.commit()
+			return int(cursor.lastrowid)
+	except sqlite3.Error as err:
+		raise LocalDatabaseError(str(err)) from err
+
+
+def fetch_pending_firebase_writes(db_path: Path, limit: int) -> List[Dict[str, Any]]:
+	db_path = Path(db_path)
+	try:
+		with _connect(db_path) as conn:
+			_ensure_schema(conn)
+			rows = conn.execute(
+				"""
+				SELECT id, path, payload, class_id, student_id, created_at, attempts FROM firebase_outbox
+				WHERE flushed_at IS NULL AND failed = 0 ORDER BY id LIMIT ?
+				""",
+				(int(limit),),
+			).fetchall()
+	except sqlite3.Error as err:
+		raise LocalDatabaseError(str(err)) from err
+	return [dict(row) for row in rows]
+
+
+def mark_firebase_writes_flushed(db_path: Path, ids: List[int], flushed_at: float) -> None:
+	db_path = Path(db_path)
+	if not ids:
+		return
+	try:
+		with _connect(db_path) as conn:
+			_ensure_schema(conn)
+			conn.executemany(
+				"UPDATE firebase_outbox SET flushed_at = ?, last_error = NULL WHERE id = ?",
+				[(flushed_at, row_id) for row_id in ids],
+			)
+			conn.commit()
+	except sqlite3.Error as err:
+		raise LocalDatabaseError(str(err)) from err
+
+
+def record_firebase_write_failure(db_path: Path, ids: List[int], error: str, permanent: bool = False) -> None:
+	"""Count a failed attempt; ``permanent`` failures are parked and no longer retried."""
+	db_path = Path(db_path)
+	if not ids:
+		return
+	try:
+		with _connect(db_path) as conn:
+			_ensure_schema(conn)
+			conn.executemany(
+				"UPDATE firebase_outbox SET attempts = attempts + 1, last_error = ?, failed = ? WHERE id = ?",
+				[(error[:500], 1 if permanent else 0, row_id) for row_id in ids],
+			)
+			conn.commit()
+	except sqlite3.Error as err:
+		raise LocalDatabaseError(str(err)) from err
+
+
+def get_firebase_outbox_stats(db_path: Path) -> Dict[str, Any]:
+	db_path = Path(db_path)
+	try:
+		with _connect(db_path) as conn:
+			_ensure_schema(conn)
+			row = conn.execute(
+				"""
+				SELECT
+					COALESCE(SUM(failed = 0), 0) AS depth,
+					MIN(CASE WHEN failed = 0 THEN created_at END) AS oldest,
+					COALESCE(SUM(failed), 0) AS failed
+				FROM firebase_outbox WHERE flushed_at IS NULL
+				"""
+			).fetchone()
+	except sqlite3.Error as err:
+		raise LocalDatabaseError(str(err)) from err
+	return {"depth": row["depth"], "oldestCreatedAt": row["oldest"], "failed": row["failed"]}
+
+
+def find_journaled_attendance(db_path: Path, class_id: str, student_id: str) -> Optional[str]:
+	"""Return the newest journaled attendance payload (JSON) for a student, flushed or not."""
+	db_path = Path(db_path)
+	try:
+		with _connect(db_path) as conn:
+			_ensure_schema(conn)
+			row = conn.execute(
+				"""
+				SELECT payload FROM firebase_outbox
+				WHERE class_id = ? AND student_id = ?
+				ORDER BY id DESC LIMIT 1
+				""",
+				(class_id, student_id),
+			).fetchone()
+	except sqlite3.Error as err:
+		raise LocalDatabaseError(str(err)) from err
+	return row["payload"] if row else None
+
+
+def purge_flushed_firebase_writes(db_path: Path, before: float) -> int:
+	db_path = Path(db_path)
+	try:
+		with _connect(db_path) as conn:
+			_ensure_schema(conn)
+			cursor = conn.execute(
+				"DELETE FROM firebase_outbox WHERE flushed_at IS NOT NULL AND flushed_at < ?",
+				(before,),
+			)
+			conn.commit()
+			return cursor.rowcount
+	except sqlite3.Error as err:
+		raise LocalDatabaseError(str(err)) from err
@@ -0,0 +1,301 @@
+"""Opt-in memory accounting: per-route RSS and allocation deltas, and tracemalloc snapshots.
+
+:class:`MemoryMonitor` is WSGI middleware. Around every request it reads
+the process RSS and, while ``tracemalloc`` is tracing, the traced total.
+Per route it keeps:
+
+* the highest RSS seen at the end of a request (``peakRssBytes``);
+* how much RSS grew during its requests (``rssGrowthBytes``), which
+  points at routes whose buffers or caches are not given back;
+* the net and largest traced allocation change (``allocNetBytes``,
+  ``allocMaxBytes``).
+
+Both readings are process-wide. Requests running at the same time share
+them, so a per-route figure is an upper bound, and it is exact only when
+requests do not overlap. Over a day the ranking still shows where memory
+goes.
+
+A background thread takes a ``tracemalloc`` snapshot every
+``snapshot_interval`` seconds and keeps the newest ``keep``. Each snapshot
+is stored as size and count per source line, not as the snapshot
+object, so :meth:`MemoryMonitor.top` and :meth:`MemoryMonitor.diff` can
+answer later. Tracing slows allocation-heavy code down noticeably, so the
+whole mode is off by default. Each ``serve.py`` worker keeps its own
+figures.
+"""
+
+from __future__ import annotations
+
+import ctypes
+import linecache
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import deque
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from .metrics import ROUTE_ENVIRON_KEY
+
+LOGGER = logging.getLogger("memory")
+LOGGER.addHandler(logging.NullHandler())
+
+_BASE_DIR = Path(__file__).resolve().parent.parent
+_IGNORED = (tracemalloc.__file__, linecache.__file__, "<frozen importlib._bootstrap>", "<frozen importlib._bootstrap_external>", "<unknown>")
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class _ProcessMemoryCounters(ctypes.Structure):
+    _fields_ = [
+        ("cb", ctypes.c_ulong),
+        ("PageFaultCount", ctypes.c_ulong),
+        ("PeakWorkingSetSize", ctypes.c_size_t),
+        ("WorkingSetSize", ctypes.c_size_t),
+        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+        ("QuotaPagedPoolUsage", ctypes.c_size_t),
+        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+        ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+        ("PagefileUsage", ctypes.c_size_t),
+        ("PeakPagefileUsage", ctypes.c_size_t),
+    ]
+
+
+def _windows_counters() -> Optional[_ProcessMemoryCounters]:
+    counters = _ProcessMemoryCounters()
+    counters.cb = ctypes.sizeof(counters)
+    try:
+        handle = ctypes.windll.kernel32.GetCurrentProcess()
+        if not ctypes.windll.psapi.GetProcessMemoryInfo(handle, ctypes.byref(counters), counters.cb):
+            return None
+    except (AttributeError, OSError):
+        return None
+    return counters
+
+
+def rss_bytes() -> Optional[int]:
+    """Current resident set size, or ``None`` where it cannot be read cheaply (macOS)."""
+    if sys.platform.startswith("linux"):
+        try:
+            with open("/proc/self/statm", "rb") as handle:
+                return int(handle.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError, IndexError):
+            return None
+    if sys.platform == "win32":
+        counters = _windows_counters()
+        return counters.WorkingSetSize if counters else None
+    return None
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """Highest resident set size of this process so far."""
+    if sys.platform == "win32":
+        counters = _windows_counters()
+        return counters.PeakWorkingSetSize if counters else None
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _location(frame: tracemalloc.Frame) -> str:
+    path = Path(frame.filename)
+    try:
+        name = str(path.relative_to(_BASE_DIR))
+    except ValueError:
+        name = "/".join(path.parts[-2:])
+    return f"{name}:{frame.lineno}"
+
+
+class _Route:
+    __slots__ = ("requests", "peak_rss", "rss_growth", "rss_max_delta", "alloc_net", "alloc_max")
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.peak_rss = 0
+        self.rss_growth = 0
+        self.rss_max_delta = 0
+        self.alloc_net = 0
+        self.alloc_max = 0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "peakRssBytes": self.peak_rss,
+            "rssGrowthBytes": self.rss_growth,
+            "rssMaxDeltaBytes": self.rss_max_delta,
+            "allocNetBytes": self.alloc_net,
+            "allocMaxBytes": self.alloc_max,
+        }
+
+
+class MemoryMonitor:
+    def __init__(
+        self,
+        wsgi_app: Callable[..., Any],
+        trace_frames: int = 1,
+        snapshot_interval: float = 300.0,
+        keep: int = 12,
+        top: int = 25,
+    ) -> None:
+        self.wsgi_app = wsgi_app
+        self.trace_frames = max(0, int(trace_frames))
+        self.snapshot_interval = max(1.0, float(snapshot_interval))
+        self.top_limit = max(1, int(top))
+        self._routes: Dict[str, _Route] = {}
+        self._snapshots: Deque[Dict[str, Any]] = deque(maxlen=max(2, int(keep)))
+        self._lines: Dict[int, Dict[str, Tuple[int, int]]] = {}
+        self._next_id = 1
+        self._lock = threading.Lock()
+        self._thread_pid: Optional[int] = None
+        self._since = time.time()
+
+    @property
+    def tracing(self) -> bool:
+        return self.trace_frames > 0 and tracemalloc.is_tracing()
+
+    def __call__(self, environ: Dict[str, Any], start_response: Callable[..., Any]):
+        self._ensure_started()
+        rss_before = rss_bytes() or 0
+        traced_before = tracemalloc.get_traced_memory()[0] if self.tracing else 0
+        try:
+            return self.wsgi_app(environ, start_response)
+        finally:
+            rss_after = rss_bytes() or 0
+            alloc = tracemalloc.get_traced_memory()[0] - traced_before if self.tracing else 0
+            key = f"{environ.get('REQUEST_METHOD', '')} {environ.get(ROUTE_ENVIRON_KEY) or '<unmatched>'}"
+            with self._lock:
+                route = self._routes.get(key)
+                if route is None:
+                    route = self._routes[key] = _Route()
+                route.requests += 1
+                route.peak_rss = max(route.peak_rss, rss_after)
+                delta = rss_after - rss_before
+                if delta > 0:
+                    route.rss_growth += delta
+                    route.rss_max_delta = max(route.rss_max_delta, delta)
+                route.alloc_net += alloc
+                route.alloc_max = max(route.alloc_max, alloc)
+
+    def _ensure_started(self) -> None:
+        # Started on the first request, so each forked serve.py worker traces and snapshots itself.
+        if self._thread_pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread_pid == os.getpid():
+                return
+            self._thread_pid = os.getpid()
+            if self.trace_frames and not tracemalloc.is_tracing():
+                tracemalloc.start(self.trace_frames)
+            if self.trace_frames:
+                threading.Thread(target=self._run, name="MemorySnapshots", daemon=True).start()
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.snapshot_interval)
+            try:
+                self.snapshot()
+            except Exception as exc:  # keep the thread alive; the next interval may succeed
+                LOGGER.warning("tracemalloc snapshot failed: %s", exc)
+
+    def snapshot(self) -> Optional[Dict[str, Any]]:
+        """Take a snapshot now and return its summary, or ``None`` when not tracing."""
+        if not self.tracing:
+            return None
+        started = time.perf_counter()
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, pattern) for pattern in _IGNORED]
+        )
+        lines: Dict[str, Tuple[int, int]] = {}
+        for stat in snapshot.statistics("lineno"):
+            lines[_location(stat.traceback[0])] = (stat.size, stat.count)
+        current, peak = tracemalloc.get_traced_memory()
+        with self._lock:
+            summary = {
+                "id": self._next_id,
+                "timestamp": time.time(),
+                "rssBytes": rss_bytes(),
+                "tracedBytes": current,
+                "tracedPeakBytes": peak,
+                "lines": len(lines),
+                "ms": round((time.perf_counter() - started) * 1000, 1),
+            }
+            self._next_id += 1
+            if len(self._snapshots) == self._snapshots.maxlen:
+                self._lines.pop(self._snapshots[0]["id"], None)
+            self._snapshots.append(summary)
+            self._lines[summary["id"]] = lines
+        return summary
+
+    def snapshots(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self._snapshots)
+
+    def top(self, snapshot_id: int, limit: Optional[int] = None) -> Optional[List[Dict[str, Any]]]:
+        """Largest source lines by retained size in one snapshot."""
+        with self._lock:
+            lines = self._lines.get(snapshot_id)
+        if lines is None:
+            return None
+        ranked = sorted(lines.items(), key=lambda item: item[1][0], reverse=True)
+        return [
+            {"line": line, "bytes": size, "blocks": count} for line, (size, count) in ranked[: limit or self.top_limit]
+        ]
+
+    def diff(self, first_id: int, second_id: int, limit: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """Source lines whose retained size changed most from ``first_id`` to ``second_id``."""
+        with self._lock:
+            first, second = self._lines.get(first_id), self._lines.get(second_id)
+            meta = {item["id"]: item for item in self._snapshots}
+        if first is None or second is None:
+            return None
+        changes = []
+        for line in first.keys() | second.keys():
+            size_before, count_before = first.get(line, (0, 0))
+            size_after, count_after = second.get(line, (0, 0))
+            if size_after != size_before:
+                changes.append(
+                    {
+                        "line": line,
+                        "bytesDelta": size_after - size_before,
+                        "bytes": size_after,
+                        "blocksDelta": count_after - count_before,
+                    }
+                )
+        changes.sort(key=lambda item: abs(item["bytesDelta"]), reverse=True)
+        return {
+            "from": meta[first_id],
+            "to": meta[second_id],
+            "tracedDeltaBytes": meta[second_id]["tracedBytes"] - meta[first_id]["tracedBytes"],
+            "changes": changes[: limit or self.top_limit],
+        }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._routes.clear()
+            self._since = time.time()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            routes = {key: route.as_dict() for key, route in self._routes.items()}
+            snapshots = len(self._snapshots)
+        traced, traced_peak = tracemalloc.get_traced_memory() if self.tracing else (None, None)
+        return {
+            "pid": os.getpid(),
+            "rssBytes": rss_bytes(),
+            "peakRssBytes": peak_rss_bytes(),
+            "tracing": self.tracing,
+            "tracedBytes": traced,
+            "tracedPeakBytes": traced_peak,
+            "snapshots": snapshots,
+            "snapshotIntervalSeconds": self.snapshot_interval,
+            "since": self._since,
+            "routes": dict(sorted(routes.items(), key=lambda item: item[1]["rssGrowthBytes"], reverse=True)),
+        }
@@ -0,0 +1,308 @@
+"""In-process latency histograms and counters, exported in Prometheus text format.
+
+:class:`Histogram` is HDR-style. A value in microseconds goes into one of
+``2**sub_bucket_bits`` linear sub-buckets of its power-of-two range, so
+any percentile is exact to within ``1 / 2**sub_bucket_bits`` (6.25% by
+default) from 1 µs to over a day. Memory is fixed, and recording
+costs a ``bit_length`` plus an increment under a lock.
+
+:class:`Registry` holds named, labelled histograms, counters and gauge
+callbacks. :meth:`Registry.render` emits them for ``/api/metrics``.
+Histograms go out as Prometheus histograms with :data:`EXPORT_BUCKETS`
+bounds, plus a ``<name>_quantile`` gauge for p50/p90/p99/p999.
+Each process keeps its own registry; with several ``serve.py`` workers a
+scrape reflects the worker that answered. Every series therefore carries a
+``worker`` label with the process ID, so counters from different workers
+are separate series that ``rate()`` and ``sum()`` handle correctly.
+"""
+
+from __future__ import annotations
+
+import functools
+import os
+import threading
+import time
+from types import ModuleType
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+Labels = Tuple[Tuple[str, str], ...]
+
+# Seconds; the ``le`` bounds exported for every histogram.
+EXPORT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+EXPORT_QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+
+class Histogram:
+    def __init__(self, sub_bucket_bits: int = 4, max_magnitude: int = 32) -> None:
+        self.sub_bucket_bits = sub_bucket_bits
+        self._sub_buckets = 1 << sub_bucket_bits
+        self._max_magnitude = max_magnitude
+        # Values below 2**sub_bucket_bits µs are exact; each later range has _sub_buckets slots.
+        self._counts: List[int] = [0] * ((max_magnitude + 2) * self._sub_buckets)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total_us = 0
+        self.max_us = 0
+
+    def _index(self, value_us: int) -> int:
+        if value_us < self._sub_buckets:
+            return value_us
+        magnitude = value_us.bit_length() - self.sub_bucket_bits - 1
+        if magnitude > self._max_magnitude:
+            return len(self._counts) - 1
+        return (magnitude + 1) * self._sub_buckets + (value_us >> magnitude) - self._sub_buckets
+
+    def _upper_bound_us(self, index: int) -> int:
+        """Largest value (µs) that lands in bucket ``index``."""
+        if index < self._sub_buckets:
+            return index
+        magnitude, offset = divmod(index, self._sub_buckets)
+        return ((self._sub_buckets + offset + 1) << (magnitude - 1)) - 1
+
+    def record(self, seconds: float) -> None:
+        value_us = max(0, int(seconds * 1_000_000))
+        index = self._index(value_us)
+        with self._lock:
+            self._counts[index] += 1
+            self.count += 1
+            self.total_us += value_us
+            if value_us > self.max_us:
+                self.max_us = value_us
+
+    def snapshot(self) -> Tuple[List[int], int, int, int]:
+        with self._lock:
+            return list(self._counts), self.count, self.total_us, self.max_us
+
+    def percentile(self, quantile: float, snapshot: Optional[Tuple[List[int], int, int, int]] = None) -> float:
+        """Upper bound, in seconds, of the bucket holding the ``quantile`` value."""
+        counts, count, _, max_us = snapshot or self.snapshot()
+        if not count:
+            return 0.0
+        rank = max(1, int(quantile * count + 0.999999))
+        seen = 0
+        for index, bucket in enumerate(counts):
+            seen += bucket
+            if seen >= rank:
+                return min(self._upper_bound_us(index), max_us) / 1_000_000
+        return max_us / 1_000_000
+
+    def cumulative(self, bounds: Sequence[float], snapshot: Optional[Tuple[List[int], int, int, int]] = None) -> List[int]:
+        """Counts of values ``<=`` each bound (seconds), to bucket precision."""
+        counts, _, _, _ = snapshot or self.snapshot()
+        result = []
+        index = seen = 0
+        for bound in bounds:
+            limit_us = bound * 1_000_000
+            while index < len(counts) and self._upper_bound_us(index) <= limit_us:
+                seen += counts[index]
+                index += 1
+            result.append(seen)
+        return result
+
+    def summary(self) -> Dict[str, Any]:
+        snapshot = self.snapshot()
+        _, count, total_us, max_us = snapshot
+        return {
+            "count": count,
+            "meanMs": round(total_us / count / 1000, 3) if count else 0.0,
+            "p50Ms": round(self.percentile(0.5, snapshot) * 1000, 3),
+            "p95Ms": round(self.percentile(0.95, snapshot) * 1000, 3),
+            "p99Ms": round(self.percentile(0.99, snapshot) * 1000, 3),
+            "maxMs": round(max_us / 1000, 3),
+        }
+
+
+def _labels(labels: Optional[Dict[str, Any]]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in (labels or {}).items()))
+
+
+def _format_labels(labels: Labels, extra: Iterable[Tuple[str, str]] = ()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+class Registry:
+    def __init__(self, process_label: Optional[str] = "worker") -> None:
+        self.process_label = process_label
+        self._lock = threading.Lock()
+        self._help: Dict[str, Tuple[str, str]] = {}
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._gauges: List[Callable[[], Iterable[Tuple[str, Dict[str, Any], float]]]] = []
+
+    def describe(self, name: str, kind: str, help_text: str) -> None:
+        self._help[name] = (kind, help_text)
+
+    def histogram(self, name: str, labels: Optional[Dict[str, Any]] = None) -> Histogram:
+        key = _labels(labels)
+        series = self._histograms.get(name)
+        if series is not None and key in series:
+            return series[key]
+        with self._lock:
+            return self._histograms.setdefault(name, {}).setdefault(key, Histogram())
+
+    def observe(self, name: str, seconds: float, labels: Optional[Dict[str, Any]] = None) -> None:
+        self.histogram(name, labels).record(seconds)
+
+    def inc(self, name: str, amount: float = 1, labels: Optional[Dict[str, Any]] = None) -> None:
+        key = _labels(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def add_gauges(self, collector: Callable[[], Iterable[Tuple[str, Dict[str, Any], float]]]) -> None:
+        """Register ``collector``; it returns ``(name, labels, value)`` rows at scrape time."""
+        self._gauges.append(collector)
+
+    def histograms(self, name: str) -> Dict[Labels, Histogram]:
+        with self._lock:
+            return dict(self._histograms.get(name, {}))
+
+    def render(self) -> str:
+        lines: List[str] = []
+
+        def header(name: str, default_kind: str) -> None:
+            kind, help_text = self._help.get(name, (default_kind, ""))
+            if help_text:
+                lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        # Read at scrape time: the registry is created before serve.py forks its workers.
+        process = [(self.process_label, str(os.getpid()))] if self.process_label else []
+        with self._lock:
+            histograms = {name: dict(series) for name, series in self._histograms.items()}
+            counters = {name: dict(series) for name, series in self._counters.items()}
+        for name in sorted(histograms):
+            header(name, "histogram")
+            quantile_lines = []
+            for labels, histogram in sorted(histograms[name].items()):
+                snapshot = histogram.snapshot()
+                cumulative = histogram.cumulative(EXPORT_BUCKETS, snapshot)
+                for bound, value in zip(EXPORT_BUCKETS, cumulative):
+                    lines.append(f"{name}_bucket{_format_labels(labels, process + [('le', repr(bound))])} {value}")
+                lines.append(f"{name}_bucket{_format_labels(labels, process + [('le', '+Inf')])} {snapshot[1]}")
+                lines.append(f"{name}_sum{_format_labels(labels, process)} {_format_value(snapshot[2] / 1_000_000)}")
+                lines.append(f"{name}_count{_format_labels(labels, process)} {snapshot[1]}")
+                for quantile in EXPORT_QUANTILES:
+                    value = histogram.percentile(quantile, snapshot)
+                    quantile_lines.append(
+                        f"{name}_quantile{_format_labels(labels, process + [('quantile', str(quantile))])} "
+                        f"{_format_value(value)}"
+                    )
+            lines.append(f"# TYPE {name}_quantile gauge")
+            lines.extend(quantile_lines)
+        for name in sorted(counters):
+            header(name, "counter")
+            for labels, value in sorted(counters[name].items()):
+                lines.append(f"{name}{_format_labels(labels, process)} {_format_value(value)}")
+        gauges: Dict[str, List[str]] = {}
+        for collector in self._gauges:
+            try:
+                rows = list(collector())
+            except Exception as exc:  # a broken collector must not break the scrape
+                rows = [("portal_metrics_collector_errors", {"error": type(exc).__name__}, 1)]
+            for name, labels, value in rows:
+                if value is None:
+                    continue
+                gauges.setdefault(name, []).append(
+                    f"{name}{_format_labels(_labels(labels), process)} {_format_value(float(value))}"
+                )
+        for name in sorted(gauges):
+            header(name, "gauge")
+            lines.extend(gauges[name])
+        return "\n".join(lines) + "\n"
+
+
+def instrument_module(
+    module: ModuleType,
+    registry: Registry,
+    metric: str,
+    error_counter: Optional[str] = None,
+    classify: Optional[Callable[[BaseException], Optional[str]]] = None,
+) -> List[str]:
+    """Time every public function defined in ``module`` into ``metric{function=...}``.
+
+    The module attributes are replaced, so callers that look functions up
+    as ``module.name`` are measured. When ``classify`` returns a reason for
+    an exception, ``error_counter{function, reason}`` is incremented.
+    Returns the wrapped names.
+    """
+    wrapped = []
+    for name, value in list(vars(module).items()):
+        if name.startswith("_") or not callable(value) or isinstance(value, type):
+            continue
+        if getattr(value, "__module__", None) != module.__name__ or getattr(value, "__wrapped__", None):
+            continue
+        setattr(module, name, _timed(value, metric, registry, error_counter, classify))
+        wrapped.append(name)
+    return wrapped
+
+
+def _timed(
+    func: Callable[..., Any],
+    metric: str,
+    registry: Registry,
+    error_counter: Optional[str],
+    classify: Optional[Callable[[BaseException], Optional[str]]],
+) -> Callable[..., Any]:
+    labels = {"function": func.__name__}
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except BaseException as exc:
+            reason = classify(exc) if classify and error_counter else None
+            if reason:
+                registry.inc(error_counter, labels={"function": func.__name__, "reason": reason})
+            raise
+        finally:
+            registry.observe(metric, time.perf_counter() - started, labels)
+
+    return wrapper
+
+
+ROUTE_ENVIRON_KEY = "portal.route"
+
+
+class RequestMetrics:
+    """WSGI middleware: time every request into ``metric{route, method, status}``.
+
+    ``route`` is the URL rule stored in ``environ[ROUTE_ENVIRON_KEY]`` by
+    the app (for example ``/api/timetable/<int:entry_id>``), so label
+    cardinality stays bounded.
+    """
+
+    def __init__(self, wsgi_app: Callable[..., Any], registry: Registry, metric: str) -> None:
+        self.wsgi_app = wsgi_app
+        self.registry = registry
+        self.metric = metric
+
+    def __call__(self, environ: Dict[str, Any], start_response: Callable[..., Any]):
+        started = time.perf_counter()
+        status_holder: List[str] = []
+
+        def recording_start_response(status: str, headers, exc_info=None):
+            status_holder.append(status.split(" ", 1)[0])
+            return start_response(status, headers, exc_info)
+
+        try:
+            return self.wsgi_app(environ, recording_start_response)
+        finally:
+            status = status_holder[-1] if status_holder else "500"
+            labels = {
+                "route": environ.get(ROUTE_ENVIRON_KEY) or "<unmatched>",
+                "method": environ.get("REQUEST_METHOD", ""),
+                "status": status[0] + "xx",
+            }
+            self.registry.observe(self.metric, time.perf_counter() - started, labels)
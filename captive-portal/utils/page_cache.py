@@ -0,0 +1,144 @@
+"""Pre-rendered responses for pages that do not depend on the visitor.
+
+The landing and code-entry pages only change with the templates, the
+static asset manifest and the year in the footer. Yet phones reload them
+constantly, and OS connectivity checks keep landing on them.
+:class:`PageCache` renders each page once per cache key. It keeps the
+identity, gzip and brotli bytes together with an ETag and serves them with
+``no-cache``, so browsers revalidate cheaply and get a 304.
+
+Entries live in memory, so a restart starts fresh. A change to any file in
+the template folder clears the cache, and Jinja's, on the next request
+after ``check_interval`` seconds.
+
+:class:`ProbeRedirect` is WSGI middleware that answers the OS captive
+probe URLs with a bare 302. It runs before Flask, so there is no session
+lookup, no CORS hooks and no compression.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Hashable, Iterable, Tuple
+
+from flask import Flask, Response, render_template, request
+
+from .metrics import ROUTE_ENVIRON_KEY
+from .static_assets import Asset, compress
+
+
+class PageCache:
+    def __init__(self, app: Flask, enabled: bool = True, check_interval: float = 2.0) -> None:
+        self.app = app
+        self.enabled = enabled
+        self.check_interval = max(0.0, float(check_interval))
+        self._template_dir = Path(app.root_path) / (app.template_folder or "templates")
+        self._entries: Dict[Tuple[Hashable, ...], Asset] = {}
+        self._lock = threading.Lock()
+        self._signature = self._template_signature()
+        self._checked_at = time.monotonic()
+        self.counters = {"hits": 0, "misses": 0, "notModified": 0, "invalidations": 0}
+
+    def _template_signature(self) -> Tuple[Tuple[str, int, int], ...]:
+        try:
+            return tuple(
+                sorted(
+                    (str(path), path.stat().st_mtime_ns, path.stat().st_size)
+                    for path in self._template_dir.rglob("*")
+                    if path.is_file()
+                )
+            )
+        except OSError:
+            return ()
+
+    def _check_templates(self) -> None:
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        signature = self._template_signature()
+        if signature != self._signature:
+            self._signature = signature
+            self.clear()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.counters["invalidations"] += 1
+        if self.app.jinja_env.cache is not None:
+            self.app.jinja_env.cache.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.counters, "entries": len(self._entries), "enabled": self.enabled}
+
+    def render(self, template: str, key: Iterable[Hashable] = (), **context: Any) -> Response:
+        """Cached ``render_template(template, **context)``.
+
+        ``key`` must cover everything besides the template that changes the
+        output; ``context`` must not vary for the same key.
+        """
+        if not self.enabled:
+            return Response(render_template(template, **context), content_type="text/html; charset=utf-8")
+        self._check_templates()
+        cache_key = (template, *key)
+        entry = self._entries.get(cache_key)
+        if entry is None:
+            body = render_template(template, **context).encode("utf-8")
+            entry = Asset("text/html; charset=utf-8", hashlib.sha256(body).hexdigest()[:16], compress(body))
+            with self._lock:
+                self._entries[cache_key] = entry
+                self.counters["misses"] += 1
+        else:
+            with self._lock:
+                self.counters["hits"] += 1
+        return self._respond(entry)
+
+    def _respond(self, entry: Asset) -> Response:
+        encoding, body = entry.choose(request.headers.get("Accept-Encoding", ""))
+        etag = f"{entry.etag}-{encoding}"
+        headers = {"Cache-Control": "no-cache", "Vary": "Accept-Encoding", "ETag": f'"{etag}"'}
+        if etag in request.if_none_match:
+            with self._lock:
+                self.counters["notModified"] += 1
+            return Response(status=304, headers=headers)
+        if encoding != "identity":
+            # Already compressed: Flask-Compress skips responses with Content-Encoding.
+            headers["Content-Encoding"] = encoding
+        response = Response(body, content_type=entry.content_type, headers=headers)
+        response.direct_passthrough = True
+        return response
+
+
+WSGIApp = Callable[[Dict[str, Any], Callable[..., Any]], Iterable[bytes]]
+
+
+class ProbeRedirect:
+    """Answer GET/HEAD on ``paths`` with ``302 Location: location`` before the app sees them."""
+
+    def __init__(self, wsgi_app: WSGIApp, paths: Iterable[str], location: str) -> None:
+        self.wsgi_app = wsgi_app
+        self.paths = frozenset(paths)
+        # Probes must never be answered from a cache, or the OS misses the portal.
+        self._headers = [
+            ("Location", location),
+            ("Content-Length", "0"),
+            ("Cache-Control", "no-store"),
+        ]
+        self.hits = 0
+
+    def __call__(self, environ: Dict[str, Any], start_response: Callable[..., Any]) -> Iterable[bytes]:
+        if environ.get("PATH_INFO") in self.paths and environ.get("REQUEST_METHOD") in ("GET", "HEAD"):
+            self.hits += 1
+            environ[ROUTE_ENVIRON_KEY] = "<captive-probe>"
+            start_response("302 FOUND", list(self._headers))
+            return [b""]
+        return self.wsgi_app(environ, start_response)
+
+
+def rule_paths(app: Flask, endpoint: str) -> Tuple[str, ...]:
+    """Static URL rules registered for ``endpoint``."""
+    return tuple(rule.rule for rule in app.url_map.iter_rules(endpoint) if not rule.arguments)
@@ -0,0 +1,313 @@
+"""Opt-in sampling profiler and slow-request capture.
+
+:class:`SamplingProfiler` is WSGI middleware plus one sampler thread.
+While a request runs, its thread is registered. Every ``interval``
+seconds the sampler reads ``sys._current_frames()`` and folds the stack of
+each registered thread into a collapsed ``outer;...;inner`` string. Idle
+threads and the rest of the process are never walked, so the cost grows
+with the number of requests in flight, not with the thread count.
+
+Code marks its phases with ``with profiler.phase("sqlite"):``, or with
+:meth:`SamplingProfiler.trace_module` for a whole module. Time outside any
+phase is reported as ``other``. Phases do not nest: a phase opened inside
+another one counts towards the outer phase.
+
+A request slower than ``slow_threshold`` is written to ``ring_dir`` as one
+JSON file holding its route, phase breakdown and stack samples. The
+newest ``ring_size`` files are kept. Files are written by the sampler
+thread, so the slow request itself is not delayed further.
+:meth:`SamplingProfiler.collapsed` returns flamegraph input, in the
+format read by ``flamegraph.pl`` and speedscope.
+"""
+
+from __future__ import annotations
+
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from types import ModuleType
+from typing import Any, Callable, Dict, List, Optional
+
+from .metrics import ROUTE_ENVIRON_KEY
+
+LOGGER = logging.getLogger("profiler")
+LOGGER.addHandler(logging.NullHandler())
+
+_MAX_DEPTH = 64
+_TRUNCATED = "[truncated]"
+
+
+class RequestTrace:
+    __slots__ = ("method", "path", "started", "samples", "sample_count", "phases", "_phase", "_phase_started")
+
+    def __init__(self, method: str, path: str) -> None:
+        self.method = method
+        self.path = path
+        self.started = time.perf_counter()
+        self.samples: Counter = Counter()
+        self.sample_count = 0
+        # phase -> [seconds, calls]
+        self.phases: Dict[str, List[float]] = {}
+        self._phase: Optional[str] = None
+        self._phase_started = 0.0
+
+
+class _Phase:
+    __slots__ = ("trace", "name")
+
+    def __init__(self, trace: Optional[RequestTrace], name: str) -> None:
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self) -> "_Phase":
+        trace = self.trace
+        if trace is not None:
+            if trace._phase is None:
+                trace._phase = self.name
+                trace._phase_started = time.perf_counter()
+            else:
+                self.trace = None
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        trace = self.trace
+        if trace is not None:
+            totals = trace.phases.setdefault(self.name, [0.0, 0])
+            totals[0] += time.perf_counter() - trace._phase_started
+            totals[1] += 1
+            trace._phase = None
+
+
+def _collapse(frame: Any) -> str:
+    names = []
+    while frame is not None and len(names) < _MAX_DEPTH:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SamplingProfiler:
+    def __init__(
+        self,
+        wsgi_app: Callable[..., Any],
+        interval: float = 0.01,
+        slow_threshold: float = 0.5,
+        ring_dir: Optional[Path] = None,
+        ring_size: int = 50,
+        max_stacks: int = 5000,
+    ) -> None:
+        self.wsgi_app = wsgi_app
+        self.interval = max(0.001, float(interval))
+        self.slow_threshold = float(slow_threshold)
+        self.ring_dir = Path(ring_dir) if ring_dir else None
+        self.ring_size = max(1, int(ring_size))
+        self.max_stacks = max(1, int(max_stacks))
+        self._active: Dict[int, RequestTrace] = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stacks: Counter = Counter()
+        self._stacks_since = time.time()
+        self._pending: List[Dict[str, Any]] = []
+        self._thread_pid: Optional[int] = None
+        self.counters = {"requests": 0, "samples": 0, "slowRequests": 0, "writeErrors": 0}
+
+    # -- phases -------------------------------------------------------
+
+    def phase(self, name: str) -> _Phase:
+        """Context manager charging the enclosed time to ``name`` on the current request."""
+        return _Phase(getattr(self._local, "trace", None), name)
+
+    def trace_module(self, module: ModuleType, phase: str) -> List[str]:
+        """Charge every public function of ``module`` to ``phase``; returns the wrapped names."""
+        wrapped = []
+        for name, value in list(vars(module).items()):
+            if name.startswith("_") or not callable(value) or isinstance(value, type):
+                continue
+            target = getattr(value, "__wrapped__", value)
+            if getattr(target, "__module__", None) != module.__name__ or getattr(value, "_profiler_phase", None):
+                continue
+            setattr(module, name, self._phased(value, phase))
+            wrapped.append(name)
+        return wrapped
+
+    def _phased(self, func: Callable[..., Any], name: str) -> Callable[..., Any]:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _Phase(getattr(self._local, "trace", None), name):
+                return func(*args, **kwargs)
+
+        wrapper._profiler_phase = name  # type: ignore[attr-defined]
+        return wrapper
+
+    # -- requests -----------------------------------------------------
+
+    def __call__(self, environ: Dict[str, Any], start_response: Callable[..., Any]):
+        self._ensure_sampler()
+        trace = RequestTrace(environ.get("REQUEST_METHOD", ""), environ.get("PATH_INFO", ""))
+        ident = threading.get_ident()
+        self._local.trace = trace
+        self._active[ident] = trace
+        status_holder: List[str] = []
+
+        def recording_start_response(status: str, headers, exc_info=None):
+            status_holder.append(status.split(" ", 1)[0])
+            return start_response(status, headers, exc_info)
+
+        try:
+            return self.wsgi_app(environ, recording_start_response)
+        finally:
+            self._active.pop(ident, None)
+            self._local.trace = None
+            duration = time.perf_counter() - trace.started
+            self.counters["requests"] += 1
+            if duration >= self.slow_threshold:
+                self._capture(trace, duration, environ.get(ROUTE_ENVIRON_KEY), status_holder)
+
+    def _capture(self, trace: RequestTrace, duration: float, route: Optional[str], status: List[str]) -> None:
+        phases = {
+            name: {"ms": round(seconds * 1000, 3), "calls": calls} for name, (seconds, calls) in trace.phases.items()
+        }
+        accounted = sum(seconds for seconds, _ in trace.phases.values())
+        phases["other"] = {"ms": round(max(0.0, duration - accounted) * 1000, 3), "calls": 1}
+        record = {
+            "timestamp": time.time(),
+            "pid": os.getpid(),
+            "method": trace.method,
+            "path": trace.path,
+            "route": route,
+            "status": status[-1] if status else None,
+            "durationMs": round(duration * 1000, 3),
+            "phases": phases,
+            "sampleIntervalMs": round(self.interval * 1000, 3),
+            "samples": trace.sample_count,
+            "stacks": dict(trace.samples.most_common()),
+        }
+        with self._lock:
+            self.counters["slowRequests"] += 1
+            if len(self._pending) < self.ring_size:
+                self._pending.append(record)
+
+    # -- sampler ------------------------------------------------------
+
+    def _ensure_sampler(self) -> None:
+        # Started on the first request, so each forked serve.py worker samples its own threads.
+        if self._thread_pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread_pid == os.getpid():
+                return
+            self._thread_pid = os.getpid()
+            threading.Thread(target=self._run, name="SamplingProfiler", daemon=True).start()
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            if self._active:
+                self.sample(skip=own)
+            if self._pending:
+                self._write_pending()
+
+    def sample(self, skip: Optional[int] = None) -> int:
+        """Take one sample of every request thread; returns how many were sampled."""
+        frames = sys._current_frames()
+        taken = 0
+        for ident, trace in list(self._active.items()):
+            frame = frames.get(ident)
+            if frame is None or ident == skip:
+                continue
+            stack = _collapse(frame)
+            if trace._phase:
+                stack = f"{stack};[{trace._phase}]"
+            trace.samples[stack] += 1
+            trace.sample_count += 1
+            taken += 1
+            with self._lock:
+                if stack in self._stacks or len(self._stacks) < self.max_stacks:
+                    self._stacks[stack] += 1
+                else:
+                    self._stacks[_TRUNCATED] += 1
+        if taken:
+            self.counters["samples"] += taken
+        return taken
+
+    def _write_pending(self) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if self.ring_dir is None:
+            return
+        try:
+            self.ring_dir.mkdir(parents=True, exist_ok=True)
+            for record in pending:
+                name = f"slow-{time.time_ns()}-{record['pid']}.json"
+                tmp = self.ring_dir / (name + ".tmp")
+                tmp.write_text(json.dumps(record), encoding="utf-8")
+                tmp.replace(self.ring_dir / name)
+            for stale in self._ring_files()[self.ring_size:]:
+                stale.unlink(missing_ok=True)
+        except OSError as exc:
+            self.counters["writeErrors"] += 1
+            LOGGER.warning("Unable to save slow request: %s", exc)
+
+    # -- reading ------------------------------------------------------
+
+    def _ring_files(self) -> List[Path]:
+        """Ring entries, newest first."""
+        if self.ring_dir is None or not self.ring_dir.is_dir():
+            return []
+        return sorted(self.ring_dir.glob("slow-*.json"), reverse=True)
+
+    def slow_requests(self) -> List[Dict[str, Any]]:
+        """Summaries of the saved slow requests, newest first."""
+        entries = []
+        for path in self._ring_files():
+            record = self.slow_request(path.stem)
+            if record is None:
+                continue
+            record.pop("stacks", None)
+            entries.append({"id": path.stem, **record})
+        return entries
+
+    def slow_request(self, entry_id: str) -> Optional[Dict[str, Any]]:
+        if self.ring_dir is None or not entry_id.startswith("slow-") or "/" in entry_id or "\\" in entry_id:
+            return None
+        try:
+            return json.loads((self.ring_dir / f"{entry_id}.json").read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+
+    def collapsed(self, stacks: Optional[Dict[str, int]] = None) -> str:
+        """``stack count`` lines for a flamegraph; all sampled requests unless ``stacks`` is given."""
+        if stacks is None:
+            with self._lock:
+                stacks = dict(self._stacks)
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(stacks.items()))
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stacks.clear()
+            self._stacks_since = time.time()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            distinct = len(self._stacks)
+        return {
+            **self.counters,
+            "inFlight": len(self._active),
+            "distinctStacks": distinct,
+            "stacksSince": self._stacks_since,
+            "intervalMs": round(self.interval * 1000, 3),
+            "slowThresholdMs": round(self.slow_threshold * 1000, 3),
+        }
+
+
+def phase_of(profiler: Optional[SamplingProfiler], name: str) -> Any:
+    """``profiler.phase(name)``, or a no-op context when profiling is off."""
+    return profiler.phase(name) if profiler is not None else _Phase(None, name)
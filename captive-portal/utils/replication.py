@@ -0,0 +1,229 @@
+"""Asynchronous replication of the local SQLite data to Firebase (``hybrid`` mode).
+
+In hybrid mode every read and write is served by :mod:`local_db`. Each
+local change is also appended to the ``firebase_outbox`` change log and
+pushed to Firebase in the background by a :class:`FirebaseWriteQueue`,
+so the web app keeps seeing codes, students and attendance.
+
+Attendance can be written on both sides (the web app writes straight to
+Firebase). A Firebase node only holds a student's latest record, and both
+sides resolve it the same way, see :func:`resolve_attendance`:
+
+* the record with the later ``date`` wins;
+* on the same date the earlier ``timestamp`` wins, because the first
+  mark of the day is the one that counts.
+
+Before a batch of attendance is pushed, the current Firebase records of
+the affected classes are read. Entries where Firebase already holds the
+winner are not pushed; that record is imported locally instead.
+:func:`resync` applies the same rule to everything, to catch up after
+Firebase was unreachable or the change log lost an entry.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from . import local_db
+from .firebase_client import CODE_INDEX_PATH
+from .firebase_queue import FirebaseWriteQueue, attendance_path
+
+LOGGER = logging.getLogger("replication")
+LOGGER.addHandler(logging.NullHandler())
+
+Reader = Callable[..., Any]
+Writer = Callable[[Dict[str, Any]], None]
+
+LOCAL = "local"
+REMOTE = "remote"
+
+
+def resolve_attendance(local: Optional[Dict[str, Any]], remote: Optional[Dict[str, Any]]) -> str:
+    """Return :data:`LOCAL` or :data:`REMOTE` for the record that should win."""
+    if not remote or not remote.get("date"):
+        return LOCAL
+    if not local or not local.get("date"):
+        return REMOTE
+    if local["date"] != remote["date"]:
+        return LOCAL if str(local["date"]) > str(remote["date"]) else REMOTE
+    local_ts = int(local.get("timestamp") or 0)
+    remote_ts = int(remote.get("timestamp") or 0)
+    return REMOTE if remote_ts < local_ts else LOCAL
+
+
+def _same_record(local: Dict[str, Any], remote: Optional[Dict[str, Any]]) -> bool:
+    return bool(remote) and remote.get("date") == local.get("date") and int(remote.get("timestamp") or 0) == int(
+        local.get("timestamp") or 0
+    )
+
+
+def attendance_row_to_payload(row: Dict[str, Any]) -> Dict[str, Any]:
+    payload = {
+        "name": row.get("name"),
+        "email": row.get("email"),
+        "studentId": row.get("student_id"),
+        "timestamp": row.get("timestamp"),
+        "markedAt": row.get("marked_at"),
+        "date": row.get("date"),
+        "subject": row.get("subject"),
+        "code": row.get("code"),
+        "manualEntry": bool(row.get("manual_entry")),
+        "teacherName": row.get("teacher_name"),
+        "classId": row.get("class_id"),
+        "department": row.get("department"),
+        "markedVia": row.get("marked_via"),
+        "deviceFingerprint": row.get("device_fingerprint"),
+        "faceCaptureId": row.get("face_capture_id"),
+    }
+    return {key: value for key, value in payload.items() if value is not None}
+
+
+def code_row_to_payload(row: Dict[str, Any]) -> Dict[str, Any]:
+    payload = {
+        "code": row.get("code"),
+        "subject": row.get("subject"),
+        "teacherName": row.get("teacher_name"),
+        "expiryTime": row.get("expiry_time"),
+        "department": row.get("department"),
+        "duration": row.get("duration"),
+        "createdAt": row.get("created_at"),
+    }
+    return {key: value for key, value in payload.items() if value is not None}
+
+
+def student_row_to_payload(row: Dict[str, Any]) -> Dict[str, Any]:
+    # Passwords stay local; Firebase only needs what the web app displays.
+    payload = {
+        "name": row.get("name"),
+        "email": row.get("email"),
+        "department": row.get("department"),
+        "batch": row.get("batch"),
+        "classId": row.get("class_id"),
+    }
+    return {key: value for key, value in payload.items() if value is not None}
+
+
+def _latest_by_student(rows: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    latest: Dict[str, Dict[str, Any]] = {}
+    for row in rows:
+        payload = attendance_row_to_payload(row)
+        current = latest.get(row["student_id"])
+        if current is None or (payload.get("date"), payload.get("timestamp")) > (
+            current.get("date"),
+            current.get("timestamp"),
+        ):
+            latest[row["student_id"]] = payload
+    return latest
+
+
+class HybridReplicator:
+    def __init__(
+        self,
+        db_path: Path,
+        reader: Reader,
+        writer: Writer,
+        **queue_options: Any,
+    ) -> None:
+        self.db_path = Path(db_path)
+        self._reader = reader
+        self._writer = writer
+        self._lock = threading.Lock()
+        self.counters = {"conflicts": 0, "remoteWins": 0, "imported": 0}
+        self.queue = FirebaseWriteQueue(self.db_path, self._write_batch, **queue_options)
+
+    def start(self) -> None:
+        self.queue.start()
+
+    def close(self) -> None:
+        self.queue.close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self.counters)
+        return {**self.queue.stats(), **counters}
+
+    # -- change log -------------------------------------------------------
+
+    def attendance_marked(self, class_id: str, student_id: str, payload: Dict[str, Any]) -> None:
+        self.queue.enqueue_attendance(class_id, student_id, payload)
+
+    def code_saved(self, row: Dict[str, Any], previous_code: Optional[str] = None) -> None:
+        class_id = row.get("id") or row.get("class_id")
+        if previous_code and str(previous_code) != str(row.get("code")):
+            self.queue.enqueue(f"{CODE_INDEX_PATH}/{previous_code}", None)
+        self.queue.enqueue(f"attendance_codes/{class_id}", code_row_to_payload(row))
+        self.queue.enqueue(f"{CODE_INDEX_PATH}/{row.get('code')}", class_id)
+
+    def code_cleared(self, class_id: str, previous_code: Optional[str]) -> None:
+        self.queue.enqueue(f"attendance_codes/{class_id}", None)
+        if previous_code:
+            self.queue.enqueue(f"{CODE_INDEX_PATH}/{previous_code}", None)
+
+    def student_saved(self, row: Dict[str, Any]) -> None:
+        self.queue.enqueue(f"students/{row['id']}", student_row_to_payload(row))
+
+    # -- replication ------------------------------------------------------
+
+    def _write_batch(self, updates: Dict[str, Any]) -> None:
+        """Queue writer: drop attendance entries Firebase already holds the winner for."""
+        by_class: Dict[str, List[str]] = {}
+        for path in updates:
+            parts = path.split("/")
+            if len(parts) == 3 and parts[0] == "attendance" and isinstance(updates[path], dict):
+                by_class.setdefault(parts[1], []).append(path)
+        for class_id, paths in by_class.items():
+            remote_class = self._reader(f"attendance/{class_id}") or {}
+            for path in paths:
+                student_id = path.rsplit("/", 1)[1]
+                remote = remote_class.get(student_id)
+                if resolve_attendance(updates[path], remote) == REMOTE:
+                    self._import(class_id, student_id, remote)
+                    del updates[path]
+        if updates:
+            self._writer(updates)
+
+    def _import(self, class_id: str, student_id: str, remote: Dict[str, Any]) -> None:
+        local_db.upsert_replicated_attendance(self.db_path, class_id, student_id, remote)
+        with self._lock:
+            self.counters["conflicts"] += 1
+            self.counters["remoteWins"] += 1
+            self.counters["imported"] += 1
+        LOGGER.info("Kept Firebase attendance for %s/%s (%s)", class_id, student_id, remote.get("markedVia"))
+
+    def resync(self, dry_run: bool = False) -> Dict[str, int]:
+        """Reconcile every class, student and code with Firebase.
+
+        Firebase-side winners are imported locally; local winners, and all
+        codes and students, are queued for pushing. Returns counts per action.
+        """
+        summary = {"classes": 0, "pushed": 0, "imported": 0, "unchanged": 0, "codes": 0, "students": 0}
+        remote_classes = self._reader("attendance", shallow=True) or {}
+        class_ids = sorted(set(local_db.list_attendance_class_ids(self.db_path)) | set(remote_classes))
+        for class_id in class_ids:
+            summary["classes"] += 1
+            local = _latest_by_student(local_db.list_attendance_records(self.db_path, class_id))
+            remote_class = self._reader(f"attendance/{class_id}") or {}
+            for student_id in sorted(set(local) | set(remote_class)):
+                local_record, remote_record = local.get(student_id), remote_class.get(student_id)
+                if local_record and _same_record(local_record, remote_record):
+                    summary["unchanged"] += 1
+                elif resolve_attendance(local_record, remote_record) == REMOTE:
+                    summary["imported"] += 1
+                    if not dry_run:
+                        local_db.upsert_replicated_attendance(self.db_path, class_id, student_id, remote_record)
+                else:
+                    summary["pushed"] += 1
+                    if not dry_run:
+                        self.queue.enqueue(attendance_path(class_id, student_id), local_record, class_id, student_id)
+        for row in local_db.list_attendance_codes(self.db_path):
+            summary["codes"] += 1
+            if not dry_run:
+                self.code_saved(row)
+        for row in local_db.list_students(self.db_path):
+            summary["students"] += 1
+            if not dry_run:
+                self.student_saved(row)
+        return summary
@@ -1,25 +1,63 @@
 """Utility helpers for working with Flask sessions in the captive portal."""
 
 from datetime import datetime, timedelta
+from pathlib import Path
 from typing import Any, Optional
 from flask import current_app, session
 
+from .session_store import STORE_BACKENDS, ServerSessionInterface, SessionStore
+
 _CODE_KEY = "code_data"
 _STUDENT_KEY = "student_data"
 _ATTENDANCE_KEY = "attendance_data"
 _SESSION_EXPIRY_KEY = "session_expiry"
 _FACE_CAPTURE_KEY = "face_capture"
 
+_STORE: Optional[SessionStore] = None
+
 
 def _utc_now() -> datetime:
     return datetime.utcnow()
 
 
-def configure_session(app, lifetime_minutes: int, secure_cookie: bool) -> None:
-    """Apply session-related options to the Flask app instance."""
+def configure_session(
+    app,
+    lifetime_minutes: int,
+    secure_cookie: bool,
+    store: str = "cookie",
+    max_entries: int = 10000,
+    db_path: Optional[Path] = None,
+    shared: bool = False,
+) -> Optional[SessionStore]:
+    """Apply session-related options to the Flask app instance.
+
+    ``store`` selects where session data lives: ``cookie`` (Flask's signed
+    cookie), ``memory`` (server-side LRU, cookie holds only an ID) or
+    ``sqlite`` (the memory store, persisted to ``db_path``). With ``shared``
+    (several worker processes) any server-side store reads and writes
+    ``db_path`` directly so every process sees the same sessions.
+    """
+    global _STORE
     app.permanent_session_lifetime = timedelta(minutes=lifetime_minutes)
     app.config["SESSION_COOKIE_SECURE"] = secure_cookie
     app.config["SESSION_COOKIE_SAMESITE"] = "Lax"
+    if store not in STORE_BACKENDS:
+        raise ValueError(f"Unknown session store {store!r}; expected one of {', '.join(STORE_BACKENDS)}.")
+    if store == "cookie":
+        return None
+    _STORE = SessionStore(
+        lifetime=app.permanent_session_lifetime.total_seconds(),
+        max_entries=max_entries,
+        db_path=db_path if store == "sqlite" or shared else None,
+        shared=shared,
+    )
+    app.session_interface = ServerSessionInterface(_STORE)
+    return _STORE
+
+
+def session_store_stats() -> Optional[dict[str, Any]]:
+    """Size and eviction counters of the server-side store, if one is configured."""
+    return _STORE.stats() if _STORE is not None else None
 
 
 def _touch_session() -> None:
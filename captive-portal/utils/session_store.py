@@ -0,0 +1,311 @@
+"""Server-side storage for captive portal sessions.
+
+Flask's default session serialises every value into a signed cookie, so each
+phone uploads and the server re-verifies the whole verification/attendance
+state on every request. :class:`ServerSessionInterface` keeps that state in
+a :class:`SessionStore` instead and sends only a random session ID.
+
+The store is an in-memory LRU ordered by last access: sessions idle for
+longer than ``lifetime`` seconds, or the least recently used ones beyond
+``max_entries``, are evicted. With ``db_path`` set, changed sessions are
+written behind to the ``portal_sessions`` SQLite table every
+``flush_interval`` seconds so they survive a restart; a memory miss falls
+back to that table. A ``shared`` store skips the memory layer and reads
+and writes the table directly, for portals served by several processes.
+As the table is then the only copy, a shared write that still fails after
+a few retries raises ``LocalDatabaseError`` instead of dropping the session.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+from . import local_db
+
+LOGGER = logging.getLogger("session_store")
+LOGGER.addHandler(logging.NullHandler())
+
+STORE_BACKENDS = ("cookie", "memory", "sqlite")
+
+_SERIALIZER = TaggedJSONSerializer()
+_SWEEP_INTERVAL_SECONDS = 30.0
+_SHARED_WRITE_ATTEMPTS = 3
+_SHARED_RETRY_SECONDS = 0.05
+
+
+class SessionStore:
+    def __init__(
+        self,
+        lifetime: float,
+        max_entries: int = 10000,
+        db_path: Optional[Path] = None,
+        flush_interval: float = 2.0,
+        shared: bool = False,
+    ) -> None:
+        if shared and db_path is None:
+            raise ValueError("A shared session store needs a database path.")
+        self.lifetime = float(lifetime)
+        self.max_entries = max(1, int(max_entries))
+        self.db_path = Path(db_path) if db_path else None
+        self.flush_interval = max(0.1, float(flush_interval))
+        self.shared = shared
+        # session_id -> (data, last_access)
+        self._entries: "OrderedDict[str, Tuple[Dict[str, Any], float]]" = OrderedDict()
+        self._dirty: Set[str] = set()
+        self._deleted: Set[str] = set()
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+        self._last_purge = 0.0
+        self._closed = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.counters = {
+            "hits": 0,
+            "misses": 0,
+            "restored": 0,
+            "saves": 0,
+            "idleEvictions": 0,
+            "capacityEvictions": 0,
+            "persistFailures": 0,
+        }
+        self._thread_pid: Optional[int] = None
+
+    def _ensure_flusher(self) -> None:
+        # Started on first write rather than in __init__, so a process forked
+        # after the store was created (serve.py workers) runs its own flusher.
+        if self.db_path is None or self.shared or self._closed.is_set() or self._thread_pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread_pid == os.getpid():
+                return
+            self._thread_pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="SessionStoreFlush", daemon=True)
+            self._thread.start()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        if self.shared:
+            data = self._restore(session_id)
+            with self._lock:
+                self.counters["hits" if data is not None else "misses"] += 1
+            return data
+        now = time.monotonic()
+        with self._lock:
+            self._sweep(now)
+            entry = self._entries.get(session_id)
+            if entry is not None:
+                data, last_access = entry
+                if now - last_access <= self.lifetime:
+                    self._entries[session_id] = (data, now)
+                    self._entries.move_to_end(session_id)
+                    self.counters["hits"] += 1
+                    return dict(data)
+                del self._entries[session_id]
+                self.counters["idleEvictions"] += 1
+        data = self._restore(session_id)
+        if data is None:
+            with self._lock:
+                self.counters["misses"] += 1
+            return None
+        with self._lock:
+            self._insert(session_id, data, now)
+            self.counters["restored"] += 1
+        return dict(data)
+
+    def set(self, session_id: str, data: Dict[str, Any]) -> None:
+        if self.shared:
+            self._persist([(session_id, _SERIALIZER.dumps(data), time.time() + self.lifetime)], [])
+            with self._lock:
+                self.counters["saves"] += 1
+                purge = time.monotonic() - self._last_purge >= _SWEEP_INTERVAL_SECONDS
+                if purge:
+                    self._last_purge = time.monotonic()
+            if purge:
+                try:
+                    local_db.purge_expired_portal_sessions(self.db_path, time.time())
+                except local_db.LocalDatabaseError as exc:
+                    LOGGER.warning("Unable to purge sessions: %s", exc)
+            return
+        self._ensure_flusher()
+        now = time.monotonic()
+        with self._lock:
+            self._sweep(now)
+            self._insert(session_id, dict(data), now)
+            self.counters["saves"] += 1
+            if self.db_path is not None:
+                self._dirty.add(session_id)
+                self._deleted.discard(session_id)
+
+    def delete(self, session_id: str) -> None:
+        if self.shared:
+            self._persist([], [session_id])
+            return
+        self._ensure_flusher()
+        with self._lock:
+            self._entries.pop(session_id, None)
+            if self.db_path is not None:
+                self._dirty.discard(session_id)
+                self._deleted.add(session_id)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self.counters,
+                "size": len(self._entries),
+                "maxEntries": self.max_entries,
+                "pendingWrites": len(self._dirty) + len(self._deleted),
+                "persistent": self.db_path is not None,
+                "shared": self.shared,
+            }
+
+    def _insert(self, session_id: str, data: Dict[str, Any], now: float) -> None:
+        self._entries[session_id] = (data, now)
+        self._entries.move_to_end(session_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.counters["capacityEvictions"] += 1
+
+    def _sweep(self, now: float) -> None:
+        # Entries are ordered by last access, so idle ones are all at the front.
+        if now - self._last_sweep < _SWEEP_INTERVAL_SECONDS:
+            return
+        self._last_sweep = now
+        cutoff = now - self.lifetime
+        while self._entries:
+            session_id, (_, last_access) = next(iter(self._entries.items()))
+            if last_access > cutoff:
+                break
+            del self._entries[session_id]
+            self.counters["idleEvictions"] += 1
+
+    def _restore(self, session_id: str) -> Optional[Dict[str, Any]]:
+        if self.db_path is None:
+            return None
+        try:
+            row = local_db.load_portal_session(self.db_path, session_id, time.time())
+        except local_db.LocalDatabaseError as exc:
+            LOGGER.warning("Unable to load session from SQLite: %s", exc)
+            return None
+        if row is None:
+            return None
+        try:
+            return dict(_SERIALIZER.loads(row[0]))
+        except (ValueError, TypeError):
+            return None
+
+    def _persist(self, rows: List[Tuple[str, str, float]], deleted: List[str]) -> None:
+        # Each attempt already waits out SQLite's busy timeout; a retry covers
+        # a writer that held the lock for longer than that.
+        for attempt in range(1, _SHARED_WRITE_ATTEMPTS + 1):
+            try:
+                local_db.save_portal_sessions(self.db_path, rows, deleted)
+                return
+            except local_db.LocalDatabaseError as exc:
+                locked = "locked" in str(exc) or "busy" in str(exc)
+                if not locked or attempt == _SHARED_WRITE_ATTEMPTS:
+                    LOGGER.warning("Unable to persist sessions: %s", exc)
+                    with self._lock:
+                        self.counters["persistFailures"] += 1
+                    raise
+            time.sleep(_SHARED_RETRY_SECONDS * attempt)
+
+    def flush(self) -> None:
+        if self.db_path is None or self.shared:
+            return
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            deleted, self._deleted = self._deleted, set()
+            expires_at = time.time() + self.lifetime
+            rows = [
+                (session_id, _SERIALIZER.dumps(self._entries[session_id][0]), expires_at)
+                for session_id in dirty
+                if session_id in self._entries
+            ]
+        try:
+            local_db.save_portal_sessions(self.db_path, rows, list(deleted))
+            if time.monotonic() - self._last_purge >= _SWEEP_INTERVAL_SECONDS:
+                self._last_purge = time.monotonic()
+                local_db.purge_expired_portal_sessions(self.db_path, time.time())
+        except local_db.LocalDatabaseError as exc:
+            LOGGER.warning("Unable to persist sessions: %s", exc)
+            with self._lock:
+                self.counters["persistFailures"] += 1
+                self._dirty |= {session_id for session_id in dirty if session_id not in self._deleted}
+                self._deleted |= {session_id for session_id in deleted if session_id not in self._dirty}
+
+    def close(self) -> None:
+        self._closed.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush()
+
+    def _run(self) -> None:
+        while not self._closed.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                LOGGER.exception("Session flush failed")
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    """Session dict identified by ``sid``; the cookie carries nothing else."""
+
+    def __init__(self, initial: Optional[Dict[str, Any]] = None, sid: str = "", new: bool = False) -> None:
+        def on_update(self) -> None:
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+
+
+class ServerSessionInterface(SessionInterface):
+    def __init__(self, store: SessionStore) -> None:
+        self.store = store
+
+    def open_session(self, app, request) -> ServerSession:
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            data = self.store.get(sid)
+            if data is not None:
+                return ServerSession(data, sid=sid)
+        return ServerSession(sid=secrets.token_urlsafe(24), new=True)
+
+    def save_session(self, app, session: ServerSession, response) -> None:
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if not session:
+            if session.modified and not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        if session.modified:
+            self.store.set(session.sid, dict(session))
+        elif not self.should_set_cookie(app, session):
+            # Reads already refreshed the idle timer in the store.
+            return
+        response.set_cookie(
+            name,
+            session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
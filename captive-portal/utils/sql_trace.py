@@ -0,0 +1,312 @@
+"""Statement tracing for the SQLite helpers in :mod:`utils.local_db`.
+
+When tracing is on, ``local_db`` opens its connections as
+:class:`TracedConnection`. Each ``execute``, ``executemany`` and
+``executescript`` then reports to the :class:`SqlTracer`: the statement,
+the shape of its parameters (types only, never values), the time taken
+and the number of rows returned or changed. Time spent fetching rows counts
+towards the statement that produced them.
+
+Statements are aggregated by their normalised text, so the same query with
+different values is counted once. ``IN (?, ?, ?)`` lists of any length are
+also counted once. When ``execute`` itself takes longer than
+``slow_threshold`` (SQLite produces the first row inside it), the
+statement is written as one JSON line to a rotating log. Its
+``EXPLAIN QUERY PLAN`` is attached, computed once per statement every
+``plan_ttl`` seconds.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import logging.handlers
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+LOGGER = logging.getLogger("sql_trace")
+LOGGER.addHandler(logging.NullHandler())
+
+_WHITESPACE = re.compile(r"\s+")
+_PLACEHOLDER_LIST = re.compile(r"\?(?:\s*,\s*\?)+")
+_EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "REPLACE", "WITH")
+_MAX_SHAPES = 5
+
+
+def normalise(sql: str) -> str:
+    return _PLACEHOLDER_LIST.sub("?, ...", _WHITESPACE.sub(" ", sql).strip())
+
+
+def parameter_shape(parameters: Any) -> str:
+    """``(str, int, NoneType)`` or ``{name: str}``; never the values themselves."""
+    if isinstance(parameters, dict):
+        return "{" + ", ".join(f"{key}: {type(value).__name__}" for key, value in parameters.items()) + "}"
+    if isinstance(parameters, (list, tuple)):
+        if len(parameters) > 8 and len({type(value) for value in parameters}) == 1:
+            return f"({len(parameters)} x {type(parameters[0]).__name__})"
+        return "(" + ", ".join(type(value).__name__ for value in parameters) + ")"
+    return type(parameters).__name__
+
+
+class _Statement:
+    __slots__ = ("sql", "count", "seconds", "max_seconds", "rows", "slow", "errors", "shapes", "plan", "plan_at")
+
+    def __init__(self, sql: str) -> None:
+        self.sql = sql
+        self.count = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.rows = 0
+        self.slow = 0
+        self.errors = 0
+        self.shapes: List[str] = []
+        self.plan: Optional[List[str]] = None
+        self.plan_at = 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "sql": self.sql,
+            "calls": self.count,
+            "totalMs": round(self.seconds * 1000, 3),
+            "meanMs": round(self.seconds / self.count * 1000, 3) if self.count else 0.0,
+            "maxMs": round(self.max_seconds * 1000, 3),
+            "rows": self.rows,
+            "rowsPerCall": round(self.rows / self.count, 2) if self.count else 0.0,
+            "slow": self.slow,
+            "errors": self.errors,
+            "parameterShapes": list(self.shapes),
+            "plan": self.plan,
+        }
+
+
+class SqlTracer:
+    def __init__(
+        self,
+        slow_threshold: float = 0.05,
+        log_path: Optional[Path] = None,
+        max_bytes: int = 1_048_576,
+        backup_count: int = 3,
+        explain: bool = True,
+        plan_ttl: float = 300.0,
+        max_statements: int = 500,
+    ) -> None:
+        self.slow_threshold = float(slow_threshold)
+        self.explain = explain
+        self.plan_ttl = float(plan_ttl)
+        self.max_statements = max(1, int(max_statements))
+        self._statements: Dict[str, _Statement] = {}
+        self._lock = threading.Lock()
+        self._since = time.time()
+        self._slow_log: Optional[logging.Logger] = None
+        if log_path is not None:
+            log_path = Path(log_path)
+            log_path.parent.mkdir(parents=True, exist_ok=True)
+            handler = logging.handlers.RotatingFileHandler(
+                log_path, maxBytes=int(max_bytes), backupCount=int(backup_count), encoding="utf-8"
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self._slow_log = logging.getLogger(f"sql_trace.slow.{log_path}")
+            self._slow_log.propagate = False
+            self._slow_log.setLevel(logging.INFO)
+            self._slow_log.handlers[:] = [handler]
+
+    def _statement(self, sql: str) -> _Statement:
+        key = normalise(sql)
+        statement = self._statements.get(key)
+        if statement is None:
+            if len(self._statements) >= self.max_statements:
+                key = "[other statements]"
+                statement = self._statements.get(key)
+            if statement is None:
+                statement = self._statements[key] = _Statement(key)
+        return statement
+
+    def record(
+        self,
+        conn: sqlite3.Connection,
+        sql: str,
+        parameters: Any,
+        seconds: float,
+        rows: int,
+        error: Optional[BaseException] = None,
+        calls: int = 1,
+    ) -> None:
+        with self._lock:
+            statement = self._statement(sql)
+            statement.count += calls
+            statement.seconds += seconds
+            statement.rows += max(0, rows)
+            statement.max_seconds = max(statement.max_seconds, seconds)
+            if error is not None:
+                statement.errors += 1
+            shape = parameter_shape(parameters)
+            if shape not in statement.shapes and len(statement.shapes) < _MAX_SHAPES:
+                statement.shapes.append(shape)
+            slow = seconds >= self.slow_threshold
+            if slow:
+                statement.slow += 1
+        if slow:
+            self._log_slow(conn, statement, sql, parameters, seconds, rows, error)
+
+    def fetched(self, sql: str, rows: int, seconds: float) -> None:
+        """Add rows fetched after ``execute`` returned, and the time taken, to ``sql``."""
+        with self._lock:
+            statement = self._statement(sql)
+            statement.rows += rows
+            statement.seconds += seconds
+
+    def _plan(self, conn: sqlite3.Connection, statement: _Statement, sql: str, parameters: Any) -> Optional[List[str]]:
+        if not self.explain or not sql.lstrip().upper().startswith(_EXPLAINABLE):
+            return None
+        now = time.monotonic()
+        if statement.plan is not None and now - statement.plan_at < self.plan_ttl:
+            return statement.plan
+        try:
+            rows = sqlite3.Connection.execute(conn, "EXPLAIN QUERY PLAN " + sql, parameters).fetchall()
+        except sqlite3.Error as exc:
+            plan = [f"unavailable: {exc}"]
+        else:
+            plan = [str(row[3]) for row in rows]
+        statement.plan, statement.plan_at = plan, now
+        return plan
+
+    def _log_slow(
+        self,
+        conn: sqlite3.Connection,
+        statement: _Statement,
+        sql: str,
+        parameters: Any,
+        seconds: float,
+        rows: int,
+        error: Optional[BaseException],
+    ) -> None:
+        if self._slow_log is None:
+            return
+        entry = {
+            "timestamp": time.time(),
+            "ms": round(seconds * 1000, 3),
+            "sql": statement.sql,
+            "parameters": parameter_shape(parameters),
+            "rows": rows,
+            "plan": self._plan(conn, statement, sql, parameters),
+        }
+        if error is not None:
+            entry["error"] = str(error)
+        self._slow_log.info(json.dumps(entry))
+
+    def stats(self, sort: str = "totalMs", limit: int = 50) -> Dict[str, Any]:
+        with self._lock:
+            statements = [statement.as_dict() for statement in self._statements.values()]
+        if statements and sort not in statements[0]:
+            sort = "totalMs"
+        statements.sort(key=lambda item: item[sort], reverse=True)
+        return {
+            "since": self._since,
+            "slowThresholdMs": round(self.slow_threshold * 1000, 3),
+            "statements": len(statements),
+            "calls": sum(item["calls"] for item in statements),
+            "totalMs": round(sum(item["totalMs"] for item in statements), 3),
+            "top": statements[: max(0, limit)],
+        }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._statements.clear()
+            self._since = time.time()
+
+
+class TracedCursor(sqlite3.Cursor):
+    tracer: Optional[SqlTracer] = None
+    _traced_sql = ""
+
+    def execute(self, sql: str, parameters: Any = ()) -> "TracedCursor":
+        self._traced_sql = sql
+        started = time.perf_counter()
+        try:
+            super().execute(sql, parameters)
+        except sqlite3.Error as exc:
+            self.tracer.record(self.connection, sql, parameters, time.perf_counter() - started, 0, exc)
+            raise
+        self.tracer.record(self.connection, sql, parameters, time.perf_counter() - started, max(self.rowcount, 0))
+        return self
+
+    def executemany(self, sql: str, seq_of_parameters: Any) -> "TracedCursor":
+        rows = seq_of_parameters if isinstance(seq_of_parameters, Sequence) else list(seq_of_parameters)
+        self._traced_sql = ""
+        started = time.perf_counter()
+        first = rows[0] if rows else ()
+        try:
+            super().executemany(sql, rows)
+        except sqlite3.Error as exc:
+            self.tracer.record(self.connection, sql, first, time.perf_counter() - started, 0, exc, len(rows))
+            raise
+        self.tracer.record(self.connection, sql, first, time.perf_counter() - started, max(self.rowcount, 0), None, len(rows))
+        return self
+
+    def executescript(self, sql_script: str) -> "TracedCursor":
+        self._traced_sql = ""
+        started = time.perf_counter()
+        try:
+            super().executescript(sql_script)
+        finally:
+            # Scripts (the schema) are counted as one statement and never explained.
+            label = "[script] " + normalise(sql_script)[:80]
+            self.tracer.record(self.connection, label, (), time.perf_counter() - started, 0)
+        return self
+
+    def _fetched(self, rows: int, started: float) -> None:
+        if self._traced_sql:
+            self.tracer.fetched(self._traced_sql, rows, time.perf_counter() - started)
+
+    def fetchone(self) -> Any:
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(0 if row is None else 1, started)
+        return row
+
+    def fetchmany(self, size: int = -1) -> List[Any]:
+        started = time.perf_counter()
+        rows = super().fetchmany(size if size >= 0 else self.arraysize)
+        self._fetched(len(rows), started)
+        return rows
+
+    def fetchall(self) -> List[Any]:
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(len(rows), started)
+        return rows
+
+    def __next__(self) -> Any:
+        started = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._fetched(0, started)
+            raise
+        self._fetched(1, started)
+        return row
+
+
+class TracedConnection(sqlite3.Connection):
+    """``sqlite3.connect(..., factory=TracedConnection)``; set :attr:`tracer` before use."""
+
+    tracer: Optional[SqlTracer] = None
+
+    def cursor(self, factory: Any = None) -> Any:
+        cursor = super().cursor(factory or TracedCursor)
+        if isinstance(cursor, TracedCursor):
+            cursor.tracer = self.tracer
+        return cursor
+
+    def execute(self, sql: str, parameters: Any = ()) -> Any:
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql: str, seq_of_parameters: Any) -> Any:
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script: str) -> Any:
+        return self.cursor().executescript(sql_script)
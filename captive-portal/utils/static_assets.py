@@ -0,0 +1,191 @@
+"""Fingerprinted, precompressed static assets.
+
+:func:`build` copies every file under ``static/`` to ``static/dist/`` with
+a content hash in its name (``css/style.3f2a9c1d04be.css``). Next to each
+text asset it writes a gzip (``.gz``) and, if the ``brotli`` package is
+installed, a brotli (``.br``) variant, both at maximum compression. A
+``manifest.json`` maps each source path to its fingerprinted name.
+
+:class:`AssetStore` loads the manifest and the variant bytes into memory.
+The portal serves them from ``/static/v/<name>``: the variant is chosen
+from ``Accept-Encoding`` and returned as stored, with a long-lived
+``immutable`` cache header. That header is safe because a changed file
+gets a new name. Requests therefore do no compression or disk I/O.
+"""
+
+from __future__ import annotations
+
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+try:
+    import brotli  # type: ignore
+except ImportError:  # pragma: no cover - gzip variants are still produced
+    brotli = None
+
+LOGGER = logging.getLogger("static_assets")
+LOGGER.addHandler(logging.NullHandler())
+
+DIST_DIRNAME = "dist"
+MANIFEST_NAME = "manifest.json"
+URL_PREFIX = "/static/v/"
+
+# Compressing images and fonts again only costs CPU; they are served as-is.
+COMPRESSIBLE_SUFFIXES = {".css", ".js", ".svg", ".html", ".json", ".txt", ".xml", ".map"}
+_MIN_COMPRESS_BYTES = 256
+_HASH_LENGTH = 12
+
+
+def _gzip(data: bytes) -> bytes:
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+# (Content-Encoding, file suffix, encoder), best first.
+ENCODERS: List[Tuple[str, str, Callable[[bytes], bytes]]] = [("gzip", ".gz", _gzip)]
+if brotli is not None:
+    ENCODERS.insert(0, ("br", ".br", lambda data: brotli.compress(data, quality=11)))
+
+
+def compress(content: bytes) -> Dict[str, bytes]:
+    """All encodings of ``content``, keyed by Content-Encoding, including ``identity``."""
+    variants = {"identity": content}
+    if len(content) >= _MIN_COMPRESS_BYTES:
+        for encoding, _, encoder in ENCODERS:
+            variants[encoding] = encoder(content)
+    return variants
+
+
+def fingerprint(relative: str, content: bytes) -> str:
+    digest = hashlib.sha256(content).hexdigest()[:_HASH_LENGTH]
+    path = Path(relative)
+    return str(path.with_name(f"{path.stem}.{digest}{path.suffix}")).replace("\\", "/")
+
+
+def _sources(static_dir: Path) -> List[Path]:
+    dist = static_dir / DIST_DIRNAME
+    return sorted(
+        path
+        for path in static_dir.rglob("*")
+        if path.is_file() and dist not in path.parents and not path.name.startswith(".")
+    )
+
+
+def _write_if_changed(path: Path, content: bytes) -> bool:
+    if path.exists() and path.stat().st_size == len(content) and path.read_bytes() == content:
+        return False
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_bytes(content)
+    tmp.replace(path)
+    return True
+
+
+def build(static_dir: Path, prune: bool = True) -> Dict[str, Dict[str, object]]:
+    """Write fingerprinted copies and compressed variants; returns the manifest.
+
+    Unchanged files are not rewritten. With ``prune``, files left over from
+    earlier builds are deleted.
+    """
+    static_dir = Path(static_dir)
+    dist = static_dir / DIST_DIRNAME
+    manifest: Dict[str, Dict[str, object]] = {}
+    written = 0
+    keep = {dist / MANIFEST_NAME}
+    for source in _sources(static_dir):
+        relative = source.relative_to(static_dir).as_posix()
+        content = source.read_bytes()
+        name = fingerprint(relative, content)
+        target = dist / name
+        written += _write_if_changed(target, content)
+        keep.add(target)
+        encodings = []
+        if source.suffix.lower() in COMPRESSIBLE_SUFFIXES and len(content) >= _MIN_COMPRESS_BYTES:
+            for encoding, suffix, encoder in ENCODERS:
+                variant = target.with_name(target.name + suffix)
+                keep.add(variant)
+                if not variant.exists():
+                    written += _write_if_changed(variant, encoder(content))
+                encodings.append(encoding)
+        manifest[relative] = {"path": name, "size": len(content), "encodings": encodings}
+    _write_if_changed(dist / MANIFEST_NAME, json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8"))
+    if prune and dist.exists():
+        for stale in [path for path in dist.rglob("*") if path.is_file() and path not in keep]:
+            stale.unlink()
+    LOGGER.info("Static assets: %s file(s), %s written", len(manifest), written)
+    return manifest
+
+
+class Asset:
+    __slots__ = ("content_type", "etag", "variants")
+
+    def __init__(self, content_type: str, etag: str, variants: Dict[str, bytes]) -> None:
+        self.content_type = content_type
+        self.etag = etag
+        # encoding ("br", "gzip" or "identity") -> bytes
+        self.variants = variants
+
+    def choose(self, accept_encoding: str) -> Tuple[str, bytes]:
+        accepted = _accepted_encodings(accept_encoding)
+        for encoding in ("br", "gzip"):
+            if encoding in self.variants and encoding in accepted:
+                return encoding, self.variants[encoding]
+        return "identity", self.variants["identity"]
+
+
+def _accepted_encodings(header: str) -> set:
+    accepted = set()
+    for item in (header or "").split(","):
+        name, _, params = item.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        if name:
+            accepted.add(name.strip().lower())
+    return accepted
+
+
+class AssetStore:
+    """In-memory copy of ``static/dist`` keyed by fingerprinted name."""
+
+    def __init__(self, static_dir: Path) -> None:
+        self.static_dir = Path(static_dir)
+        self._urls: Dict[str, str] = {}
+        self._assets: Dict[str, Asset] = {}
+
+    def load(self, rebuild: bool = True) -> "AssetStore":
+        dist = self.static_dir / DIST_DIRNAME
+        if rebuild:
+            manifest = build(self.static_dir)
+        else:
+            manifest = json.loads((dist / MANIFEST_NAME).read_text(encoding="utf-8"))
+        urls: Dict[str, str] = {}
+        assets: Dict[str, Asset] = {}
+        for relative, entry in manifest.items():
+            name = str(entry["path"])
+            target = dist / name
+            variants = {"identity": target.read_bytes()}
+            suffixes = {encoding: suffix for encoding, suffix, _ in ENCODERS}
+            for encoding in entry.get("encodings", []):
+                variants[str(encoding)] = target.with_name(target.name + suffixes[encoding]).read_bytes()
+            content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+            if content_type.startswith("text/") or content_type in ("application/javascript", "image/svg+xml"):
+                content_type += "; charset=utf-8"
+            etag = name.rsplit(".", 2)[-2] if name.count(".") >= 2 else name
+            assets[name] = Asset(content_type, etag, variants)
+            urls[relative] = URL_PREFIX + name
+        self._urls, self._assets = urls, assets
+        return self
+
+    def __len__(self) -> int:
+        return len(self._assets)
+
+    def url(self, filename: str) -> Optional[str]:
+        """Fingerprinted URL for ``filename`` (relative to ``static/``), or ``None``."""
+        return self._urls.get(filename.lstrip("/"))
+
+    def get(self, name: str) -> Optional[Asset]:
+        return self._assets.get(name)
@@ -0,0 +1,255 @@
+"""Opt-in recorder of anonymised request traces, for replay with ``tools.traffic_replay``.
+
+:class:`TrafficRecorder` is WSGI middleware. It writes one JSON line per
+request: start time, duration, client, method, route, path, status and
+body sizes, plus the JSON body with identities replaced. Nothing else
+from the request is kept: no headers, cookies or client addresses.
+
+Identities are replaced by keyed pseudonyms (HMAC-SHA256 with ``salt``).
+The same student, code or device therefore maps to the same token
+throughout a recording, and across workers, which share the salt.
+Without a configured salt, a random one is made at start-up and tokens
+are stable only until the next restart. A configured salt must be kept
+as secret as the data: with it, short values such as six-digit codes can
+be recovered by brute force.
+
+* ``client`` is a pseudonym of the client IP and User-Agent, the pair
+  the portal fingerprints devices by.
+* Identity fields (:data:`IDENTITY_FIELDS`) become ``anon-<hex>``, with
+  an ``@anon.invalid`` address for e-mails. Codes (:data:`CODE_FIELDS`)
+  become other digits of the same length, so they still pass validation.
+* Secrets (:data:`SECRET_FIELDS`) become ``"$secret"``.
+* Images, which are ``data:`` URLs, become
+  ``{"$image": <bytes>, "digest": <pseudonym>}``.
+* Strings under any other key become pseudonyms too, except the
+  non-personal fields in :data:`KEPT_FIELDS`. Numbers, booleans and
+  ``null`` are kept.
+* Path parameters are pseudonymised like identity fields, except
+  ``<int:...>`` and ``<path:...>`` (static file names). Unmatched paths
+  are replaced, since behind a captive portal they are other sites'
+  URLs.
+
+Each process appends to its own ``traffic-<ns>-<pid>.jsonl`` in ``log_dir``
+and starts a new file after ``max_bytes``. The newest ``max_files`` files
+are kept.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import hmac
+import io
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import parse_qsl
+
+from .metrics import ROUTE_ENVIRON_KEY
+
+LOGGER = logging.getLogger("traffic_recorder")
+LOGGER.addHandler(logging.NullHandler())
+
+IDENTITY_FIELDS = frozenset(
+    {
+        "studentId", "rollNumber", "rollNo", "roll_no", "email", "name", "studentName", "teacherName",
+        "classId", "id", "ipAddress", "deviceFingerprint",
+    }
+)
+CODE_FIELDS = frozenset({"code"})
+SECRET_FIELDS = frozenset({"password", "token"})
+KEPT_FIELDS = frozenset(
+    {
+        "subject", "department", "batch", "day", "start_time", "end_time", "credits", "durationMinutes",
+        "expiryTime", "capturedAt", "captureId", "faceCaptureId", "manualEntry", "format", "sort", "reset",
+        "minutes", "limit",
+    }
+)
+UNMATCHED_PATH = "/__unmatched__"
+_KEPT_CONVERTERS = ("<int:", "<path:")
+_MAX_KEPT_STRING = 64
+
+
+class Pseudonymiser:
+    def __init__(self, salt: Optional[str] = None) -> None:
+        self._key = salt.encode("utf-8") if salt else secrets.token_bytes(32)
+
+    def digest(self, value: Any) -> str:
+        return hmac.new(self._key, str(value).strip().lower().encode("utf-8"), hashlib.sha256).hexdigest()
+
+    def token(self, value: Any) -> str:
+        return "anon-" + self.digest(value)[:12]
+
+    def code(self, value: Any) -> str:
+        text = str(value).strip()
+        if not text.isdigit():
+            return self.token(text)
+        return str(int(self.digest(text), 16) % 10 ** len(text)).zfill(len(text))
+
+    def field(self, key: str, value: Any) -> Any:
+        """The recorded form of ``value`` found under ``key``."""
+        if isinstance(value, dict):
+            return {name: self.field(name, item) for name, item in value.items()}
+        if isinstance(value, list):
+            return [self.field(key, item) for item in value]
+        if key in IDENTITY_FIELDS and isinstance(value, (int, float)) and not isinstance(value, bool):
+            return self.token(value)
+        if not isinstance(value, str):
+            return value
+        if value.startswith("data:"):
+            return {"$image": len(value), "digest": self.digest(value)[:12]}
+        if key in SECRET_FIELDS:
+            return "$secret"
+        if key in CODE_FIELDS:
+            return self.code(value)
+        if key in KEPT_FIELDS and len(value) <= _MAX_KEPT_STRING:
+            return value
+        if key == "email" and "@" in value:
+            return self.token(value) + "@anon.invalid"
+        return self.token(value)
+
+    def path(self, route: Optional[str], path: str) -> str:
+        if route == "<captive-probe>":
+            return path
+        if not route or route.startswith("<"):
+            return UNMATCHED_PATH
+        template = route.strip("/").split("/")
+        segments = path.strip("/").split("/")
+        if len(segments) < len(template):
+            return UNMATCHED_PATH
+        recorded = []
+        for position, part in enumerate(template):
+            if not part.startswith("<"):
+                recorded.append(part)
+            elif part.startswith("<path:"):
+                recorded.extend(segments[position:])
+                break
+            elif part.startswith(_KEPT_CONVERTERS):
+                recorded.append(segments[position])
+            else:
+                recorded.append(self.token(segments[position]))
+        return "/" + "/".join(recorded)
+
+
+class TrafficRecorder:
+    def __init__(
+        self,
+        wsgi_app: Callable[..., Any],
+        log_dir: Path,
+        salt: Optional[str] = None,
+        max_bytes: int = 64 * 1024 * 1024,
+        max_files: int = 20,
+        max_body_bytes: int = 8 * 1024 * 1024,
+    ) -> None:
+        self.wsgi_app = wsgi_app
+        self.log_dir = Path(log_dir)
+        self.pseudonyms = Pseudonymiser(salt)
+        self.max_bytes = max(1024, int(max_bytes))
+        self.max_files = max(1, int(max_files))
+        self.max_body_bytes = max(0, int(max_body_bytes))
+        self._lock = threading.Lock()
+        self._file: Optional[io.TextIOWrapper] = None
+        self._file_pid: Optional[int] = None
+        self._file_bytes = 0
+        self.counters = {"requests": 0, "bytes": 0, "files": 0, "unparsedBodies": 0, "writeErrors": 0}
+
+    def __call__(self, environ: Dict[str, Any], start_response: Callable[..., Any]):
+        started_at = time.time()
+        started = time.perf_counter()
+        body = self._read_body(environ)
+        response: Dict[str, Any] = {}
+
+        def recording_start_response(status: str, headers, exc_info=None):
+            response["status"] = int(status.split(" ", 1)[0])
+            for name, value in headers:
+                if name.lower() == "content-length":
+                    response["out"] = int(value)
+            return start_response(status, headers, exc_info)
+
+        try:
+            return self.wsgi_app(environ, recording_start_response)
+        finally:
+            self._record(environ, body, response, started_at, time.perf_counter() - started)
+
+    def _read_body(self, environ: Dict[str, Any]) -> Optional[bytes]:
+        try:
+            length = int(environ.get("CONTENT_LENGTH") or 0)
+        except ValueError:
+            return None
+        if length <= 0 or length > self.max_body_bytes or "json" not in environ.get("CONTENT_TYPE", ""):
+            return None
+        body = environ["wsgi.input"].read(length)
+        environ["wsgi.input"] = io.BytesIO(body)
+        return body
+
+    def _record(
+        self, environ: Dict[str, Any], body: Optional[bytes], response: Dict[str, Any], started_at: float, seconds: float
+    ) -> None:
+        route = environ.get(ROUTE_ENVIRON_KEY)
+        pseudonyms = self.pseudonyms
+        record: Dict[str, Any] = {
+            "ts": round(started_at * 1000, 3),
+            "ms": round(seconds * 1000, 3),
+            "client": pseudonyms.token(f"{environ.get('REMOTE_ADDR', '')} {environ.get('HTTP_USER_AGENT', '')}"),
+            "method": environ.get("REQUEST_METHOD", ""),
+            "route": route or "<unmatched>",
+            "path": pseudonyms.path(route, environ.get("PATH_INFO", "")),
+            "status": response.get("status", 500),
+        }
+        query = environ.get("QUERY_STRING", "")
+        if query and route:
+            record["query"] = {key: pseudonyms.field(key, value) for key, value in parse_qsl(query)}
+        length = environ.get("CONTENT_LENGTH")
+        if length:
+            record["in"] = int(length) if str(length).isdigit() else 0
+        if "out" in response:
+            record["out"] = response["out"]
+        if environ.get("HTTP_AUTHORIZATION"):
+            record["auth"] = True
+        if body is not None:
+            try:
+                record["body"] = pseudonyms.field("", json.loads(body))
+            except ValueError:
+                self.counters["unparsedBodies"] += 1
+        self._write(json.dumps(record, separators=(",", ":")) + "\n")
+
+    def _write(self, line: str) -> None:
+        with self._lock:
+            try:
+                if self._file is None or self._file_pid != os.getpid() or self._file_bytes >= self.max_bytes:
+                    self._rotate()
+                self._file.write(line)
+                self._file.flush()
+            except OSError as exc:
+                self.counters["writeErrors"] += 1
+                LOGGER.warning("Unable to record request: %s", exc)
+                return
+            self._file_bytes += len(line)
+            self.counters["requests"] += 1
+            self.counters["bytes"] += len(line)
+
+    def _rotate(self) -> None:
+        # A worker forked after the first request must not share its parent's file.
+        if self._file is not None and self._file_pid == os.getpid():
+            self._file.close()
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        path = self.log_dir / f"traffic-{time.time_ns()}-{os.getpid()}.jsonl"
+        self._file = path.open("a", encoding="utf-8")
+        self._file_pid = os.getpid()
+        self._file_bytes = 0
+        self.counters["files"] += 1
+        for stale in self.files()[: -self.max_files]:
+            stale.unlink(missing_ok=True)
+
+    def files(self) -> List[Path]:
+        """Recorded files, oldest first."""
+        if not self.log_dir.is_dir():
+            return []
+        return sorted(self.log_dir.glob("traffic-*.jsonl"))
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.counters, "logDir": str(self.log_dir), "filesOnDisk": len(self.files())}